@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# Letto da config/settings.py: sotto ASGI gli export usano il pool di thread dedicato.
+os.environ.setdefault('SERVER_ASGI', 'True')
 
 application = get_asgi_application()
@@ -0,0 +1,43 @@
+"""
+Avvio del gestionale in modalità ASGI con uvicorn, alternativa a waitress:
+
+    python -m config.asgi_server --host 0.0.0.0 --port 8000 --workers 2
+
+In ASGI le API JSON (anagrafiche per tipo documento, saldo conto,
+autocompletamento) sono servite dall'event loop senza occupare thread, le
+altre viste girano ciascuna nel proprio thread e gli export nel pool dedicato
+(EXPORT_THREAD, gestionale/pool_export.py): un export lento non blocca più le
+richieste interattive degli altri utenti.
+
+Ogni worker è un processo con il proprio pool di export; la cache di Django
+(KPI, versioni delle aziende in cache) è condivisa su file tra i worker, a meno
+di usare LocMemCache (vedi CACHE_BACKEND in config/settings.py).
+"""
+
+import argparse
+import os
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Avvia il gestionale in ASGI con uvicorn.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1, help="Numero di processi (default: 1).")
+    parser.add_argument('--log-level', default='warning')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    os.environ.setdefault('SERVER_ASGI', 'True')
+
+    import uvicorn
+
+    # Django non gestisce il protocollo 'lifespan' di ASGI.
+    uvicorn.run(
+        'config.asgi:application',
+        host=args.host, port=args.port, workers=args.workers,
+        lifespan='off', log_level=args.log_level,
+    )
+
+
+if __name__ == '__main__':
+    main()
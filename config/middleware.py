@@ -1,28 +1,213 @@
-from tenants.models import Company
-from gestionale.managers import set_current_tenant
+import os
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from gestionale.budget_query import ControlloQuery
+from gestionale.managers import reset_current_tenant, set_current_tenant
+from gestionale.profilazione import MisuraRichiesta, attiva_misure
+from tenants.cache import risolvi_tenant
+
+# Chiavi di sessione impostate alla scelta dell'azienda (tenants.views.ActivateTenantView)
+CHIAVI_SESSIONE_TENANT = ('active_tenant_id', 'active_tenant_name', 'user_company_role')
+
+
+def _tenant_valido(tenant_obj, ruolo):
+    # Azienda eliminata/disattivata o permesso revocato: l'utente torna
+    # alla selezione dell'azienda alla prossima vista protetta.
+    return tenant_obj is not None and tenant_obj.is_active and ruolo is not None
+
 
 class TenantMiddleware:
+    """
+    Imposta azienda attiva (request.tenant e tenant corrente dei manager) e ruolo
+    verificato (request.company_role) a partire dalla sessione.
+
+    Funziona sia sotto WSGI (waitress) sia sotto ASGI: nella catena async non
+    blocca l'event loop (sessione, utente e cache letti con le API async) e il
+    tenant corrente è una ContextVar, ripristinata al termine della richiesta.
+    """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        request.tenant = None # Nessun tenant finché sessione e permessi non sono verificati
+        request.company_role = None
+
         if request.user.is_authenticated:
             active_tenant_id = request.session.get('active_tenant_id')
             if active_tenant_id:
-                try:
-                    tenant_obj = Company.objects.get(pk=active_tenant_id)
+                # Azienda e ruolo arrivano dalla cache di processo (tenants/cache.py)
+                tenant_obj, ruolo = risolvi_tenant(request.user.pk, active_tenant_id)
+                if not _tenant_valido(tenant_obj, ruolo):
+                    for chiave in CHIAVI_SESSIONE_TENANT:
+                        request.session.pop(chiave, None)
+                else:
                     request.tenant = tenant_obj # Manteniamo per compatibilità con le viste
-                    set_current_tenant(tenant_obj) # Imposta il tenant per il manager
-                except Company.DoesNotExist:
-                    request.tenant = None
-                    set_current_tenant(None)
-            else:
-                request.tenant = None
-                set_current_tenant(None)
-        else:
-            request.tenant = None # No tenant for unauthenticated users
-            set_current_tenant(None)
+                    request.company_role = ruolo
+                    if request.session.get('user_company_role') != ruolo:
+                        # Ruolo cambiato dal Super Admin: aggiorniamo anche la sessione (usata dai template)
+                        request.session['user_company_role'] = ruolo
+
+        token = set_current_tenant(request.tenant) # Imposta il tenant per il manager
+        try:
+            return self.get_response(request)
+        finally:
+            reset_current_tenant(token) # Pulisce il tenant dopo la richiesta
+
+    async def __acall__(self, request):
+        request.tenant = None
+        request.company_role = None
+
+        user = await request.auser()
+        # request.user e request.auser() hanno cache separate: senza questo le
+        # viste sync rileggerebbero l'utente dal database.
+        request.user = user
+        if user.is_authenticated:
+            active_tenant_id = await request.session.aget('active_tenant_id')
+            if active_tenant_id:
+                tenant_obj, ruolo = await sync_to_async(risolvi_tenant)(user.pk, active_tenant_id)
+                if not _tenant_valido(tenant_obj, ruolo):
+                    for chiave in CHIAVI_SESSIONE_TENANT:
+                        await request.session.apop(chiave, None)
+                else:
+                    request.tenant = tenant_obj
+                    request.company_role = ruolo
+                    if await request.session.aget('user_company_role') != ruolo:
+                        await request.session.aset('user_company_role', ruolo)
+
+        token = set_current_tenant(request.tenant)
+        try:
+            return await self.get_response(request)
+        finally:
+            reset_current_tenant(token)
+
+
+class _ContenutoMisurato:
+    """
+    Contenuto in streaming che conta i byte inviati. Django registra close() tra
+    le chiusure della risposta: la misura si chiude a fine invio anche se il
+    client si disconnette prima di leggere tutto.
+    """
+
+    def __init__(self, blocchi, request, response, misura):
+        self.blocchi = blocchi
+        self.request = request
+        self.response = response
+        self.misura = misura
+
+    def __iter__(self):
+        for blocco in self.blocchi:
+            self.misura.byte += len(blocco)
+            yield blocco
+
+    def close(self):
+        self.misura.concludi(self.request, self.response)
 
-        response = self.get_response(request)
-        set_current_tenant(None) # Pulisce il tenant dopo la richiesta
+
+class _ContenutoMisuratoAsync(_ContenutoMisurato):
+    async def __aiter__(self):
+        async for blocco in self.blocchi:
+            self.misura.byte += len(blocco)
+            yield blocco
+
+
+class _MiddlewareMisura:
+    """
+    Base dei middleware che aprono una misura sulle query (misura_classe, una
+    MisuraQuery) per tutta la richiesta e la chiudono con concludi(request,
+    response): a risposta pronta o, per le risposte in streaming, quando è stata
+    inviata. La misura riceve le query anche quando, sotto ASGI, la vista gira in
+    un altro thread (gestionale/profilazione.py). attivo() decide all'avvio se il
+    middleware serve.
+    """
+    sync_capable = True
+    async_capable = True
+    misura_classe = None
+
+    def __init__(self, get_response):
+        if not self.attivo():
+            raise MiddlewareNotUsed
+        attiva_misure()
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def attivo(self):
+        """Le sottoclassi lo ridefiniscono in base alle impostazioni: di base il middleware è escluso."""
+        return False
+
+    @staticmethod
+    def _risposta(request, response, misura):
+        if response.streaming:
+            classe = _ContenutoMisuratoAsync if response.is_async else _ContenutoMisurato
+            response.streaming_content = classe(response.streaming_content, request, response, misura)
+        else:
+            misura.byte = len(response.content)
+            misura.concludi(request, response)
         return response
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        misura = self.misura_classe()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            misura.concludi(request, None)
+            raise
+        return self._risposta(request, response, misura)
+
+    async def __acall__(self, request):
+        misura = self.misura_classe()
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            misura.concludi(request, None)
+            raise
+        return self._risposta(request, response, misura)
+
+
+class ProfilazioneRichiesteMiddleware(_MiddlewareMisura):
+    """
+    Misura tempo, query e dimensione di ogni richiesta e la scrive nel log di
+    profilazione (gestionale/profilazione.py). Attivo solo con
+    PROFILAZIONE_RICHIESTE=True: altrimenti Django lo esclude all'avvio.
+
+    Va elencato prima di TenantMiddleware: così il tempo comprende sessione e
+    autenticazione e, a risposta pronta, request.tenant e request.company_role
+    sono già impostati. Per le risposte in streaming (export) la misura si chiude
+    quando la risposta è stata inviata.
+    """
+    misura_classe = MisuraRichiesta
+
+    def attivo(self):
+        if not settings.PROFILAZIONE_RICHIESTE:
+            return False
+        os.makedirs(os.path.dirname(settings.PROFILAZIONE_LOG) or '.', exist_ok=True)
+        return True
+
+
+class ControlloQueryMiddleware(_MiddlewareMisura):
+    """
+    Controllo dei budget di query per vista e degli N+1 (gestionale/budget_query.py).
+    Attivo con CONTROLLO_QUERY (di default quando DEBUG è attivo): le richieste
+    oltre il budget o con la stessa query ripetuta finiscono nel log
+    'gestionale.budget_query' o, con CONTROLLO_QUERY_ERRORE=True, in un errore.
+    """
+    misura_classe = ControlloQuery
+
+    def attivo(self):
+        return settings.CONTROLLO_QUERY
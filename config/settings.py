@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 from decouple import config
 
@@ -40,6 +41,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.humanize',
+    'django.contrib.postgres',
 
     # Le nostre App    
     'accounts',
@@ -57,6 +59,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',  # <-- Assicurati che sia qui
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'config.middleware.ProfilazioneRichiesteMiddleware',  # Attivo solo con PROFILAZIONE_RICHIESTE
+    'config.middleware.ControlloQueryMiddleware',  # Attivo solo con CONTROLLO_QUERY
     'config.middleware.TenantMiddleware',  # Il nostro middleware personalizzato
 ]
 
@@ -170,6 +174,153 @@ if not DEBUG:
     SECURE_HSTS_PRELOAD = True
 
 
+# ==============================================================================
+# === CACHE                                                                 ===
+# ==============================================================================
+# Di default usiamo la cache su file: non richiede servizi esterni ed è condivisa
+# da tutti i processi (processi web, worker dei report, comandi di gestione),
+# così l'invalidazione dei KPI (gestionale/kpi.py) e delle aziende in cache
+# (tenants/cache.py) fatta da un processo vale subito anche per gli altri. Con
+# CACHE_BACKEND=django.core.cache.backends.locmem.LocMemCache la cache resta
+# nella memoria del singolo processo e l'invalidazione vale solo lì: gli altri
+# processi vedono le modifiche solo alla scadenza delle voci (KPI_CACHE_TIMEOUT,
+# TENANT_CACHE_TIMEOUT). Va bene solo con un unico processo web.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': config('CACHE_LOCATION', default=str(BASE_DIR / 'cache')),
+        'OPTIONS': {'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=5000, cast=int)},
+    }
+}
+
+# Durata massima (in secondi) dei blocchi KPI in cache. I dati vengono comunque
+# invalidati subito a ogni modifica dei modelli da cui dipendono (gestionale/signals.py).
+KPI_CACHE_TIMEOUT = config('KPI_CACHE_TIMEOUT', default=300, cast=int)
+
+# Secondi per cui ogni processo riusa azienda attiva e ruolo dell'utente senza
+# rileggerli dal database (tenants/cache.py). Le modifiche fatte dal pannello
+# Super Admin invalidano subito la cache tramite i segnali di tenants/signals.py.
+TENANT_CACHE_TIMEOUT = config('TENANT_CACHE_TIMEOUT', default=60, cast=int)
+
+
+# ==============================================================================
+# === REPORT IN BACKGROUND                                                  ===
+# ==============================================================================
+# I report richiesti in coda vengono elaborati dal comando 'esegui_report_in_coda'
+# (avviato da start_gestionale.bat) e salvati in MEDIA_ROOT/report/.
+# I file non sono serviti direttamente: si scaricano dalla vista di download,
+# che controlla tenant e utente.
+MEDIA_ROOT = config('MEDIA_ROOT', default=str(BASE_DIR / 'media'))
+MEDIA_URL = 'media/'
+
+# Giorni dopo i quali le richieste terminate e i relativi file vengono eliminati.
+REPORT_GIORNI_CONSERVAZIONE = config('REPORT_GIORNI_CONSERVAZIONE', default=7, cast=int)
+
+# Minuti oltre i quali una richiesta rimasta "in elaborazione" viene considerata
+# persa (worker interrotto) e segnata come errore.
+REPORT_MINUTI_TIMEOUT = config('REPORT_MINUTI_TIMEOUT', default=30, cast=int)
+
+# Cache su disco dei file generati dagli export (gestionale/cache_artefatti.py):
+# export identici su dati invariati vengono serviti senza rigenerarli.
+# Oltre ARTEFATTI_CACHE_MB vengono eliminati i file usati meno di recente (0 = cache disattivata).
+ARTEFATTI_CACHE_DIR = config('ARTEFATTI_CACHE_DIR', default=os.path.join(MEDIA_ROOT, 'cache'))
+ARTEFATTI_CACHE_MB = config('ARTEFATTI_CACHE_MB', default=512, cast=int)
+
+
+# ==============================================================================
+# === PAGINAZIONE DELLE LISTE                                               ===
+# ==============================================================================
+# Con PAGINAZIONE_CURSORE le liste di Prima Nota, Documenti e Scadenziario
+# avanzano "dopo l'ultimo record visto" (gestionale/paginazione.py) invece di
+# usare COUNT(*) e OFFSET: ogni pagina costa uguale anche su anni di dati.
+PAGINAZIONE_CURSORE = config('PAGINAZIONE_CURSORE', default=False, cast=bool)
+# In modalità cursore il totale mostrato è la stima del planner di PostgreSQL
+# (nessun COUNT sull'intera tabella); False per il conteggio esatto.
+PAGINAZIONE_CONTEGGIO_STIMATO = config('PAGINAZIONE_CONTEGGIO_STIMATO', default=True, cast=bool)
+
+
+# ==============================================================================
+# === RENDERING PDF                                                         ===
+# ==============================================================================
+# I PDF vengono impaginati da un pool di processi (gestionale/pdf_renderer.py),
+# così più export contemporanei usano core diversi invece di mettersi in fila
+# sul GIL. PDF_PROCESSI=0 disattiva il pool e converte nel processo corrente.
+PDF_PROCESSI = config('PDF_PROCESSI', default=min(4, os.cpu_count() or 1), cast=int)
+# Secondi massimi di attesa per un singolo PDF in una richiesta web (il worker
+# dei report in coda non ha limite). Dopo un timeout il pool viene ricreato.
+PDF_TIMEOUT = config('PDF_TIMEOUT', default=120, cast=int)
+
+
+# ==============================================================================
+# === SERVER ASGI                                                           ===
+# ==============================================================================
+# SERVER_ASGI viene attivato da config/asgi.py quando il gestionale è servito in
+# ASGI (python -m config.asgi_server): le API JSON sono viste async e gli export
+# girano in un pool di EXPORT_THREAD thread (gestionale/pool_export.py), così non
+# rallentano le richieste interattive. Sotto waitress resta tutto sincrono.
+SERVER_ASGI = config('SERVER_ASGI', default=False, cast=bool)
+EXPORT_THREAD = config('EXPORT_THREAD', default=2, cast=int)
+
+
+# ==============================================================================
+# === PROFILAZIONE DELLE RICHIESTE                                          ===
+# ==============================================================================
+# Con PROFILAZIONE_RICHIESTE ogni richiesta (vista, azienda, ruolo, tempo, query,
+# tempo SQL, istruzioni più lente, byte) viene scritta come riga JSON nel log a
+# rotazione PROFILAZIONE_LOG (gestionale/profilazione.py); il pannello Superadmin
+# ne mostra gli endpoint più lenti per azienda.
+PROFILAZIONE_RICHIESTE = config('PROFILAZIONE_RICHIESTE', default=False, cast=bool)
+PROFILAZIONE_LOG = config('PROFILAZIONE_LOG', default=str(BASE_DIR / 'logs' / 'richieste.jsonl'))
+# Dimensione di ogni file e numero di file conservati dalla rotazione.
+PROFILAZIONE_LOG_MB = config('PROFILAZIONE_LOG_MB', default=20, cast=int)
+PROFILAZIONE_LOG_FILE = config('PROFILAZIONE_LOG_FILE', default=5, cast=int)
+# Istruzioni SQL più lente conservate per richiesta.
+PROFILAZIONE_QUERY_LENTE = config('PROFILAZIONE_QUERY_LENTE', default=3, cast=int)
+# Registra solo le richieste più lente di questi millisecondi (0 = tutte).
+PROFILAZIONE_SOGLIA_MS = config('PROFILAZIONE_SOGLIA_MS', default=0, cast=int)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'riga': {'format': '%(message)s'},
+    },
+    'handlers': {
+        # delay=True: il file viene aperto solo alla prima richiesta registrata.
+        # La rotazione non è coordinata tra processi: con più worker usare un file per processo.
+        'profilazione': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': PROFILAZIONE_LOG,
+            'maxBytes': PROFILAZIONE_LOG_MB * 1024 * 1024,
+            'backupCount': PROFILAZIONE_LOG_FILE,
+            'encoding': 'utf-8',
+            'delay': True,
+            'formatter': 'riga',
+        },
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'gestionale.profilazione': {'handlers': ['profilazione'], 'level': 'INFO', 'propagate': False},
+        'gestionale.budget_query': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
+
+
+# ==============================================================================
+# === BUDGET DI QUERY PER VISTA                                             ===
+# ==============================================================================
+# Con CONTROLLO_QUERY (di default in sviluppo) ogni richiesta viene confrontata
+# con il budget di query della sua vista (attributo 'query_budget', vedi
+# gestionale/budget_query.py) e le query ripetute con la stessa forma (N+1)
+# vengono segnalate nel log; con CONTROLLO_QUERY_ERRORE diventano un errore.
+# Il comando 'verifica_budget_query' controlla tutti gli URL del gestionale.
+CONTROLLO_QUERY = config('CONTROLLO_QUERY', default=DEBUG, cast=bool)
+CONTROLLO_QUERY_ERRORE = config('CONTROLLO_QUERY_ERRORE', default=False, cast=bool)
+# Budget delle viste che non ne dichiarano uno.
+QUERY_BUDGET_DEFAULT = config('QUERY_BUDGET_DEFAULT', default=15, cast=int)
+# Quante volte la stessa forma di query può ripetersi prima di essere un N+1.
+QUERY_RIPETUTE_SOGLIA = config('QUERY_RIPETUTE_SOGLIA', default=10, cast=int)
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
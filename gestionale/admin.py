@@ -19,7 +19,14 @@ from .models import (
     PrimaNota,
     DipendenteDettaglio,
     DiarioAttivita,
-    ScadenzaPersonale
+    ScadenzaPersonale,
+    SaldoContoFinanziario,
+    SaldoGiornaliero,
+    StatoSaldiGiornalieri,
+    TotaleMensileDocumenti,
+    TotaleMensileMovimenti,
+    RichiestaReport,
+    ContatoreNumerazione
 )
 
 # Registriamo tutti i modelli per renderli visibili nel pannello di amministrazione
@@ -36,8 +43,41 @@ admin.site.register(ContoFinanziario)
 admin.site.register(ContoOperativo)
 admin.site.register(MezzoAziendale)
 admin.site.register(TipoScadenzaPersonale)
-admin.site.register(Scadenza)
 admin.site.register(PrimaNota)
-admin.site.register(DipendenteDettaglio)
-admin.site.register(DiarioAttivita)
-admin.site.register(ScadenzaPersonale)
\ No newline at end of file
+admin.site.register(ContatoreNumerazione)
+admin.site.register(RichiestaReport)
+admin.site.register(SaldoGiornaliero)
+admin.site.register(TotaleMensileDocumenti)
+admin.site.register(TotaleMensileMovimenti)
+
+
+# Modelli il cui __str__ legge oggetti collegati: senza list_select_related
+# la lista dell'admin farebbe una query per riga.
+@admin.register(Scadenza)
+class ScadenzaAdmin(admin.ModelAdmin):
+    list_select_related = ('anagrafica',)
+
+
+@admin.register(SaldoContoFinanziario)
+class SaldoContoFinanziarioAdmin(admin.ModelAdmin):
+    list_select_related = ('conto_finanziario',)
+
+
+@admin.register(StatoSaldiGiornalieri)
+class StatoSaldiGiornalieriAdmin(admin.ModelAdmin):
+    list_select_related = ('tenant',)
+
+
+@admin.register(DipendenteDettaglio)
+class DipendenteDettaglioAdmin(admin.ModelAdmin):
+    list_select_related = ('anagrafica',)
+
+
+@admin.register(DiarioAttivita)
+class DiarioAttivitaAdmin(admin.ModelAdmin):
+    list_select_related = ('dipendente',)
+
+
+@admin.register(ScadenzaPersonale)
+class ScadenzaPersonaleAdmin(admin.ModelAdmin):
+    list_select_related = ('tipo_scadenza', 'dipendente')
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class GestionaleConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'gestionale'
+
+    def ready(self):
+        # Registra i segnali che invalidano la cache dei KPI
+        from . import signals  # noqa: F401
@@ -0,0 +1,101 @@
+# gestionale/autocomplete.py
+
+"""
+Sorgenti dati per i campi di selezione con autocompletamento.
+
+I form non caricano più intere tabelle nei <select>: il widget AutocompleteSelect
+(gestionale/forms.py) mostra solo il valore selezionato e il browser chiede le
+opzioni alla vista 'api_autocomplete' una pagina alla volta, filtrando sul testo
+digitato. Ogni sorgente è una funzione (termine, tipo) -> queryset, già limitata
+al tenant corrente dal manager del modello; 'tipo' è un filtro facoltativo il cui
+significato dipende dalla sorgente (tipo anagrafica, stato cantiere, ...).
+"""
+
+from django.db.models import Q
+
+from .models import Anagrafica, Cantiere, Causale, ContoFinanziario
+from .ricerca import cerca_anagrafiche
+
+LIMITE_DEFAULT = 20
+LIMITE_MASSIMO = 50
+
+
+def _anagrafiche(termine, tipo):
+    queryset = Anagrafica.objects.filter(attivo=True).only('pk', 'codice', 'nome_cognome_ragione_sociale')
+    if tipo in Anagrafica.Tipo.values:
+        queryset = queryset.filter(tipo=tipo)
+    return cerca_anagrafiche(queryset, termine)
+
+
+def _cantieri(termine, tipo):
+    queryset = Cantiere.objects.only('pk', 'codice_cantiere', 'descrizione').order_by('codice_cantiere')
+    # 'aperti' replica il filtro del form di Prima Nota, altrimenti quello dei documenti.
+    queryset = queryset.filter(stato=Cantiere.Stato.APERTO) if tipo == 'aperti' else queryset.filter(attivo=True)
+    if termine:
+        queryset = queryset.filter(Q(codice_cantiere__icontains=termine) | Q(descrizione__icontains=termine))
+    return queryset
+
+
+def _causali(termine, tipo):
+    queryset = Causale.objects.filter(attivo=True).only('pk', 'descrizione').order_by('descrizione')
+    if termine:
+        queryset = queryset.filter(descrizione__icontains=termine)
+    return queryset
+
+
+def _conti_finanziari(termine, tipo):
+    queryset = ContoFinanziario.objects.filter(attivo=True).only('pk', 'nome_conto').order_by('nome_conto')
+    if termine:
+        queryset = queryset.filter(nome_conto__icontains=termine)
+    return queryset
+
+
+SORGENTI_AUTOCOMPLETAMENTO = {
+    'anagrafica': _anagrafiche,
+    'cantiere': _cantieri,
+    'causale': _causali,
+    'conto_finanziario': _conti_finanziari,
+}
+
+
+def _intero_positivo(valore, default, massimo=None):
+    try:
+        numero = int(valore)
+    except (TypeError, ValueError):
+        return default
+    if numero < 1:
+        return default
+    return min(numero, massimo) if massimo else numero
+
+
+def _pagina(sorgente, termine, tipo, pagina, limite):
+    """(queryset della pagina con una riga in più, limite). Solleva KeyError se la sorgente non esiste."""
+    funzione = SORGENTI_AUTOCOMPLETAMENTO[sorgente]
+    limite = _intero_positivo(limite, LIMITE_DEFAULT, LIMITE_MASSIMO)
+    pagina = _intero_positivo(pagina, 1)
+
+    inizio = (pagina - 1) * limite
+    return funzione((termine or '').strip(), tipo)[inizio:inizio + limite + 1], limite
+
+
+def _risposta(risultati, limite):
+    return {
+        'results': [{'id': obj.pk, 'text': str(obj)} for obj in risultati[:limite]],
+        'pagination': {'more': len(risultati) > limite},
+    }
+
+
+def cerca_opzioni(sorgente, termine='', tipo=None, pagina=None, limite=None):
+    """
+    Restituisce la pagina richiesta come {'results': [{'id', 'text'}], 'pagination': {'more': bool}}.
+    Legge una riga in più del limite per sapere se esiste una pagina successiva,
+    senza contare tutti i risultati. Solleva KeyError se la sorgente non esiste.
+    """
+    queryset, limite = _pagina(sorgente, termine, tipo, pagina, limite)
+    return _risposta(list(queryset), limite)
+
+
+async def acerca_opzioni(sorgente, termine='', tipo=None, pagina=None, limite=None):
+    """Versione async di cerca_opzioni (ORM async), usata dalle viste API."""
+    queryset, limite = _pagina(sorgente, termine, tipo, pagina, limite)
+    return _risposta([obj async for obj in queryset], limite)
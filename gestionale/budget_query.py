@@ -0,0 +1,110 @@
+# gestionale/budget_query.py
+
+"""
+Budget di query per vista e rilevazione degli N+1 (sviluppo e verifiche).
+
+Ogni vista può dichiarare quante query le servono al massimo: con l'attributo
+di classe 'query_budget' per le viste a classe, con il decoratore
+@budget_query(n) per quelle a funzione. Le viste senza dichiarazione hanno il
+budget QUERY_BUDGET_DEFAULT.
+
+ControlloQuery conta le query di una richiesta raggruppandole per "forma" (lo
+stesso SQL con valori diversi): una forma ripetuta molte volte è il segno tipico
+di un N+1, cioè di una query per riga dentro un ciclo o un template (es. una
+chiave esterna letta senza select_related). Lo usano:
+- il middleware config.middleware.ControlloQueryMiddleware (CONTROLLO_QUERY,
+  attivo di default con DEBUG), che segnala nel log o con un'eccezione le
+  richieste fuori budget;
+- il comando 'verifica_budget_query', che visita tutti gli URL di
+  gestionale/urls.py e fallisce se uno supera il budget.
+"""
+
+import logging
+import re
+from collections import Counter
+
+from django.conf import settings
+
+from .profilazione import MisuraQuery
+
+logger = logging.getLogger('gestionale.budget_query')
+
+_STRINGHE = re.compile(r"'(?:[^']|'')*'")
+_NUMERI = re.compile(r"\b\d+(?:\.\d+)?\b")
+_LISTE = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+
+class BudgetQuerySuperato(Exception):
+    """Richiesta oltre il budget di query o con query ripetute (CONTROLLO_QUERY_ERRORE)."""
+
+
+def budget_query(limite):
+    """Decoratore per le viste a funzione: equivale a 'query_budget = limite' sulle viste a classe."""
+    def decoratore(vista):
+        vista.query_budget = limite
+        return vista
+    return decoratore
+
+
+def budget_vista(vista):
+    """Budget della vista risolta da un URL (resolver_match.func o URLPattern.callback)."""
+    budget = getattr(getattr(vista, 'view_class', None), 'query_budget', None)
+    if budget is None:
+        budget = getattr(vista, 'query_budget', None)
+    return settings.QUERY_BUDGET_DEFAULT if budget is None else budget
+
+
+def forma_sql(sql):
+    """SQL senza valori: stringhe e numeri diventano '?', le liste di IN '(?)'."""
+    forma = _NUMERI.sub('?', _STRINGHE.sub('?', sql.replace('%s', '?')))
+    return ' '.join(_LISTE.sub('(?)', forma).split())
+
+
+class ControlloQuery(MisuraQuery):
+    """
+    Query di una richiesta raggruppate per forma. Le riceve dalla creazione
+    fino a stacca(), in qualunque thread giri la richiesta (vedi MisuraQuery in
+    gestionale/profilazione.py).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.forme = Counter()
+        self.byte = 0  # contato dal middleware come per MisuraRichiesta, qui non usato
+
+    def wrapper(self, execute, sql, params, many, context):
+        self.forme[forma_sql(sql)] += 1
+        return execute(sql, params, many, context)
+
+    @property
+    def query(self):
+        return sum(self.forme.values())
+
+    def ripetute(self):
+        """(forma, volte) delle query ripetute almeno QUERY_RIPETUTE_SOGLIA volte, le più frequenti prima."""
+        return [(forma, volte) for forma, volte in self.forme.most_common() if volte >= settings.QUERY_RIPETUTE_SOGLIA]
+
+    def problemi(self, budget):
+        problemi = []
+        if self.query > budget:
+            problemi.append(f"{self.query} query, budget {budget}")
+        for forma, volte in self.ripetute():
+            problemi.append(f"{volte} volte: {forma[:300]}")
+        return problemi
+
+    def concludi(self, request, response):
+        """Chiusura della richiesta nel middleware (una sola volta): segnala o solleva se ci sono problemi."""
+        if not self.attiva:
+            return
+        self.stacca()
+        match = getattr(request, 'resolver_match', None)
+        if response is None or match is None:
+            return
+        problemi = self.problemi(budget_vista(match.func))
+        if not problemi:
+            return
+        messaggio = f"{match.view_name or match._func_path} ({request.path}): " + ' | '.join(problemi)
+        # Per le risposte in streaming la richiesta è già stata inviata: resta solo il log.
+        if settings.CONTROLLO_QUERY_ERRORE and not response.streaming:
+            raise BudgetQuerySuperato(messaggio)
+        logger.warning(messaggio)
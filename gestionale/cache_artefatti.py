@@ -0,0 +1,136 @@
+# gestionale/cache_artefatti.py
+
+"""
+Cache su disco dei file generati dagli export (PDF ed Excel).
+
+La chiave di un artefatto è l'hash di: tenant, report (la vista di export),
+parametri (path e filtri GET), data odierna e "versione dei dati", cioè numero
+di righe e ultimo updated_at delle tabelle da cui il report legge. Se i dati
+non cambiano, la stessa richiesta viene servita dal file già generato; appena
+una riga viene creata, modificata o eliminata la chiave cambia e il report
+viene rigenerato. La data odierna nella chiave copre i report che dipendono da
+"oggi" (scadute/a scadere). I report che leggono tabelle senza updated_at non
+vengono messi in cache (vedi versione_dati()).
+
+Struttura su disco: ARTEFATTI_CACHE_DIR/<hash[:2]>/<hash>/<nome file originale>.
+Quando la dimensione totale supera ARTEFATTI_CACHE_MB vengono eliminati gli
+artefatti usati meno di recente (la data di modifica viene aggiornata a ogni lettura).
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import date
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+_lock_pulizia = threading.Lock()
+
+
+def cache_attiva():
+    return settings.ARTEFATTI_CACHE_MB > 0
+
+
+def versione_dati(querysets):
+    """
+    Impronta dei dati letti da un report: per ogni queryset numero di righe e
+    ultimo updated_at. Il conteggio intercetta anche le eliminazioni, che non
+    toccano updated_at. Restituisce None (report da non mettere in cache) se un
+    modello non ha updated_at: una modifica sul posto non cambierebbe l'impronta.
+    """
+    impronta = []
+    for queryset in querysets:
+        if 'updated_at' not in {f.name for f in queryset.model._meta.get_fields()}:
+            return None
+        valori = queryset.order_by().aggregate(righe=Count('pk'), ultimo=Max('updated_at'))
+        impronta.append([queryset.model._meta.label, valori['righe'], str(valori['ultimo'])])
+    return impronta
+
+
+def chiave_artefatto(tenant_id, report, parametri, versione):
+    """Hash SHA-256 che identifica l'artefatto; 'parametri' deve essere serializzabile in JSON."""
+    contenuto = json.dumps(
+        [tenant_id, report, parametri, date.today().isoformat(), versione],
+        sort_keys=True, default=str
+    )
+    return hashlib.sha256(contenuto.encode('utf-8')).hexdigest()
+
+
+def _cartella(chiave):
+    return os.path.join(settings.ARTEFATTI_CACHE_DIR, chiave[:2], chiave)
+
+
+def leggi_artefatto(chiave):
+    """Percorso del file in cache per la chiave (aggiornandone l'ultimo uso), o None."""
+    cartella = _cartella(chiave)
+    try:
+        nomi = [n for n in os.listdir(cartella) if not n.startswith('.')]
+    except FileNotFoundError:
+        return None
+    if not nomi:
+        return None
+    percorso = os.path.join(cartella, nomi[0])
+    try:
+        os.utime(percorso)
+    except OSError:
+        return None  # eliminato nel frattempo dalla pulizia
+    return percorso
+
+
+def salva_artefatto(chiave, nome_file, blocchi):
+    """
+    Scrive in cache i 'blocchi' (bytes) con il nome file indicato e restituisce il percorso.
+    La scrittura avviene su un file temporaneo nella stessa cartella, poi rinominato:
+    chi legge in parallelo non vede mai un file incompleto.
+    """
+    cartella = _cartella(chiave)
+    os.makedirs(cartella, exist_ok=True)
+    percorso = os.path.join(cartella, os.path.basename(nome_file))
+    fd, temporaneo = tempfile.mkstemp(dir=cartella, prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as destinazione:
+            for blocco in blocchi:
+                destinazione.write(blocco)
+        os.replace(temporaneo, percorso)
+    except BaseException:
+        if os.path.exists(temporaneo):
+            os.remove(temporaneo)
+        raise
+    pulisci_cache()
+    return percorso
+
+
+def pulisci_cache():
+    """Elimina gli artefatti usati meno di recente finché la cache non rientra in ARTEFATTI_CACHE_MB."""
+    limite = settings.ARTEFATTI_CACHE_MB * 1024 * 1024
+    if not _lock_pulizia.acquire(blocking=False):
+        return  # Un altro thread sta già facendo pulizia
+    try:
+        artefatti = []
+        totale = 0
+        for radice, _cartelle, nomi in os.walk(settings.ARTEFATTI_CACHE_DIR):
+            for nome in nomi:
+                if nome.startswith('.'):
+                    continue
+                percorso = os.path.join(radice, nome)
+                try:
+                    stat = os.stat(percorso)
+                except OSError:
+                    continue
+                artefatti.append((stat.st_mtime, stat.st_size, percorso))
+                totale += stat.st_size
+
+        for _mtime, dimensione, percorso in sorted(artefatti):
+            if totale <= limite:
+                break
+            try:
+                shutil.rmtree(os.path.dirname(percorso))
+            except OSError:
+                continue  # file aperto in lettura (Windows): riproveremo alla prossima pulizia
+            totale -= dimensione
+    finally:
+        _lock_pulizia.release()
@@ -0,0 +1,120 @@
+# gestionale/documenti.py
+
+"""
+Creazione di un documento (testata, righe e scadenze) a partire dai dati
+raccolti dal wizard in sessione.
+
+Tutto viene prima costruito e validato in memoria (importi, aliquote, totale
+delle scadenze); solo dopo si apre la transazione che assegna il numero,
+salva la testata e inserisce righe e scadenze con bulk_create. Il tenant viene
+assegnato direttamente a ogni oggetto: una fattura con centinaia di righe si
+salva con poche query invece di un INSERT per riga.
+
+bulk_create non chiama save() né invia i segnali post_save: per questo le
+scadenze ricevono qui importo pagato e residuo, e i KPI del tenant vengono
+invalidati dal salvataggio della testata (gestionale/signals.py).
+"""
+
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .models import AliquotaIVA, Anagrafica, Cantiere, DocumentoRiga, DocumentoTestata, ModalitaPagamento, Scadenza
+
+# Righe inserite per singolo INSERT.
+DIMENSIONE_LOTTO = 500
+
+
+def _importo(valore, descrizione):
+    try:
+        importo = Decimal(str(valore))
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValidationError(f"Valore non valido per {descrizione}: {valore!r}.")
+    if not importo.is_finite():
+        raise ValidationError(f"Valore non valido per {descrizione}: {valore!r}.")
+    return importo
+
+
+def prepara_documento(tenant_id, utente, testata_data, righe_data, scadenze_data):
+    """
+    Restituisce (testata, righe, scadenze) non salvati, già collegati al tenant.
+    Solleva ValidationError se i dati non sono coerenti e DoesNotExist se
+    anagrafica, modalità di pagamento o cantiere non esistono più.
+    """
+    if not righe_data:
+        raise ValidationError("Il documento non contiene righe.")
+
+    anagrafica = Anagrafica.objects.get(pk=testata_data.get('anagrafica_id'), tenant_id=tenant_id)
+    modalita_pagamento = ModalitaPagamento.objects.get(pk=testata_data.get('modalita_pagamento_id'), tenant_id=tenant_id)
+    cantiere = None
+    if testata_data.get('cantiere_id'):
+        cantiere = Cantiere.objects.get(pk=testata_data['cantiere_id'], tenant_id=tenant_id)
+
+    righe = [
+        DocumentoRiga(
+            tenant_id=tenant_id,
+            descrizione=riga['descrizione'],
+            quantita=_importo(riga['quantita'], f"la quantità della riga {numero}"),
+            prezzo_unitario=_importo(riga['prezzo_unitario'], f"il prezzo della riga {numero}"),
+            aliquota_iva_id=riga['aliquota_iva_id'],
+            imponibile_riga=_importo(riga['imponibile_riga'], f"l'imponibile della riga {numero}"),
+            iva_riga=_importo(riga['iva_riga'], f"l'IVA della riga {numero}"),
+        )
+        for numero, riga in enumerate(righe_data, start=1)
+    ]
+    # Una sola query per verificare tutte le aliquote usate.
+    aliquote = {str(riga.aliquota_iva_id) for riga in righe}
+    if AliquotaIVA.objects.filter(pk__in=aliquote, tenant_id=tenant_id).count() != len(aliquote):
+        raise ValidationError("Una delle aliquote IVA indicate non esiste più.")
+
+    imponibile = sum((riga.imponibile_riga for riga in righe), Decimal('0'))
+    iva = sum((riga.iva_riga for riga in righe), Decimal('0'))
+    testata = DocumentoTestata(
+        tenant_id=tenant_id, tipo_doc=testata_data['tipo_doc'], anagrafica=anagrafica,
+        data_documento=date.fromisoformat(testata_data['data_documento']),
+        numero_documento=testata_data.get('numero_documento_manuale') or '',
+        modalita_pagamento=modalita_pagamento, cantiere=cantiere, note=testata_data.get('note'),
+        imponibile=imponibile, iva=iva, totale=imponibile + iva,
+        stato=DocumentoTestata.Stato.CONFERMATO, created_by=utente, updated_by=utente,
+    )
+
+    tipo_scadenza = Scadenza.Tipo.INCASSO if 'V' in testata.tipo_doc else Scadenza.Tipo.PAGAMENTO
+    scadenze = []
+    for numero, dati in enumerate(scadenze_data, start=1):
+        importo_rata = _importo(dati['importo_rata'], f"la rata {numero}")
+        scadenze.append(Scadenza(
+            tenant_id=tenant_id, anagrafica=anagrafica,
+            data_scadenza=date.fromisoformat(dati['data_scadenza']),
+            importo_rata=importo_rata, importo_pagato=Decimal('0'), importo_residuo=importo_rata,
+            stato=Scadenza.Stato.APERTA, tipo_scadenza=tipo_scadenza,
+        ))
+    if sum((s.importo_rata for s in scadenze), Decimal('0')) != testata.totale:
+        raise ValidationError("L'importo delle scadenze non corrisponde al totale del documento.")
+
+    if testata.tipo_doc not in DocumentoTestata.PREFISSI_NUMERAZIONE and not testata.numero_documento:
+        raise ValidationError("Numero documento mancante.")
+    return testata, righe, scadenze
+
+
+def crea_documento(tenant_id, utente, testata_data, righe_data, scadenze_data):
+    """
+    Valida e salva il documento in un'unica transazione; restituisce la testata.
+    I documenti di vendita ricevono il numero dal contatore del tenant.
+    """
+    testata, righe, scadenze = prepara_documento(tenant_id, utente, testata_data, righe_data, scadenze_data)
+
+    with transaction.atomic():
+        if testata.tipo_doc in DocumentoTestata.PREFISSI_NUMERAZIONE:
+            testata.numero_documento = DocumentoTestata.genera_numero(tenant_id, testata.tipo_doc, date.today().year)
+        testata.save()
+
+        for riga in righe:
+            riga.testata = testata
+        DocumentoRiga.objects.bulk_create(righe, batch_size=DIMENSIONE_LOTTO)
+
+        for scadenza in scadenze:
+            scadenza.documento = testata
+        Scadenza.objects.bulk_create(scadenze, batch_size=DIMENSIONE_LOTTO)
+    return testata
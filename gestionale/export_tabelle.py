@@ -0,0 +1,130 @@
+# gestionale/export_tabelle.py
+
+"""
+Esportazione completa delle tabelle dell'azienda corrente (Pannello di
+Amministrazione: tabelle di sistema e tabelle contabili).
+
+Ogni tabella viene letta con values_list().iterator() a blocchi: non vengono
+create istanze dei modelli e non si chiama __str__ sulle chiavi esterne (che
+costava una query per ogni oggetto collegato). Le chiavi esterne sono esportate
+come id, nella colonna '<campo>_id' come nel database.
+
+Formati:
+- 'xlsx' (default): un foglio write-only per tabella; oltre il limite di righe
+  di Excel la tabella prosegue in fogli successivi ("PrimaNota (2)", ...);
+- 'csv': archivio zip con un CSV per tabella (separatore ';', UTF-8 con BOM
+  per l'apertura diretta in Excel).
+
+Il file viene composto su un file temporaneo e inviato a blocchi con
+FileResponse: la memoria occupata non dipende dalla dimensione dell'azienda.
+"""
+
+import csv
+import io
+import json
+import tempfile
+import zipfile
+from datetime import datetime
+
+from django.http import FileResponse
+from django.utils import timezone
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+from .report_utils import CONTENT_TYPE_XLSX
+from .righe_export import CHUNK_SIZE_EXPORT
+
+# Righe di dati per foglio: il limite di Excel (1.048.576) meno l'intestazione.
+MAX_RIGHE_FOGLIO = 1_048_575
+
+
+def colonne(modello):
+    """Nomi delle colonne esportate: i campi del modello, con '_id' per le chiavi esterne."""
+    return [field.attname for field in modello._meta.concrete_fields]
+
+
+def _valore(valore):
+    if isinstance(valore, datetime):
+        # Excel non gestisce i fusi orari: data e ora locali, senza tzinfo.
+        if timezone.is_aware(valore):
+            valore = timezone.localtime(valore)
+        return valore.replace(tzinfo=None)
+    if isinstance(valore, (dict, list)):
+        return json.dumps(valore, ensure_ascii=False)
+    return valore
+
+
+def righe_tabella(modello):
+    """Righe della tabella per il tenant corrente, in ordine di chiave primaria."""
+    queryset = modello.objects.order_by('pk').values_list(*colonne(modello))
+    for riga in queryset.iterator(chunk_size=CHUNK_SIZE_EXPORT):
+        yield [_valore(valore) for valore in riga]
+
+
+def _scrivi_xlsx(output, modelli, messaggio_vuoto):
+    workbook = Workbook(write_only=True)
+    font_intestazione = Font(bold=True)
+
+    for modello in modelli:
+        nomi_colonne = colonne(modello)
+        foglio, parte, righe_foglio = None, 0, 0
+        for riga in righe_tabella(modello):
+            # Il foglio viene creato alla prima riga: le tabelle vuote non compaiono.
+            if foglio is None or righe_foglio == MAX_RIGHE_FOGLIO:
+                parte += 1
+                titolo = modello.__name__[:31] if parte == 1 else f"{modello.__name__[:25]} ({parte})"
+                foglio = workbook.create_sheet(title=titolo)
+                intestazione = []
+                for nome in nomi_colonne:
+                    cella = WriteOnlyCell(foglio, value=nome)
+                    cella.font = font_intestazione
+                    intestazione.append(cella)
+                foglio.append(intestazione)
+                righe_foglio = 0
+            foglio.append(riga)
+            righe_foglio += 1
+
+    if not workbook.sheetnames:
+        workbook.create_sheet(title="NessunDato").append([messaggio_vuoto])
+    workbook.save(output)
+
+
+def _scrivi_csv_zip(output, modelli, messaggio_vuoto):
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as archivio:
+        tabelle = 0
+        for modello in modelli:
+            righe = righe_tabella(modello)
+            prima = next(righe, None)
+            if prima is None:
+                continue
+            # force_zip64: una tabella può superare i 2 GB non compressi.
+            voce = archivio.open(f"{modello.__name__}.csv", 'w', force_zip64=True)
+            with io.TextIOWrapper(voce, encoding='utf-8-sig', newline='') as testo:
+                writer = csv.writer(testo, delimiter=';')
+                writer.writerow(colonne(modello))
+                writer.writerow(prima)
+                writer.writerows(righe)
+            tabelle += 1
+        if not tabelle:
+            archivio.writestr('LEGGIMI.txt', messaggio_vuoto)
+
+
+def export_tabelle(modelli, nome_file, formato='xlsx', messaggio_vuoto="Nessun dato trovato."):
+    """
+    FileResponse con le tabelle 'modelli' dell'azienda corrente.
+    'formato' è 'xlsx' oppure 'csv' (zip con un CSV per tabella).
+    """
+    timestamp = timezone.localtime(timezone.now()).strftime('%Y%m%d%H%M')
+    # Il file temporaneo viene chiuso (e quindi cancellato) da FileResponse a fine invio.
+    output = tempfile.TemporaryFile()
+    if formato == 'csv':
+        _scrivi_csv_zip(output, modelli, messaggio_vuoto)
+        estensione, content_type = 'zip', 'application/zip'
+    else:
+        _scrivi_xlsx(output, modelli, messaggio_vuoto)
+        estensione, content_type = 'xlsx', CONTENT_TYPE_XLSX
+    output.seek(0)
+    return FileResponse(
+        output, as_attachment=True, filename=f"{timestamp}_{nome_file}.{estensione}", content_type=content_type
+    )
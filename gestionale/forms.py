@@ -1,13 +1,55 @@
 # gestionale/forms.py
 
 from django import forms
-from django.db import models
-from django.db.models import Sum, Value
-from django.db.models.functions import Coalesce
+from django.core.exceptions import ValidationError
+from django.urls import reverse
 from .models import (Anagrafica, Cantiere, Causale, ContoOperativo, 
         DipendenteDettaglio, DocumentoRiga, DocumentoTestata, AliquotaIVA, ModalitaPagamento, PrimaNota,
         Scadenza, ContoFinanziario, DiarioAttivita, MezzoAziendale, ScadenzaPersonale, TipoScadenzaPersonale)
 
+
+class AutocompleteSelect(forms.Select):
+    """
+    Select per ModelChoiceField che non carica tutta la tabella: nell'HTML ci sono
+    solo l'opzione vuota e il valore selezionato, le altre opzioni vengono cercate
+    dal browser pagina per pagina (partials/_autocomplete_js.html) sulla vista
+    'api_autocomplete' con la sorgente indicata (vedi gestionale/autocomplete.py).
+    Il queryset del campo resta quello usato per validare il valore inviato.
+    """
+    def __init__(self, sorgente, tipo=None, url_name=None, parametro_tipo='tipo', attrs=None):
+        super().__init__(attrs={'class': 'form-select', **(attrs or {})})
+        self.sorgente = sorgente
+        self.tipo = tipo
+        self.url_name = url_name
+        self.parametro_tipo = parametro_tipo
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        url = reverse(self.url_name) if self.url_name else reverse('api_autocomplete', args=[self.sorgente])
+        context['widget']['attrs'].update({
+            'data-autocomplete-url': url,
+            'data-autocomplete-tipo': self.tipo or '',
+            'data-autocomplete-parametro': self.parametro_tipo,
+        })
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        campo = self.choices.field
+        selezionati = {str(v) for v in value if v not in (None, '')}
+        opzioni = []
+        if campo.empty_label is not None:
+            opzioni.append(('', campo.empty_label))
+        if selezionati:
+            try:
+                for obj in self.choices.queryset.filter(pk__in=selezionati):
+                    opzioni.append((campo.prepare_value(obj), campo.label_from_instance(obj)))
+            except (ValueError, TypeError, ValidationError):
+                pass  # Valore inviato non valido: l'errore lo mostra già la validazione del campo
+        return [
+            (None, [self.create_option(name, valore, etichetta, str(valore) in selezionati, indice, attrs=attrs)], indice)
+            for indice, (valore, etichetta) in enumerate(opzioni)
+        ]
+
 class AnagraficaForm(forms.ModelForm):
     """
     Form per la creazione e modifica di un'Anagrafica.
@@ -119,23 +161,26 @@ class AnagraficaForm(forms.ModelForm):
         # In creazione, è un oggetto vuoto. In modifica, è l'oggetto esistente.
         
         # 1. Controlla la Partita IVA
-        if p_iva:
-            # Cerca anagrafiche con la stessa P.IVA, escludendo quella corrente.
-            queryset = Anagrafica.objects.filter(p_iva=p_iva).exclude(pk=self.instance.pk)
-            if queryset.exists():
-                # Se trovi un duplicato, solleva un errore di validazione
-                # che verrà mostrato all'utente vicino al campo 'p_iva'.
-                self.add_error('p_iva', "Esiste già un'anagrafica con questa Partita IVA.")
+        if p_iva and self.p_iva_esistente(p_iva):
+            # Se trovi un duplicato, solleva un errore di validazione
+            # che verrà mostrato all'utente vicino al campo 'p_iva'.
+            self.add_error('p_iva', "Esiste già un'anagrafica con questa Partita IVA.")
 
         # 2. Controlla il Codice Fiscale
-        if codice_fiscale:
-            # Cerca anagrafiche con lo stesso C.F., escludendo quella corrente.
-            queryset = Anagrafica.objects.filter(codice_fiscale=codice_fiscale).exclude(pk=self.instance.pk)
-            if queryset.exists():
-                self.add_error('codice_fiscale', "Esiste già un'anagrafica con questo Codice Fiscale.")
+        if codice_fiscale and self.codice_fiscale_esistente(codice_fiscale):
+            self.add_error('codice_fiscale', "Esiste già un'anagrafica con questo Codice Fiscale.")
         
         return cleaned_data
 
+    # I controlli di unicità sono metodi separati perché l'importazione massiva
+    # (gestionale/importazione.py) li sostituisce con una ricerca in memoria.
+    def p_iva_esistente(self, p_iva):
+        # Cerca anagrafiche con la stessa P.IVA, escludendo quella corrente.
+        return Anagrafica.objects.filter(p_iva=p_iva).exclude(pk=self.instance.pk).exists()
+
+    def codice_fiscale_esistente(self, codice_fiscale):
+        return Anagrafica.objects.filter(codice_fiscale=codice_fiscale).exclude(pk=self.instance.pk).exists()
+
 class AnagraficaFilterForm(forms.Form):
     """
     Form per i filtri della lista anagrafiche.
@@ -222,10 +267,11 @@ class DocumentoTestataForm(forms.ModelForm):
         ]
         widgets = {
             'tipo_doc': forms.Select(attrs={'class': 'form-select'}),
-            'anagrafica': forms.Select(attrs={'class': 'form-select'}),
+            # Il tipo (clienti o fornitori) lo imposta lo script del wizard in base a tipo_doc.
+            'anagrafica': AutocompleteSelect('anagrafica', url_name='api_get_anagrafiche', parametro_tipo='tipo_doc'),
             'data_documento': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
             'modalita_pagamento': forms.Select(attrs={'class': 'form-select'}),
-            'cantiere': forms.Select(attrs={'class': 'form-select'}),
+            'cantiere': AutocompleteSelect('cantiere'),
             'note': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
         }
 
@@ -236,9 +282,12 @@ class DocumentoTestataForm(forms.ModelForm):
             # Popoliamo i queryset con i dati del tenant corrente
             self.fields['modalita_pagamento'].queryset = ModalitaPagamento.objects.filter(tenant=tenant, attivo=True)
             self.fields['cantiere'].queryset = Cantiere.objects.filter(tenant=tenant, attivo=True)
-        # Inizializziamo l'anagrafica a vuoto, verrà popolata da JS
+        # Inizializziamo l'anagrafica a vuoto, le opzioni vengono cercate da JS
         self.fields['anagrafica'].queryset = Anagrafica.objects.none()
 
+        # Filtro iniziale del widget: lo script lo aggiorna quando cambia il tipo documento
+        self.fields['anagrafica'].widget.tipo = self.data.get('tipo_doc') or self.instance.tipo_doc
+
         if 'tipo_doc' in self.data:
             try:
                 tipo_doc = self.data.get('tipo_doc')
@@ -271,14 +320,7 @@ class DocumentoTestataForm(forms.ModelForm):
         ]
         
         if tipo_doc in tipi_passivi and anagrafica and numero_manuale:
-            # Cerchiamo nel database se esiste già un documento con questa combinazione.
-            # self.instance.pk ci assicura che in modifica non controlliamo l'oggetto stesso.
-            if DocumentoTestata.objects.filter(
-                anagrafica=anagrafica,
-                tipo_doc=tipo_doc,
-                numero_documento=numero_manuale
-            ).exclude(pk=self.instance.pk).exists():
-                
+            if self.documento_esistente(anagrafica, tipo_doc, numero_manuale):
                 # Se esiste, solleviamo un errore di validazione specifico
                 # sul campo 'numero_documento_manuale'.
                 self.add_error(
@@ -287,6 +329,15 @@ class DocumentoTestataForm(forms.ModelForm):
                 )
 
         return cleaned_data
+
+    def documento_esistente(self, anagrafica, tipo_doc, numero_documento):
+        # Cerchiamo nel database se esiste già un documento con questa combinazione.
+        # self.instance.pk ci assicura che in modifica non controlliamo l'oggetto stesso.
+        return DocumentoTestata.objects.filter(
+            anagrafica=anagrafica,
+            tipo_doc=tipo_doc,
+            numero_documento=numero_documento
+        ).exclude(pk=self.instance.pk).exists()
     
 class DocumentoRigaForm(forms.ModelForm):
     class Meta:
@@ -380,10 +431,10 @@ class ScadenzarioFilterForm(forms.Form):
     )
 
     anagrafica = forms.ModelChoiceField(
-        queryset=Anagrafica.objects.filter(attivo=True).order_by('nome_cognome_ragione_sociale'),
+        queryset=Anagrafica.objects.none(),
         required=False,
         label="Filtra per Anagrafica",
-        widget=forms.Select(attrs={'class': 'form-select'})
+        widget=AutocompleteSelect('anagrafica')
     )
     data_da = forms.DateField(
         required=False, 
@@ -408,6 +459,12 @@ class ScadenzarioFilterForm(forms.Form):
         widget=forms.Select(attrs={'class': 'form-select'})
     )
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Il queryset va creato qui e non a livello di classe: il manager filtra
+        # per il tenant attivo solo al momento della chiamata.
+        self.fields['anagrafica'].queryset = Anagrafica.objects.filter(attivo=True)
+
 class DiarioAttivitaForm(forms.ModelForm):
     """
     Form per la pianificazione e consuntivazione delle attività giornaliere.
@@ -476,16 +533,16 @@ class PrimaNotaFilterForm(forms.Form):
         widget=forms.TextInput(attrs={'class': 'form-control'})
     )
     conto_finanziario = forms.ModelChoiceField(
-        queryset=ContoFinanziario.objects.filter(attivo=True),
+        queryset=ContoFinanziario.objects.none(),
         required=False,
         label="Conto Finanziario",
-        widget=forms.Select(attrs={'class': 'form-select'})
+        widget=AutocompleteSelect('conto_finanziario')
     )
     causale = forms.ModelChoiceField(
-        queryset=Causale.objects.filter(attivo=True),
+        queryset=Causale.objects.none(),
         required=False,
         label="Causale",
-        widget=forms.Select(attrs={'class': 'form-select'})
+        widget=AutocompleteSelect('causale')
     )
     data_da = forms.DateField(
         required=False, 
@@ -498,12 +555,18 @@ class PrimaNotaFilterForm(forms.Form):
         widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'})
     )
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Queryset creati qui perché il manager li limiti al tenant attivo.
+        self.fields['conto_finanziario'].queryset = ContoFinanziario.objects.filter(attivo=True)
+        self.fields['causale'].queryset = Causale.objects.filter(attivo=True)
+
 class PrimaNotaForm(forms.ModelForm):
     conto_destinazione = forms.ModelChoiceField(
-        queryset=ContoFinanziario.objects.filter(attivo=True),
+        queryset=ContoFinanziario.objects.none(),
         required=False,
         label="Conto Finanziario di Destinazione",
-        widget=forms.Select(attrs={'class': 'form-select'})
+        widget=AutocompleteSelect('conto_finanziario')
     )
     
     class Meta:
@@ -515,21 +578,21 @@ class PrimaNotaForm(forms.ModelForm):
             'conto_operativo', 'anagrafica', 'cantiere'
         ]
         widgets = {
-            'causale': forms.Select(attrs={'class': 'form-select'}),
+            'causale': AutocompleteSelect('causale'),
             'data_registrazione': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
             'descrizione': forms.TextInput(attrs={'class': 'form-control'}),
             'importo': forms.NumberInput(attrs={'class': 'form-control'}),
             'tipo_movimento': forms.Select(attrs={'class': 'form-select'}),            
-            'conto_finanziario': forms.Select(attrs={'class': 'form-select'}),
+            'conto_finanziario': AutocompleteSelect('conto_finanziario'),
             'conto_operativo': forms.Select(attrs={'class': 'form-select'}),
-            'anagrafica': forms.Select(attrs={'class': 'form-select'}),
-            'cantiere': forms.Select(attrs={'class': 'form-select'}),
+            'anagrafica': AutocompleteSelect('anagrafica'),
+            'cantiere': AutocompleteSelect('cantiere', tipo='aperti'),
         }
     
     def __init__(self, *args, **kwargs):
         tenant = kwargs.pop('tenant', None)
         super().__init__(*args, **kwargs)
-        # Ottimizziamo i queryset per i menu a tendina
+        # Queryset usati per validare i valori scelti (le opzioni arrivano via autocompletamento)
         if tenant:
             self.fields['conto_finanziario'].queryset = ContoFinanziario.objects.filter(tenant=tenant, attivo=True)
             self.fields['conto_operativo'].queryset = ContoOperativo.objects.filter(tenant=tenant, attivo=True)
@@ -555,10 +618,7 @@ class PrimaNotaForm(forms.ModelForm):
         causale = cleaned_data.get('causale')
         tipo_movimento = cleaned_data.get('tipo_movimento')
 
-        try:
-            causale_giroconto = Causale.objects.get(descrizione__iexact="GIROCONTO")
-        except Causale.DoesNotExist:
-            causale_giroconto = None
+        causale_giroconto = self.causale_giroconto()
 
         # CASO 1: È un giroconto
         if causale and causale == causale_giroconto:
@@ -582,6 +642,12 @@ class PrimaNotaForm(forms.ModelForm):
                 
         return cleaned_data
 
+    def causale_giroconto(self):
+        try:
+            return Causale.objects.get(descrizione__iexact="GIROCONTO")
+        except Causale.DoesNotExist:
+            return None
+
 class PartitarioFilterForm(forms.Form):
     """
     Form per i filtri di data del Partitario Anagrafica.
@@ -644,11 +710,9 @@ class PagamentoUpdateForm(forms.ModelForm):
         scadenza = self.instance.scadenza_collegata
         importo_originale_pagamento = self.instance.importo
         
-        # Calcoliamo il totale già pagato sulla scadenza, ESCLUSO questo pagamento
-        # Aggiungiamo output_field=models.DecimalField() a Coalesce
-        totale_altri_pagamenti = scadenza.pagamenti.exclude(pk=self.instance.pk).aggregate(
-            total=Coalesce(Sum('importo'), Value(0), output_field=models.DecimalField())
-        )['total']
+        # Totale già pagato sulla scadenza, ESCLUSO questo pagamento
+        # (l'importo pagato è memorizzato sulla scadenza stessa)
+        totale_altri_pagamenti = scadenza.importo_pagato - importo_originale_pagamento
         
         # Il massimo importo che questo pagamento può assumere
         massimo_importo_consentito = scadenza.importo_rata - totale_altri_pagamenti
@@ -910,3 +974,26 @@ class AnalisiFilterForm(forms.Form):
     )
 
 
+
+class ImportazioneDatiForm(forms.Form):
+    """
+    Form del pannello di amministrazione per l'importazione massiva da CSV/XLSX
+    (gestionale/importazione.py).
+    """
+    TIPI = [
+        ('anagrafiche', 'Anagrafiche'),
+        ('primanota', 'Movimenti di Prima Nota'),
+        ('documenti', 'Documenti (una riga per riga di documento)'),
+    ]
+    tipo = forms.ChoiceField(choices=TIPI, label="Dati da importare", widget=forms.Select(attrs={'class': 'form-select'}))
+    file = forms.FileField(label="File CSV o XLSX", widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,.xlsx'}))
+    simula = forms.BooleanField(
+        required=False, label="Solo verifica (non salva nulla)",
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
+
+    def clean_file(self):
+        file = self.cleaned_data['file']
+        if not file.name.lower().endswith(('.csv', '.xlsx')):
+            raise forms.ValidationError("Formato non supportato: caricare un file .csv o .xlsx.")
+        return file
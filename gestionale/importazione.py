@@ -0,0 +1,552 @@
+# gestionale/importazione.py
+
+"""
+Importazione massiva di anagrafiche, movimenti di Prima Nota e documenti da
+file CSV o XLSX (comando 'importa_dati' e pagina del pannello di amministrazione).
+
+Il file viene letto una riga alla volta (csv o openpyxl in sola lettura), quindi
+anche centinaia di migliaia di righe non vengono mai caricate tutte in memoria.
+Ogni riga passa dagli stessi form usati dalle viste (AnagraficaForm,
+PrimaNotaForm, DocumentoTestataForm/DocumentoRigaForm), ma:
+- clienti, conti, causali, aliquote... vengono risolti con mappe in memoria
+  caricate una volta all'inizio, invece di una query per campo e per riga;
+- i controlli di unicità dei form (P.IVA, codice fiscale, numero documento)
+  usano insiemi in memoria, aggiornati con quanto importato;
+- le righe valide vengono scritte con bulk_create a lotti, ciascuno nella
+  propria transazione, e codici/numeri vengono riservati a blocchi dai contatori.
+
+Le righe non valide non bloccano l'importazione: vengono riportate con il loro
+numero nel file e il motivo.
+
+bulk_create non chiama save() né invia segnali: i saldi dei conti finanziari
+vengono aggiornati qui una volta per conto e per lotto, così come i totali
+mensili (una volta per mese e chiave), i saldi giornalieri vengono invalidati
+dalla data più vecchia del lotto e i KPI del tenant alla fine.
+"""
+
+import csv
+import io
+import re
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from itertools import chain, groupby, islice
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from openpyxl import load_workbook
+
+from .forms import AnagraficaForm, DocumentoRigaForm, DocumentoTestataForm, PrimaNotaForm
+from .kpi import invalida_kpi
+from .managers import tenant_context
+from .models import (
+    AliquotaIVA, Anagrafica, Cantiere, Causale, ContatoreNumerazione, ContoFinanziario, ContoOperativo,
+    DocumentoRiga, DocumentoTestata, ModalitaPagamento, PrimaNota, SaldoContoFinanziario,
+    SaldoGiornaliero, Scadenza, TotaleMensileDocumenti, TotaleMensileMovimenti
+)
+from .totali_mensili import registra_totali
+
+# Righe (o documenti) scritte per transazione.
+DIMENSIONE_LOTTO = 1000
+
+# Colonne con importi: nei CSV italiani possono arrivare come "1.234,56".
+COLONNE_NUMERICHE = {'importo', 'quantita', 'prezzo_unitario'}
+
+VALORI_VERI = {'1', 'si', 'sì', 's', 'true', 'vero', 'x', 'yes', 'y'}
+
+
+# ==============================================================================
+# === LETTURA DEL FILE                                                      ===
+# ==============================================================================
+
+def _intestazione(valore):
+    return str(valore or '').strip().lower().replace(' ', '_')
+
+
+def _valore(colonna, valore):
+    if valore is None:
+        return ''
+    if isinstance(valore, float) and valore.is_integer():
+        # openpyxl restituisce 12.0 per un codice o un importo intero.
+        valore = int(valore)
+    if isinstance(valore, str):
+        valore = valore.strip()
+        if colonna in COLONNE_NUMERICHE and ',' in valore:
+            valore = valore.replace('.', '').replace(',', '.')
+    return valore
+
+
+def _leggi_csv(file):
+    testo = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    prima_riga = testo.readline()
+    # Il separatore è quello più presente nell'intestazione (Excel italiano usa ';').
+    separatore = max(';,\t', key=prima_riga.count)
+    lettore = csv.reader(chain([prima_riga], testo), delimiter=separatore)
+    colonne = [_intestazione(c) for c in next(lettore, [])]
+    for numero, valori in enumerate(lettore, start=2):
+        if any(v.strip() for v in valori):
+            yield numero, {c: _valore(c, v) for c, v in zip(colonne, valori)}
+
+
+def _leggi_xlsx(file):
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        righe = workbook.worksheets[0].iter_rows(values_only=True)
+        colonne = [_intestazione(c) for c in next(righe, ())]
+        for numero, valori in enumerate(righe, start=2):
+            if any(v not in (None, '') for v in valori):
+                yield numero, {c: _valore(c, v) for c, v in zip(colonne, valori)}
+    finally:
+        workbook.close()
+
+
+def leggi_righe(file, nome_file):
+    """
+    Restituisce un generatore di (numero riga nel file, {colonna: valore}).
+    'file' è un file binario (aperto con 'rb' o caricato dal browser); le
+    intestazioni sono confrontate senza maiuscole e con '_' al posto degli spazi.
+    """
+    nome_file = nome_file.lower()
+    if nome_file.endswith('.csv'):
+        return _leggi_csv(file)
+    if nome_file.endswith('.xlsx'):
+        return _leggi_xlsx(file)
+    raise ValidationError("Formato non supportato: caricare un file .csv o .xlsx.")
+
+
+# ==============================================================================
+# === SUPPORTO ALLA VALIDAZIONE                                             ===
+# ==============================================================================
+
+def _chiave(valore):
+    return str(valore).strip().lower()
+
+
+def _mappa(queryset, campo):
+    """{valore del campo in minuscolo: oggetto} con una sola query."""
+    return {_chiave(getattr(obj, campo)): obj for obj in queryset if getattr(obj, campo)}
+
+
+class SceltaDaMappa(forms.ModelChoiceField):
+    """
+    Campo di scelta che risolve il valore (descrizione, codice, nome conto...)
+    in una mappa precaricata invece di interrogare il database per ogni riga.
+    """
+    def __init__(self, mappa, queryset, **kwargs):
+        self.mappa = mappa
+        super().__init__(queryset=queryset, **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            return self.mappa[_chiave(value)]
+        except KeyError:
+            raise ValidationError(f"'{value}' non trovato.", code='invalid_choice')
+
+    def validate(self, value):
+        forms.Field.validate(self, value)
+
+
+def _messaggi(form):
+    messaggi = []
+    for campo, errori in form.errors.items():
+        prefisso = '' if campo == '__all__' else f"{campo}: "
+        messaggi.extend(f"{prefisso}{errore}" for errore in errori)
+    return '; '.join(messaggi)
+
+
+class EsitoImportazione:
+    """Contatori e righe scartate di un'importazione."""
+
+    def __init__(self):
+        self.righe_lette = 0
+        self.importati = 0
+        self.errori = []  # (numero riga, messaggio)
+
+    def aggiungi_errore(self, numero_riga, messaggio):
+        self.errori.append((numero_riga, messaggio))
+
+
+# ==============================================================================
+# === IMPORTATORI                                                           ===
+# ==============================================================================
+
+class Importatore:
+    """
+    Schema comune: prepara() carica le mappe, unita() raggruppa le righe del file
+    (una riga per record, più righe per un documento), valida() trasforma
+    un'unità in oggetti non salvati o solleva ValidationError, scrivi() salva
+    un lotto di oggetti validi. Dopo un lotto non salvato prepara() viene
+    ripetuto, per ripartire dai dati effettivamente presenti nel database.
+    """
+    descrizione = ''
+
+    def __init__(self, tenant, utente=None, simula=False, dimensione_lotto=DIMENSIONE_LOTTO):
+        self.tenant = tenant
+        self.utente = utente
+        self.simula = simula
+        self.dimensione_lotto = dimensione_lotto
+
+    def prepara(self):
+        pass
+
+    def unita(self, righe):
+        for numero, dati in righe:
+            yield numero, 1, dati
+
+    def valida(self, dati):
+        raise NotImplementedError
+
+    def scrivi(self, oggetti):
+        raise NotImplementedError
+
+    def esegui(self, righe, al_lotto=None):
+        """Importa le righe lette da leggi_righe(); 'al_lotto(esito)' viene chiamato dopo ogni lotto."""
+        esito = EsitoImportazione()
+        with tenant_context(self.tenant):
+            self.prepara()
+            unita = self.unita(righe)
+            while lotto := list(islice(unita, self.dimensione_lotto)):
+                validi = []
+                for numero, righe_unita, dati in lotto:
+                    esito.righe_lette += righe_unita
+                    try:
+                        validi.append(self.valida(dati))
+                    except ValidationError as e:
+                        esito.aggiungi_errore(numero, '; '.join(e.messages))
+                if validi and not self.simula:
+                    try:
+                        with transaction.atomic():
+                            self.scrivi(validi)
+                    except DatabaseError as e:
+                        esito.aggiungi_errore(lotto[0][0], f"Lotto fino alla riga {lotto[-1][0]} non salvato: {e}")
+                        validi = []
+                        # valida() e scrivi() hanno già registrato le chiavi del lotto (P.IVA,
+                        # C.F., numeri di documento): le ricarichiamo dal database, così le
+                        # righe successive non vengono scartate come duplicati di record mai salvati.
+                        self.prepara()
+                esito.importati += len(validi)
+                if al_lotto:
+                    al_lotto(esito)
+        if esito.importati and not self.simula:
+            invalida_kpi(self.tenant.pk)
+        return esito
+
+
+class ImportatoreAnagrafiche(Importatore):
+    """
+    Colonne: tipo, nome_cognome_ragione_sociale, p_iva, codice_fiscale, indirizzo,
+    cap, citta, provincia, email, telefono, attivo (facoltativa, default sì).
+    Il codice viene assegnato dal contatore del tenant, come in inserimento manuale.
+    """
+    descrizione = 'anagrafiche'
+
+    def prepara(self):
+        esistenti = Anagrafica._base_manager.filter(tenant=self.tenant)
+        self.partite_iva = set(esistenti.exclude(p_iva__isnull=True).exclude(p_iva='').values_list('p_iva', flat=True))
+        self.codici_fiscali = set(
+            esistenti.exclude(codice_fiscale__isnull=True).exclude(codice_fiscale='').values_list('codice_fiscale', flat=True)
+        )
+        importatore = self
+
+        class AnagraficaImportForm(AnagraficaForm):
+            def p_iva_esistente(self, p_iva):
+                return p_iva in importatore.partite_iva
+
+            def codice_fiscale_esistente(self, codice_fiscale):
+                return codice_fiscale in importatore.codici_fiscali
+
+        self.form_class = AnagraficaImportForm
+
+    def valida(self, dati):
+        dati = dict(dati)
+        dati['tipo'] = str(dati.get('tipo', '')).capitalize()
+        attivo = dati.get('attivo', '')
+        dati['attivo'] = attivo == '' or attivo is True or _chiave(attivo) in VALORI_VERI
+        form = self.form_class(data=dati)
+        if not form.is_valid():
+            raise ValidationError(_messaggi(form))
+        anagrafica = form.save(commit=False)
+        anagrafica.tenant = self.tenant
+        anagrafica.created_by = anagrafica.updated_by = self.utente
+        # Le righe successive dello stesso file non possono riusare P.IVA e C.F.
+        if anagrafica.p_iva:
+            self.partite_iva.add(anagrafica.p_iva)
+        if anagrafica.codice_fiscale:
+            self.codici_fiscali.add(anagrafica.codice_fiscale)
+        return anagrafica
+
+    def scrivi(self, anagrafiche):
+        per_tipo = defaultdict(list)
+        for anagrafica in anagrafiche:
+            per_tipo[anagrafica.tipo].append(anagrafica)
+        for tipo, gruppo in per_tipo.items():
+            for anagrafica, codice in zip(gruppo, Anagrafica.genera_codici(self.tenant.pk, tipo, len(gruppo))):
+                anagrafica.codice = codice
+        Anagrafica.objects.bulk_create(anagrafiche)
+
+
+class ImportatorePrimaNota(Importatore):
+    """
+    Colonne: data_registrazione, descrizione, importo, tipo_movimento (E/U o
+    Entrata/Uscita), causale (descrizione), conto_finanziario (nome), e facoltative
+    conto_destinazione (giroconti), conto_operativo (nome), anagrafica (codice),
+    cantiere (codice). Un giroconto genera i due movimenti collegati, come nella vista.
+    """
+    descrizione = 'movimenti di prima nota'
+
+    def prepara(self):
+        tenant = self.tenant
+        causali = Causale.objects.filter(tenant=tenant, attivo=True)
+        conti = ContoFinanziario.objects.filter(tenant=tenant, attivo=True)
+        conti_operativi = ContoOperativo.objects.filter(tenant=tenant, attivo=True)
+        anagrafiche = Anagrafica.objects.filter(tenant=tenant, attivo=True).only('pk', 'codice', 'tenant_id')
+        cantieri = Cantiere.objects.filter(tenant=tenant, stato=Cantiere.Stato.APERTO).only('pk', 'codice_cantiere', 'tenant_id')
+
+        mappa_causali = _mappa(causali, 'descrizione')
+        mappa_conti = _mappa(conti, 'nome_conto')
+        giroconto = mappa_causali.get('giroconto')
+
+        class PrimaNotaImportForm(PrimaNotaForm):
+            causale = SceltaDaMappa(mappa_causali, causali)
+            conto_finanziario = SceltaDaMappa(mappa_conti, conti)
+            conto_destinazione = SceltaDaMappa(mappa_conti, conti, required=False)
+            conto_operativo = SceltaDaMappa(_mappa(conti_operativi, 'nome_conto'), conti_operativi, required=False)
+            anagrafica = SceltaDaMappa(_mappa(anagrafiche, 'codice'), anagrafiche, required=False)
+            cantiere = SceltaDaMappa(_mappa(cantieri, 'codice_cantiere'), cantieri, required=False)
+
+            class Meta(PrimaNotaForm.Meta):
+                # I collegamenti sono assegnati da valida(): così la validazione
+                # del modello non ricontrolla con una query ogni chiave esterna.
+                fields = ['data_registrazione', 'descrizione', 'importo', 'tipo_movimento']
+
+            def causale_giroconto(self):
+                return giroconto
+
+        self.form_class = PrimaNotaImportForm
+
+    def valida(self, dati):
+        dati = dict(dati)
+        dati['tipo_movimento'] = str(dati.get('tipo_movimento', ''))[:1].upper()
+        form = self.form_class(data=dati)
+        if not form.is_valid():
+            raise ValidationError(_messaggi(form))
+
+        movimento = form.save(commit=False)
+        for campo in ('causale', 'conto_finanziario', 'conto_operativo', 'anagrafica', 'cantiere'):
+            setattr(movimento, campo, form.cleaned_data[campo])
+        movimento.tenant = self.tenant
+        movimento.created_by = movimento.updated_by = self.utente
+
+        if movimento.causale.tipo_movimento_default != Causale.Tipo.MISTO:
+            return movimento, None
+
+        conto_destinazione = form.cleaned_data['conto_destinazione']
+        if not conto_destinazione:
+            raise ValidationError("conto_destinazione: Questo campo è obbligatorio per un giroconto.")
+        movimento.tipo_movimento = PrimaNota.TipoMovimento.USCITA
+        movimento.descrizione = f"GIROCONTO -> {conto_destinazione.nome_conto}"
+        entrata = PrimaNota(
+            tenant=self.tenant, data_registrazione=movimento.data_registrazione,
+            descrizione=f"GIROCONTO <- {movimento.conto_finanziario.nome_conto}",
+            importo=movimento.importo, tipo_movimento=PrimaNota.TipoMovimento.ENTRATA,
+            causale=movimento.causale, conto_finanziario=conto_destinazione,
+            created_by=self.utente,
+        )
+        return movimento, entrata
+
+    def scrivi(self, movimenti):
+        SaldoGiornaliero.invalida(self.tenant.pk, min(movimento.data_registrazione for movimento, _ in movimenti))
+        PrimaNota.objects.bulk_create([movimento for movimento, _ in movimenti])
+        giroconti = [(uscita, entrata) for uscita, entrata in movimenti if entrata]
+        if giroconti:
+            for uscita, entrata in giroconti:
+                entrata.movimento_collegato = uscita
+            PrimaNota.objects.bulk_create([entrata for _, entrata in giroconti])
+            for uscita, entrata in giroconti:
+                uscita.movimento_collegato = entrata
+            PrimaNota.objects.bulk_update([uscita for uscita, _ in giroconti], ['movimento_collegato'])
+
+        # Saldi materializzati: un aggiornamento per conto e tipo invece di uno per movimento.
+        totali = defaultdict(Decimal)
+        for movimento in chain.from_iterable(movimenti):
+            if movimento:
+                totali[movimento.conto_finanziario_id, movimento.tipo_movimento] += movimento.importo
+        for (conto_id, tipo_movimento), importo in totali.items():
+            SaldoContoFinanziario.registra_movimento(self.tenant.pk, conto_id, tipo_movimento, importo)
+        registra_totali(self.tenant.pk, TotaleMensileMovimenti, chain.from_iterable(movimenti))
+
+
+class ImportatoreDocumenti(Importatore):
+    """
+    Una riga per riga di documento. Colonne di testata: tipo_doc (FTV, NCV, FTA,
+    NCA), numero_documento, data_documento, anagrafica (codice), modalita_pagamento
+    (descrizione), cantiere (codice, facoltativo), note; colonne di riga:
+    descrizione, quantita, prezzo_unitario, aliquota_iva (descrizione).
+
+    Le righe consecutive con stessi tipo, numero, data e anagrafica formano un
+    documento. I documenti di vendita senza numero lo ricevono dal contatore
+    dell'anno del documento; quelli con numero già assegnato (es. FT-2024-000123)
+    fanno avanzare il contatore, così la numerazione prosegue senza duplicati.
+    Ogni documento riceve un'unica scadenza per il totale, alla data proposta dal
+    wizard (data documento + giorni della modalità di pagamento).
+    """
+    descrizione = 'documenti'
+
+    COLONNE_TESTATA = ('tipo_doc', 'numero_documento', 'data_documento', 'anagrafica')
+    TIPI_VENDITA = (DocumentoTestata.TipoDoc.FATTURA_VENDITA, DocumentoTestata.TipoDoc.NOTA_CREDITO_VENDITA)
+
+    def prepara(self):
+        tenant = self.tenant
+        anagrafiche = Anagrafica.objects.filter(tenant=tenant, attivo=True).only('pk', 'codice', 'tipo', 'nome_cognome_ragione_sociale', 'tenant_id')
+        clienti = _mappa(anagrafiche.filter(tipo=Anagrafica.Tipo.CLIENTE), 'codice')
+        fornitori = _mappa(anagrafiche.filter(tipo=Anagrafica.Tipo.FORNITORE), 'codice')
+        modalita = ModalitaPagamento.objects.filter(tenant=tenant, attivo=True)
+        cantieri = Cantiere.objects.filter(tenant=tenant, attivo=True).only('pk', 'codice_cantiere', 'tenant_id')
+        aliquote = AliquotaIVA.objects.filter(tenant=tenant, attivo=True)
+
+        self.documenti = set(
+            DocumentoTestata._base_manager.filter(tenant=tenant).values_list('anagrafica_id', 'tipo_doc', 'numero_documento')
+        )
+        importatore = self
+        tipi_vendita = self.TIPI_VENDITA
+
+        class DocumentoTestataImportForm(DocumentoTestataForm):
+            anagrafica = SceltaDaMappa({}, anagrafiche)
+            modalita_pagamento = SceltaDaMappa(_mappa(modalita, 'descrizione'), modalita)
+            cantiere = SceltaDaMappa(_mappa(cantieri, 'codice_cantiere'), cantieri, required=False)
+
+            class Meta(DocumentoTestataForm.Meta):
+                fields = ['tipo_doc', 'data_documento', 'note']
+
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                # Come nel wizard: clienti per i documenti di vendita, fornitori per gli acquisti.
+                self.fields['anagrafica'].mappa = clienti if self.data.get('tipo_doc') in tipi_vendita else fornitori
+
+            def documento_esistente(self, anagrafica, tipo_doc, numero_documento):
+                return (anagrafica.pk, tipo_doc, numero_documento) in importatore.documenti
+
+        class DocumentoRigaImportForm(DocumentoRigaForm):
+            aliquota_iva = SceltaDaMappa(_mappa(aliquote, 'descrizione'), aliquote)
+
+            class Meta(DocumentoRigaForm.Meta):
+                fields = ['descrizione', 'quantita', 'prezzo_unitario']
+
+        self.form_testata = DocumentoTestataImportForm
+        self.form_riga = DocumentoRigaImportForm
+
+    def unita(self, righe):
+        def chiave(riga):
+            return tuple(str(riga[1].get(colonna, '')) for colonna in self.COLONNE_TESTATA)
+
+        for _, gruppo in groupby(righe, key=chiave):
+            gruppo = list(gruppo)
+            yield gruppo[0][0], len(gruppo), gruppo
+
+    def valida(self, gruppo):
+        dati = dict(gruppo[0][1])
+        dati['tipo_doc'] = str(dati.get('tipo_doc', '')).upper()
+        dati['numero_documento_manuale'] = dati.get('numero_documento', '')
+        form = self.form_testata(data=dati)
+        if not form.is_valid():
+            raise ValidationError(_messaggi(form))
+
+        testata = form.save(commit=False)
+        testata.tenant = self.tenant
+        testata.anagrafica = form.cleaned_data['anagrafica']
+        testata.modalita_pagamento = form.cleaned_data['modalita_pagamento']
+        testata.cantiere = form.cleaned_data['cantiere']
+        testata.numero_documento = str(form.cleaned_data['numero_documento_manuale'] or '')
+        testata.stato = DocumentoTestata.Stato.CONFERMATO
+        testata.created_by = testata.updated_by = self.utente
+
+        chiave = (testata.anagrafica.pk, testata.tipo_doc, testata.numero_documento)
+        if testata.numero_documento and chiave in self.documenti:
+            raise ValidationError(f"Il documento {testata.numero_documento} è già presente.")
+        if not testata.numero_documento and testata.tipo_doc not in DocumentoTestata.PREFISSI_NUMERAZIONE:
+            raise ValidationError("Numero documento mancante.")
+
+        righe = []
+        for numero, dati_riga in gruppo:
+            form_riga = self.form_riga(data=dati_riga)
+            if not form_riga.is_valid():
+                raise ValidationError(f"Riga {numero}: {_messaggi(form_riga)}")
+            riga = form_riga.save(commit=False)
+            riga.tenant = self.tenant
+            riga.aliquota_iva = form_riga.cleaned_data['aliquota_iva']
+            # Stessi calcoli del wizard (passo 2).
+            imponibile_riga = riga.quantita * riga.prezzo_unitario
+            iva_riga = imponibile_riga * (riga.aliquota_iva.valore_percentuale / Decimal(100))
+            riga.imponibile_riga = imponibile_riga.quantize(Decimal('0.01'))
+            riga.iva_riga = iva_riga.quantize(Decimal('0.01'))
+            righe.append(riga)
+
+        testata.imponibile = sum((riga.imponibile_riga for riga in righe), Decimal('0'))
+        testata.iva = sum((riga.iva_riga for riga in righe), Decimal('0'))
+        testata.totale = testata.imponibile + testata.iva
+        scadenza = Scadenza(
+            tenant=self.tenant, anagrafica=testata.anagrafica,
+            data_scadenza=testata.data_documento + timedelta(days=testata.modalita_pagamento.giorni_scadenza),
+            importo_rata=testata.totale, importo_pagato=Decimal('0'), importo_residuo=testata.totale,
+            stato=Scadenza.Stato.APERTA,
+            tipo_scadenza=Scadenza.Tipo.INCASSO if 'V' in testata.tipo_doc else Scadenza.Tipo.PAGAMENTO,
+        )
+        if testata.numero_documento:
+            self.documenti.add(chiave)
+        return testata, righe, scadenza
+
+    def _numera(self, testate):
+        da_numerare = defaultdict(list)
+        gia_numerati = {}
+        for testata in testate:
+            if testata.tipo_doc not in DocumentoTestata.PREFISSI_NUMERAZIONE:
+                continue
+            serie = (testata.tipo_doc, testata.data_documento.year)
+            if not testata.numero_documento:
+                da_numerare[serie].append(testata)
+                continue
+            prefisso = DocumentoTestata.PREFISSI_NUMERAZIONE[testata.tipo_doc]
+            trovato = re.fullmatch(rf'{prefisso}-{serie[1]}-(\d+)', testata.numero_documento)
+            if trovato:
+                gia_numerati[serie] = max(gia_numerati.get(serie, 0), int(trovato.group(1)))
+
+        for (tipo_doc, anno), numero in gia_numerati.items():
+            ContatoreNumerazione.allinea(self.tenant.pk, ContatoreNumerazione.serie_documento(tipo_doc), anno, numero)
+        for (tipo_doc, anno), gruppo in da_numerare.items():
+            for testata, numero in zip(gruppo, DocumentoTestata.genera_numeri(self.tenant.pk, tipo_doc, anno, len(gruppo))):
+                testata.numero_documento = numero
+                # Un numero indicato più avanti nel file che coincide con uno appena
+                # assegnato viene scartato in validazione invece di far fallire il lotto.
+                self.documenti.add((testata.anagrafica.pk, tipo_doc, numero))
+
+    def scrivi(self, documenti):
+        testate = [testata for testata, _, _ in documenti]
+        SaldoGiornaliero.invalida(self.tenant.pk, min(testata.data_documento for testata in testate))
+        self._numera(testate)
+        DocumentoTestata.objects.bulk_create(testate)
+
+        righe = []
+        for testata, righe_documento, scadenza in documenti:
+            for riga in righe_documento:
+                riga.testata = testata
+            righe.extend(righe_documento)
+            scadenza.documento = testata
+        DocumentoRiga.objects.bulk_create(righe, batch_size=DIMENSIONE_LOTTO)
+        Scadenza.objects.bulk_create([scadenza for _, _, scadenza in documenti])
+        registra_totali(self.tenant.pk, TotaleMensileDocumenti, testate)
+
+
+IMPORTATORI = {
+    'anagrafiche': ImportatoreAnagrafiche,
+    'primanota': ImportatorePrimaNota,
+    'documenti': ImportatoreDocumenti,
+}
+
+
+def importa(tipo, file, nome_file, tenant, utente=None, simula=False, al_lotto=None):
+    """Importa un file del tipo indicato (chiave di IMPORTATORI) e restituisce l'EsitoImportazione."""
+    importatore = IMPORTATORI[tipo](tenant, utente=utente, simula=simula)
+    return importatore.esegui(leggi_righe(file, nome_file), al_lotto=al_lotto)
@@ -0,0 +1,286 @@
+# gestionale/kpi.py
+
+"""
+Motore di calcolo dei KPI condiviso da Dashboard, Dashboard Analisi e Fascicolo Cantiere.
+
+Ogni KPI è una somma condizionale (SUM(...) FILTER (WHERE ...)) e tutti i KPI
+di una stessa tabella vengono calcolati con UNA sola query: aggiungere un KPI
+significa aggiungere una condizione, non un'altra andata e ritorno al database.
+Le funzioni restituiscono dizionari di Decimal già pronti per le viste.
+
+I KPI su un periodo (anno corrente, periodo della Dashboard Analisi, vita di
+un cantiere) leggono i mesi interi dai totali mensili (TotaleMensileDocumenti,
+TotaleMensileMovimenti) e solo i giorni ai bordi del periodo da documenti e
+movimenti: il costo dipende dal numero di mesi, non dalla mole dello storico.
+
+I risultati possono essere messi in cache per tenant con kpi_in_cache(): le
+chiavi contengono una "versione" del tenant che i segnali di gestionale/signals.py
+cambiano a ogni salvataggio/eliminazione dei dati da cui i KPI dipendono.
+"""
+
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, DecimalField, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import (
+    Anagrafica, ContoOperativo, DocumentoTestata, PrimaNota, SaldoGiornaliero, Scadenza,
+    TotaleMensileDocumenti, TotaleMensileMovimenti
+)
+from .saldi_giornalieri import saldi_alle_date
+
+
+def somme_condizionali(queryset, campo, condizioni):
+    """
+    Esegue un'unica aggregate() con una SUM filtrata per ogni condizione.
+    'condizioni' è un dizionario {nome_kpi: Q(...)}; i totali vuoti valgono zero.
+    """
+    return queryset.aggregate(**{
+        nome: Coalesce(Sum(campo, filter=condizione), Value(0), output_field=DecimalField())
+        for nome, condizione in condizioni.items()
+    })
+
+
+def _nel_periodo(campo, data_da=None, data_a=None):
+    """Costruisce il filtro Q per un intervallo di date con estremi opzionali."""
+    filtro = Q()
+    if data_da:
+        filtro &= Q(**{f'{campo}__gte': data_da})
+    if data_a:
+        filtro &= Q(**{f'{campo}__lte': data_a})
+    return filtro
+
+
+def _mese_successivo(giorno):
+    return (giorno.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def _scomponi_periodo(data_da=None, data_a=None):
+    """
+    Divide il periodo (estremi opzionali) nei mesi interi che contiene e nei giorni
+    ai bordi: restituisce (filtro Q sui mesi o None, lista di intervalli (dal, al)).
+    """
+    # Primo giorno del primo mese intero e primo giorno dopo l'ultimo mese intero.
+    inizio = fine = None
+    if data_da:
+        inizio = data_da if data_da.day == 1 else _mese_successivo(data_da)
+    if data_a:
+        fine = _mese_successivo(data_a)
+        if fine - data_a > timedelta(days=1):  # data_a non è l'ultimo giorno del mese
+            fine = data_a.replace(day=1)
+    if inizio and fine and inizio >= fine:
+        return None, [(data_da, data_a)]
+
+    bordi = []
+    if data_da and data_da < inizio:
+        bordi.append((data_da, inizio - timedelta(days=1)))
+    if data_a and fine <= data_a:
+        bordi.append((fine, data_a))
+    mesi = Q()
+    if inizio:
+        mesi &= Q(mese__gte=inizio)
+    if fine:
+        mesi &= Q(mese__lt=fine)
+    return mesi, bordi
+
+
+def somme_nel_periodo(dettaglio, totali_mensili, campo_data, campo, condizioni, data_da=None, data_a=None):
+    """
+    somme_condizionali() su un periodo: i mesi interi dal queryset dei totali
+    mensili, i giorni ai bordi dal queryset di dettaglio (le condizioni e il campo
+    sommato hanno lo stesso nome nelle due tabelle).
+    Query eseguite: 1, più 1 se il periodo non è fatto solo di mesi interi.
+    """
+    mesi, bordi = _scomponi_periodo(data_da, data_a)
+    parziali = []
+    if mesi is not None:
+        parziali.append(somme_condizionali(totali_mensili.filter(mesi), campo, condizioni))
+    if bordi:
+        filtro = Q()
+        for dal, al in bordi:
+            filtro |= _nel_periodo(campo_data, dal, al)
+        parziali.append(somme_condizionali(dettaglio.filter(filtro), campo, condizioni))
+
+    somme = dict.fromkeys(condizioni, Decimal('0'))
+    for parziale in parziali:
+        for nome, valore in parziale.items():
+            somme[nome] += valore
+    return somme
+
+
+def _fatturato(data_da=None, data_a=None, cantiere=None):
+    """Fatturato attivo/passivo netto (fatture meno note di credito) dei documenti confermati."""
+    documenti = DocumentoTestata.objects.filter(stato=DocumentoTestata.Stato.CONFERMATO)
+    totali_mensili = TotaleMensileDocumenti.objects.all()
+    if cantiere is not None:
+        documenti, totali_mensili = documenti.filter(cantiere=cantiere), totali_mensili.filter(cantiere=cantiere)
+    tot = somme_nel_periodo(documenti, totali_mensili, 'data_documento', 'totale', {
+        'fatture_vendita': Q(tipo_doc=DocumentoTestata.TipoDoc.FATTURA_VENDITA),
+        'note_credito_vendita': Q(tipo_doc=DocumentoTestata.TipoDoc.NOTA_CREDITO_VENDITA),
+        'fatture_acquisto': Q(tipo_doc=DocumentoTestata.TipoDoc.FATTURA_ACQUISTO),
+        'note_credito_acquisto': Q(tipo_doc=DocumentoTestata.TipoDoc.NOTA_CREDITO_ACQUISTO),
+    }, data_da, data_a)
+    return {
+        'fatturato_attivo': tot['fatture_vendita'] - tot['note_credito_vendita'],
+        'fatturato_passivo': tot['fatture_acquisto'] - tot['note_credito_acquisto'],
+    }
+
+
+# Flussi di cassa e risultato economico dei movimenti di Prima Nota.
+CONDIZIONI_MOVIMENTI = {
+    'entrate': Q(tipo_movimento=PrimaNota.TipoMovimento.ENTRATA),
+    'uscite': Q(tipo_movimento=PrimaNota.TipoMovimento.USCITA),
+    'ricavi': Q(conto_operativo__tipo=ContoOperativo.Tipo.RICAVO),
+    'costi': Q(conto_operativo__tipo=ContoOperativo.Tipo.COSTO),
+}
+
+
+def conta_anagrafiche_attive():
+    """Numero di clienti, fornitori e dipendenti attivi (una query)."""
+    return Anagrafica.objects.filter(attivo=True).aggregate(
+        clienti=Count('id', filter=Q(tipo=Anagrafica.Tipo.CLIENTE)),
+        fornitori=Count('id', filter=Q(tipo=Anagrafica.Tipo.FORNITORE)),
+        dipendenti=Count('id', filter=Q(tipo=Anagrafica.Tipo.DIPENDENTE)),
+    )
+
+
+def calcola_kpi_dashboard(oggi=None):
+    """
+    KPI della dashboard principale: crediti/debiti aperti e scaduti, fatturato,
+    cash flow e risultato economico dell'anno corrente.
+    Query eseguite: 1 su Scadenza, 1 sui totali mensili dei documenti, 1 su quelli
+    dei movimenti (l'anno è fatto di mesi interi: nessun bordo da leggere).
+    """
+    oggi = oggi or date.today()
+    inizio_anno, fine_anno = date(oggi.year, 1, 1), date(oggi.year, 12, 31)
+
+    scadenze = somme_condizionali(
+        Scadenza.objects.filter(stato__in=[Scadenza.Stato.APERTA, Scadenza.Stato.PARZIALE]),
+        'importo_residuo', {
+            'crediti_clienti': Q(tipo_scadenza=Scadenza.Tipo.INCASSO),
+            'debiti_fornitori': Q(tipo_scadenza=Scadenza.Tipo.PAGAMENTO),
+            'crediti_scaduti': Q(tipo_scadenza=Scadenza.Tipo.INCASSO, data_scadenza__lt=oggi),
+            'debiti_scaduti': Q(tipo_scadenza=Scadenza.Tipo.PAGAMENTO, data_scadenza__lt=oggi),
+        }
+    )
+
+    fatturato = _fatturato(inizio_anno, fine_anno)
+    movimenti = somme_nel_periodo(
+        PrimaNota.objects.all(), TotaleMensileMovimenti.objects.all(), 'data_registrazione', 'importo',
+        CONDIZIONI_MOVIMENTI, inizio_anno, fine_anno
+    )
+
+    return {
+        **scadenze,
+        **fatturato,
+        'fatturato_netto_ytd': fatturato['fatturato_attivo'] - fatturato['fatturato_passivo'],
+        'cash_flow_ytd': movimenti['entrate'] - movimenti['uscite'],
+        'risultato_economico_ytd': movimenti['ricavi'] - movimenti['costi'],
+    }
+
+
+def calcola_kpi_periodo(data_da, data_a):
+    """
+    KPI della Dashboard Analisi: valori di stato alla data 'data_a' (liquidità,
+    crediti e debiti) e valori di flusso nel periodo [data_da, data_a].
+    Stato e flussi arrivano dai saldi giornalieri (gestionale/saldi_giornalieri.py):
+    i flussi sono la differenza tra i valori di chiusura a 'data_a' e quelli del
+    giorno prima di 'data_da', quindi il costo non dipende dalla lunghezza dello storico.
+    Query eseguite: 1 sui saldi giornalieri (più 2 per ogni data non ancora
+    fotografata, es. oggi), 1 su ContoOperativo, 1 sui totali mensili dei documenti
+    (più 1 su DocumentoTestata per i giorni ai bordi del periodo).
+    """
+    vigilia = data_da - timedelta(days=1)
+    saldi = saldi_alle_date(vigilia, data_a)
+    tipi_conti_operativi = dict(ContoOperativo.objects.values_list('pk', 'tipo'))
+
+    def totali(valori):
+        tot = dict.fromkeys((*SaldoGiornaliero.Voce.values, *ContoOperativo.Tipo.values), Decimal('0'))
+        for (voce, riferimento), importo in valori.items():
+            tot[voce] += importo
+            if voce == SaldoGiornaliero.Voce.OPERATIVO and riferimento in tipi_conti_operativi:
+                tot[tipi_conti_operativi[riferimento]] += importo
+        return tot
+
+    inizio, fine = totali(saldi[vigilia]), totali(saldi[data_a])
+    fatturato = _fatturato(data_da, data_a)
+    ricavi_periodo = fine[ContoOperativo.Tipo.RICAVO] - inizio[ContoOperativo.Tipo.RICAVO]
+    costi_periodo = fine[ContoOperativo.Tipo.COSTO] - inizio[ContoOperativo.Tipo.COSTO]
+
+    return {
+        'liquidita_totale': fine[SaldoGiornaliero.Voce.LIQUIDITA],
+        'crediti_clienti': fine[SaldoGiornaliero.Voce.CREDITI],
+        'debiti_fornitori': fine[SaldoGiornaliero.Voce.DEBITI],
+        'fatturato_attivo_periodo': fatturato['fatturato_attivo'],
+        'costi_fatturati_periodo': fatturato['fatturato_passivo'],
+        'ricavi_periodo': ricavi_periodo,
+        'costi_periodo': costi_periodo,
+        'risultato_economico_periodo': ricavi_periodo - costi_periodo,
+        'cash_flow_periodo': fine[SaldoGiornaliero.Voce.LIQUIDITA] - inizio[SaldoGiornaliero.Voce.LIQUIDITA],
+    }
+
+
+def calcola_kpi_cantiere(cantiere):
+    """
+    KPI di riepilogo del Fascicolo Cantiere sull'intera vita del cantiere.
+    Query eseguite: 1 sui totali mensili dei documenti, 1 su quelli dei movimenti.
+    """
+    fatturato = _fatturato(cantiere=cantiere)
+    movimenti = somme_condizionali(
+        TotaleMensileMovimenti.objects.filter(cantiere=cantiere), 'importo', CONDIZIONI_MOVIMENTI
+    )
+
+    fatturato_netto = fatturato['fatturato_attivo']
+    costi_fatturati_netti = fatturato['fatturato_passivo']
+    return {
+        'redditivita': (fatturato_netto + movimenti['ricavi']) - (costi_fatturati_netti + movimenti['costi']),
+        'cash_flow': movimenti['entrate'] - movimenti['uscite'],
+        'esposizione_clienti': fatturato_netto - movimenti['entrate'],
+        'esposizione_fornitori': costi_fatturati_netti - movimenti['uscite'],
+    }
+
+
+# ==============================================================================
+# === CACHE DEI KPI PER TENANT                                              ===
+# ==============================================================================
+
+def _chiave_versione(tenant_id):
+    return f'kpi:{tenant_id}:versione'
+
+
+def versione_kpi(tenant_id):
+    """
+    Restituisce la versione corrente dei KPI del tenant.
+    Usiamo un timestamp e non un contatore: se la chiave viene espulsa dalla
+    cache, la nuova versione non può coincidere con una già usata in passato.
+    """
+    chiave = _chiave_versione(tenant_id)
+    versione = cache.get(chiave)
+    if versione is None:
+        versione = time.time_ns()
+        cache.add(chiave, versione, timeout=None)
+        versione = cache.get(chiave, versione)
+    return versione
+
+
+def invalida_kpi(tenant_id):
+    """Cambia la versione dei KPI del tenant: tutte le chiavi precedenti diventano irraggiungibili."""
+    cache.set(_chiave_versione(tenant_id), time.time_ns(), timeout=None)
+
+
+def kpi_in_cache(tenant_id, blocco, calcola, *parametri):
+    """
+    Restituisce il blocco di KPI dalla cache o lo calcola con 'calcola()' e lo memorizza.
+    I 'parametri' (es. la data di riferimento) entrano nella chiave.
+    """
+    suffisso = ':'.join(str(p) for p in parametri)
+    chiave = f'kpi:{tenant_id}:{versione_kpi(tenant_id)}:{blocco}:{suffisso}'
+    valore = cache.get(chiave)
+    if valore is None:
+        valore = calcola()
+        cache.set(chiave, valore, timeout=settings.KPI_CACHE_TIMEOUT)
+    return valore
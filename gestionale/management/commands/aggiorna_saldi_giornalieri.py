@@ -0,0 +1,73 @@
+# gestionale/management/commands/aggiorna_saldi_giornalieri.py
+
+from collections import defaultdict
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gestionale.models import SaldoGiornaliero, StatoSaldiGiornalieri
+from gestionale.saldi_giornalieri import aggiorna_tenant, chiusure
+from tenants.models import Company
+
+# Giorni con differenze mostrati per azienda con --verifica.
+MAX_DIFFERENZE_MOSTRATE = 10
+
+
+class Command(BaseCommand):
+    help = (
+        "Aggiorna i saldi giornalieri (liquidità per conto, crediti e debiti aperti, movimenti "
+        "per conto operativo) dal giorno dopo l'ultimo calcolato fino alla data indicata. "
+        "Con --ricostruisci li ricalcola da zero, con --verifica li confronta soltanto con "
+        "i movimenti e i documenti. Lo stesso aggiornamento gira ogni ora nel worker 'esegui_report_in_coda'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenant', type=int, help="ID dell'azienda da elaborare (default: tutte).")
+        parser.add_argument('--al', type=date.fromisoformat, help="Ultimo giorno da calcolare, AAAA-MM-GG (default: ieri).")
+        parser.add_argument('--ricostruisci', action='store_true', help="Elimina i saldi giornalieri e li ricalcola da zero.")
+        parser.add_argument(
+            '--verifica', action='store_true',
+            help="Non modifica nulla: segnala le differenze ed esce con errore se ne trova."
+        )
+
+    def _verifica(self, tenant_id):
+        """Numero di giorni in cui i saldi salvati differiscono da quelli ricalcolati da zero."""
+        calcolati_al = StatoSaldiGiornalieri._base_manager.filter(
+            tenant_id=tenant_id
+        ).values_list('calcolati_al', flat=True).first()
+        salvati = defaultdict(dict)
+        for giorno, voce, riferimento, importo in SaldoGiornaliero._base_manager.filter(
+            tenant_id=tenant_id
+        ).values_list('data', 'voce', 'riferimento', 'importo').iterator():
+            salvati[giorno][voce, riferimento] = importo
+
+        giorni_errati = []
+        if calcolati_al:
+            for giorno, attesi in chiusure(tenant_id, None, calcolati_al):
+                if salvati.pop(giorno, {}) != attesi:
+                    giorni_errati.append(giorno)
+        giorni_errati.extend(salvati)  # righe oltre l'ultimo giorno calcolato o prima del primo movimento
+
+        for giorno in sorted(giorni_errati)[:MAX_DIFFERENZE_MOSTRATE]:
+            self.stdout.write(self.style.WARNING(f"[tenant {tenant_id}] {giorno}: saldi giornalieri non allineati"))
+        return len(giorni_errati)
+
+    def handle(self, *args, **options):
+        aziende = Company.objects.order_by('pk')
+        if options['tenant']:
+            aziende = aziende.filter(pk=options['tenant'])
+            if not aziende.exists():
+                raise CommandError(f"Azienda {options['tenant']} inesistente.")
+        al = options['al'] or date.today() - timedelta(days=1)
+
+        if options['verifica']:
+            differenze = sum(self._verifica(pk) for pk in aziende.values_list('pk', flat=True))
+            if differenze:
+                raise CommandError(f"Trovati {differenze} giorni con saldi giornalieri non allineati.")
+            self.stdout.write(self.style.SUCCESS("Tutti i saldi giornalieri sono allineati."))
+            return
+
+        for azienda in aziende:
+            scritte = aggiorna_tenant(azienda.pk, al, ricostruisci=options['ricostruisci'])
+            self.stdout.write(f"{azienda}: {scritte} righe scritte.")
+        self.stdout.write(self.style.SUCCESS(f"Saldi giornalieri aggiornati al {al}."))
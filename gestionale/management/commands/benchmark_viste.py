@@ -0,0 +1,309 @@
+# gestionale/management/commands/benchmark_viste.py
+
+import json
+import statistics
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from gestionale.kpi import invalida_kpi
+from gestionale.managers import tenant_context
+from gestionale.models import (
+    Anagrafica, Cantiere, DiarioAttivita, DocumentoRiga, DocumentoTestata, PrimaNota, Scadenza,
+)
+from gestionale.report_utils import contenuto_risposta
+from tenants.models import Company, UserCompanyPermission
+
+# Pagine misurate: (nome nel report, nome URL, oggetto del dettaglio, query string).
+VISTE = [
+    ('dashboard', 'dashboard', None, ''),
+    ('dashboard_analisi', 'dashboard_analisi', None, ''),
+    ('dashboard_hr', 'dashboard_hr', None, ''),
+    ('scadenzario', 'scadenzario_list', None, ''),
+    ('primanota', 'primanota_list', None, ''),
+    ('anagrafica_dettaglio', 'anagrafica_detail', 'anagrafica', ''),
+    ('cantiere_dettaglio', 'cantiere_detail', 'cantiere', ''),
+]
+
+# Tutti gli export Excel, PDF e CSV.
+EXPORT = [
+    ('anagrafiche_excel', 'anagrafica_list_export_excel', None, ''),
+    ('anagrafiche_pdf', 'anagrafica_list_export_pdf', None, ''),
+    ('documenti_excel', 'documento_list_export_excel', None, ''),
+    ('documenti_pdf', 'documento_list_export_pdf', None, ''),
+    ('documento_pdf', 'documento_detail_export_pdf', 'documento', ''),
+    ('primanota_excel', 'primanota_export_excel', None, ''),
+    ('primanota_pdf', 'primanota_export_pdf', None, ''),
+    ('scadenzario_excel', 'scadenzario_export_excel', None, ''),
+    ('scadenzario_pdf', 'scadenzario_export_pdf', None, ''),
+    ('partitario_excel', 'anagrafica_partitario_export_excel', 'anagrafica', ''),
+    ('partitario_pdf', 'anagrafica_partitario_export_pdf', 'anagrafica', ''),
+    ('tesoreria_excel', 'tesoreria_export_excel', None, ''),
+    ('tesoreria_pdf', 'tesoreria_export_pdf', None, ''),
+    ('cantieri_excel', 'cantiere_list_export_excel', None, ''),
+    ('cantieri_pdf', 'cantiere_list_export_pdf', None, ''),
+    ('fascicolo_cantiere_excel', 'cantiere_fascicolo_export_excel', 'cantiere', ''),
+    ('fascicolo_cantiere_pdf', 'cantiere_fascicolo_export_pdf', 'cantiere', ''),
+    ('tabelle_sistema_excel', 'export_tabelle_sistema', None, ''),
+    ('tabelle_contabili_excel', 'export_tabelle_contabili', None, ''),
+    ('tabelle_contabili_csv', 'export_tabelle_contabili', None, 'formato=csv'),
+]
+
+# Tabelle di cui si riporta il numero di righe: i risultati sono confrontabili solo a parità di volumi.
+MODELLI_VOLUMI = [Anagrafica, Cantiere, DocumentoTestata, DocumentoRiga, Scadenza, PrimaNota, DiarioAttivita]
+
+
+def _percentile(ordinati, quota):
+    return ordinati[min(len(ordinati) - 1, int(len(ordinati) * quota))]
+
+
+@contextmanager
+def _conta_query(misura):
+    """Conta le query eseguite e il tempo passato nel database, senza conservarne il testo."""
+    def wrapper(execute, sql, params, many, context):
+        inizio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            misura['query'] += 1
+            misura['sql'] += time.perf_counter() - inizio
+
+    with connection.execute_wrapper(wrapper):
+        yield misura
+
+
+class Command(BaseCommand):
+    help = (
+        "Misura le viste più usate (dashboard, scadenzario, Prima Nota, dettagli di anagrafica e "
+        "cantiere) e tutti gli export con il client di test di Django: latenza (p50/p95), numero di "
+        "query, tempo SQL e picco di memoria. Il risultato può essere salvato in JSON e confrontato "
+        "con un'esecuzione precedente. Per dati riproducibili vedi il comando 'genera_dati_prova'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenant', type=int, required=True, help="ID dell'azienda su cui misurare.")
+        parser.add_argument('--utente', help="Username con accesso all'azienda (default: il primo amministratore).")
+        parser.add_argument('--ripetizioni', type=int, default=5, help="Richieste misurate per vista (default: %(default)s).")
+        parser.add_argument('--solo', nargs='+', metavar='NOME', help="Misura solo le viste indicate (nomi del report).")
+        parser.add_argument('--senza-export', action='store_true', help="Salta gli export.")
+        parser.add_argument(
+            '--con-cache', action='store_true',
+            help="Lascia attive la cache dei KPI e quella degli export su disco (default: misura a freddo)."
+        )
+        parser.add_argument('--output', help="Salva i risultati in questo file JSON.")
+        parser.add_argument('--confronta', help="File JSON di un'esecuzione precedente con cui confrontare i risultati.")
+        parser.add_argument(
+            '--soglia', type=float, default=1.25,
+            help="Con --confronta: esce con errore se p95 o memoria peggiorano oltre questo fattore "
+                 "o se aumentano le query (default: %(default)s)."
+        )
+
+    # --------------------------------------------------------------------------
+    # PREPARAZIONE
+    # --------------------------------------------------------------------------
+
+    def _utente(self, tenant, username):
+        if username:
+            try:
+                utente = get_user_model().objects.get(username=username)
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"Utente {username} inesistente.")
+            if not UserCompanyPermission.objects.filter(user=utente, company=tenant).exists():
+                raise CommandError(f"L'utente {username} non ha accesso all'azienda {tenant}.")
+            return utente
+        permesso = UserCompanyPermission.objects.filter(
+            company=tenant, company_role=UserCompanyPermission.CompanyRole.ADMIN
+        ).select_related('user').order_by('pk').first()
+        if permesso is None:
+            raise CommandError(
+                f"L'azienda {tenant} non ha amministratori: indicare --utente "
+                "(o creare i dati con 'genera_dati_prova --utente')."
+            )
+        return permesso.user
+
+    def _oggetti(self):
+        """I dettagli più pesanti dell'azienda: più documenti, più movimenti, più righe."""
+        anagrafica = Anagrafica.objects.filter(tipo=Anagrafica.Tipo.CLIENTE).annotate(
+            n=Count('documenti')).order_by('-n', 'pk').values_list('pk', flat=True).first()
+        cantiere = Cantiere.objects.annotate(
+            n=Count('movimenti_primanota')).order_by('-n', 'pk').values_list('pk', flat=True).first()
+        documento = DocumentoTestata.objects.annotate(
+            n=Count('righe')).order_by('-n', 'pk').values_list('pk', flat=True).first()
+        return {'anagrafica': anagrafica, 'cantiere': cantiere, 'documento': documento}
+
+    def _voci(self, options, oggetti):
+        voci = VISTE + ([] if options['senza_export'] else EXPORT)
+        if options['solo']:
+            sconosciute = set(options['solo']) - {nome for nome, *_ in VISTE + EXPORT}
+            if sconosciute:
+                raise CommandError(f"Viste sconosciute: {', '.join(sorted(sconosciute))}.")
+            voci = [voce for voce in VISTE + EXPORT if voce[0] in options['solo']]
+        risultato = []
+        for nome, nome_url, oggetto, query_string in voci:
+            if oggetto and oggetti[oggetto] is None:
+                self.stdout.write(self.style.WARNING(f"  {nome}: nessun {oggetto} nell'azienda, saltata."))
+                continue
+            url = reverse(nome_url, kwargs={'pk': oggetti[oggetto]} if oggetto else None)
+            risultato.append((nome, f"{url}?{query_string}" if query_string else url))
+        return risultato
+
+    # --------------------------------------------------------------------------
+    # MISURA
+    # --------------------------------------------------------------------------
+
+    def _richiesta(self, client, url, tenant_id, a_freddo):
+        if a_freddo:
+            invalida_kpi(tenant_id)
+        misura = {'query': 0, 'sql': 0.0}
+        with _conta_query(misura):
+            inizio = time.perf_counter()
+            response = client.get(url, secure=True)
+            # Gli export in streaming vengono generati mentre si legge il corpo.
+            dimensione = sum(len(blocco) for blocco in contenuto_risposta(response))
+            response.close()
+            misura['secondi'] = time.perf_counter() - inizio
+        misura['stato'] = response.status_code
+        misura['byte'] = dimensione
+        return misura
+
+    def _misura(self, client, url, tenant_id, options):
+        a_freddo = not options['con_cache']
+        misure = []
+        for _ in range(options['ripetizioni']):
+            misura = self._richiesta(client, url, tenant_id, a_freddo)
+            if misura['stato'] != 200:
+                return {'url': url, 'stato': misura['stato']}
+            misure.append(misura)
+
+        # Il picco di memoria si misura in una richiesta a parte: tracemalloc
+        # rallenta molto l'esecuzione e falserebbe le latenze. Non comprende la
+        # memoria dei processi di rendering dei PDF.
+        tracemalloc.start()
+        try:
+            self._richiesta(client, url, tenant_id, a_freddo)
+            picco = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        secondi = sorted(m['secondi'] for m in misure)
+        return {
+            'url': url,
+            'stato': 200,
+            'n': len(misure),
+            'primo_ms': round(misure[0]['secondi'] * 1000, 1),
+            'p50_ms': round(statistics.median(secondi) * 1000, 1),
+            'p95_ms': round(_percentile(secondi, 0.95) * 1000, 1),
+            'max_ms': round(secondi[-1] * 1000, 1),
+            'query': max(m['query'] for m in misure),
+            'sql_ms': round(statistics.median(m['sql'] for m in misure) * 1000, 1),
+            'picco_memoria_kb': picco // 1024,
+            'byte': misure[-1]['byte'],
+        }
+
+    # --------------------------------------------------------------------------
+    # REPORT
+    # --------------------------------------------------------------------------
+
+    def _stampa(self, nome, r):
+        if r['stato'] != 200:
+            self.stdout.write(self.style.ERROR(f"  {nome:<26} HTTP {r['stato']}  {r['url']}"))
+            return
+        self.stdout.write(
+            f"  {nome:<26} p50={r['p50_ms']:9.1f} ms  p95={r['p95_ms']:9.1f} ms  primo={r['primo_ms']:9.1f} ms  "
+            f"query={r['query']:<5} sql={r['sql_ms']:8.1f} ms  memoria={r['picco_memoria_kb']:>8} KB"
+        )
+
+    def _confronta(self, risultati, percorso, soglia):
+        try:
+            with open(percorso, encoding='utf-8') as file:
+                precedente = json.load(file)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Impossibile leggere {percorso}: {e}")
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Confronto con {percorso} ({precedente.get('eseguito_il', '?')})"))
+        if precedente.get('volumi') != risultati['volumi']:
+            self.stdout.write(self.style.WARNING("  Attenzione: i volumi dei dati sono diversi, il confronto è indicativo."))
+
+        peggioramenti = []
+        for nome, attuale in risultati['viste'].items():
+            prima = precedente.get('viste', {}).get(nome)
+            if not prima or prima.get('stato') != 200 or attuale['stato'] != 200:
+                continue
+            rapporto_p95 = attuale['p95_ms'] / max(prima['p95_ms'], 0.1)
+            rapporto_memoria = attuale['picco_memoria_kb'] / max(prima['picco_memoria_kb'], 1)
+            riga = (
+                f"  {nome:<26} p95 {prima['p95_ms']:9.1f} -> {attuale['p95_ms']:9.1f} ms (x{rapporto_p95:.2f})  "
+                f"query {prima['query']} -> {attuale['query']}  "
+                f"memoria {prima['picco_memoria_kb']} -> {attuale['picco_memoria_kb']} KB (x{rapporto_memoria:.2f})"
+            )
+            if rapporto_p95 > soglia or rapporto_memoria > soglia or attuale['query'] > prima['query']:
+                peggioramenti.append(nome)
+                self.stdout.write(self.style.WARNING(riga))
+            else:
+                self.stdout.write(riga)
+        return peggioramenti
+
+    def handle(self, *args, **options):
+        if options['ripetizioni'] < 1:
+            raise CommandError("--ripetizioni deve essere almeno 1.")
+        try:
+            tenant = Company.objects.get(pk=options['tenant'])
+        except Company.DoesNotExist:
+            raise CommandError(f"Azienda {options['tenant']} inesistente.")
+        utente = self._utente(tenant, options['utente'])
+
+        with tenant_context(tenant):
+            volumi = {modello.__name__: modello.objects.count() for modello in MODELLI_VOLUMI}
+            oggetti = self._oggetti()
+        voci = self._voci(options, oggetti)
+
+        impostazioni = {'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver']}
+        if not options['con_cache']:
+            impostazioni['ARTEFATTI_CACHE_MB'] = 0
+
+        risultati = {
+            'eseguito_il': timezone.now().isoformat(timespec='seconds'),
+            'tenant': tenant.pk,
+            'ripetizioni': options['ripetizioni'],
+            'con_cache': options['con_cache'],
+            'volumi': volumi,
+            'viste': {},
+        }
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{tenant} - " + ', '.join(f"{nome}: {quanti}" for nome, quanti in volumi.items())
+        ))
+        with override_settings(**impostazioni):
+            client = Client()
+            client.force_login(utente)
+            # Stessa attivazione dell'azienda che fa l'utente dalla pagina di selezione.
+            client.get(reverse('activate_tenant', args=[tenant.pk]), secure=True)
+            if client.session.get('active_tenant_id') != tenant.pk:
+                raise CommandError(f"Impossibile attivare l'azienda {tenant} per l'utente {utente}.")
+
+            for nome, url in voci:
+                risultato = self._misura(client, url, tenant.pk, options)
+                risultati['viste'][nome] = risultato
+                self._stampa(nome, risultato)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(risultati, file, indent=2, ensure_ascii=False)
+            self.stdout.write(f"Risultati salvati in {options['output']}.")
+
+        errori = [nome for nome, r in risultati['viste'].items() if r['stato'] != 200]
+        peggioramenti = self._confronta(risultati, options['confronta'], options['soglia']) if options['confronta'] else []
+        if errori:
+            raise CommandError(f"Viste non riuscite: {', '.join(errori)}.")
+        if peggioramenti:
+            raise CommandError(f"Peggioramenti oltre la soglia di {options['soglia']:.2f}: {', '.join(peggioramenti)}.")
+        self.stdout.write(self.style.SUCCESS("Benchmark completato."))
@@ -0,0 +1,105 @@
+# gestionale/management/commands/esegui_report_in_coda.py
+
+import time
+import traceback
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from gestionale.report_in_coda import (
+    chiudi_richieste_bloccate, elimina_richieste_scadute, esegui_richiesta, preleva_richiesta, segna_errore,
+)
+from gestionale.saldi_giornalieri import aggiorna_saldi_giornalieri
+
+# Ogni quanto (in secondi) il worker fa pulizia delle richieste vecchie o bloccate
+# e aggiorna i saldi giornalieri fino a ieri.
+INTERVALLO_PULIZIA = 3600
+# Secondi di attesa dopo un errore imprevisto (es. database non raggiungibile).
+ATTESA_DOPO_ERRORE = 10
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker dei report in background: elabora le richieste in coda (PDF ed Excel) "
+        "una alla volta e salva i file prodotti. Resta in ascolto finché non viene interrotto."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--intervallo', type=float, default=2.0,
+            help="Secondi di attesa tra un controllo e l'altro quando la coda è vuota (default: 2)."
+        )
+        parser.add_argument(
+            '--una-volta', action='store_true',
+            help="Elabora le richieste presenti in coda ed esce."
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS("Worker dei report avviato."))
+        self.ultima_pulizia = 0
+        try:
+            while True:
+                try:
+                    if not self._ciclo(options):
+                        break
+                except Exception:
+                    # Un errore del database (es. PostgreSQL riavviato) non deve fermare il
+                    # worker: lo segnaliamo e riproviamo dopo una pausa, con connessioni nuove.
+                    self.stderr.write(traceback.format_exc())
+                    if options['una_volta']:
+                        raise
+                    time.sleep(ATTESA_DOPO_ERRORE)
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write("Worker dei report arrestato.")
+
+    def _ciclo(self, options):
+        """Un giro del worker; restituisce False quando deve fermarsi (--una-volta e coda vuota)."""
+        # Il worker vive a lungo: scartiamo le connessioni scadute o in errore
+        # come farebbe Django alla fine di ogni richiesta.
+        close_old_connections()
+
+        if time.monotonic() - self.ultima_pulizia > INTERVALLO_PULIZIA:
+            self._pulizia()
+            self.ultima_pulizia = time.monotonic()
+
+        richiesta = preleva_richiesta()
+        if richiesta is None:
+            if options['una_volta']:
+                return False
+            time.sleep(options['intervallo'])
+            return True
+
+        self._elabora(richiesta)
+        return True
+
+    def _elabora(self, richiesta):
+        self.stdout.write(f"[tenant {richiesta.tenant_id}] Richiesta {richiesta.pk}: {richiesta.titolo} ({richiesta.formato})...")
+        inizio = time.monotonic()
+        try:
+            esegui_richiesta(richiesta)
+        except Exception as exc:
+            self.stderr.write(traceback.format_exc())
+            segna_errore(richiesta, str(exc) or exc.__class__.__name__)
+            self.stdout.write(self.style.ERROR(f"  errore: {exc}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"  completata in {time.monotonic() - inizio:.1f}s: {richiesta.nome_file}"
+            ))
+
+    def _pulizia(self):
+        bloccate = chiudi_richieste_bloccate()
+        eliminate = elimina_richieste_scadute()
+        if bloccate or eliminate:
+            self.stdout.write(f"Pulizia: {bloccate} richieste bloccate chiuse, {eliminate} richieste scadute eliminate.")
+        # Di solito lavora una volta al giorno, dopo la mezzanotte; nelle altre ore
+        # ricalcola solo i giorni invalidati da movimenti con date passate. Un errore
+        # qui non deve bloccare i report: riproverà alla prossima pulizia.
+        try:
+            righe = sum(aggiorna_saldi_giornalieri().values())
+        except Exception:
+            self.stderr.write(traceback.format_exc())
+            self.stdout.write(self.style.ERROR("Saldi giornalieri: aggiornamento non riuscito."))
+            return
+        if righe:
+            self.stdout.write(f"Saldi giornalieri: {righe} righe scritte.")
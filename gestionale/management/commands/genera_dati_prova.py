@@ -0,0 +1,562 @@
+# gestionale/management/commands/genera_dati_prova.py
+
+import random
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from gestionale.kpi import invalida_kpi
+from gestionale.models import (
+    AliquotaIVA, Anagrafica, Cantiere, Causale, ContoFinanziario, ContoOperativo, DiarioAttivita,
+    DipendenteDettaglio, DocumentoRiga, DocumentoTestata, MezzoAziendale, ModalitaPagamento, PrimaNota,
+    SaldoContoFinanziario, Scadenza,
+)
+from gestionale.totali_mensili import ricostruisci_tenant
+from tenants.models import Company, UserCompanyPermission
+
+# Righe inserite per singolo INSERT e documenti generati per giro.
+DIMENSIONE_LOTTO = 1000
+
+CENTESIMO = Decimal('0.01')
+
+COGNOMI = [
+    'Rossi', 'Russo', 'Ferrari', 'Esposito', 'Bianchi', 'Romano', 'Colombo', 'Ricci', 'Marino', 'Greco',
+    'Bruno', 'Gallo', 'Conti', 'De Luca', 'Mancini', 'Costa', 'Giordano', 'Rizzo', 'Lombardi', 'Moretti',
+    'Barbieri', 'Fontana', 'Santoro', 'Mariani', 'Rinaldi', 'Caruso', 'Ferrara', 'Galli', 'Martini', 'Leone',
+]
+NOMI = [
+    'Marco', 'Giuseppe', 'Luca', 'Andrea', 'Francesco', 'Alessandro', 'Matteo', 'Davide', 'Stefano', 'Paolo',
+    'Giulia', 'Francesca', 'Sara', 'Chiara', 'Laura', 'Elena', 'Anna', 'Valentina', 'Martina', 'Silvia',
+]
+ATTIVITA_CLIENTI = ['Immobiliare', 'Costruzioni', 'Condominio', 'Residence', 'Hotel', 'Logistica', 'Studio Tecnico']
+ATTIVITA_FORNITORI = ['Edilforniture', 'Calcestruzzi', 'Ferramenta', 'Noleggi', 'Impianti', 'Trasporti', 'Legnami']
+FORME_GIURIDICHE = ['S.r.l.', 'S.p.A.', 'S.n.c.', 'S.a.s.', '& C.', 'S.r.l.s.']
+CITTA = [
+    ('Milano', 'MI', '20121'), ('Roma', 'RM', '00184'), ('Torino', 'TO', '10121'), ('Napoli', 'NA', '80133'),
+    ('Bologna', 'BO', '40121'), ('Firenze', 'FI', '50122'), ('Bergamo', 'BG', '24121'), ('Brescia', 'BS', '25121'),
+    ('Verona', 'VR', '37121'), ('Padova', 'PD', '35121'), ('Monza', 'MB', '20900'), ('Varese', 'VA', '21100'),
+]
+VIE = ['Via Roma', 'Via Garibaldi', 'Via Mazzini', 'Corso Italia', 'Via Verdi', 'Viale Europa', 'Via Dante']
+LAVORAZIONI = [
+    'Demolizione', 'Scavo e movimento terra', 'Getto calcestruzzo', 'Posa ferro', 'Muratura', 'Intonaco',
+    'Massetto', 'Impermeabilizzazione', 'Posa pavimento', 'Tinteggiatura', 'Impianto elettrico',
+    'Impianto idraulico', 'Ponteggio', 'Smaltimento macerie', 'Fornitura materiale', 'Manodopera',
+]
+MANSIONI = ['Muratore', 'Carpentiere', 'Manovale', 'Capocantiere', 'Elettricista', 'Idraulico', 'Gruista', 'Impiegato']
+ASSENZE = ['Ferie', 'Malattia', 'Permesso', 'Infortunio']
+
+# Ripartizione dei documenti per tipo.
+TIPI_DOCUMENTO = [
+    (DocumentoTestata.TipoDoc.FATTURA_VENDITA, 55),
+    (DocumentoTestata.TipoDoc.FATTURA_ACQUISTO, 36),
+    (DocumentoTestata.TipoDoc.NOTA_CREDITO_VENDITA, 5),
+    (DocumentoTestata.TipoDoc.NOTA_CREDITO_ACQUISTO, 4),
+]
+STATI_CANTIERE = [
+    (Cantiere.Stato.APERTO, 45), (Cantiere.Stato.CHIUSO, 35), (Cantiere.Stato.SOSPESO, 10), (Cantiere.Stato.BOZZA, 10),
+]
+
+
+def _scegli(rng, pesati):
+    valori, pesi = zip(*pesati)
+    return rng.choices(valori, weights=pesi)[0]
+
+
+def _importo(valore):
+    return Decimal(str(valore)).quantize(CENTESIMO)
+
+
+def _giorno_feriale(giorno):
+    # Sabato e domenica slittano al venerdì precedente.
+    return giorno - timedelta(days=max(0, giorno.weekday() - 4))
+
+
+def _a_lotti(oggetti, dimensione):
+    iteratore = iter(oggetti)
+    while lotto := list(islice(iteratore, dimensione)):
+        yield lotto
+
+
+class GeneratoreAzienda:
+    """
+    Genera i dati di prova di una singola azienda.
+
+    Le distribuzioni imitano quelle di un'impresa edile reale: pochi clienti e
+    fornitori concentrano la maggior parte dei documenti (pesi di Pareto), gli
+    importi seguono una log-normale, le scadenze passate sono in gran parte
+    pagate e quelle recenti aperte. Con lo stesso seme si ottengono gli stessi dati.
+
+    Tutto viene scritto con bulk_create: codici e numeri arrivano dai contatori
+    del tenant, mentre saldi dei conti e pagato delle scadenze (che bulk_create
+    non aggiorna) vengono calcolati qui e scritti direttamente; i totali mensili
+    vengono ricostruiti alla fine.
+    """
+
+    def __init__(self, tenant, rng, oggi, options):
+        self.tenant = tenant
+        self.rng = rng
+        self.oggi = oggi
+        self.inizio = oggi - timedelta(days=365 * options['anni'])
+        self.options = options
+        self.conteggi = defaultdict(int)
+        self.saldi = defaultdict(lambda: [Decimal('0'), Decimal('0')])
+
+    def _data_casuale(self, dal=None):
+        dal = dal or self.inizio
+        return _giorno_feriale(dal + timedelta(days=self.rng.randint(0, max(0, (self.oggi - dal).days))))
+
+    def _crea(self, modello, oggetti):
+        oggetti = modello.objects.bulk_create(oggetti, batch_size=DIMENSIONE_LOTTO)
+        self.conteggi[modello.__name__] += len(oggetti)
+        return oggetti
+
+    # --------------------------------------------------------------------------
+    # TABELLE DI BASE
+    # --------------------------------------------------------------------------
+
+    def tabelle_di_base(self):
+        tenant = self.tenant
+        # Descrizioni e nomi dei conti sono univoci su tutta la piattaforma:
+        # il suffisso con l'id dell'azienda evita collisioni tra i tenant generati.
+        suffisso = f" [{tenant.pk}]"
+        self.aliquote = self._crea(AliquotaIVA, [
+            AliquotaIVA(tenant=tenant, descrizione=f"IVA {valore}%", valore_percentuale=Decimal(valore))
+            for valore in ('22', '10', '4')
+        ])
+        self.modalita = self._crea(ModalitaPagamento, [
+            ModalitaPagamento(tenant=tenant, descrizione=descrizione + suffisso, giorni_scadenza=giorni)
+            for descrizione, giorni in (('Rimessa diretta', 0), ('Bonifico 30 gg', 30), ('Bonifico 60 gg', 60), ('RiBa 30/60/90', 30))
+        ])
+        causali = {
+            'incasso': ('Incasso fattura', Causale.Tipo.ENTRATA),
+            'incassi_vari': ('Incassi vari', Causale.Tipo.ENTRATA),
+            'pagamento': ('Pagamento fattura', Causale.Tipo.USCITA),
+            'spese': ('Spese generali', Causale.Tipo.USCITA),
+            'carburante': ('Carburante', Causale.Tipo.USCITA),
+            'stipendi': ('Stipendi', Causale.Tipo.USCITA),
+            'giroconto': ('Giroconto', Causale.Tipo.MISTO),
+        }
+        self.causali = dict(zip(causali, self._crea(Causale, [
+            Causale(tenant=tenant, descrizione=descrizione + suffisso, tipo_movimento_default=tipo)
+            for descrizione, tipo in causali.values()
+        ])))
+        self.conti = self._crea(ContoFinanziario, [
+            ContoFinanziario(tenant=tenant, nome_conto=nome + suffisso)
+            for nome in ('Cassa', 'Banca principale', 'Banca secondaria')
+        ])
+        self.conti_costo = self._crea(ContoOperativo, [
+            ContoOperativo(tenant=tenant, nome_conto=nome + suffisso, tipo=ContoOperativo.Tipo.COSTO)
+            for nome in ('Materiali', 'Manodopera', 'Noli e trasporti', 'Spese generali')
+        ])
+        self.conti_ricavo = self._crea(ContoOperativo, [
+            ContoOperativo(tenant=tenant, nome_conto=nome + suffisso, tipo=ContoOperativo.Tipo.RICAVO)
+            for nome in ('Ricavi lavori', 'Ricavi diversi')
+        ])
+        self.mezzi = self._crea(MezzoAziendale, [
+            MezzoAziendale(tenant=tenant, targa=f"PR{tenant.pk:03d}{n:03d}", descrizione=descrizione, tipo=descrizione)
+            for n, descrizione in enumerate(['Furgone', 'Furgone', 'Autocarro', 'Escavatore', 'Autovettura'], start=1)
+        ])
+
+    # --------------------------------------------------------------------------
+    # ANAGRAFICHE E CANTIERI
+    # --------------------------------------------------------------------------
+
+    def _partite_iva(self, quante):
+        partite_iva = set()
+        while len(partite_iva) < quante:
+            partite_iva.add(f"{self.rng.randrange(10 ** 10, 10 ** 11)}")
+        return sorted(partite_iva, key=lambda _: self.rng.random())
+
+    def _codice_fiscale(self):
+        lettere = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+        rng = self.rng
+        return (
+            ''.join(rng.choices(lettere, k=6)) + f"{rng.randint(50, 99)}" + rng.choice('ABCDEHLMPRST')
+            + f"{rng.randint(1, 28):02d}" + rng.choice(lettere) + f"{rng.randint(100, 999)}" + rng.choice(lettere)
+        )
+
+    def _indirizzo(self):
+        citta, provincia, cap = self.rng.choice(CITTA)
+        return {
+            'indirizzo': f"{self.rng.choice(VIE)} {self.rng.randint(1, 200)}",
+            'citta': citta, 'provincia': provincia, 'cap': cap,
+        }
+
+    def anagrafiche(self):
+        rng, tenant, options = self.rng, self.tenant, self.options
+        Tipo = Anagrafica.Tipo
+        partite_iva = iter(self._partite_iva(options['clienti'] + options['fornitori']))
+        generate = {}
+        for tipo, quante, attivita in (
+            (Tipo.CLIENTE, options['clienti'], ATTIVITA_CLIENTI),
+            (Tipo.FORNITORE, options['fornitori'], ATTIVITA_FORNITORI),
+        ):
+            codici = Anagrafica.genera_codici(tenant.pk, tipo, quante) if quante else []
+            anagrafiche = []
+            for codice in codici:
+                nome = f"{rng.choice(COGNOMI)} {rng.choice(attivita)} {rng.choice(FORME_GIURIDICHE)}"
+                anagrafiche.append(Anagrafica(
+                    tenant=tenant, codice=codice, tipo=tipo, nome_cognome_ragione_sociale=nome,
+                    p_iva=next(partite_iva), email=f"amministrazione@{codice.lower()}.example.com",
+                    telefono=f"0{rng.randint(2, 99)} {rng.randint(1000000, 9999999)}",
+                    attivo=rng.random() > 0.05, **self._indirizzo(),
+                ))
+            generate[tipo] = self._crea(Anagrafica, anagrafiche)
+
+        codici = Anagrafica.genera_codici(tenant.pk, Tipo.DIPENDENTE, options['dipendenti']) if options['dipendenti'] else []
+        dipendenti, dettagli = [], []
+        for codice in codici:
+            cessato = rng.random() < 0.1
+            dipendenti.append(Anagrafica(
+                tenant=tenant, codice=codice, tipo=Tipo.DIPENDENTE, attivo=not cessato,
+                nome_cognome_ragione_sociale=f"{rng.choice(NOMI)} {rng.choice(COGNOMI)}",
+                codice_fiscale=self._codice_fiscale(), **self._indirizzo(),
+            ))
+            assunzione = self.inizio - timedelta(days=rng.randint(0, 3650))
+            dettagli.append(DipendenteDettaglio(
+                tenant=tenant, mansione=rng.choice(MANSIONI), data_assunzione=assunzione,
+                data_fine_rapporto=self._data_casuale(self.inizio) if cessato else None,
+                costo_orario=_importo(rng.uniform(16, 32)),
+            ))
+        self.dipendenti = self._crea(Anagrafica, dipendenti)
+        for dipendente, dettaglio in zip(self.dipendenti, dettagli):
+            dettaglio.anagrafica = dipendente
+        self.dettagli = self._crea(DipendenteDettaglio, dettagli)
+
+        self.clienti = generate[Tipo.CLIENTE]
+        self.fornitori = generate[Tipo.FORNITORE]
+        # Pesi di Pareto: pochi clienti e fornitori concentrano gran parte dei documenti.
+        self.pesi_clienti = [rng.paretovariate(1.16) for _ in self.clienti]
+        self.pesi_fornitori = [rng.paretovariate(1.16) for _ in self.fornitori]
+
+    def cantieri(self):
+        rng, tenant = self.rng, self.tenant
+        cantieri = []
+        if self.clienti:
+            committenti = rng.choices(self.clienti, weights=self.pesi_clienti, k=self.options['cantieri'])
+            for n, cliente in enumerate(committenti, start=1):
+                inizio = self._data_casuale()
+                cantieri.append(Cantiere(
+                    tenant=tenant, codice_cantiere=f"C{tenant.pk}-{n:05d}", cliente=cliente,
+                    descrizione=f"{rng.choice(['Ristrutturazione', 'Nuova costruzione', 'Manutenzione', 'Ampliamento'])} "
+                                f"{rng.choice(['palazzina', 'villa', 'capannone', 'condominio', 'uffici'])} {cliente.citta}",
+                    indirizzo=self._indirizzo()['indirizzo'], data_inizio=inizio,
+                    data_fine_prevista=inizio + timedelta(days=rng.randint(30, 540)),
+                    stato=_scegli(rng, STATI_CANTIERE),
+                ))
+        self.cantieri_generati = self._crea(Cantiere, cantieri)
+        self.cantieri_aperti = [c for c in self.cantieri_generati if c.stato == Cantiere.Stato.APERTO]
+        self.cantieri_per_cliente = defaultdict(list)
+        for cantiere in self.cantieri_generati:
+            self.cantieri_per_cliente[cantiere.cliente_id].append(cantiere)
+
+    # --------------------------------------------------------------------------
+    # DOCUMENTI, SCADENZE E PAGAMENTI
+    # --------------------------------------------------------------------------
+
+    def _righe(self, tipo_doc):
+        rng = self.rng
+        # Righe per documento: la maggior parte ne ha poche, alcune decine.
+        quante = min(1 + int(rng.expovariate(1 / 3)), self.options['righe_max'])
+        righe = []
+        for _ in range(quante):
+            aliquota = rng.choices(self.aliquote, weights=(80, 15, 5))[0]
+            quantita = _importo(rng.choice([1, 1, 1, 2, 3, 5, 10, 20, 50]))
+            prezzo = _importo(min(rng.lognormvariate(5, 1.2), 20000))
+            imponibile = (quantita * prezzo).quantize(CENTESIMO)
+            righe.append(DocumentoRiga(
+                tenant=self.tenant, descrizione=rng.choice(LAVORAZIONI), quantita=quantita,
+                prezzo_unitario=prezzo, aliquota_iva=aliquota, imponibile_riga=imponibile,
+                iva_riga=(imponibile * aliquota.valore_percentuale / 100).quantize(CENTESIMO),
+            ))
+        return righe
+
+    def _rate(self, testata, modalita):
+        # RiBa in tre rate a 30/60/90 giorni, le altre modalità in un'unica rata.
+        numero_rate = 3 if modalita.descrizione.startswith('RiBa') else 1
+        rata = (testata.totale / numero_rate).quantize(CENTESIMO)
+        rate = []
+        for n in range(numero_rate):
+            importo = testata.totale - rata * (numero_rate - 1) if n == numero_rate - 1 else rata
+            rate.append((testata.data_documento + timedelta(days=modalita.giorni_scadenza * (n + 1)), importo))
+        return rate
+
+    def _pagamenti(self, scadenza, testata):
+        """Pagamenti della scadenza: le scadenze passate sono quasi tutte pagate, spesso in ritardo."""
+        rng = self.rng
+        if scadenza.data_scadenza <= self.oggi:
+            esito = rng.random()
+            quota = Decimal('1') if esito < 0.85 else _importo(rng.uniform(0.3, 0.9)) if esito < 0.92 else Decimal('0')
+        else:
+            quota = Decimal('1') if rng.random() < 0.1 else Decimal('0')
+        if not quota:
+            return []
+        data_pagamento = scadenza.data_scadenza + timedelta(days=int(rng.expovariate(1 / 10)) - 3)
+        data_pagamento = max(testata.data_documento, min(data_pagamento, self.oggi))
+        incasso = scadenza.tipo_scadenza == Scadenza.Tipo.INCASSO
+        return [PrimaNota(
+            tenant=self.tenant, data_registrazione=data_pagamento,
+            descrizione=f"{'Incasso' if incasso else 'Pagamento'} {testata.numero_documento}",
+            importo=(scadenza.importo_rata * quota).quantize(CENTESIMO),
+            tipo_movimento=PrimaNota.TipoMovimento.ENTRATA if incasso else PrimaNota.TipoMovimento.USCITA,
+            causale=self.causali['incasso' if incasso else 'pagamento'],
+            conto_finanziario=rng.choices(self.conti, weights=(5, 75, 20))[0],
+            anagrafica_id=scadenza.anagrafica_id, cantiere_id=testata.cantiere_id,
+            scadenza_collegata=scadenza, created_by=self.utente,
+        )]
+
+    def documenti(self):
+        rng, tenant = self.rng, self.tenant
+        quanti = self.options['documenti']
+        if not quanti or not (self.clienti or self.fornitori):
+            return
+        # Date generate in anticipo e ordinate: la numerazione segue l'ordine cronologico.
+        date_documenti = sorted(self._data_casuale() for _ in range(quanti))
+        Tipo = DocumentoTestata.TipoDoc
+        for lotto in _a_lotti(date_documenti, DIMENSIONE_LOTTO):
+            testate, righe_per_testata = [], []
+            for data_documento in lotto:
+                tipo_doc = _scegli(rng, TIPI_DOCUMENTO)
+                vendita = tipo_doc in (Tipo.FATTURA_VENDITA, Tipo.NOTA_CREDITO_VENDITA)
+                if vendita and not self.clienti or not vendita and not self.fornitori:
+                    vendita = not vendita
+                    tipo_doc = Tipo.FATTURA_VENDITA if vendita else Tipo.FATTURA_ACQUISTO
+                if vendita:
+                    anagrafica = rng.choices(self.clienti, weights=self.pesi_clienti)[0]
+                    cantieri = self.cantieri_per_cliente.get(anagrafica.pk)
+                    cantiere = rng.choice(cantieri) if cantieri and rng.random() < 0.7 else None
+                else:
+                    anagrafica = rng.choices(self.fornitori, weights=self.pesi_fornitori)[0]
+                    cantiere = rng.choice(self.cantieri_generati) if self.cantieri_generati and rng.random() < 0.4 else None
+                righe = self._righe(tipo_doc)
+                imponibile = sum((riga.imponibile_riga for riga in righe), Decimal('0'))
+                iva = sum((riga.iva_riga for riga in righe), Decimal('0'))
+                testate.append(DocumentoTestata(
+                    tenant=tenant, tipo_doc=tipo_doc, anagrafica=anagrafica, data_documento=data_documento,
+                    numero_documento=f"{rng.randint(1, 9999)}/{data_documento.year}",
+                    modalita_pagamento=rng.choices(self.modalita, weights=(10, 45, 20, 25))[0], cantiere=cantiere,
+                    imponibile=imponibile, iva=iva, totale=imponibile + iva,
+                    stato=DocumentoTestata.Stato.CONFERMATO, created_by=self.utente, updated_by=self.utente,
+                ))
+                righe_per_testata.append(righe)
+
+            self._numera(testate)
+            testate = self._crea(DocumentoTestata, testate)
+
+            righe, scadenze = [], []
+            for testata, righe_testata in zip(testate, righe_per_testata):
+                for riga in righe_testata:
+                    riga.testata = testata
+                righe.extend(righe_testata)
+                tipo_scadenza = Scadenza.Tipo.INCASSO if 'V' in testata.tipo_doc else Scadenza.Tipo.PAGAMENTO
+                for data_scadenza, importo_rata in self._rate(testata, testata.modalita_pagamento):
+                    scadenze.append(Scadenza(
+                        tenant=tenant, documento=testata, anagrafica_id=testata.anagrafica_id,
+                        data_scadenza=data_scadenza, importo_rata=importo_rata, tipo_scadenza=tipo_scadenza,
+                    ))
+            self._crea(DocumentoRiga, righe)
+
+            pagamenti = []
+            testate_per_pk = {testata.pk: testata for testata in testate}
+            for scadenza in scadenze:
+                pagamenti_scadenza = self._pagamenti(scadenza, testate_per_pk[scadenza.documento_id])
+                pagato = sum((p.importo for p in pagamenti_scadenza), Decimal('0'))
+                scadenza.importo_pagato = pagato
+                scadenza.importo_residuo = scadenza.importo_rata - pagato
+                scadenza.stato = Scadenza.calcola_stato(scadenza.importo_rata, pagato)
+                pagamenti.append(pagamenti_scadenza)
+            self._crea(Scadenza, scadenze)
+            for scadenza, pagamenti_scadenza in zip(scadenze, pagamenti):
+                for pagamento in pagamenti_scadenza:
+                    pagamento.scadenza_collegata = scadenza
+            self._registra(self._crea(PrimaNota, [p for pagamenti_scadenza in pagamenti for p in pagamenti_scadenza]))
+
+    def _numera(self, testate):
+        """Numeri dal contatore del tenant per i documenti di vendita, un blocco per serie e anno."""
+        per_serie = defaultdict(list)
+        for testata in testate:
+            if testata.tipo_doc in DocumentoTestata.PREFISSI_NUMERAZIONE:
+                per_serie[testata.tipo_doc, testata.data_documento.year].append(testata)
+        for (tipo_doc, anno), testate_serie in per_serie.items():
+            numeri = DocumentoTestata.genera_numeri(self.tenant.pk, tipo_doc, anno, len(testate_serie))
+            for testata, numero in zip(testate_serie, numeri):
+                testata.numero_documento = numero
+
+    # --------------------------------------------------------------------------
+    # PRIMA NOTA E DIARIO
+    # --------------------------------------------------------------------------
+
+    def _registra(self, movimenti):
+        for movimento in movimenti:
+            totali = self.saldi[movimento.conto_finanziario_id]
+            totali[movimento.tipo_movimento != PrimaNota.TipoMovimento.ENTRATA] += movimento.importo
+
+    def prima_nota(self):
+        """Movimenti non legati a scadenze: spese, stipendi, incassi vari e giroconti tra i conti."""
+        rng, tenant = self.rng, self.tenant
+        date_movimenti = sorted(self._data_casuale() for _ in range(self.options['primanota']))
+        cassa, banca, *_ = self.conti
+        for lotto in _a_lotti(date_movimenti, DIMENSIONE_LOTTO):
+            movimenti, giroconti = [], []
+            for data_registrazione in lotto:
+                genere = rng.random()
+                if genere < 0.05:
+                    importo = _importo(rng.choice([200, 500, 1000, 2000]))
+                    uscita = PrimaNota(
+                        tenant=tenant, data_registrazione=data_registrazione, importo=importo,
+                        descrizione=f"GIROCONTO -> {cassa.nome_conto}", tipo_movimento=PrimaNota.TipoMovimento.USCITA,
+                        causale=self.causali['giroconto'], conto_finanziario=banca, created_by=self.utente,
+                    )
+                    entrata = PrimaNota(
+                        tenant=tenant, data_registrazione=data_registrazione, importo=importo,
+                        descrizione=f"GIROCONTO <- {banca.nome_conto}", tipo_movimento=PrimaNota.TipoMovimento.ENTRATA,
+                        causale=self.causali['giroconto'], conto_finanziario=cassa, created_by=self.utente,
+                    )
+                    movimenti.append(uscita)
+                    giroconti.append((uscita, entrata))
+                    continue
+                if genere < 0.15:
+                    causale, tipo = self.causali['incassi_vari'], PrimaNota.TipoMovimento.ENTRATA
+                    conto_operativo = rng.choice(self.conti_ricavo)
+                    importo = _importo(rng.lognormvariate(6, 1))
+                    anagrafica = rng.choices(self.clienti, weights=self.pesi_clienti)[0] if self.clienti else None
+                elif genere < 0.25 and self.dipendenti:
+                    causale, tipo = self.causali['stipendi'], PrimaNota.TipoMovimento.USCITA
+                    conto_operativo = self.conti_costo[1]
+                    importo = _importo(rng.uniform(1400, 2600))
+                    anagrafica = rng.choice(self.dipendenti)
+                else:
+                    causale = self.causali[rng.choice(['spese', 'carburante'])]
+                    tipo, conto_operativo = PrimaNota.TipoMovimento.USCITA, rng.choice(self.conti_costo)
+                    importo = _importo(rng.lognormvariate(4.5, 1.1))
+                    anagrafica = rng.choices(self.fornitori, weights=self.pesi_fornitori)[0] if self.fornitori and rng.random() < 0.5 else None
+                cantiere = rng.choice(self.cantieri_aperti) if self.cantieri_aperti and rng.random() < 0.4 else None
+                movimenti.append(PrimaNota(
+                    tenant=tenant, data_registrazione=data_registrazione, importo=importo,
+                    descrizione=f"{causale.descrizione.rsplit(' [', 1)[0]} {data_registrazione:%m/%Y}",
+                    tipo_movimento=tipo, causale=causale, conto_finanziario=rng.choices(self.conti, weights=(30, 55, 15))[0],
+                    conto_operativo=conto_operativo, anagrafica=anagrafica, cantiere=cantiere, created_by=self.utente,
+                ))
+
+            self._registra(self._crea(PrimaNota, movimenti))
+            if giroconti:
+                for uscita, entrata in giroconti:
+                    entrata.movimento_collegato = uscita
+                self._registra(self._crea(PrimaNota, [entrata for _, entrata in giroconti]))
+                for uscita, entrata in giroconti:
+                    uscita.movimento_collegato = entrata
+                PrimaNota.objects.bulk_update([uscita for uscita, _ in giroconti], ['movimento_collegato'])
+
+    def diario(self):
+        """Una giornata per dipendente in servizio e giorno feriale degli ultimi 'giorni_diario' giorni."""
+        rng, tenant = self.rng, self.tenant
+        Stato = DiarioAttivita.StatoPresenza
+        giorni = [self.oggi - timedelta(days=n) for n in range(self.options['giorni_diario'], -1, -1)]
+        giorni = [giorno for giorno in giorni if giorno.weekday() < 5]
+        pianificabili = self.cantieri_aperti or self.cantieri_generati
+
+        def giornate():
+            for dettaglio in self.dettagli:
+                for giorno in giorni:
+                    if giorno < dettaglio.data_assunzione or dettaglio.data_fine_rapporto and giorno > dettaglio.data_fine_rapporto:
+                        continue
+                    stato = _scegli(rng, [(Stato.PRESENTE, 92), (Stato.ASSENTE_G, 6), (Stato.ASSENTE_I, 2)])
+                    presente = stato == Stato.PRESENTE
+                    yield DiarioAttivita(
+                        tenant=tenant, data=giorno, dipendente_id=dettaglio.anagrafica_id, stato_presenza=stato,
+                        cantiere_pianificato=rng.choice(pianificabili) if presente and pianificabili else None,
+                        mezzo_pianificato=rng.choice(self.mezzi) if presente and rng.random() < 0.3 else None,
+                        tipo_assenza_giustificata=rng.choice(ASSENZE) if stato == Stato.ASSENTE_G else None,
+                        ore_ordinarie=Decimal('8.00') if presente else Decimal('0.00'),
+                        ore_straordinarie=_importo(rng.choice([1, 1.5, 2, 3])) if presente and rng.random() < 0.15 else Decimal('0.00'),
+                        created_by=self.utente, updated_by=self.utente,
+                    )
+
+        for lotto in _a_lotti(giornate(), DIMENSIONE_LOTTO):
+            self._crea(DiarioAttivita, lotto)
+
+    def saldi_conti(self):
+        self._crea(SaldoContoFinanziario, [
+            SaldoContoFinanziario(
+                tenant=self.tenant, conto_finanziario_id=conto_id,
+                totale_entrate=entrate, totale_uscite=uscite, saldo=entrate - uscite,
+            )
+            for conto_id, (entrate, uscite) in self.saldi.items()
+        ])
+
+    def genera(self, utente):
+        self.utente = utente
+        self.tabelle_di_base()
+        self.anagrafiche()
+        self.cantieri()
+        self.documenti()
+        self.prima_nota()
+        self.diario()
+        self.saldi_conti()
+        self.conteggi['TotaleMensile'] += ricostruisci_tenant(self.tenant.pk)
+        return self.conteggi
+
+
+class Command(BaseCommand):
+    help = (
+        "Crea una o più aziende con dati di prova realistici e riproducibili (anagrafiche, cantieri, "
+        "documenti con righe e scadenze, pagamenti, Prima Nota e diario attività), per misurare le "
+        "prestazioni con volumi controllati (vedi il comando 'benchmark_viste')."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--aziende', type=int, default=1, help="Numero di aziende da creare (default: %(default)s).")
+        parser.add_argument('--prefisso', default="Azienda di prova", help="Nome delle aziende, seguito dal numero progressivo.")
+        parser.add_argument('--seed', type=int, default=1, help="Seme del generatore casuale: stesso seme, stessi dati (default: %(default)s).")
+        parser.add_argument('--al', type=date.fromisoformat, help="Data più recente dei dati, AAAA-MM-GG (default: oggi).")
+        parser.add_argument('--anni', type=int, default=3, help="Anni di storico generati (default: %(default)s).")
+        parser.add_argument('--clienti', type=int, default=600, help="Clienti per azienda (default: %(default)s).")
+        parser.add_argument('--fornitori', type=int, default=300, help="Fornitori per azienda (default: %(default)s).")
+        parser.add_argument('--dipendenti', type=int, default=40, help="Dipendenti per azienda (default: %(default)s).")
+        parser.add_argument('--cantieri', type=int, default=80, help="Cantieri per azienda (default: %(default)s).")
+        parser.add_argument('--documenti', type=int, default=5000, help="Documenti per azienda, con righe, scadenze e pagamenti (default: %(default)s).")
+        parser.add_argument('--righe-max', type=int, default=40, help="Righe massime per documento (default: %(default)s).")
+        parser.add_argument('--primanota', type=int, default=10000, help="Movimenti di Prima Nota non legati a scadenze (default: %(default)s).")
+        parser.add_argument('--giorni-diario', type=int, default=90, help="Giorni di diario attività per dipendente (default: %(default)s).")
+        parser.add_argument('--utente', help="Username a cui dare il ruolo di amministratore sulle aziende create (creato se non esiste).")
+
+    def handle(self, *args, **options):
+        if options['aziende'] < 1 or options['anni'] < 1 or options['righe_max'] < 1:
+            raise CommandError("--aziende, --anni e --righe-max devono essere almeno 1.")
+        oggi = options['al'] or date.today()
+        nomi = [f"{options['prefisso']} {n}" for n in range(1, options['aziende'] + 1)]
+        esistenti = list(Company.objects.filter(company_name__in=nomi).values_list('company_name', flat=True))
+        if esistenti:
+            raise CommandError(f"Aziende già presenti: {', '.join(esistenti)}. Usare un altro --prefisso.")
+
+        utente = None
+        if options['utente']:
+            utente, creato = get_user_model().objects.get_or_create(username=options['utente'])
+            if creato:
+                utente.set_unusable_password()
+                utente.save()
+
+        for n, nome in enumerate(nomi, start=1):
+            inizio = time.monotonic()
+            # Un generatore per azienda: i dati di ciascuna non dipendono da quante se ne creano.
+            rng = random.Random(f"{options['seed']}:{n}")
+            with transaction.atomic():
+                tenant = Company.objects.create(company_name=nome, vat_number=f"{rng.randrange(10 ** 10, 10 ** 11)}")
+                if utente:
+                    UserCompanyPermission.objects.create(
+                        user=utente, company=tenant, company_role=UserCompanyPermission.CompanyRole.ADMIN
+                    )
+                conteggi = GeneratoreAzienda(tenant, rng, oggi, options).genera(utente)
+            invalida_kpi(tenant.pk)
+
+            self.stdout.write(self.style.SUCCESS(
+                f"{nome} (id {tenant.pk}) creata in {time.monotonic() - inizio:.1f} s."
+            ))
+            for modello, quanti in conteggi.items():
+                self.stdout.write(f"  {modello:<25} {quanti}")
@@ -0,0 +1,75 @@
+# gestionale/management/commands/importa_dati.py
+
+import csv
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from gestionale.importazione import IMPORTATORI, importa
+from tenants.models import Company
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa anagrafiche, movimenti di Prima Nota o documenti da un file CSV o XLSX, "
+        "con le stesse regole di validazione dei form e scrittura a lotti. "
+        "Le righe non valide vengono segnalate senza interrompere l'importazione."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('tipo', choices=sorted(IMPORTATORI), help="Cosa importare.")
+        parser.add_argument('file', help="Percorso del file .csv o .xlsx (la prima riga contiene i nomi delle colonne).")
+        parser.add_argument('--tenant', type=int, required=True, help="ID dell'azienda in cui importare.")
+        parser.add_argument('--utente', help="Username registrato come autore dei record importati.")
+        parser.add_argument('--simula', action='store_true', help="Valida il file senza salvare nulla.")
+        parser.add_argument('--errori', help="Scrive le righe scartate in questo file CSV.")
+
+    def handle(self, *args, **options):
+        try:
+            tenant = Company.objects.get(pk=options['tenant'])
+        except Company.DoesNotExist:
+            raise CommandError(f"Azienda {options['tenant']} inesistente.")
+        utente = None
+        if options['utente']:
+            try:
+                utente = get_user_model().objects.get(username=options['utente'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"Utente {options['utente']} inesistente.")
+
+        inizio = time.monotonic()
+
+        def al_lotto(esito):
+            self.stdout.write(
+                f"  righe lette: {esito.righe_lette}  importati: {esito.importati}  "
+                f"scartati: {len(esito.errori)}  ({time.monotonic() - inizio:.0f} s)"
+            )
+
+        try:
+            with open(options['file'], 'rb') as file:
+                esito = importa(
+                    options['tipo'], file, options['file'], tenant,
+                    utente=utente, simula=options['simula'], al_lotto=al_lotto,
+                )
+        except OSError as e:
+            raise CommandError(f"Impossibile leggere il file: {e}")
+        except ValidationError as e:
+            raise CommandError('; '.join(e.messages))
+
+        for numero_riga, messaggio in esito.errori[:20]:
+            self.stdout.write(self.style.WARNING(f"  riga {numero_riga}: {messaggio}"))
+        if len(esito.errori) > 20:
+            self.stdout.write(self.style.WARNING(f"  ... e altre {len(esito.errori) - 20} righe scartate."))
+        if options['errori'] and esito.errori:
+            with open(options['errori'], 'w', newline='', encoding='utf-8') as file:
+                writer = csv.writer(file, delimiter=';')
+                writer.writerow(['riga', 'errore'])
+                writer.writerows(esito.errori)
+
+        descrizione = IMPORTATORI[options['tipo']].descrizione
+        verbo = "validi (simulazione, nulla è stato salvato)" if options['simula'] else "importati"
+        self.stdout.write(self.style.SUCCESS(
+            f"Record {verbo}: {esito.importati} {descrizione} da {esito.righe_lette} righe in "
+            f"{time.monotonic() - inizio:.1f} s; {len(esito.errori)} scartati."
+        ))
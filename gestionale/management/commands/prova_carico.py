@@ -0,0 +1,170 @@
+# gestionale/management/commands/prova_carico.py
+
+import json
+import statistics
+import threading
+import time
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode, urljoin
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Chiamate che l'utente fa mentre lavora: API JSON del wizard e dei form, dashboard.
+RICHIESTE_INTERATTIVE = [
+    '/app/api/autocomplete/anagrafica/?q=',
+    '/app/api/get-anagrafiche/?tipo_doc=FTV',
+    '/app/api/get-conto-saldo/?conto_id={conto}',
+    '/app/',
+]
+
+# Export pesanti lanciati in parallelo durante la seconda fase.
+EXPORT = [
+    '/app/documenti/export/excel/',
+    '/app/primanota/export/excel/',
+    '/app/scadenzario/export/pdf/',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Prova di carico su un server in esecuzione (waitress o ASGI): misura la latenza delle "
+        "richieste interattive prima da sole e poi mentre altri client scaricano export pesanti, "
+        "per verificare che gli export non rallentino le API e le dashboard."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Indirizzo del server (default: %(default)s).")
+        parser.add_argument('--utente', required=True, help="Username con cui accedere.")
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--azienda', type=int, required=True, help="ID dell'azienda da attivare.")
+        parser.add_argument('--client-interattivi', type=int, default=4, help="Client interattivi concorrenti (default: %(default)s).")
+        parser.add_argument('--client-export', type=int, default=4, help="Client che scaricano export (default: %(default)s).")
+        parser.add_argument('--durata', type=int, default=20, help="Secondi di ciascuna fase (default: %(default)s).")
+        parser.add_argument(
+            '--soglia', type=float,
+            help="Esce con errore se il 95° percentile interattivo sotto export supera di questo fattore quello senza export."
+        )
+
+    # --------------------------------------------------------------------------
+    # HTTP
+    # --------------------------------------------------------------------------
+
+    def _accedi(self, base, utente, password, azienda):
+        """Login e attivazione dell'azienda; restituisce l'opener con i cookie di sessione."""
+        cookie = CookieJar()
+        opener = build_opener(HTTPCookieProcessor(cookie))
+        url_login = urljoin(base, '/accounts/login/')
+        try:
+            opener.open(url_login, timeout=30).read()
+            csrf = next((c.value for c in cookie if c.name == 'csrftoken'), '')
+            dati = urlencode({'username': utente, 'password': password, 'csrfmiddlewaretoken': csrf}).encode()
+            risposta = opener.open(Request(url_login, data=dati, headers={'Referer': url_login}), timeout=30)
+            if '/accounts/login/' in risposta.geturl():
+                raise CommandError("Accesso non riuscito: controllare utente e password.")
+            opener.open(urljoin(base, f'/tenants/activate/{azienda}/'), timeout=30).read()
+        except (HTTPError, URLError) as e:
+            raise CommandError(f"Impossibile accedere a {base}: {e}")
+        return opener
+
+    def _primo_conto(self, opener, base):
+        with opener.open(urljoin(base, '/app/api/autocomplete/conto_finanziario/?limit=1'), timeout=30) as risposta:
+            risultati = json.load(risposta)['results']
+        if not risultati:
+            raise CommandError("L'azienda non ha conti finanziari attivi.")
+        return risultati[0]['id']
+
+    def _client(self, opener, urls, fine, tempi, errori, lock, unici=False):
+        """Chiama ciclicamente gli URL fino a 'fine' registrando (url, secondi) per ogni risposta."""
+        n = 0
+        while time.monotonic() < fine:
+            url = urls[n % len(urls)]
+            n += 1
+            if unici:
+                # Parametro sempre diverso: l'export non viene servito dalla cache su disco.
+                url = f"{url}{'&' if '?' in url else '?'}_prova={threading.get_ident()}-{n}"
+            inizio = time.perf_counter()
+            try:
+                with opener.open(url, timeout=300) as risposta:
+                    risposta.read()
+            except (HTTPError, URLError, TimeoutError) as e:
+                with lock:
+                    errori.append((url, str(e)))
+                continue
+            with lock:
+                tempi.append((urls[(n - 1) % len(urls)], time.perf_counter() - inizio))
+
+    def _fase(self, opener, interattivi, export, options):
+        fine = time.monotonic() + options['durata']
+        tempi_interattivi, tempi_export, errori = [], [], []
+        lock = threading.Lock()
+        thread = [
+            threading.Thread(target=self._client, args=(opener, interattivi, fine, tempi_interattivi, errori, lock))
+            for _ in range(options['client_interattivi'])
+        ]
+        if export:
+            thread += [
+                threading.Thread(target=self._client, args=(opener, export, fine, tempi_export, errori, lock, True))
+                for _ in range(options['client_export'])
+            ]
+        for t in thread:
+            t.start()
+        for t in thread:
+            t.join()
+        return tempi_interattivi, tempi_export, errori
+
+    # --------------------------------------------------------------------------
+    # REPORT
+    # --------------------------------------------------------------------------
+
+    def _percentili(self, secondi):
+        if not secondi:
+            return None
+        ordinati = sorted(secondi)
+        p95 = ordinati[min(len(ordinati) - 1, int(len(ordinati) * 0.95))]
+        return {'n': len(ordinati), 'p50': statistics.median(ordinati), 'p95': p95, 'max': ordinati[-1]}
+
+    def _stampa(self, titolo, tempi):
+        self.stdout.write(self.style.MIGRATE_HEADING(titolo))
+        per_url = {}
+        for url, secondi in tempi:
+            per_url.setdefault(url, []).append(secondi)
+        for url, secondi in [('TOTALE', [s for _, s in tempi])] + sorted(per_url.items()):
+            p = self._percentili(secondi)
+            if p:
+                self.stdout.write(
+                    f"  {url:<50} n={p['n']:<6} p50={p['p50'] * 1000:8.1f} ms  "
+                    f"p95={p['p95'] * 1000:8.1f} ms  max={p['max'] * 1000:8.1f} ms"
+                )
+        return self._percentili([s for _, s in tempi])
+
+    def handle(self, *args, **options):
+        base = options['url'].rstrip('/')
+        opener = self._accedi(base, options['utente'], options['password'], options['azienda'])
+        conto = self._primo_conto(opener, base)
+        interattivi = [urljoin(base, url.format(conto=conto)) for url in RICHIESTE_INTERATTIVE]
+        export = [urljoin(base, url) for url in EXPORT]
+
+        self.stdout.write(f"Fase 1: {options['client_interattivi']} client interattivi per {options['durata']} s...")
+        tempi_base, _, errori_base = self._fase(opener, interattivi, None, options)
+        self.stdout.write(
+            f"Fase 2: {options['client_interattivi']} client interattivi e {options['client_export']} "
+            f"client export per {options['durata']} s..."
+        )
+        tempi_carico, tempi_export, errori_carico = self._fase(opener, interattivi, export, options)
+
+        base_p = self._stampa("Richieste interattive senza export", tempi_base)
+        carico_p = self._stampa("Richieste interattive durante gli export", tempi_carico)
+        self._stampa("Export", tempi_export)
+
+        for url, errore in (errori_base + errori_carico)[:10]:
+            self.stdout.write(self.style.WARNING(f"  errore: {url}: {errore}"))
+        if not base_p or not carico_p:
+            raise CommandError("Nessuna richiesta interattiva completata.")
+
+        rapporto = carico_p['p95'] / base_p['p95']
+        self.stdout.write(f"\nRapporto p95 interattivo (con export / senza export): {rapporto:.2f}")
+        if options['soglia'] and rapporto > options['soglia']:
+            raise CommandError(f"La latenza interattiva sotto export supera la soglia di {options['soglia']:.2f}.")
+        self.stdout.write(self.style.SUCCESS("Prova di carico completata."))
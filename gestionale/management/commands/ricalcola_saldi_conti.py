@@ -0,0 +1,83 @@
+# gestionale/management/commands/ricalcola_saldi_conti.py
+
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q, Sum, Value, DecimalField
+from django.db.models.functions import Coalesce
+
+from gestionale.models import ContoFinanziario, PrimaNota, SaldoContoFinanziario
+
+
+class Command(BaseCommand):
+    help = (
+        "Ricostruisce (o con --verifica controlla soltanto) i saldi materializzati "
+        "dei conti finanziari a partire dai movimenti di Prima Nota."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenant', type=int, help="ID dell'azienda da elaborare (default: tutte).")
+        parser.add_argument(
+            '--verifica', action='store_true',
+            help="Non modifica nulla: segnala le differenze ed esce con errore se ne trova."
+        )
+
+    def handle(self, *args, **options):
+        # Usiamo sempre i _base_manager: il comando gira fuori da una richiesta,
+        # quindi non c'è un tenant corrente e vogliamo vedere tutti i record.
+        conti = ContoFinanziario._base_manager.all()
+        movimenti = PrimaNota._base_manager.all()
+        if options['tenant']:
+            conti = conti.filter(tenant_id=options['tenant'])
+            movimenti = movimenti.filter(tenant_id=options['tenant'])
+
+        zero = Value(Decimal('0.00'), output_field=DecimalField())
+        totali_per_conto = {
+            riga['conto_finanziario_id']: riga
+            for riga in movimenti.values('conto_finanziario_id').annotate(
+                entrate=Coalesce(Sum('importo', filter=Q(tipo_movimento=PrimaNota.TipoMovimento.ENTRATA)), zero),
+                uscite=Coalesce(Sum('importo', filter=Q(tipo_movimento=PrimaNota.TipoMovimento.USCITA)), zero),
+            ).order_by()
+        }
+        saldi_attuali = {
+            s.conto_finanziario_id: s
+            for s in SaldoContoFinanziario._base_manager.filter(conto_finanziario__in=conti)
+        }
+
+        differenze = 0
+        with transaction.atomic():
+            for conto in conti.order_by('tenant_id', 'nome_conto'):
+                totali = totali_per_conto.get(conto.pk, {'entrate': Decimal('0.00'), 'uscite': Decimal('0.00')})
+                atteso = totali['entrate'] - totali['uscite']
+                saldo = saldi_attuali.get(conto.pk)
+                attuale = saldo.saldo if saldo else Decimal('0.00')
+
+                if attuale != atteso:
+                    differenze += 1
+                    self.stdout.write(self.style.WARNING(
+                        f"[tenant {conto.tenant_id}] {conto.nome_conto}: "
+                        f"saldo materializzato {attuale} / atteso {atteso}"
+                    ))
+
+                if options['verifica']:
+                    continue
+
+                SaldoContoFinanziario._base_manager.update_or_create(
+                    conto_finanziario=conto,
+                    defaults={
+                        'tenant_id': conto.tenant_id,
+                        'totale_entrate': totali['entrate'],
+                        'totale_uscite': totali['uscite'],
+                        'saldo': atteso,
+                    }
+                )
+
+        if options['verifica']:
+            if differenze:
+                raise CommandError(f"Trovati {differenze} conti con saldo non allineato.")
+            self.stdout.write(self.style.SUCCESS("Tutti i saldi materializzati sono allineati."))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Saldi ricalcolati per {conti.count()} conti ({differenze} corretti)."
+            ))
@@ -0,0 +1,68 @@
+# gestionale/management/commands/riconcilia_scadenze.py
+
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+
+from gestionale.models import PrimaNota, Scadenza
+
+
+class Command(BaseCommand):
+    help = (
+        "Riconcilia importo pagato, residuo e stato delle scadenze con i pagamenti "
+        "registrati in Prima Nota (con --verifica segnala soltanto le differenze)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenant', type=int, help="ID dell'azienda da elaborare (default: tutte).")
+        parser.add_argument(
+            '--verifica', action='store_true',
+            help="Non modifica nulla: segnala le differenze ed esce con errore se ne trova."
+        )
+
+    def handle(self, *args, **options):
+        # Fuori da una richiesta non c'è un tenant corrente: usiamo i _base_manager.
+        scadenze = Scadenza._base_manager.all()
+        pagamenti = PrimaNota._base_manager.filter(scadenza_collegata__isnull=False)
+        if options['tenant']:
+            scadenze = scadenze.filter(tenant_id=options['tenant'])
+            pagamenti = pagamenti.filter(tenant_id=options['tenant'])
+
+        pagato_per_scadenza = dict(
+            pagamenti.values('scadenza_collegata_id').annotate(totale=Sum('importo'))
+            .order_by().values_list('scadenza_collegata_id', 'totale')
+        )
+
+        differenze = 0
+        with transaction.atomic():
+            for scadenza in scadenze.select_for_update().order_by('pk'):
+                pagato = pagato_per_scadenza.get(scadenza.pk) or Decimal('0.00')
+                residuo = scadenza.importo_rata - pagato
+                stato = scadenza.stato
+                if stato != Scadenza.Stato.ANNULLATA:
+                    stato = Scadenza.calcola_stato(scadenza.importo_rata, pagato)
+
+                if (scadenza.importo_pagato, scadenza.importo_residuo, scadenza.stato) == (pagato, residuo, stato):
+                    continue
+
+                differenze += 1
+                self.stdout.write(self.style.WARNING(
+                    f"[tenant {scadenza.tenant_id}] Scadenza {scadenza.pk}: "
+                    f"pagato {scadenza.importo_pagato} -> {pagato}, "
+                    f"residuo {scadenza.importo_residuo} -> {residuo}, stato {scadenza.stato} -> {stato}"
+                ))
+                if options['verifica']:
+                    continue
+
+                scadenza.importo_pagato = pagato
+                scadenza.stato = stato
+                scadenza.save(update_fields=['importo_pagato', 'importo_residuo', 'stato', 'updated_at'])
+
+        if options['verifica']:
+            if differenze:
+                raise CommandError(f"Trovate {differenze} scadenze non allineate ai pagamenti.")
+            self.stdout.write(self.style.SUCCESS("Tutte le scadenze sono allineate ai pagamenti."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Riconciliazione completata ({differenze} scadenze corrette)."))
@@ -0,0 +1,52 @@
+# gestionale/management/commands/ricostruisci_totali_mensili.py
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gestionale.totali_mensili import SORGENTI, ricostruisci_tenant, totali_attesi, totali_salvati
+from tenants.models import Company
+
+
+class Command(BaseCommand):
+    help = (
+        "Ricostruisce (o con --verifica controlla soltanto) i totali mensili per tipo "
+        "documento, conto finanziario, conto operativo e cantiere usati dai KPI di "
+        "Dashboard e Dashboard Analisi, a partire da documenti e movimenti di Prima Nota."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenant', type=int, help="ID dell'azienda da elaborare (default: tutte).")
+        parser.add_argument(
+            '--verifica', action='store_true',
+            help="Non modifica nulla: segnala le differenze ed esce con errore se ne trova."
+        )
+
+    def _verifica(self, tenant_id):
+        differenze = 0
+        for modello in SORGENTI:
+            attesi, salvati = totali_attesi(modello, tenant_id), totali_salvati(modello, tenant_id)
+            for chiave in sorted(attesi.keys() | salvati.keys(), key=str):
+                if attesi.get(chiave, 0) != salvati.get(chiave, 0):
+                    differenze += 1
+                    self.stdout.write(self.style.WARNING(
+                        f"[tenant {tenant_id}] {modello._meta.verbose_name} {chiave}: "
+                        f"salvato {salvati.get(chiave, 0)} / atteso {attesi.get(chiave, 0)}"
+                    ))
+        return differenze
+
+    def handle(self, *args, **options):
+        aziende = Company.objects.order_by('pk')
+        if options['tenant']:
+            aziende = aziende.filter(pk=options['tenant'])
+            if not aziende.exists():
+                raise CommandError(f"Azienda {options['tenant']} inesistente.")
+
+        if options['verifica']:
+            differenze = sum(self._verifica(pk) for pk in aziende.values_list('pk', flat=True))
+            if differenze:
+                raise CommandError(f"Trovati {differenze} totali mensili non allineati.")
+            self.stdout.write(self.style.SUCCESS("Tutti i totali mensili sono allineati."))
+            return
+
+        for azienda in aziende:
+            self.stdout.write(f"{azienda}: {ricostruisci_tenant(azienda.pk)} righe scritte.")
+        self.stdout.write(self.style.SUCCESS("Totali mensili ricostruiti."))
@@ -0,0 +1,220 @@
+# gestionale/management/commands/verifica_budget_query.py
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from gestionale.autocomplete import SORGENTI_AUTOCOMPLETAMENTO
+from gestionale.budget_query import ControlloQuery, budget_vista
+from gestionale.kpi import invalida_kpi
+from gestionale.managers import tenant_context
+from gestionale.models import Anagrafica, Cantiere, DocumentoTestata, PrimaNota, RichiestaReport
+from gestionale.profilazione import attiva_misure
+from gestionale.report_utils import contenuto_risposta
+from gestionale.urls import urlpatterns
+from tenants.models import Company, UserCompanyPermission
+
+# Oggetto usato per i parametri pk degli URL, in base al prefisso del nome;
+# gli altri URL usano il primo oggetto del modello della vista.
+OGGETTI_PER_PREFISSO = {
+    'anagrafica': 'cliente',
+    'dipendente': 'dipendente',
+    'documento': 'documento',
+    'cantiere': 'cantiere',
+    'primanota': 'movimento',
+    'pagamento': 'pagamento',
+    'report': 'report',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Visita con GET tutti gli URL di gestionale/urls.py come amministratore dell'azienda e "
+        "confronta le query di ogni vista con il suo budget (attributo 'query_budget', default "
+        "QUERY_BUDGET_DEFAULT), segnalando le query ripetute con la stessa forma (N+1). Le viste "
+        "di dettaglio usano gli oggetti più pesanti dell'azienda. Le richieste girano in una "
+        "transazione annullata alla fine: il database non viene modificato. Con --asgi passano "
+        "dal gestore ASGI, come sotto uvicorn."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenant', type=int, required=True, help="ID dell'azienda su cui verificare.")
+        parser.add_argument('--utente', help="Username con accesso all'azienda (default: il primo amministratore).")
+        parser.add_argument('--solo', nargs='+', metavar='NOME_URL', help="Verifica solo gli URL con questi nomi.")
+        parser.add_argument(
+            '--asgi', action='store_true',
+            help="Invia le richieste al gestore ASGI (viste async e viste sync eseguite con sync_to_async)."
+        )
+
+    # --------------------------------------------------------------------------
+    # PREPARAZIONE
+    # --------------------------------------------------------------------------
+
+    def _utente(self, tenant, username):
+        permessi = UserCompanyPermission.objects.filter(company=tenant).select_related('user')
+        if username:
+            permesso = permessi.filter(user__username=username).first()
+            if permesso is None:
+                if not get_user_model().objects.filter(username=username).exists():
+                    raise CommandError(f"Utente {username} inesistente.")
+                raise CommandError(f"L'utente {username} non ha accesso all'azienda {tenant}.")
+        else:
+            permesso = permessi.filter(company_role=UserCompanyPermission.CompanyRole.ADMIN).order_by('pk').first()
+            if permesso is None:
+                raise CommandError(f"L'azienda {tenant} non ha amministratori: indicare --utente.")
+        return permesso.user
+
+    def _oggetti(self, utente):
+        """Per i dettagli gli oggetti più pesanti: è lì che una query per riga si fa notare."""
+        primo = lambda queryset: queryset.values_list('pk', flat=True).first()
+        return {
+            'cliente': primo(Anagrafica.objects.filter(tipo=Anagrafica.Tipo.CLIENTE).annotate(
+                n=Count('documenti')).order_by('-n', 'pk')),
+            'dipendente': primo(Anagrafica.objects.filter(tipo=Anagrafica.Tipo.DIPENDENTE).annotate(
+                n=Count('diario')).order_by('-n', 'pk')),
+            'documento': primo(DocumentoTestata.objects.annotate(n=Count('righe')).order_by('-n', 'pk')),
+            'cantiere': primo(Cantiere.objects.annotate(n=Count('movimenti_primanota')).order_by('-n', 'pk')),
+            'movimento': primo(PrimaNota.objects.order_by('pk')),
+            'pagamento': primo(PrimaNota.objects.filter(scadenza_collegata__isnull=False).order_by('pk')),
+            'report': primo(RichiestaReport.objects.filter(utente=utente).order_by('-pk')),
+        }
+
+    def _parametri(self, pattern, oggetti):
+        """Elenco di kwargs con cui invocare l'URL ([] se mancano i dati per farlo)."""
+        nomi = set(pattern.pattern.converters)
+        parametri = {}
+        if 'year' in nomi:
+            oggi = timezone.localdate()
+            parametri.update(year=oggi.year, month=oggi.month, day=oggi.day)
+        for nome in nomi & {'anagrafica_id', 'dipendente_pk'}:
+            parametri[nome] = oggetti['dipendente']
+        if 'pk' in nomi:
+            chiave = OGGETTI_PER_PREFISSO.get(pattern.name.split('_')[0])
+            if chiave:
+                parametri['pk'] = oggetti[chiave]
+            else:
+                modello = getattr(getattr(pattern.callback, 'view_class', None), 'model', None)
+                parametri['pk'] = modello.objects.order_by('pk').values_list('pk', flat=True).first() if modello else None
+        if any(valore is None for valore in parametri.values()):
+            return []
+        if 'sorgente' in nomi:
+            return [{**parametri, 'sorgente': sorgente} for sorgente in SORGENTI_AUTOCOMPLETAMENTO]
+        return [parametri]
+
+    def _voci(self, options, oggetti):
+        """(nome, url, vista) delle richieste GET da verificare."""
+        voci, saltate = [], []
+        for pattern in urlpatterns:
+            if options['solo'] and pattern.name not in options['solo']:
+                continue
+            vista = getattr(pattern.callback, 'view_class', None)
+            if vista is not None and not hasattr(vista, 'get'):
+                continue  # solo POST: azioni, non pagine
+            elenco = self._parametri(pattern, oggetti)
+            if not elenco:
+                saltate.append(f"{pattern.name} (nessun oggetto nell'azienda)")
+            for kwargs in elenco:
+                nome = f"{pattern.name}:{kwargs['sorgente']}" if 'sorgente' in kwargs else pattern.name
+                voci.append((nome, reverse(pattern.name, kwargs=kwargs), pattern.callback))
+        return voci, saltate
+
+    # --------------------------------------------------------------------------
+    # VERIFICA
+    # --------------------------------------------------------------------------
+
+    @staticmethod
+    def _leggi(response):
+        # Gli export in streaming interrogano il database mentre si legge il corpo; a
+        # fine lettura il client di test chiude la risposta senza chiudere la connessione.
+        for _ in contenuto_risposta(response):
+            pass
+
+    @classmethod
+    async def _get_asgi(cls, client, url):
+        response = await client.get(url, secure=True)
+        if response.streaming and response.is_async:
+            async for _ in response.streaming_content:
+                pass
+        else:
+            # Come fa il gestore ASGI, il corpo sync viene letto in un thread, fuori dall'event loop.
+            await sync_to_async(cls._leggi)(response)
+        return response
+
+    def _get(self, client, url):
+        if isinstance(client, AsyncClient):
+            return async_to_sync(self._get_asgi)(client, url)
+        response = client.get(url, secure=True)
+        self._leggi(response)
+        return response
+
+    def _richiesta(self, client, url, tenant_id):
+        invalida_kpi(tenant_id)  # i KPI in cache nasconderebbero le query della dashboard
+        controllo = ControlloQuery()
+        try:
+            response = self._get(client, url)
+        finally:
+            controllo.stacca()
+        return response.status_code, controllo
+
+    def handle(self, *args, **options):
+        try:
+            tenant = Company.objects.get(pk=options['tenant'])
+        except Company.DoesNotExist:
+            raise CommandError(f"Azienda {options['tenant']} inesistente.")
+        utente = self._utente(tenant, options['utente'])
+        with tenant_context(tenant):
+            voci, saltate = self._voci(options, self._oggetti(utente))
+        if not voci:
+            raise CommandError("Nessun URL da verificare.")
+
+        impostazioni = {
+            'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'],
+            'ARTEFATTI_CACHE_MB': 0,
+            'CONTROLLO_QUERY': False,  # il controllo lo fa il comando, non il middleware
+        }
+        fuori_budget, errori, verificate = [], [], 0
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{tenant} - utente {utente}"))
+        attiva_misure()
+        with override_settings(**impostazioni), transaction.atomic():
+            client = (AsyncClient if options['asgi'] else Client)(raise_request_exception=False)
+            client.force_login(utente)
+            self._get(client, reverse('activate_tenant', args=[tenant.pk]))
+            if client.session.get('active_tenant_id') != tenant.pk:
+                raise CommandError(f"Impossibile attivare l'azienda {tenant} per l'utente {utente}.")
+
+            for nome, url, vista in voci:
+                stato, controllo = self._richiesta(client, url, tenant.pk)
+                if stato in (404, 405):
+                    saltate.append(f"{nome} (HTTP {stato})")
+                    continue
+                verificate += 1
+                budget = budget_vista(vista)
+                problemi = controllo.problemi(budget)
+                riga = f"  {nome:<44} HTTP {stato}  query {controllo.query:>4} / {budget:<4}"
+                if stato >= 500:
+                    errori.append(nome)
+                    self.stdout.write(self.style.ERROR(riga))
+                elif problemi:
+                    fuori_budget.append(nome)
+                    self.stdout.write(self.style.WARNING(riga))
+                    for problema in problemi:
+                        self.stdout.write(f"      {problema}")
+                else:
+                    self.stdout.write(riga)
+            # Le viste GET di questo gestionale non scrivono, ma per sicurezza non resta nulla.
+            transaction.set_rollback(True)
+
+        for voce in saltate:
+            self.stdout.write(self.style.WARNING(f"  saltato: {voce}"))
+        if errori:
+            raise CommandError(f"Viste in errore: {', '.join(errori)}.")
+        if fuori_budget:
+            raise CommandError(f"Viste oltre il budget o con query ripetute: {', '.join(fuori_budget)}.")
+        self.stdout.write(self.style.SUCCESS(f"{verificate} URL nel budget."))
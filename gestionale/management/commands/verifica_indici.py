@@ -0,0 +1,129 @@
+# gestionale/management/commands/verifica_indici.py
+
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+
+from gestionale.models import Anagrafica, DiarioAttivita, DocumentoTestata, PrimaNota, Scadenza
+from gestionale.ricerca import cerca_anagrafiche, ricerca_trigram_disponibile
+
+
+class Command(BaseCommand):
+    help = (
+        "Esegue EXPLAIN sulle query più frequenti delle liste (Prima Nota, Scadenziario, "
+        "Documenti, Planning HR, ricerca anagrafiche) ed esce con errore se non usano gli indici per tenant previsti. "
+        "Da eseguire su un database popolato con un volume di dati realistico."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tenant', type=int,
+            help="ID dell'azienda su cui verificare le query (default: quella con più movimenti)."
+        )
+        parser.add_argument(
+            '--analizza', action='store_true',
+            help="Aggiorna prima le statistiche del planner (ANALYZE) sulle tabelle coinvolte."
+        )
+        parser.add_argument(
+            '--forza-indici', action='store_true',
+            help="Scoraggia le scansioni sequenziali (enable_seqscan = off) per verificare che gli "
+                 "indici siano utilizzabili anche su database piccoli. Solo PostgreSQL."
+        )
+        parser.add_argument('--mostra-piani', action='store_true', help="Stampa il piano completo di ogni query.")
+
+    def _query_da_verificare(self, tenant_id):
+        """(descrizione, queryset come lo costruiscono le viste, indice atteso)."""
+        oggi = date.today()
+        inizio_mese = oggi - timedelta(days=30)
+        query = [
+            (
+                "Prima Nota: ultimi movimenti del periodo",
+                PrimaNota._base_manager.filter(tenant_id=tenant_id, data_registrazione__gte=inizio_mese)
+                .order_by('-data_registrazione', '-pk')[:15],
+                'primanota_tenant_data_idx',
+            ),
+            (
+                "Prima Nota: estratto conto",
+                PrimaNota._base_manager.filter(
+                    tenant_id=tenant_id,
+                    conto_finanziario_id=PrimaNota._base_manager.filter(tenant_id=tenant_id)
+                    .values('conto_finanziario_id').annotate(n=Count('pk')).order_by('-n')
+                    .values_list('conto_finanziario_id', flat=True).first(),
+                ).order_by('-data_registrazione')[:15],
+                'primanota_tenant_conto_idx',
+            ),
+            (
+                "Scadenziario: scadenze aperte per data",
+                Scadenza._base_manager.filter(
+                    tenant_id=tenant_id, stato__in=[Scadenza.Stato.APERTA, Scadenza.Stato.PARZIALE]
+                ).order_by('data_scadenza')[:15],
+                'scadenza_aperte_data_idx',
+            ),
+            (
+                "Documenti: elenco per data",
+                DocumentoTestata._base_manager.filter(tenant_id=tenant_id)
+                .order_by('data_documento', 'numero_documento')[:15],
+                'documento_tenant_data_idx',
+            ),
+            (
+                "Documenti: fatturato per tipo e periodo",
+                DocumentoTestata._base_manager.filter(
+                    tenant_id=tenant_id, tipo_doc=DocumentoTestata.TipoDoc.FATTURA_VENDITA,
+                    data_documento__range=(date(oggi.year, 1, 1), oggi),
+                ),
+                'documento_tenant_tipo_data_idx',
+            ),
+            (
+                "Planning HR: diario della settimana",
+                DiarioAttivita._base_manager.filter(
+                    tenant_id=tenant_id, data__range=(oggi - timedelta(days=oggi.weekday()), oggi + timedelta(days=6)),
+                ),
+                'diario_tenant_data_idx',
+            ),
+        ]
+        if ricerca_trigram_disponibile():
+            query.append((
+                "Anagrafiche: ricerca per somiglianza",
+                cerca_anagrafiche(Anagrafica._base_manager.filter(tenant_id=tenant_id), 'rossi')[:20],
+                'anagrafica_nome_trgm_idx',
+            ))
+        return query
+
+    def handle(self, *args, **options):
+        tenant_id = options['tenant'] or (
+            PrimaNota._base_manager.values('tenant_id').annotate(n=Count('pk')).order_by('-n')
+            .values_list('tenant_id', flat=True).first()
+        )
+        if tenant_id is None:
+            raise CommandError("Nessun dato presente: popolare il database prima della verifica.")
+        postgres = connection.vendor == 'postgresql'
+
+        if options['analizza'] and postgres:
+            with connection.cursor() as cursor:
+                for modello in (PrimaNota, Scadenza, DocumentoTestata, DiarioAttivita):
+                    cursor.execute(f'ANALYZE {connection.ops.quote_name(modello._meta.db_table)}')
+
+        errori = 0
+        with transaction.atomic():
+            if options['forza_indici']:
+                if not postgres:
+                    raise CommandError("--forza-indici è disponibile solo su PostgreSQL.")
+                with connection.cursor() as cursor:
+                    # SET LOCAL vale solo fino alla fine di questa transazione.
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+
+            for descrizione, queryset, indice in self._query_da_verificare(tenant_id):
+                piano = queryset.explain()
+                if indice in piano:
+                    self.stdout.write(self.style.SUCCESS(f"[OK] {descrizione}: usa {indice}"))
+                else:
+                    errori += 1
+                    self.stdout.write(self.style.ERROR(f"[NO] {descrizione}: {indice} non utilizzato"))
+                if options['mostra_piani'] or indice not in piano:
+                    self.stdout.write(f"{piano}\n")
+
+        if errori:
+            raise CommandError(f"{errori} query non usano l'indice previsto (tenant {tenant_id}).")
+        self.stdout.write(self.style.SUCCESS(f"Tutte le query verificate usano gli indici previsti (tenant {tenant_id})."))
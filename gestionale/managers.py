@@ -1,8 +1,16 @@
+import functools
+import inspect
+from contextlib import contextmanager
+from contextvars import ContextVar
+
 from django.db import models
 from django.db.models.query import QuerySet
-from threading import local
 
-_current_tenant = local()
+# Tenant corrente. Una ContextVar (e non threading.local) segue il flusso della
+# richiesta anche sotto ASGI: ogni task asyncio ha il proprio contesto e
+# asgiref lo copia nei thread usati da sync_to_async, quindi due richieste
+# servite dallo stesso thread o dallo stesso event loop non si vedono a vicenda.
+_current_tenant = ContextVar('current_tenant', default=None)
 
 class TenantAwareQuerySet(QuerySet):
     def for_tenant(self, tenant):
@@ -19,10 +27,57 @@ class TenantAwareManager(models.Manager):
     def for_tenant(self, tenant):
         return self.get_queryset().for_tenant(tenant)
 
-# Funzione per impostare il tenant corrente (usata dal middleware)
+# Funzione per impostare il tenant corrente (usata dal middleware).
+# Restituisce il token da passare a reset_current_tenant per ripristinare il valore precedente.
 def set_current_tenant(tenant):
-    _current_tenant.value = tenant
+    return _current_tenant.set(tenant)
+
+def reset_current_tenant(token):
+    _current_tenant.reset(token)
 
 # Funzione per ottenere il tenant corrente (usata dal manager e dal modello)
 def get_current_tenant():
-    return getattr(_current_tenant, 'value', None)
+    return _current_tenant.get()
+
+
+@contextmanager
+def tenant_context(tenant):
+    """
+    Esegue il blocco con 'tenant' come tenant corrente, per il codice che non
+    passa dal TenantMiddleware (worker, comandi di gestione, script):
+
+        with tenant_context(azienda):
+            Anagrafica.objects.count()
+
+    All'uscita viene ripristinato il tenant precedente, anche in caso di eccezione.
+    """
+    token = set_current_tenant(tenant)
+    try:
+        yield tenant
+    finally:
+        reset_current_tenant(token)
+
+
+def with_tenant(func):
+    """
+    Decoratore per job in background e comandi: la funzione decorata riceve
+    l'azienda nell'argomento 'tenant' e viene eseguita con quel tenant corrente.
+    Funziona anche con le funzioni async.
+    """
+    firma = inspect.signature(func)
+
+    def _tenant(args, kwargs):
+        return firma.bind_partial(*args, **kwargs).arguments.get('tenant')
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper_async(*args, **kwargs):
+            with tenant_context(_tenant(args, kwargs)):
+                return await func(*args, **kwargs)
+        return wrapper_async
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with tenant_context(_tenant(args, kwargs)):
+            return func(*args, **kwargs)
+    return wrapper
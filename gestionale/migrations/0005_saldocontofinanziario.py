@@ -0,0 +1,63 @@
+# Generated by Django 5.2.4 on 2026-10-17 11:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Q, Sum
+
+
+def popola_saldi(apps, schema_editor):
+    """Inizializza i saldi materializzati a partire dai movimenti esistenti."""
+    ContoFinanziario = apps.get_model('gestionale', 'ContoFinanziario')
+    PrimaNota = apps.get_model('gestionale', 'PrimaNota')
+    SaldoContoFinanziario = apps.get_model('gestionale', 'SaldoContoFinanziario')
+
+    totali = {
+        riga['conto_finanziario_id']: riga
+        for riga in PrimaNota.objects.values('conto_finanziario_id').annotate(
+            entrate=Sum('importo', filter=Q(tipo_movimento='E')),
+            uscite=Sum('importo', filter=Q(tipo_movimento='U')),
+        ).order_by()
+    }
+    saldi = []
+    for conto in ContoFinanziario.objects.all():
+        riga = totali.get(conto.pk)
+        if not riga:
+            continue
+        entrate = riga['entrate'] or 0
+        uscite = riga['uscite'] or 0
+        saldi.append(SaldoContoFinanziario(
+            tenant_id=conto.tenant_id,
+            conto_finanziario=conto,
+            totale_entrate=entrate,
+            totale_uscite=uscite,
+            saldo=entrate - uscite,
+        ))
+    SaldoContoFinanziario.objects.bulk_create(saldi)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestionale', '0004_remove_causale_tipo_movimento_and_more'),
+        ('tenants', '0004_company_cap_company_city_company_province'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaldoContoFinanziario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('totale_entrate', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('totale_uscite', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('saldo', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('conto_finanziario', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='saldo_corrente', to='gestionale.contofinanziario')),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(app_label)s_%(class)s_related', to='tenants.company')),
+            ],
+            options={
+                'verbose_name': 'Saldo Conto Finanziario',
+                'verbose_name_plural': 'Saldi Conti Finanziari',
+            },
+        ),
+        migrations.RunPython(popola_saldi, migrations.RunPython.noop),
+    ]
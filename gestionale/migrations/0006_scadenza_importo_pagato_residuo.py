@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-17 11:24
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def popola_importi(apps, schema_editor):
+    """Valorizza pagato e residuo delle scadenze esistenti dai pagamenti collegati."""
+    Scadenza = apps.get_model('gestionale', 'Scadenza')
+    PrimaNota = apps.get_model('gestionale', 'PrimaNota')
+
+    pagato_per_scadenza = dict(
+        PrimaNota.objects.filter(scadenza_collegata__isnull=False)
+        .values('scadenza_collegata_id').annotate(totale=Sum('importo'))
+        .order_by().values_list('scadenza_collegata_id', 'totale')
+    )
+    scadenze = list(Scadenza.objects.all())
+    for scadenza in scadenze:
+        scadenza.importo_pagato = pagato_per_scadenza.get(scadenza.pk) or 0
+        scadenza.importo_residuo = scadenza.importo_rata - scadenza.importo_pagato
+    Scadenza.objects.bulk_update(scadenze, ['importo_pagato', 'importo_residuo'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestionale', '0005_saldocontofinanziario'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scadenza',
+            name='importo_pagato',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Importo Pagato'),
+        ),
+        migrations.AddField(
+            model_name='scadenza',
+            name='importo_residuo',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Importo Residuo'),
+        ),
+        migrations.RunPython(popola_importi, migrations.RunPython.noop),
+    ]
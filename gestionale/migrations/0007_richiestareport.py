@@ -0,0 +1,46 @@
+# Generated by Django 5.2.4 on 2026-10-17 11:34
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestionale', '0006_scadenza_importo_pagato_residuo'),
+        ('tenants', '0004_company_cap_company_city_company_province'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RichiestaReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ruolo', models.CharField(max_length=50, verbose_name="Ruolo dell'utente al momento della richiesta")),
+                ('titolo', models.CharField(max_length=200)),
+                ('formato', models.CharField(choices=[('PDF', 'PDF'), ('XLSX', 'Excel')], max_length=4)),
+                ('vista', models.CharField(max_length=100)),
+                ('argomenti', models.JSONField(blank=True, default=dict)),
+                ('parametri', models.TextField(blank=True)),
+                ('host', models.CharField(blank=True, max_length=255)),
+                ('stato', models.CharField(choices=[('In coda', 'In coda'), ('In corso', 'In elaborazione'), ('Completata', 'Completata'), ('Errore', 'Errore')], default='In coda', max_length=20)),
+                ('progresso', models.PositiveSmallIntegerField(default=0)),
+                ('messaggio_errore', models.TextField(blank=True)),
+                ('file', models.FileField(blank=True, upload_to='report/%Y/%m/')),
+                ('nome_file', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('avviata_il', models.DateTimeField(blank=True, null=True)),
+                ('completata_il', models.DateTimeField(blank=True, null=True)),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(app_label)s_%(class)s_related', to='tenants.company')),
+                ('utente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='richieste_report', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Richiesta Report',
+                'verbose_name_plural': 'Richieste Report',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['stato', 'created_at'], name='richiestareport_coda_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.4 on 2026-10-17 11:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestionale', '0008_updated_at_tabelle_export'),
+        ('tenants', '0004_company_cap_company_city_company_province'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='diarioattivita',
+            index=models.Index(fields=['tenant', 'data'], name='diario_tenant_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='documentotestata',
+            index=models.Index(fields=['tenant', 'data_documento'], name='documento_tenant_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='documentotestata',
+            index=models.Index(fields=['tenant', 'tipo_doc', 'data_documento'], name='documento_tenant_tipo_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='primanota',
+            index=models.Index(fields=['tenant', 'data_registrazione'], name='primanota_tenant_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='primanota',
+            index=models.Index(fields=['tenant', 'conto_finanziario', 'data_registrazione'], name='primanota_tenant_conto_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scadenza',
+            index=models.Index(condition=models.Q(('stato__in', ['Aperta', 'Parziale'])), fields=['tenant', 'data_scadenza'], name='scadenza_aperte_data_idx'),
+        ),
+    ]
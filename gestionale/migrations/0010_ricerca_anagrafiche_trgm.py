@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-17 11:41
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestionale', '0009_indici_tenant'),
+        ('tenants', '0004_company_cap_company_city_company_province'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='anagrafica',
+            index=models.Index(fields=['tenant', 'nome_cognome_ragione_sociale'], name='anagrafica_tenant_nome_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='anagrafica',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['nome_cognome_ragione_sociale'], name='anagrafica_nome_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='anagrafica',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['citta'], name='anagrafica_citta_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='anagrafica',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['p_iva'], name='anagrafica_piva_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.4 on 2026-10-17 11:56
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Stessi formati generati da DocumentoTestata.genera_numero e Anagrafica.genera_codice.
+NUMERO_DOCUMENTO_RE = re.compile(r'^(FT|NC)-(\d{4})-(\d+)$')
+CODICE_ANAGRAFICA_RE = re.compile(r'^[A-Z]{2}(\d+)$')
+TIPI_NUMERATI = ('FTV', 'NCV')
+
+
+def popola_contatori(apps, schema_editor):
+    """Allinea i contatori ai numeri già assegnati, così la numerazione prosegue senza duplicati."""
+    Anagrafica = apps.get_model('gestionale', 'Anagrafica')
+    DocumentoTestata = apps.get_model('gestionale', 'DocumentoTestata')
+    ContatoreNumerazione = apps.get_model('gestionale', 'ContatoreNumerazione')
+
+    ultimi = {}
+    documenti = DocumentoTestata.objects.filter(tipo_doc__in=TIPI_NUMERATI).values_list('tenant_id', 'tipo_doc', 'numero_documento')
+    for tenant_id, tipo_doc, numero in documenti.iterator():
+        trovato = NUMERO_DOCUMENTO_RE.match(numero or '')
+        if trovato:
+            chiave = (tenant_id, f'documento:{tipo_doc}', int(trovato.group(2)))
+            ultimi[chiave] = max(ultimi.get(chiave, 0), int(trovato.group(3)))
+
+    for tenant_id, tipo, codice in Anagrafica.objects.values_list('tenant_id', 'tipo', 'codice').iterator():
+        trovato = CODICE_ANAGRAFICA_RE.match(codice or '')
+        if trovato:
+            chiave = (tenant_id, f'anagrafica:{tipo}', 0)
+            ultimi[chiave] = max(ultimi.get(chiave, 0), int(trovato.group(1)))
+
+    ContatoreNumerazione.objects.bulk_create([
+        ContatoreNumerazione(tenant_id=tenant_id, serie=serie, anno=anno, ultimo_numero=ultimo)
+        for (tenant_id, serie, anno), ultimo in ultimi.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestionale', '0010_ricerca_anagrafiche_trgm'),
+        ('tenants', '0004_company_cap_company_city_company_province'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContatoreNumerazione',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('serie', models.CharField(max_length=30)),
+                ('anno', models.PositiveIntegerField(default=0)),
+                ('ultimo_numero', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(app_label)s_%(class)s_related', to='tenants.company')),
+            ],
+            options={
+                'verbose_name': 'Contatore Numerazione',
+                'verbose_name_plural': 'Contatori Numerazione',
+                'constraints': [models.UniqueConstraint(fields=('tenant', 'serie', 'anno'), name='contatore_tenant_serie_anno_uniq')],
+            },
+        ),
+        migrations.RunPython(popola_contatori, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestionale', '0011_contatorenumerazione'),
+        ('tenants', '0004_company_cap_company_city_company_province'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaldoGiornaliero',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField()),
+                ('voce', models.CharField(choices=[('LIQ', 'Liquidità per conto finanziario'), ('CRE', 'Crediti verso clienti aperti'), ('DEB', 'Debiti verso fornitori aperti'), ('OPE', 'Movimenti per conto operativo')], max_length=3)),
+                ('riferimento', models.PositiveBigIntegerField(default=0)),
+                ('importo', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(app_label)s_%(class)s_related', to='tenants.company')),
+            ],
+            options={
+                'verbose_name': 'Saldo Giornaliero',
+                'verbose_name_plural': 'Saldi Giornalieri',
+                'constraints': [models.UniqueConstraint(fields=('tenant', 'data', 'voce', 'riferimento'), name='saldo_giornaliero_unico')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StatoSaldiGiornalieri',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calcolati_al', models.DateField(blank=True, null=True)),
+                ('in_calcolo_fino_a', models.DateField(blank=True, help_text="Ultimo giorno del blocco che l'aggiornamento sta calcolando.", null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(app_label)s_%(class)s_related', to='tenants.company')),
+            ],
+            options={
+                'verbose_name': 'Stato Saldi Giornalieri',
+                'verbose_name_plural': 'Stato Saldi Giornalieri',
+                'constraints': [models.UniqueConstraint(fields=('tenant',), name='stato_saldi_giornalieri_unico')],
+            },
+        ),
+    ]
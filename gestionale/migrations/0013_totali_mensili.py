@@ -0,0 +1,78 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:41
+
+import django.db.models.deletion
+import django.db.models.functions.comparison
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+
+
+def popola_totali(apps, schema_editor):
+    """Calcola i totali mensili di documenti confermati e movimenti già registrati."""
+    DocumentoTestata = apps.get_model('gestionale', 'DocumentoTestata')
+    PrimaNota = apps.get_model('gestionale', 'PrimaNota')
+    TotaleMensileDocumenti = apps.get_model('gestionale', 'TotaleMensileDocumenti')
+    TotaleMensileMovimenti = apps.get_model('gestionale', 'TotaleMensileMovimenti')
+
+    sorgenti = (
+        (TotaleMensileDocumenti, DocumentoTestata.objects.filter(stato='Confermato'), 'data_documento',
+         'totale', ('tipo_doc', 'cantiere_id')),
+        (TotaleMensileMovimenti, PrimaNota.objects.all(), 'data_registrazione',
+         'importo', ('tipo_movimento', 'conto_finanziario_id', 'conto_operativo_id', 'cantiere_id')),
+    )
+    for modello, dettaglio, campo_data, campo_importo, chiave in sorgenti:
+        righe = dettaglio.annotate(mese=TruncMonth(campo_data)).values(
+            'tenant_id', 'mese', *chiave
+        ).annotate(somma=Sum(campo_importo)).order_by()
+        modello.objects.bulk_create([
+            modello(**{campo: riga[campo] for campo in ('tenant_id', 'mese', *chiave)}, **{campo_importo: riga['somma']})
+            for riga in righe if riga['somma']
+        ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestionale', '0012_saldi_giornalieri'),
+        ('tenants', '0004_company_cap_company_city_company_province'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TotaleMensileDocumenti',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mese', models.DateField(help_text='Primo giorno del mese.')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('tipo_doc', models.CharField(choices=[('FTV', 'Fattura di Vendita'), ('NCV', 'Nota di Credito di Vendita'), ('FTA', 'Fattura di Acquisto'), ('NCA', 'Nota di Credito di Acquisto')], max_length=10)),
+                ('totale', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cantiere', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='totali_mensili_documenti', to='gestionale.cantiere')),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(app_label)s_%(class)s_related', to='tenants.company')),
+            ],
+            options={
+                'verbose_name': 'Totale Mensile Documenti',
+                'verbose_name_plural': 'Totali Mensili Documenti',
+                'constraints': [models.UniqueConstraint(models.F('tenant'), models.F('mese'), models.F('tipo_doc'), django.db.models.functions.comparison.Coalesce('cantiere', models.Value(0)), name='totale_mensile_documenti_unico')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TotaleMensileMovimenti',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mese', models.DateField(help_text='Primo giorno del mese.')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('tipo_movimento', models.CharField(choices=[('E', 'Entrata'), ('U', 'Uscita')], max_length=1)),
+                ('importo', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cantiere', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='totali_mensili_movimenti', to='gestionale.cantiere')),
+                ('conto_finanziario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='totali_mensili', to='gestionale.contofinanziario')),
+                ('conto_operativo', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='totali_mensili', to='gestionale.contooperativo')),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(app_label)s_%(class)s_related', to='tenants.company')),
+            ],
+            options={
+                'verbose_name': 'Totale Mensile Movimenti',
+                'verbose_name_plural': 'Totali Mensili Movimenti',
+                'constraints': [models.UniqueConstraint(models.F('tenant'), models.F('mese'), models.F('tipo_movimento'), models.F('conto_finanziario'), django.db.models.functions.comparison.Coalesce('conto_operativo', models.Value(0)), django.db.models.functions.comparison.Coalesce('cantiere', models.Value(0)), name='totale_mensile_movimenti_unico')],
+            },
+        ),
+        migrations.RunPython(popola_totali, migrations.RunPython.noop),
+    ]
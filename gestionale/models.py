@@ -1,7 +1,13 @@
 # gestionale/models.py
 
+from datetime import timedelta
+
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models, transaction
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Coalesce
 from django.conf import settings
+from django.utils import timezone
 from django.urls import reverse # Per riferirci al nostro User model personalizzato
 from tenants.models import Company
 from .managers import TenantAwareManager
@@ -14,17 +20,20 @@ class TenantAwareModel(models.Model):
     class Meta:
         abstract = True
 
-    def save(self, *args, **kwargs):
+    def _imposta_tenant(self):
         from .managers import get_current_tenant
+        if not self.tenant_id:
+            current_tenant = get_current_tenant()
+            if current_tenant:
+                self.tenant = current_tenant
+            else:
+                # Questo dovrebbe essere gestito dal middleware o dalla vista
+                # ma è un fallback di sicurezza per evitare IntegrityError
+                raise Exception("Cannot save tenant-aware model without a current tenant set.")
+
+    def save(self, *args, **kwargs):
         if not self.pk:
-            if not self.tenant_id:
-                current_tenant = get_current_tenant()
-                if current_tenant:
-                    self.tenant = current_tenant
-                else:
-                    # Questo dovrebbe essere gestito dal middleware o dalla vista
-                    # ma è un fallback di sicurezza per evitare IntegrityError
-                    raise Exception("Cannot save tenant-aware model without a current tenant set.")
+            self._imposta_tenant()
         super().save(*args, **kwargs)
 
 # ==============================================================================
@@ -37,6 +46,8 @@ class AliquotaIVA(TenantAwareModel):
     descrizione = models.CharField(max_length=100, verbose_name="Descrizione")
     valore_percentuale = models.DecimalField(max_digits=5, decimal_places=2, verbose_name="Valore %")
     attivo = models.BooleanField(default=True)
+    # Versione dei dati per la cache degli export (gestionale/cache_artefatti.py).
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.descrizione} ({self.valore_percentuale}%)"
@@ -76,6 +87,8 @@ class Causale(TenantAwareModel):
         help_text="Se impostato, pre-compilerà il tipo di movimento nella Prima Nota."
     )
     attivo = models.BooleanField(default=True)
+    # Versione dei dati per la cache degli export (gestionale/cache_artefatti.py).
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.descrizione
@@ -87,6 +100,8 @@ class Causale(TenantAwareModel):
 class ContoFinanziario(TenantAwareModel):
     nome_conto = models.CharField(max_length=100, unique=True, verbose_name="Nome Conto")
     attivo = models.BooleanField(default=True)
+    # Versione dei dati per la cache degli export (gestionale/cache_artefatti.py).
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.nome_conto
@@ -167,6 +182,22 @@ class Anagrafica(TenantAwareModel):
 
     def __str__(self):
         return f"{self.nome_cognome_ragione_sociale} ({self.codice})"
+
+    @classmethod
+    def genera_codice(cls, tenant_id, tipo):
+        """Prossimo codice anagrafica del tenant per il tipo (es. CL000042). Va chiamato in una transazione."""
+        return cls.genera_codici(tenant_id, tipo, 1)[0]
+
+    @classmethod
+    def genera_codici(cls, tenant_id, tipo, quanti):
+        """Riserva 'quanti' codici consecutivi con un solo aggiornamento del contatore (importazioni)."""
+        prefisso = {
+            cls.Tipo.CLIENTE: 'CL',
+            cls.Tipo.FORNITORE: 'FO',
+            cls.Tipo.DIPENDENTE: 'DI'
+        }.get(tipo, 'XX')
+        ultimo = ContatoreNumerazione.prossimo(tenant_id, ContatoreNumerazione.serie_anagrafica(tipo), quanti=quanti)
+        return [f"{prefisso}{progressivo:06d}" for progressivo in range(ultimo - quanti + 1, ultimo + 1)]
     
     # === NUOVO METODO SAVE  ===
     def save(self, *args, **kwargs):
@@ -177,23 +208,13 @@ class Anagrafica(TenantAwareModel):
         # La logica di generazione del codice deve essere eseguita solo
         # se l'oggetto è nuovo (non ha ancora un 'pk') E non ha già un codice.
         if not self.pk or not self.codice:
-            tipo = self.tipo
-            prefisso = {
-                self.Tipo.CLIENTE: 'CL',
-                self.Tipo.FORNITORE: 'FO',
-                self.Tipo.DIPENDENTE: 'DI'
-            }.get(tipo, 'XX')
-
-            last_anagrafica = Anagrafica.objects.filter(tipo=tipo).order_by('codice').last()
-            
-            if last_anagrafica and last_anagrafica.codice:
-                last_number = int(last_anagrafica.codice[2:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.codice = f"{prefisso}{new_number:06d}"
-            
+            # Il progressivo arriva dal contatore del tenant (ContatoreNumerazione):
+            # se il salvataggio fallisce, la transazione annulla anche l'incremento.
+            with transaction.atomic():
+                self._imposta_tenant()
+                self.codice = self.genera_codice(self.tenant_id, self.tipo)
+                super().save(*args, **kwargs)
+            return
         # Chiama il metodo save() originale per eseguire il salvataggio effettivo
         super().save(*args, **kwargs)
 
@@ -201,6 +222,13 @@ class Anagrafica(TenantAwareModel):
         verbose_name = "Anagrafica"
         verbose_name_plural = "Anagrafiche"
         ordering = ['nome_cognome_ragione_sociale']
+        indexes = [
+            models.Index(fields=['tenant', 'nome_cognome_ragione_sociale'], name='anagrafica_tenant_nome_idx'),
+            # Ricerca per somiglianza (pg_trgm) usata da lista e autocompletamento: vedi gestionale/ricerca.py.
+            GinIndex(fields=['nome_cognome_ragione_sociale'], name='anagrafica_nome_trgm_idx', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['citta'], name='anagrafica_citta_trgm_idx', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['p_iva'], name='anagrafica_piva_trgm_idx', opclasses=['gin_trgm_ops']),
+        ]
 
 class Cantiere(TenantAwareModel):
     class Stato(models.TextChoices):
@@ -277,9 +305,31 @@ class DocumentoTestata(TenantAwareModel):
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='documenti_creati', on_delete=models.SET_NULL, null=True, blank=True)
     updated_by = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='documenti_aggiornati', on_delete=models.SET_NULL, null=True, blank=True)
 
+    # Documenti numerati automaticamente (quelli di acquisto riportano il numero del fornitore).
+    PREFISSI_NUMERAZIONE = {
+        TipoDoc.FATTURA_VENDITA: 'FT',
+        TipoDoc.NOTA_CREDITO_VENDITA: 'NC',
+    }
+
     def __str__(self):
         return f"{self.get_tipo_doc_display()} N. {self.numero_documento} del {self.data_documento}"
 
+    @classmethod
+    def genera_numero(cls, tenant_id, tipo_doc, anno):
+        """
+        Prossimo numero del tenant per tipo documento e anno (es. FT-2025-000042).
+        Va chiamato nella transazione che crea il documento: il contatore resta
+        bloccato fino al commit e, se la creazione fallisce, il numero non va perso.
+        """
+        return cls.genera_numeri(tenant_id, tipo_doc, anno, 1)[0]
+
+    @classmethod
+    def genera_numeri(cls, tenant_id, tipo_doc, anno, quanti):
+        """Riserva 'quanti' numeri consecutivi della serie (importazioni), alle stesse condizioni di genera_numero."""
+        ultimo = ContatoreNumerazione.prossimo(tenant_id, ContatoreNumerazione.serie_documento(tipo_doc), anno, quanti=quanti)
+        prefisso = cls.PREFISSI_NUMERAZIONE[tipo_doc]
+        return [f"{prefisso}-{anno}-{progressivo:06d}" for progressivo in range(ultimo - quanti + 1, ultimo + 1)]
+
     def get_absolute_url(self):
         """
         Restituisce l'URL canonico per un'istanza di questo modello.
@@ -290,6 +340,11 @@ class DocumentoTestata(TenantAwareModel):
         verbose_name_plural = "Documenti (Testate)"
         unique_together = ('anagrafica', 'tipo_doc', 'numero_documento')
         ordering = ['-data_documento', '-numero_documento']
+        indexes = [
+            # Elenco documenti ordinato per data e fatturato per tipo documento e periodo.
+            models.Index(fields=['tenant', 'data_documento'], name='documento_tenant_data_idx'),
+            models.Index(fields=['tenant', 'tipo_doc', 'data_documento'], name='documento_tenant_tipo_data_idx'),
+        ]
 
 
 class DocumentoRiga(TenantAwareModel):
@@ -301,6 +356,8 @@ class DocumentoRiga(TenantAwareModel):
     
     imponibile_riga = models.DecimalField(max_digits=10, decimal_places=2)
     iva_riga = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="IVA Riga")
+    # Versione dei dati per la cache degli export (gestionale/cache_artefatti.py).
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.descrizione
@@ -327,21 +384,69 @@ class Scadenza(TenantAwareModel):
     stato = models.CharField(max_length=20, choices=Stato.choices, default=Stato.APERTA)
     tipo_scadenza = models.CharField(max_length=20, choices=Tipo.choices)
 
+    # Valori denormalizzati: sono la somma dei pagamenti collegati (PrimaNota)
+    # e vengono mantenuti da PrimaNota.save()/delete() tramite aggiorna_pagato().
+    # Il comando 'riconcilia_scadenze' li verifica/ricostruisce.
+    importo_pagato = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name="Importo Pagato")
+    importo_residuo = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name="Importo Residuo")
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    
-    # NOTA: La logica per 'importo_pagato' e 'importo_residuo' che avevi nella
-    # reference la implementeremo in modo più "Djangonico" direttamente nelle viste
-    # o con delle properties del modello quando necessario. L'ORM di Django è così
-    # potente che spesso non serve pre-calcolare questi valori a livello di DB.
 
     def __str__(self):
         return f"Scadenza {self.id} - {self.anagrafica.nome_cognome_ragione_sociale} - €{self.importo_rata}"
-    
+
+    def save(self, *args, **kwargs):
+        # Il residuo segue sempre l'importo della rata (es. alla creazione).
+        # to_python: gli importi possono arrivare come stringhe (es. dal wizard documenti).
+        self.importo_rata = self._meta.get_field('importo_rata').to_python(self.importo_rata)
+        self.importo_pagato = self._meta.get_field('importo_pagato').to_python(self.importo_pagato)
+        self.importo_residuo = self.importo_rata - self.importo_pagato
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def calcola_stato(importo_rata, importo_pagato):
+        """Restituisce lo stato coerente con quanto pagato sulla rata."""
+        if importo_pagato <= 0:
+            return Scadenza.Stato.APERTA
+        if importo_pagato < importo_rata:
+            return Scadenza.Stato.PARZIALE
+        return Scadenza.Stato.SALDATA
+
+    @classmethod
+    def aggiorna_pagato(cls, scadenza_id):
+        """
+        Ricalcola importo pagato, residuo e stato di una scadenza dai suoi pagamenti.
+        La riga viene bloccata (SELECT ... FOR UPDATE) per serializzare pagamenti
+        concorrenti sulla stessa rata; va quindi chiamato dentro una transazione.
+        """
+        scadenza = cls._base_manager.select_for_update().filter(pk=scadenza_id).first()
+        if scadenza is None:
+            return None
+
+        importo_pagato = PrimaNota._base_manager.filter(scadenza_collegata_id=scadenza_id).aggregate(
+            totale=Coalesce(Sum('importo'), Value(0), output_field=models.DecimalField())
+        )['totale']
+
+        scadenza.importo_pagato = importo_pagato
+        scadenza.importo_residuo = scadenza.importo_rata - importo_pagato
+        if scadenza.stato != cls.Stato.ANNULLATA:
+            scadenza.stato = cls.calcola_stato(scadenza.importo_rata, importo_pagato)
+        scadenza.save(update_fields=['importo_pagato', 'importo_residuo', 'stato', 'updated_at'])
+        return scadenza
+
     class Meta:
         verbose_name = "Scadenza"
         verbose_name_plural = "Scadenze"
         ordering = ['data_scadenza']
+        indexes = [
+            # Scadenziario, dashboard e partitari leggono solo le scadenze aperte, in ordine
+            # di data: l'indice parziale resta piccolo perché esclude quelle saldate/annullate.
+            models.Index(
+                fields=['tenant', 'data_scadenza'], name='scadenza_aperte_data_idx',
+                condition=models.Q(stato__in=['Aperta', 'Parziale']),
+            ),
+        ]
 
 
 class PrimaNota(TenantAwareModel):
@@ -380,10 +485,412 @@ class PrimaNota(TenantAwareModel):
     def __str__(self):
         return f"{self.data_registrazione} - {self.descrizione} - €{self.importo}"
 
+    # Campi che influiscono sui valori materializzati (saldi conti, pagato delle scadenze,
+    # saldi giornalieri e totali mensili).
+    _CAMPI_MATERIALIZZATI = (
+        'conto_finanziario_id', 'tipo_movimento', 'importo', 'scadenza_collegata_id',
+        'data_registrazione', 'conto_operativo_id', 'cantiere_id',
+    )
+
+    def save(self, *args, **kwargs):
+        """
+        Sovrascrive il salvataggio per mantenere allineati i valori materializzati:
+        - il saldo del conto finanziario: si storna l'effetto della versione
+          precedente del movimento (se esiste) e si applica quello della nuova;
+        - importo pagato/residuo e stato delle scadenze collegate (vecchia e nuova);
+        - i saldi giornalieri già calcolati dalla data del movimento (vecchia o nuova);
+        - i totali mensili: si storna la versione precedente e si applica la nuova.
+        Tutto avviene nella stessa transazione del salvataggio.
+        """
+        with transaction.atomic():
+            precedente = None
+            if self.pk:
+                # Usiamo il _base_manager per leggere il record senza filtri di tenant.
+                precedente = PrimaNota._base_manager.filter(pk=self.pk).values(
+                    *self._CAMPI_MATERIALIZZATI
+                ).first()
+
+            super().save(*args, **kwargs)
+
+            nuovo = {campo: getattr(self, campo) for campo in self._CAMPI_MATERIALIZZATI}
+            # Es. il secondo save() dell'uscita di un giroconto aggiorna solo il collegamento.
+            if precedente == nuovo:
+                return
+
+            SaldoGiornaliero.invalida(
+                self.tenant_id, self.data_registrazione, precedente and precedente['data_registrazione']
+            )
+            if precedente:
+                SaldoContoFinanziario.registra_movimento(
+                    self.tenant_id, precedente['conto_finanziario_id'],
+                    precedente['tipo_movimento'], precedente['importo'], storno=True
+                )
+            SaldoContoFinanziario.registra_movimento(
+                self.tenant_id, self.conto_finanziario_id, self.tipo_movimento, self.importo
+            )
+            if precedente:
+                TotaleMensileMovimenti.registra_movimento(self.tenant_id, precedente, storno=True)
+            TotaleMensileMovimenti.registra_movimento(self.tenant_id, nuovo)
+
+            scadenze_da_aggiornare = {self.scadenza_collegata_id}
+            if precedente:
+                scadenze_da_aggiornare.add(precedente['scadenza_collegata_id'])
+            for scadenza_id in sorted(scadenze_da_aggiornare - {None}):
+                Scadenza.aggiorna_pagato(scadenza_id)
+
+    def delete(self, *args, **kwargs):
+        """
+        Sovrascrive l'eliminazione per stornare il movimento dal saldo materializzato
+        e dai totali mensili e ricalcolare la scadenza eventualmente pagata da questo movimento.
+        """
+        with transaction.atomic():
+            SaldoGiornaliero.invalida(self.tenant_id, self.data_registrazione)
+            SaldoContoFinanziario.registra_movimento(
+                self.tenant_id, self.conto_finanziario_id,
+                self.tipo_movimento, self.importo, storno=True
+            )
+            TotaleMensileMovimenti.registra_movimento(self.tenant_id, {
+                campo: getattr(self, campo) for campo in TotaleMensileMovimenti.CAMPI_MOVIMENTO
+            }, storno=True)
+            risultato = super().delete(*args, **kwargs)
+            if self.scadenza_collegata_id:
+                Scadenza.aggiorna_pagato(self.scadenza_collegata_id)
+            return risultato
+
     class Meta:
         verbose_name = "Prima Nota"
         verbose_name_plural = "Prima Nota"
         ordering = ['data_registrazione', 'pk'] # Aggiunto '-pk' per coerenza
+        indexes = [
+            # Lista di Prima Nota per periodo ed estratto conto (conto + periodo).
+            models.Index(fields=['tenant', 'data_registrazione'], name='primanota_tenant_data_idx'),
+            models.Index(fields=['tenant', 'conto_finanziario', 'data_registrazione'], name='primanota_tenant_conto_idx'),
+        ]
+
+
+class SaldoContoFinanziario(TenantAwareModel):
+    """
+    Saldo materializzato di un conto finanziario.
+    Viene aggiornato in modo incrementale da PrimaNota.save()/delete(), così la
+    lettura dei saldi (Tesoreria, Dashboard, API) costa una riga per conto invece
+    di ri-sommare tutto lo storico dei movimenti.
+    Il comando 'ricalcola_saldi_conti' lo ricostruisce/verifica da zero.
+    """
+    conto_finanziario = models.OneToOneField(ContoFinanziario, on_delete=models.CASCADE, related_name='saldo_corrente')
+    totale_entrate = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    totale_uscite = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    saldo = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Saldo {self.conto_finanziario} - €{self.saldo}"
+
+    @classmethod
+    def registra_movimento(cls, tenant_id, conto_id, tipo_movimento, importo, storno=False):
+        """
+        Applica (o storna) l'effetto di un movimento sul saldo del conto.
+        L'UPDATE con espressioni F() è atomico lato database: due transazioni
+        concorrenti sullo stesso conto si serializzano sul lock di riga.
+        """
+        if not conto_id or not importo:
+            return
+        importo = -importo if storno else importo
+        if tipo_movimento == PrimaNota.TipoMovimento.ENTRATA:
+            variazioni = {'totale_entrate': F('totale_entrate') + importo, 'saldo': F('saldo') + importo}
+        else:
+            variazioni = {'totale_uscite': F('totale_uscite') + importo, 'saldo': F('saldo') - importo}
+
+        aggiornati = cls._base_manager.filter(conto_finanziario_id=conto_id).update(
+            updated_at=timezone.now(), **variazioni
+        )
+        if not aggiornati:
+            # Primo movimento sul conto: creiamo la riga (gestendo la corsa con un'altra
+            # transazione che la crea in parallelo) e ripetiamo l'aggiornamento.
+            cls._base_manager.get_or_create(conto_finanziario_id=conto_id, defaults={'tenant_id': tenant_id})
+            cls._base_manager.filter(conto_finanziario_id=conto_id).update(
+                updated_at=timezone.now(), **variazioni
+            )
+
+    class Meta:
+        verbose_name = "Saldo Conto Finanziario"
+        verbose_name_plural = "Saldi Conti Finanziari"
+
+
+class SaldoGiornaliero(TenantAwareModel):
+    """
+    Fotografia dei valori di chiusura di un giorno: liquidità per conto
+    finanziario, crediti e debiti aperti, totale dei movimenti per conto
+    operativo. Gli importi sono cumulati dall'inizio dello storico, quindi il
+    valore "alla data X" è la riga del giorno X (o dell'ultimo giorno
+    fotografato prima di X più i movimenti successivi): vedi
+    gestionale/saldi_giornalieri.py, che calcola le righe e le legge.
+
+    Le righe sono complete (un giorno per ogni voce già apparsa) fino alla data
+    di StatoSaldiGiornalieri; un movimento o un documento registrato con una
+    data già fotografata le fa ricalcolare da quella data (invalida()).
+    """
+    class Voce(models.TextChoices):
+        LIQUIDITA = 'LIQ', 'Liquidità per conto finanziario'
+        CREDITI = 'CRE', 'Crediti verso clienti aperti'
+        DEBITI = 'DEB', 'Debiti verso fornitori aperti'
+        OPERATIVO = 'OPE', 'Movimenti per conto operativo'
+
+    data = models.DateField()
+    voce = models.CharField(max_length=3, choices=Voce.choices)
+    # ID del conto finanziario (LIQ) od operativo (OPE); 0 per crediti e debiti.
+    riferimento = models.PositiveBigIntegerField(default=0)
+    importo = models.DecimalField(max_digits=14, decimal_places=2)
+
+    def __str__(self):
+        return f"{self.data} {self.get_voce_display()} {self.riferimento or ''} - €{self.importo}"
+
+    @classmethod
+    def invalida(cls, tenant_id, *date):
+        """
+        Da chiamare nella transazione che registra, modifica o elimina movimenti o
+        documenti, con le date coinvolte (vecchie e nuove): se la più vecchia è già
+        fotografata (o è nel blocco che l'aggiornamento sta calcolando), le
+        fotografie da quel giorno in poi vengono eliminate e il prossimo
+        aggiornamento le ricalcola.
+        La riga di stato del tenant viene bloccata solo in quel caso. Altrimenti il
+        controllo viene ripetuto dopo il commit: un aggiornamento che ha letto i
+        movimenti prima del commit e ha prenotato (o già salvato) quel giorno
+        viene così comunque invalidato.
+        """
+        date = [data for data in date if data]
+        if not tenant_id or not date:
+            return
+        dal = min(date)
+        if not cls._invalida_se_fotografato(tenant_id, dal):
+            transaction.on_commit(lambda: cls._invalida_se_fotografato(tenant_id, dal), robust=True)
+
+    @classmethod
+    def _invalida_se_fotografato(cls, tenant_id, dal):
+        """Invalida da 'dal' se il giorno è fotografato o in calcolo; restituisce True se l'ha fatto."""
+        def da_invalidare(stato):
+            return stato is not None and any(
+                giorno is not None and giorno >= dal for giorno in (stato.calcolati_al, stato.in_calcolo_fino_a)
+            )
+
+        stati = StatoSaldiGiornalieri._base_manager.filter(tenant_id=tenant_id)
+        if not da_invalidare(stati.first()):
+            return False
+        with transaction.atomic():
+            stato = stati.select_for_update().first()
+            if not da_invalidare(stato):
+                return False
+            if stato.calcolati_al is not None and stato.calcolati_al >= dal:
+                cls._base_manager.filter(tenant_id=tenant_id, data__gte=dal).delete()
+                stato.calcolati_al = dal - timedelta(days=1)
+            if stato.in_calcolo_fino_a is not None and stato.in_calcolo_fino_a >= dal:
+                # Il blocco in calcolo potrebbe non comprendere questa scrittura: verrà scartato.
+                stato.in_calcolo_fino_a = None
+            stato.save(update_fields=['calcolati_al', 'in_calcolo_fino_a', 'updated_at'])
+        return True
+
+    class Meta:
+        verbose_name = "Saldo Giornaliero"
+        verbose_name_plural = "Saldi Giornalieri"
+        constraints = [
+            models.UniqueConstraint(fields=['tenant', 'data', 'voce', 'riferimento'], name='saldo_giornaliero_unico'),
+        ]
+
+
+class StatoSaldiGiornalieri(TenantAwareModel):
+    """Ultimo giorno fino al quale i SaldoGiornaliero del tenant sono completi (uno per tenant)."""
+    calcolati_al = models.DateField(null=True, blank=True)
+    in_calcolo_fino_a = models.DateField(
+        null=True, blank=True, help_text="Ultimo giorno del blocco che l'aggiornamento sta calcolando."
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Saldi giornalieri di {self.tenant} al {self.calcolati_al or '-'}"
+
+    class Meta:
+        verbose_name = "Stato Saldi Giornalieri"
+        verbose_name_plural = "Stato Saldi Giornalieri"
+        constraints = [
+            models.UniqueConstraint(fields=['tenant'], name='stato_saldi_giornalieri_unico'),
+        ]
+
+
+class TotaleMensile(TenantAwareModel):
+    """
+    Totali per tenant e mese, sommati per una chiave (tipo documento, conti,
+    cantiere...). I KPI su un periodo leggono i mesi interi da qui e solo i
+    giorni ai bordi dalle tabelle di dettaglio (vedi gestionale/kpi.py), così il
+    costo non cresce con lo storico.
+    Vengono aggiornati a ogni scrittura (registra()); il comando
+    'ricostruisci_totali_mensili' li ricostruisce/verifica da zero.
+    """
+    # Nome del campo importo (lo stesso della tabella di dettaglio, così le
+    # condizioni dei KPI valgono per entrambe) e campi della chiave oltre al mese.
+    CAMPO_IMPORTO = None
+    CAMPI_CHIAVE = ()
+
+    mese = models.DateField(help_text="Primo giorno del mese.")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def registra(cls, tenant_id, data, importo, storno=False, **chiave):
+        """
+        Somma (o storna) 'importo' al totale del mese di 'data' per la chiave indicata
+        (es. tipo_doc e cantiere_id). Come SaldoContoFinanziario.registra_movimento:
+        UPDATE con F() atomico lato database e creazione della riga al primo importo.
+        """
+        if not importo:
+            return
+        importo = -importo if storno else importo
+        filtro = {'tenant_id': tenant_id, 'mese': data.replace(day=1), **chiave}
+        variazioni = {cls.CAMPO_IMPORTO: F(cls.CAMPO_IMPORTO) + importo, 'updated_at': timezone.now()}
+        if not cls._base_manager.filter(**filtro).update(**variazioni):
+            cls._base_manager.get_or_create(**filtro)
+            cls._base_manager.filter(**filtro).update(**variazioni)
+
+
+class TotaleMensileDocumenti(TotaleMensile):
+    """Totale dei documenti confermati per mese, tipo documento e cantiere."""
+    CAMPO_IMPORTO = 'totale'
+    CAMPI_CHIAVE = ('tipo_doc', 'cantiere_id')
+
+    tipo_doc = models.CharField(max_length=10, choices=DocumentoTestata.TipoDoc.choices)
+    cantiere = models.ForeignKey(Cantiere, on_delete=models.CASCADE, null=True, blank=True, related_name='totali_mensili_documenti')
+    totale = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    # Campi della testata che spostano il documento tra i totali.
+    CAMPI_DOCUMENTO = ('data_documento', 'tipo_doc', 'cantiere_id', 'stato', 'totale')
+
+    @classmethod
+    def registra_documento(cls, tenant_id, valori, storno=False):
+        """Applica (o storna) un documento, dato come dizionario dei CAMPI_DOCUMENTO: contano solo i confermati."""
+        if valori['stato'] == DocumentoTestata.Stato.CONFERMATO:
+            cls.registra(
+                tenant_id, valori['data_documento'], valori['totale'], storno=storno,
+                tipo_doc=valori['tipo_doc'], cantiere_id=valori['cantiere_id'],
+            )
+
+    def __str__(self):
+        return f"{self.mese:%m/%Y} {self.get_tipo_doc_display()} - €{self.totale}"
+
+    class Meta:
+        verbose_name = "Totale Mensile Documenti"
+        verbose_name_plural = "Totali Mensili Documenti"
+        constraints = [
+            # Coalesce: i NULL non sarebbero uguali tra loro in un vincolo di unicità.
+            models.UniqueConstraint(
+                'tenant', 'mese', 'tipo_doc', Coalesce('cantiere', Value(0)),
+                name='totale_mensile_documenti_unico',
+            ),
+        ]
+
+
+class TotaleMensileMovimenti(TotaleMensile):
+    """Totale dei movimenti di Prima Nota per mese, tipo, conto finanziario, conto operativo e cantiere."""
+    CAMPO_IMPORTO = 'importo'
+    CAMPI_CHIAVE = ('tipo_movimento', 'conto_finanziario_id', 'conto_operativo_id', 'cantiere_id')
+
+    tipo_movimento = models.CharField(max_length=1, choices=PrimaNota.TipoMovimento.choices)
+    conto_finanziario = models.ForeignKey(ContoFinanziario, on_delete=models.CASCADE, related_name='totali_mensili')
+    conto_operativo = models.ForeignKey(ContoOperativo, on_delete=models.CASCADE, null=True, blank=True, related_name='totali_mensili')
+    cantiere = models.ForeignKey(Cantiere, on_delete=models.CASCADE, null=True, blank=True, related_name='totali_mensili_movimenti')
+    importo = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    # Campi del movimento che lo spostano tra i totali.
+    CAMPI_MOVIMENTO = ('data_registrazione', 'tipo_movimento', 'conto_finanziario_id', 'conto_operativo_id', 'cantiere_id', 'importo')
+
+    @classmethod
+    def registra_movimento(cls, tenant_id, valori, storno=False):
+        """Applica (o storna) un movimento, dato come dizionario dei CAMPI_MOVIMENTO."""
+        cls.registra(
+            tenant_id, valori['data_registrazione'], valori['importo'], storno=storno,
+            tipo_movimento=valori['tipo_movimento'], conto_finanziario_id=valori['conto_finanziario_id'],
+            conto_operativo_id=valori['conto_operativo_id'], cantiere_id=valori['cantiere_id'],
+        )
+
+    def __str__(self):
+        return f"{self.mese:%m/%Y} {self.get_tipo_movimento_display()} - €{self.importo}"
+
+    class Meta:
+        verbose_name = "Totale Mensile Movimenti"
+        verbose_name_plural = "Totali Mensili Movimenti"
+        constraints = [
+            models.UniqueConstraint(
+                'tenant', 'mese', 'tipo_movimento', 'conto_finanziario',
+                Coalesce('conto_operativo', Value(0)), Coalesce('cantiere', Value(0)),
+                name='totale_mensile_movimenti_unico',
+            ),
+        ]
+
+
+class ContatoreNumerazione(TenantAwareModel):
+    """
+    Ultimo progressivo assegnato per tenant, serie (tipo documento o tipo
+    anagrafica) e anno (0 per le serie che non ripartono ogni anno).
+
+    Il numero successivo si ottiene bloccando una sola riga (SELECT ... FOR
+    UPDATE) invece di ordinare tutti i documenti della serie: costo costante e
+    nessun numero duplicato con più utenti che registrano in parallelo. Il blocco
+    dura fino al commit della transazione che usa il numero, quindi un
+    salvataggio annullato non lascia buchi nella numerazione.
+    """
+    serie = models.CharField(max_length=30)
+    anno = models.PositiveIntegerField(default=0)
+    ultimo_numero = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.serie} {self.anno or ''}: {self.ultimo_numero}"
+
+    @staticmethod
+    def serie_documento(tipo_doc):
+        return f"documento:{tipo_doc}"
+
+    @staticmethod
+    def serie_anagrafica(tipo):
+        return f"anagrafica:{tipo}"
+
+    @classmethod
+    def _blocca(cls, tenant_id, serie, anno):
+        contatore = cls._base_manager.select_for_update().filter(tenant_id=tenant_id, serie=serie, anno=anno).first()
+        if contatore is None:
+            # Prima numerazione della serie: get_or_create gestisce la corsa con
+            # un'altra transazione che crea la stessa riga in parallelo.
+            cls._base_manager.get_or_create(tenant_id=tenant_id, serie=serie, anno=anno)
+            contatore = cls._base_manager.select_for_update().get(tenant_id=tenant_id, serie=serie, anno=anno)
+        return contatore
+
+    @classmethod
+    def prossimo(cls, tenant_id, serie, anno=0, quanti=1):
+        """
+        Incrementa il contatore (creandolo alla prima richiesta) e restituisce il
+        nuovo progressivo. Con quanti > 1 riserva un blocco di progressivi
+        consecutivi e restituisce l'ultimo.
+        """
+        with transaction.atomic():
+            contatore = cls._blocca(tenant_id, serie, anno)
+            contatore.ultimo_numero += quanti
+            contatore.save(update_fields=['ultimo_numero', 'updated_at'])
+        return contatore.ultimo_numero
+
+    @classmethod
+    def allinea(cls, tenant_id, serie, anno, numero):
+        """Porta il contatore almeno a 'numero' (numeri già assegnati fuori dal contatore, es. importati)."""
+        with transaction.atomic():
+            contatore = cls._blocca(tenant_id, serie, anno)
+            if contatore.ultimo_numero < numero:
+                contatore.ultimo_numero = numero
+                contatore.save(update_fields=['ultimo_numero', 'updated_at'])
+
+    class Meta:
+        verbose_name = "Contatore Numerazione"
+        verbose_name_plural = "Contatori Numerazione"
+        constraints = [
+            models.UniqueConstraint(fields=['tenant', 'serie', 'anno'], name='contatore_tenant_serie_anno_uniq'),
+        ]
 
 
 class DipendenteDettaglio(TenantAwareModel):
@@ -485,6 +992,10 @@ class DiarioAttivita(TenantAwareModel):
         # Un dipendente può avere una sola riga di diario per un dato giorno
         unique_together = ('data', 'dipendente')
         ordering = ['-data', 'dipendente']
+        indexes = [
+            # Planning HR e fascicolo cantiere leggono il diario per intervallo di date.
+            models.Index(fields=['tenant', 'data'], name='diario_tenant_data_idx'),
+        ]
 
 
 class ScadenzaPersonale(TenantAwareModel):
@@ -509,4 +1020,62 @@ class ScadenzaPersonale(TenantAwareModel):
     class Meta:
         verbose_name = "Scadenza Personale"
         verbose_name_plural = "Scadenze Personale"
-        ordering = ['data_scadenza']
\ No newline at end of file
+        ordering = ['data_scadenza']
+
+# ==============================================================================
+# === CODA DEI REPORT IN BACKGROUND                                         ===
+# ==============================================================================
+
+class RichiestaReport(TenantAwareModel):
+    """
+    Report (PDF o Excel) richiesto da un utente ed elaborato fuori dalla richiesta
+    web dal comando 'esegui_report_in_coda'.
+    Il worker riesegue la vista di export indicata in 'vista' con gli stessi
+    parametri, tenant e ruolo dell'utente e salva il file prodotto in 'file'.
+    """
+    class Formato(models.TextChoices):
+        PDF = 'PDF', 'PDF'
+        EXCEL = 'XLSX', 'Excel'
+
+    class Stato(models.TextChoices):
+        IN_CODA = 'In coda', 'In coda'
+        IN_CORSO = 'In corso', 'In elaborazione'
+        COMPLETATA = 'Completata', 'Completata'
+        ERRORE = 'Errore', 'Errore'
+
+    utente = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='richieste_report')
+    ruolo = models.CharField(max_length=50, verbose_name="Ruolo dell'utente al momento della richiesta")
+    titolo = models.CharField(max_length=200)
+    formato = models.CharField(max_length=4, choices=Formato.choices)
+
+    # Vista da rieseguire: nome dell'URL, argomenti del path e querystring dei filtri.
+    vista = models.CharField(max_length=100)
+    argomenti = models.JSONField(default=dict, blank=True)
+    parametri = models.TextField(blank=True)
+    host = models.CharField(max_length=255, blank=True)
+
+    stato = models.CharField(max_length=20, choices=Stato.choices, default=Stato.IN_CODA)
+    progresso = models.PositiveSmallIntegerField(default=0)
+    messaggio_errore = models.TextField(blank=True)
+    file = models.FileField(upload_to='report/%Y/%m/', blank=True)
+    nome_file = models.CharField(max_length=255, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    avviata_il = models.DateTimeField(null=True, blank=True)
+    completata_il = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.titolo} ({self.get_formato_display()}) - {self.get_stato_display()}"
+
+    @property
+    def terminata(self):
+        return self.stato in (self.Stato.COMPLETATA, self.Stato.ERRORE)
+
+    class Meta:
+        verbose_name = "Richiesta Report"
+        verbose_name_plural = "Richieste Report"
+        ordering = ['-created_at']
+        indexes = [
+            # Il worker preleva le richieste in coda in ordine di arrivo.
+            models.Index(fields=['stato', 'created_at'], name='richiestareport_coda_idx'),
+        ]
@@ -0,0 +1,178 @@
+# gestionale/paginazione.py
+
+"""
+Paginazione "a cursore" (keyset) per le liste con molti record.
+
+Paginator esegue un COUNT(*) sull'intero queryset filtrato e legge le pagine con
+OFFSET: più si va avanti, più righe il database deve scorrere e scartare. Qui la
+pagina successiva si ottiene invece con una condizione sull'ordinamento
+("dopo l'ultimo record visto"), servita dagli indici per tenant: il costo di
+ogni pagina resta lo stesso anche dopo anni di registrazioni.
+
+I cursori sono opachi (firmati con django.core.signing) e contengono la
+direzione e i valori dei campi di ordinamento dell'ultimo/primo record della
+pagina. Il totale, se richiesto, può essere la stima del planner di PostgreSQL
+invece di un COUNT(*) esatto.
+
+Attivazione: PAGINAZIONE_CURSORE e PAGINAZIONE_CONTEGGIO_STIMATO in config/settings.py.
+"""
+
+import json
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Q
+
+_SALT_CURSORE = 'gestionale.paginazione'
+
+# Parametro GET che contiene il cursore (la paginazione numerata usa 'page').
+PARAMETRO_CURSORE = 'cursore'
+
+
+class PaginaKeyset:
+    """
+    Pagina ottenuta con un cursore. Espone le stesse proprietà di Page usate dai
+    template (iterazione, has_next, has_previous, has_other_pages) più i cursori
+    per le pagine adiacenti e il totale (esatto, stimato o None).
+    """
+    is_keyset = True
+
+    def __init__(self, object_list, cursore_successivo, cursore_precedente, conteggio=None, conteggio_stimato=False):
+        self.object_list = object_list
+        self.next_cursor = cursore_successivo
+        self.previous_cursor = cursore_precedente
+        self.conteggio = conteggio
+        self.conteggio_stimato = conteggio_stimato
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def _campo(queryset, nome):
+    nome = nome.lstrip('-')
+    return queryset.model._meta.pk if nome == 'pk' else queryset.model._meta.get_field(nome)
+
+
+def _codifica_cursore(queryset, ordinamento, direzione, obj):
+    valori = []
+    for nome in ordinamento:
+        campo = _campo(queryset, nome)
+        valori.append(campo.value_to_string(obj))
+    return signing.dumps({'d': direzione, 'v': valori}, salt=_SALT_CURSORE, compress=True)
+
+
+def _decodifica_cursore(queryset, ordinamento, cursore):
+    """Restituisce (direzione, valori) oppure None se il cursore manca o non è valido."""
+    if not cursore:
+        return None
+    try:
+        dati = signing.loads(cursore, salt=_SALT_CURSORE)
+        if dati['d'] not in ('n', 'p') or len(dati['v']) != len(ordinamento):
+            return None
+        valori = [_campo(queryset, nome).to_python(valore) for nome, valore in zip(ordinamento, dati['v'])]
+    except (signing.BadSignature, KeyError, TypeError, ValueError, ValidationError):
+        return None
+    return dati['d'], valori
+
+
+def _dopo(ordinamento, valori, indietro=False):
+    """
+    Condizione "record successivo nell'ordinamento" espansa in OR di uguaglianze:
+    (a > x) OR (a = x AND b > y) OR ... . Il filtro aggiuntivo su a >= x (o <=)
+    permette al database di partire direttamente dal punto giusto dell'indice.
+    """
+    condizione = Q()
+    uguaglianze = {}
+    for nome, valore in zip(ordinamento, valori):
+        campo = nome.lstrip('-')
+        decrescente = nome.startswith('-') != indietro
+        operatore = 'lt' if decrescente else 'gt'
+        condizione |= Q(**uguaglianze, **{f'{campo}__{operatore}': valore})
+        uguaglianze[campo] = valore
+    primo = ordinamento[0]
+    operatore = 'lte' if primo.startswith('-') != indietro else 'gte'
+    return Q(**{f'{primo.lstrip("-")}__{operatore}': valori[0]}) & condizione
+
+
+def _inverti(ordinamento):
+    return [nome[1:] if nome.startswith('-') else f'-{nome}' for nome in ordinamento]
+
+
+def conteggio_stimato(queryset):
+    """
+    Numero di righe stimato dal planner di PostgreSQL (EXPLAIN, senza eseguire
+    la query). Sugli altri database restituisce None.
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    piano = json.loads(queryset.order_by().explain(format='json'))
+    return int(piano[0]['Plan']['Plan Rows'])
+
+
+def pagina_keyset(queryset, ordinamento, cursore, per_pagina, conteggio='stimato'):
+    """
+    Restituisce la PaginaKeyset indicata dal cursore (None = prima pagina).
+    'ordinamento' deve identificare univocamente ogni riga (terminare con 'pk').
+    'conteggio': 'stimato', 'esatto' oppure None per non calcolare il totale.
+    """
+    queryset = queryset.order_by(*ordinamento)
+    decodificato = _decodifica_cursore(queryset, ordinamento, cursore)
+
+    if decodificato is None:
+        righe = list(queryset[:per_pagina + 1])
+        altre = len(righe) > per_pagina
+        righe = righe[:per_pagina]
+        precedente_esiste, successiva_esiste = False, altre
+    else:
+        direzione, valori = decodificato
+        if direzione == 'n':
+            righe = list(queryset.filter(_dopo(ordinamento, valori))[:per_pagina + 1])
+            successiva_esiste = len(righe) > per_pagina
+            righe = righe[:per_pagina]
+            precedente_esiste = True
+        else:
+            # Pagina precedente: leggiamo all'indietro e rimettiamo le righe in ordine.
+            righe = list(
+                queryset.filter(_dopo(ordinamento, valori, indietro=True)).order_by(*_inverti(ordinamento))[:per_pagina + 1]
+            )
+            precedente_esiste = len(righe) > per_pagina
+            righe = righe[:per_pagina][::-1]
+            successiva_esiste = True
+
+    cursore_successivo = _codifica_cursore(queryset, ordinamento, 'n', righe[-1]) if righe and successiva_esiste else None
+    cursore_precedente = _codifica_cursore(queryset, ordinamento, 'p', righe[0]) if righe and precedente_esiste else None
+
+    totale, stimato = None, False
+    if conteggio == 'stimato':
+        totale = conteggio_stimato(queryset)
+        stimato = totale is not None
+    if conteggio == 'esatto' or (conteggio == 'stimato' and totale is None):
+        totale = queryset.count()
+
+    return PaginaKeyset(righe, cursore_successivo, cursore_precedente, totale, stimato)
+
+
+def pagina_lista(request, queryset, ordinamento, per_pagina):
+    """
+    Pagina di una lista secondo le impostazioni: a cursore se PAGINAZIONE_CURSORE
+    è attivo, altrimenti la paginazione numerata di Django ('page').
+    """
+    if settings.PAGINAZIONE_CURSORE:
+        conteggio = 'stimato' if settings.PAGINAZIONE_CONTEGGIO_STIMATO else 'esatto'
+        return pagina_keyset(queryset, ordinamento, request.GET.get(PARAMETRO_CURSORE), per_pagina, conteggio)
+    return Paginator(queryset.order_by(*ordinamento), per_pagina).get_page(request.GET.get('page'))
@@ -0,0 +1,160 @@
+# gestionale/pdf_renderer.py
+
+"""
+Conversione HTML -> PDF su un pool di processi.
+
+WeasyPrint è CPU-bound: eseguito nei thread di waitress, il GIL fa sì che due
+export contemporanei si mettano in fila. Qui la conversione viene inviata a un
+ProcessPoolExecutor, così richieste concorrenti usano core diversi.
+
+Ogni processo del pool viene "scaldato" all'avvio: importa WeasyPrint, crea la
+FontConfiguration (caricamento di fontconfig e dei font) e impagina un documento
+di prova con gli stessi stili di base dei template PDF. Le conversioni
+successive riusano la stessa FontConfiguration.
+
+Il modulo non importa modelli Django: su Windows i processi del pool vengono
+avviati con 'spawn' e reimportano soltanto questo file.
+
+Impostazioni (config/settings.py):
+- PDF_PROCESSI: numero di processi del pool (0 = conversione nel processo corrente);
+- PDF_TIMEOUT: secondi massimi di attesa per un singolo PDF nelle richieste web.
+
+Il worker dei report in coda converte dentro senza_limite_di_tempo(): nel
+processo corrente e senza PDF_TIMEOUT, perché è proprio lì che vanno i PDF
+troppo pesanti per una richiesta web.
+"""
+
+import atexit
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from weasyprint import HTML
+
+# Documento usato per scaldare i processi: stessi font e stili dei template PDF.
+_HTML_RISCALDAMENTO = """
+<html><head><style>
+    @page { size: A4; margin: 1.5cm; }
+    body { font-family: 'Helvetica', 'Arial', sans-serif; font-size: 10pt; }
+    th { font-weight: bold; } td { text-align: right; }
+</style></head>
+<body><h1>Riscaldamento</h1><table><tr><th>Colonna</th><td>€ 1.234,56</td></tr></table></body></html>
+"""
+
+
+class PdfTimeoutError(Exception):
+    """Il rendering del PDF ha superato PDF_TIMEOUT."""
+
+
+# ==============================================================================
+# === LATO PROCESSO DEL POOL                                                ===
+# ==============================================================================
+
+_font_config = None
+
+
+def _inizializza_processo():
+    """Initializer del pool: carica font e motore di layout una volta per processo."""
+    global _font_config
+    from weasyprint.text.fonts import FontConfiguration
+
+    _font_config = FontConfiguration()
+    HTML(string=_HTML_RISCALDAMENTO).write_pdf(font_config=_font_config)
+
+
+def _html_to_pdf(html_string, base_url):
+    if _font_config is None:
+        _inizializza_processo()
+    return HTML(string=html_string, base_url=base_url).write_pdf(font_config=_font_config)
+
+
+def _nessuna_operazione():
+    return None
+
+
+# ==============================================================================
+# === LATO PROCESSO WEB                                                     ===
+# ==============================================================================
+
+_executor = None
+_lock = threading.Lock()
+
+# Impostata da senza_limite_di_tempo(): conversione nel processo corrente, senza timeout.
+_senza_limite = ContextVar('pdf_senza_limite_di_tempo', default=False)
+
+
+@contextmanager
+def senza_limite_di_tempo():
+    """I PDF generati nel blocco vengono convertiti nel processo corrente, senza PDF_TIMEOUT."""
+    token = _senza_limite.set(True)
+    try:
+        yield
+    finally:
+        _senza_limite.reset(token)
+
+
+def _get_executor(processi):
+    """Crea il pool alla prima richiesta (uno per processo web) e lo riusa."""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=processi, initializer=_inizializza_processo)
+            # Avviamo subito tutti i processi: il riscaldamento non pesa sul primo utente.
+            for _ in range(processi):
+                _executor.submit(_nessuna_operazione)
+        return _executor
+
+
+def _chiudi_executor(executor=None, termina_processi=False):
+    """
+    Chiude il pool (se 'executor' è indicato, solo se è ancora quello corrente).
+    Con 'termina_processi' i processi vengono anche terminati: le conversioni in
+    corso falliscono con BrokenProcessPool e render_pdf() le riprova sul nuovo pool.
+    """
+    global _executor
+    with _lock:
+        if _executor is None or (executor is not None and _executor is not executor):
+            return
+        _executor, da_chiudere = None, _executor
+    processi = list((da_chiudere._processes or {}).values()) if termina_processi else []
+    da_chiudere.shutdown(wait=False, cancel_futures=True)
+    for processo in processi:
+        processo.terminate()
+
+
+atexit.register(_chiudi_executor)
+
+
+def render_pdf(html_string, base_url=None):
+    """
+    Converte l'HTML in PDF (bytes) usando il pool di processi.
+    Solleva PdfTimeoutError se la conversione supera PDF_TIMEOUT secondi
+    (mai dentro senza_limite_di_tempo()).
+    """
+    from django.conf import settings
+
+    processi = settings.PDF_PROCESSI
+    if processi <= 0 or _senza_limite.get():
+        return _html_to_pdf(html_string, base_url)
+
+    for tentativo in range(2):
+        executor = _get_executor(processi)
+        try:
+            future = executor.submit(_html_to_pdf, html_string, base_url)
+            return future.result(timeout=settings.PDF_TIMEOUT)
+        except FuturesTimeoutError:
+            # Una conversione già partita non si può annullare: il suo processo resterebbe
+            # occupato fino al termine e timeout ripetuti esaurirebbero il pool. Lo
+            # ricicliamo terminandone i processi.
+            if not future.cancel():
+                _chiudi_executor(executor, termina_processi=True)
+            raise PdfTimeoutError(f"Il rendering del PDF ha superato {settings.PDF_TIMEOUT} secondi.")
+        except BrokenProcessPool:
+            # Un processo del pool è terminato in modo anomalo (es. memoria esaurita):
+            # ricreiamo il pool e riproviamo una volta.
+            _chiudi_executor(executor)
+            if tentativo:
+                raise
@@ -0,0 +1,74 @@
+# gestionale/pool_export.py
+
+"""
+Pool di thread dedicato agli export quando il gestionale è servito in ASGI.
+
+Sotto waitress ogni richiesta occupa uno degli 8 thread del server: pochi
+export lenti (Excel di migliaia di righe, PDF, tabelle complete) bastano a
+lasciare in coda le chiamate AJAX e le dashboard. In ASGI le viste sync
+vengono invece eseguite ciascuna nel proprio thread, senza limite: qui gli
+export vengono fatti girare in un pool con EXPORT_THREAD thread, così quelli
+in eccesso aspettano il proprio turno senza sottrarre CPU (e GIL) alle
+richieste interattive, servite dall'event loop e dai thread di Django.
+
+Le viste restano sincrone: vista_in_pool_export le avvolge in una vista async
+solo quando SERVER_ASGI è attivo (vedi ExportInThreadPoolMixin in views.py).
+"""
+
+import atexit
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+_executor = None
+_lock = threading.Lock()
+
+
+def _get_executor():
+    """Crea il pool alla prima richiesta di export (uno per processo) e lo riusa."""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.EXPORT_THREAD, thread_name_prefix='export')
+        return _executor
+
+
+def _chiudi_executor():
+    global _executor
+    with _lock:
+        _executor, da_chiudere = None, _executor
+    if da_chiudere is not None:
+        da_chiudere.shutdown(wait=False, cancel_futures=True)
+
+
+atexit.register(_chiudi_executor)
+
+
+def _esegui(funzione, *args, **kwargs):
+    # I thread del pool non ricevono i segnali di inizio/fine richiesta che
+    # chiudono le connessioni al database: lo facciamo qui, a ogni export.
+    close_old_connections()
+    try:
+        return funzione(*args, **kwargs)
+    finally:
+        connections.close_all()
+
+
+async def esegui_in_pool_export(funzione, *args, **kwargs):
+    """
+    Esegue 'funzione' (sincrona) in un thread del pool degli export e ne
+    restituisce il risultato. Il contesto (tenant corrente) viene copiato nel thread.
+    """
+    return await sync_to_async(_esegui, thread_sensitive=False, executor=_get_executor())(funzione, *args, **kwargs)
+
+
+def vista_in_pool_export(view):
+    """Vista async che esegue la vista sincrona 'view' nel pool degli export."""
+    @functools.wraps(view)
+    async def vista(request, *args, **kwargs):
+        return await esegui_in_pool_export(view, request, *args, **kwargs)
+    return vista
@@ -0,0 +1,238 @@
+# gestionale/profilazione.py
+
+"""
+Profilazione delle richieste (PROFILAZIONE_RICHIESTE nel .env).
+
+Il middleware config.middleware.ProfilazioneRichiesteMiddleware misura ogni
+richiesta servita da una vista: tempo totale, numero di query e tempo passato
+nel database (con un execute wrapper, senza DEBUG e senza conservare tutte le
+query), le istruzioni SQL più lente e la dimensione della risposta.
+Ogni richiesta diventa una riga JSON nel log a rotazione PROFILAZIONE_LOG
+(logger 'gestionale.profilazione', configurato in config/settings.py).
+
+riepilogo() rilegge il log e aggrega le misure per azienda e vista: è la base
+della pagina "Endpoint più lenti" del pannello Superadmin.
+
+Le connessioni al database di Django sono per thread e sotto ASGI le query di
+una richiesta non girano nel thread del middleware (viste sync eseguite con
+sync_to_async, pool degli export): le misure attive stanno quindi in una
+ContextVar, che quei thread ereditano, e un unico execute wrapper installato
+sulle connessioni di ogni thread (attiva_misure()) le applica a ogni query.
+"""
+
+import functools
+import heapq
+import json
+import logging
+import os
+import statistics
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger('gestionale.profilazione')
+
+# Lunghezza massima del testo SQL conservato per le istruzioni più lente.
+MAX_CARATTERI_SQL = 1000
+
+
+# ==============================================================================
+# === AGGANCIO ALLE QUERY                                                   ===
+# ==============================================================================
+
+# Misure che ricevono le query del contesto corrente (richiesta o comando).
+_misure_attive = ContextVar('misure_query_attive', default=())
+
+
+def _esegui_con_misure(execute, sql, params, many, context):
+    """Execute wrapper delle connessioni: passa la query alle misure attive del contesto."""
+    for misura in reversed(_misure_attive.get()):
+        if misura.attiva:
+            execute = functools.partial(misura.wrapper, execute)
+    return execute(sql, params, many, context)
+
+
+def _installa_wrapper(connessione):
+    if _esegui_con_misure not in connessione.execute_wrappers:
+        connessione.execute_wrappers.append(_esegui_con_misure)
+
+
+def _installa_su_nuova_connessione(sender, connection, **kwargs):
+    _installa_wrapper(connection)
+
+
+def _installa_nel_thread(**kwargs):
+    for connessione in connections.all():
+        _installa_wrapper(connessione)
+
+
+def attiva_misure():
+    """
+    Installa il wrapper sulle connessioni del thread corrente e su quelle che
+    verranno usate dopo: ogni richiesta lo installa nel thread in cui girano le
+    sue query sync (request_started viene inviato da quel thread anche sotto
+    ASGI) e ogni nuova connessione, es. nei thread del pool degli export, lo
+    riceve all'apertura. Chiamarla più volte non ha effetto.
+    """
+    request_started.connect(_installa_nel_thread, dispatch_uid='misure_query_richiesta')
+    connection_created.connect(_installa_su_nuova_connessione, dispatch_uid='misure_query_connessione')
+    _installa_nel_thread()
+
+
+class MisuraQuery:
+    """
+    Base delle misure sulle query: alla creazione si registra nel contesto
+    corrente e riceve, con wrapper(), tutte le query eseguite da lì in poi nel
+    contesto e nei thread che lo ereditano, finché non viene staccata.
+    """
+
+    def __init__(self):
+        self.attiva = True
+        _misure_attive.set((*(misura for misura in _misure_attive.get() if misura.attiva), self))
+
+    def wrapper(self, execute, sql, params, many, context):
+        return execute(sql, params, many, context)
+
+    def stacca(self):
+        self.attiva = False
+
+
+class MisuraRichiesta(MisuraQuery):
+    """
+    Contatori di una richiesta. Si stacca dalle query in concludi(), che può
+    arrivare dopo la fine della vista per gli export in streaming.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.inizio = time.perf_counter()
+        self.query = 0
+        self.sql = 0.0
+        self.byte = 0
+        self._lente = []  # heap (secondi, progressivo, sql) delle istruzioni più lente
+
+    def wrapper(self, execute, sql, params, many, context):
+        inizio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            durata = time.perf_counter() - inizio
+            self.query += 1
+            self.sql += durata
+            voce = (durata, self.query, sql)
+            if len(self._lente) < settings.PROFILAZIONE_QUERY_LENTE:
+                heapq.heappush(self._lente, voce)
+            elif durata > self._lente[0][0]:
+                heapq.heapreplace(self._lente, voce)
+
+    def concludi(self, request, response):
+        """Stacca la misura dalle query e scrive la riga di log (una sola volta)."""
+        if not self.attiva:
+            return
+        self.stacca()
+        if response is not None:
+            self._registra(request, response)
+
+    def _registra(self, request, response):
+        # Si registrano solo le richieste risolte da una vista (niente file statici).
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return
+        durata = time.perf_counter() - self.inizio
+        if durata * 1000 < settings.PROFILAZIONE_SOGLIA_MS:
+            return
+        tenant = getattr(request, 'tenant', None)
+        user = getattr(request, 'user', None)
+        logger.info(json.dumps({
+            'ts': round(time.time(), 3),
+            'metodo': request.method,
+            'percorso': request.path,
+            'vista': match.view_name or match._func_path,
+            'tenant': tenant.pk if tenant else None,
+            'ruolo': getattr(request, 'company_role', None),
+            'utente': user.pk if user is not None and user.is_authenticated else None,
+            'stato': response.status_code,
+            'ms': round(durata * 1000, 1),
+            'query': self.query,
+            'sql_ms': round(self.sql * 1000, 1),
+            'byte': self.byte,
+            'lente': [
+                {'ms': round(secondi * 1000, 1), 'sql': sql[:MAX_CARATTERI_SQL]}
+                for secondi, _, sql in sorted(self._lente, reverse=True)
+            ],
+        }, ensure_ascii=False))
+
+
+# ==============================================================================
+# === LETTURA DEL LOG                                                       ===
+# ==============================================================================
+
+def file_log():
+    """File del log dal più vecchio al più recente (i backup della rotazione hanno suffisso .1, .2, ...)."""
+    percorso = settings.PROFILAZIONE_LOG
+    backup = [f"{percorso}.{n}" for n in range(settings.PROFILAZIONE_LOG_FILE, 0, -1)]
+    return [file for file in backup + [percorso] if os.path.exists(file)]
+
+
+def leggi_richieste(dal_timestamp=0, tenant_id=None):
+    """Righe del log (dict) registrate dopo 'dal_timestamp', eventualmente di una sola azienda."""
+    for percorso in file_log():
+        with open(percorso, encoding='utf-8', errors='replace') as file:
+            for riga in file:
+                try:
+                    richiesta = json.loads(riga)
+                except ValueError:
+                    continue  # riga troncata dalla rotazione o da un arresto
+                if richiesta.get('ts', 0) < dal_timestamp:
+                    continue
+                if tenant_id is not None and richiesta.get('tenant') != tenant_id:
+                    continue
+                yield richiesta
+
+
+def _percentile(ordinati, quota):
+    return ordinati[min(len(ordinati) - 1, int(len(ordinati) * quota))]
+
+
+def riepilogo(dal_timestamp=0, tenant_id=None):
+    """
+    Aggrega le richieste per (azienda, vista): numero, p50/p95/max del tempo,
+    query e tempo SQL medi e massimi, byte medi e la richiesta più lenta con le
+    sue istruzioni SQL. Ordinato per p95 decrescente.
+    """
+    gruppi = {}
+    for richiesta in leggi_richieste(dal_timestamp, tenant_id):
+        chiave = (richiesta.get('tenant'), richiesta.get('vista'))
+        gruppo = gruppi.setdefault(chiave, {'ms': [], 'query': [], 'sql_ms': [], 'byte': [], 'errori': 0, 'peggiore': None})
+        gruppo['ms'].append(richiesta['ms'])
+        gruppo['query'].append(richiesta['query'])
+        gruppo['sql_ms'].append(richiesta['sql_ms'])
+        gruppo['byte'].append(richiesta['byte'])
+        if richiesta.get('stato', 200) >= 500:
+            gruppo['errori'] += 1
+        if gruppo['peggiore'] is None or richiesta['ms'] > gruppo['peggiore']['ms']:
+            gruppo['peggiore'] = richiesta
+
+    risultato = []
+    for (tenant, vista), gruppo in gruppi.items():
+        tempi = sorted(gruppo['ms'])
+        risultato.append({
+            'tenant': tenant,
+            'vista': vista,
+            'richieste': len(tempi),
+            'errori': gruppo['errori'],
+            'p50_ms': statistics.median(tempi),
+            'p95_ms': _percentile(tempi, 0.95),
+            'max_ms': tempi[-1],
+            'query_media': statistics.fmean(gruppo['query']),
+            'query_max': max(gruppo['query']),
+            'sql_medio_ms': statistics.fmean(gruppo['sql_ms']),
+            'byte_medi': statistics.fmean(gruppo['byte']),
+            'peggiore': gruppo['peggiore'],
+        })
+    risultato.sort(key=lambda voce: voce['p95_ms'], reverse=True)
+    return risultato
@@ -0,0 +1,232 @@
+# gestionale/report_in_coda.py
+
+"""
+Coda dei report elaborati in background.
+
+Le viste di export (PDF ed Excel) restano quelle di sempre: invece di eseguirle
+dentro la richiesta web, che occupa uno dei thread di waitress per tutta la
+durata del rendering, l'utente crea una RichiestaReport e il comando
+'esegui_report_in_coda' la elabora in un processo separato, rieseguendo la
+stessa vista con gli stessi filtri, tenant e ruolo e salvando il file su disco.
+L'utente segue l'avanzamento dalla pagina "I miei report" e scarica il file
+quando è pronto.
+"""
+
+import tempfile
+from datetime import timedelta
+from importlib import import_module
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.contrib.messages.storage import default_storage
+from django.core.files import File
+from django.db import transaction
+from django.http import HttpRequest, QueryDict
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from tenants.cache import risolvi_tenant
+
+from .managers import tenant_context
+from .models import RichiestaReport
+from .pdf_renderer import senza_limite_di_tempo
+from .report_utils import contenuto_risposta, nome_file_allegato
+
+Formato = RichiestaReport.Formato
+
+# Viste di export che possono essere messe in coda: nome URL -> (titolo, formato).
+REPORT_ACCODABILI = {
+    'documento_list_export_excel': ('Elenco Documenti', Formato.EXCEL),
+    'documento_list_export_pdf': ('Elenco Documenti', Formato.PDF),
+    'anagrafica_list_export_excel': ('Lista Anagrafiche', Formato.EXCEL),
+    'anagrafica_list_export_pdf': ('Lista Anagrafiche', Formato.PDF),
+    'anagrafica_partitario_export_excel': ('Partitario', Formato.EXCEL),
+    'anagrafica_partitario_export_pdf': ('Partitario', Formato.PDF),
+    'scadenzario_export_excel': ('Scadenziario Aperto', Formato.EXCEL),
+    'scadenzario_export_pdf': ('Scadenziario Aperto', Formato.PDF),
+    'primanota_export_excel': ('Prima Nota', Formato.EXCEL),
+    'primanota_export_pdf': ('Prima Nota', Formato.PDF),
+    'tesoreria_export_excel': ('Saldi Tesoreria', Formato.EXCEL),
+    'tesoreria_export_pdf': ('Saldi Tesoreria', Formato.PDF),
+    'cantiere_list_export_excel': ('Elenco Cantieri', Formato.EXCEL),
+    'cantiere_list_export_pdf': ('Elenco Cantieri', Formato.PDF),
+    'cantiere_fascicolo_export_excel': ('Fascicolo Cantiere', Formato.EXCEL),
+    'cantiere_fascicolo_export_pdf': ('Fascicolo Cantiere', Formato.PDF),
+}
+
+
+def vista_consentita(vista, argomenti, ruolo):
+    """
+    Controlla in anticipo che il ruolo possa usare la vista di export, con le
+    stesse regole dei mixin della vista (il worker le riapplica comunque).
+    """
+    from .views import AdminRequiredMixin, RoleRequiredMixin
+
+    view_class = getattr(resolve(reverse(vista, kwargs=argomenti)).func, 'view_class', None)
+    if view_class is None:
+        return False
+    if issubclass(view_class, AdminRequiredMixin) and ruolo != 'admin':
+        return False
+    if issubclass(view_class, RoleRequiredMixin) and ruolo not in view_class.allowed_roles:
+        return False
+    return True
+
+
+def accoda_report(request, vista, argomenti=None, parametri=''):
+    """Crea una richiesta in coda per l'utente, il tenant e il ruolo verificati da TenantMiddleware."""
+    titolo, formato = REPORT_ACCODABILI[vista]
+    return RichiestaReport.objects.create(
+        tenant=request.tenant,
+        utente=request.user,
+        ruolo=request.company_role,
+        titolo=titolo,
+        formato=formato,
+        vista=vista,
+        argomenti=argomenti or {},
+        parametri=parametri.lstrip('?'),
+        host=request.get_host(),
+    )
+
+
+# ==============================================================================
+# === ELABORAZIONE (usata dal comando esegui_report_in_coda)                ===
+# ==============================================================================
+
+def preleva_richiesta():
+    """
+    Prende in carico la richiesta in coda più vecchia e la segna "in corso".
+    SKIP LOCKED permette di avviare più worker in parallelo senza che due di
+    loro elaborino la stessa richiesta.
+    """
+    with transaction.atomic():
+        richiesta = (
+            RichiestaReport._base_manager
+            .select_for_update(skip_locked=True)
+            .filter(stato=RichiestaReport.Stato.IN_CODA)
+            .order_by('created_at', 'pk')
+            .first()
+        )
+        if richiesta is None:
+            return None
+        richiesta.stato = RichiestaReport.Stato.IN_CORSO
+        richiesta.progresso = 10
+        richiesta.avviata_il = timezone.now()
+        richiesta.save(update_fields=['stato', 'progresso', 'avviata_il'])
+    return richiesta
+
+
+def _aggiorna_progresso(richiesta, progresso):
+    richiesta.progresso = progresso
+    RichiestaReport._base_manager.filter(pk=richiesta.pk).update(progresso=progresso)
+
+
+def _ricostruisci_richiesta_http(richiesta, tenant, ruolo):
+    """
+    HttpRequest equivalente a quella con cui l'utente avrebbe chiamato la vista
+    di export, con azienda e ruolo già verificati come fa TenantMiddleware.
+    """
+    http_request = HttpRequest()
+    http_request.method = 'GET'
+    http_request.path = http_request.path_info = reverse(richiesta.vista, kwargs=richiesta.argomenti)
+    http_request.GET = QueryDict(richiesta.parametri)
+    http_request.META = {
+        'REQUEST_METHOD': 'GET',
+        'QUERY_STRING': richiesta.parametri,
+        'HTTP_HOST': richiesta.host or 'localhost',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+    }
+    http_request.user = richiesta.utente
+    http_request.tenant = tenant
+    http_request.company_role = ruolo
+
+    # Sessione in memoria (non viene mai salvata) con le chiavi lette dai mixin.
+    http_request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+    http_request.session.update({
+        'active_tenant_id': tenant.pk,
+        'active_tenant_name': tenant.company_name,
+        'user_company_role': ruolo,
+    })
+    http_request._messages = default_storage(http_request)
+    return http_request
+
+
+def esegui_richiesta(richiesta):
+    """
+    Esegue la vista di export della richiesta e salva il file prodotto.
+    Solleva un'eccezione se l'utente non ha più accesso all'azienda o se la
+    vista non restituisce un file.
+    """
+    # Azienda e ruolo di adesso, non quelli del momento della richiesta: un'azienda
+    # disattivata o un permesso revocato o ridotto nel frattempo valgono anche qui.
+    tenant, ruolo = risolvi_tenant(richiesta.utente_id, richiesta.tenant_id)
+    if tenant is None or not tenant.is_active or ruolo is None:
+        raise RuntimeError("L'utente non ha più accesso all'azienda del report.")
+    http_request = _ricostruisci_richiesta_http(richiesta, tenant, ruolo)
+    match = resolve(http_request.path_info)
+
+    # Con SERVER_ASGI le viste di export sono async (pool_export.py): qui le eseguiamo in modo sincrono.
+    vista = async_to_sync(match.func) if iscoroutinefunction(match.func) else match.func
+
+    # Fuori dal TenantMiddleware il tenant corrente va impostato a mano. PDF_TIMEOUT
+    # vale solo per le richieste web: qui arrivano proprio i PDF troppo pesanti per quelle.
+    with tenant_context(tenant), senza_limite_di_tempo():
+        risposta = vista(http_request, *match.args, **match.kwargs)
+
+    if risposta.status_code != 200:
+        raise RuntimeError(
+            f"La vista '{richiesta.vista}' ha risposto con lo stato {risposta.status_code} "
+            "(permessi insufficienti o dati non disponibili)."
+        )
+    _aggiorna_progresso(richiesta, 60)
+
+    estensione = 'pdf' if richiesta.formato == RichiestaReport.Formato.PDF else 'xlsx'
+    nome_file = nome_file_allegato(risposta, f"report_{richiesta.pk}.{estensione}")
+
+    with tempfile.TemporaryFile() as contenuto:
+        for blocco in contenuto_risposta(risposta):
+            contenuto.write(blocco)
+        risposta.close()
+        _aggiorna_progresso(richiesta, 90)
+        richiesta.file.save(nome_file, File(contenuto), save=False)
+
+    richiesta.nome_file = nome_file
+    richiesta.stato = RichiestaReport.Stato.COMPLETATA
+    richiesta.progresso = 100
+    richiesta.completata_il = timezone.now()
+    richiesta.save(update_fields=['file', 'nome_file', 'stato', 'progresso', 'completata_il'])
+
+
+def segna_errore(richiesta, messaggio):
+    richiesta.stato = RichiestaReport.Stato.ERRORE
+    richiesta.messaggio_errore = messaggio
+    richiesta.completata_il = timezone.now()
+    richiesta.save(update_fields=['stato', 'messaggio_errore', 'completata_il'])
+
+
+def chiudi_richieste_bloccate():
+    """Segna come errore le richieste rimaste in elaborazione oltre REPORT_MINUTI_TIMEOUT."""
+    limite = timezone.now() - timedelta(minutes=settings.REPORT_MINUTI_TIMEOUT)
+    return RichiestaReport._base_manager.filter(
+        stato=RichiestaReport.Stato.IN_CORSO, avviata_il__lt=limite
+    ).update(
+        stato=RichiestaReport.Stato.ERRORE,
+        messaggio_errore="Elaborazione interrotta: il worker non ha completato il report.",
+        completata_il=timezone.now(),
+    )
+
+
+def elimina_richieste_scadute():
+    """Elimina le richieste terminate da più di REPORT_GIORNI_CONSERVAZIONE giorni e i loro file."""
+    limite = timezone.now() - timedelta(days=settings.REPORT_GIORNI_CONSERVAZIONE)
+    scadute = RichiestaReport._base_manager.filter(
+        stato__in=[RichiestaReport.Stato.COMPLETATA, RichiestaReport.Stato.ERRORE],
+        completata_il__lt=limite,
+    )
+    eliminate = 0
+    for richiesta in scadute.iterator():
+        if richiesta.file:
+            richiesta.file.delete(save=False)
+        richiesta.delete()
+        eliminate += 1
+    return eliminate
@@ -1,21 +1,39 @@
 # gestionale/report_utils.py
 
+import re
+import tempfile
+from collections import defaultdict
 from datetime import date
+from itertools import chain, islice
 from django import forms
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse
 from django.utils import timezone
 from openpyxl import Workbook
 import openpyxl
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, Alignment
 from openpyxl.utils import get_column_letter
 from django.template.loader import render_to_string
-from weasyprint import HTML
+from .pdf_renderer import PdfTimeoutError, render_pdf
 
 # ==============================================================================
 # === UTILITY PER EXPORT EXCEL                                              ===
 # ==============================================================================
 
-# gestionale/report_utils.py
+CONTENT_TYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+_FILENAME_RE = re.compile(r'filename="?([^";]+)"?')
+
+# Numero di righe per sezione usate per stimare le larghezze delle colonne
+# nell'export in streaming (vedi generate_excel_report_streaming).
+RIGHE_CAMPIONE_LARGHEZZE = 500
+
+
+def _safe_sheet_title(report_title):
+    """Rimuove i caratteri non ammessi nel nome di un foglio Excel (max 31 caratteri)."""
+    safe_sheet_title = report_title.replace(":", "-").replace("/", "-").replace("\\", "-").replace("?", "").replace("*", "").replace("[", "").replace("]", "")
+    return safe_sheet_title[:31]
+
 
 def generate_excel_report(tenant_name, report_title, filters_string, kpi_data, report_sections, filename_prefix='report'):
     """
@@ -24,7 +42,7 @@ def generate_excel_report(tenant_name, report_title, filters_string, kpi_data, r
     """
     # 1. PREPARAZIONE (invariato)
     response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        content_type=CONTENT_TYPE_XLSX,
     )
     local_time = timezone.localtime(timezone.now())
     timestamp = local_time.strftime('%Y%m%d_%H%M%S')
@@ -33,8 +51,7 @@ def generate_excel_report(tenant_name, report_title, filters_string, kpi_data, r
 
     workbook = Workbook()
     worksheet = workbook.active
-    safe_sheet_title = report_title.replace(":", "-").replace("/", "-").replace("\\", "-").replace("?", "").replace("*", "").replace("[", "").replace("]", "")
-    worksheet.title = safe_sheet_title[:31]
+    worksheet.title = _safe_sheet_title(report_title)
     
     # STILI (invariato)
     title_font = Font(name='Calibri', size=16, bold=True)
@@ -126,6 +143,112 @@ def generate_excel_report(tenant_name, report_title, filters_string, kpi_data, r
     return response
 
 
+def generate_excel_report_streaming(tenant_name, report_title, filters_string, kpi_data, report_sections, filename_prefix='report'):
+    """
+    Variante in streaming di generate_excel_report, con lo stesso contratto e lo stesso layout.
+
+    Le 'rows' di ogni sezione possono essere qualsiasi iterabile (liste, generatori,
+    queryset.iterator()...): vengono consumate una alla volta e scritte con un foglio
+    openpyxl in modalità write-only, che non tiene le celle in memoria.
+    Il file viene composto in un file temporaneo su disco e restituito con una
+    FileResponse, che lo invia al client a blocchi.
+
+    Nota sulle larghezze: in un foglio write-only le colonne vanno dichiarate prima
+    delle righe, quindi le larghezze sono stimate su intestazioni, KPI e sulle prime
+    RIGHE_CAMPIONE_LARGHEZZE righe di ogni sezione (poi rimesse in testa all'iteratore).
+    """
+    local_time = timezone.localtime(timezone.now())
+    timestamp = local_time.strftime('%Y%m%d_%H%M%S')
+    filename = f"{timestamp}_{filename_prefix}.xlsx"
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(title=_safe_sheet_title(report_title))
+
+    title_font = Font(name='Calibri', size=16, bold=True)
+    header_font = Font(name='Calibri', size=12, bold=True)
+    section_title_font = Font(name='Calibri', size=13, bold=True, italic=True)
+    currency_format = '€ #,##0.00'
+
+    max_cols = max(len(s.get('headers', [1])) for s in report_sections) if report_sections else 1
+
+    # 1. STIMA DELLE LARGHEZZE (aggiornata cella per cella sul campione)
+    larghezze = defaultdict(int)
+
+    def misura(col_idx, value):
+        larghezze[col_idx] = max(larghezze[col_idx], len(str(value if value is not None else "")))
+
+    for key, value in (kpi_data or {}).items():
+        misura(2, key)
+        misura(3, value)
+
+    sezioni = []
+    for section in report_sections:
+        headers = section.get('headers', [])
+        rows = iter(section.get('rows', []))
+        campione = list(islice(rows, RIGHE_CAMPIONE_LARGHEZZE))
+        for col_idx, header_title in enumerate(headers, 1):
+            misura(col_idx, header_title)
+        for row_data in campione:
+            for col_idx, cell_value in enumerate(row_data, 1):
+                misura(col_idx, cell_value)
+        sezioni.append((section.get('title', ''), headers, chain(campione, rows)))
+
+    for col_idx in range(1, max(max_cols, max(larghezze, default=0)) + 1):
+        worksheet.column_dimensions[get_column_letter(col_idx)].width = larghezze[col_idx] + 2
+
+    # 2. SCRITTURA SEQUENZIALE DELLE RIGHE
+    current_row = 0
+
+    def cella(value, font=None, alignment=None, number_format=None):
+        cell = WriteOnlyCell(worksheet, value=value)
+        if font:
+            cell.font = font
+        if alignment:
+            cell.alignment = alignment
+        if number_format:
+            cell.number_format = number_format
+        return cell
+
+    def scrivi(values=(), merge=False):
+        nonlocal current_row
+        worksheet.append(list(values))
+        current_row += 1
+        if merge and max_cols > 1:
+            worksheet.merged_cells.add(f"A{current_row}:{get_column_letter(max_cols)}{current_row}")
+
+    # Intestazione
+    scrivi([cella(tenant_name, font=title_font, alignment=Alignment(horizontal='center'))], merge=True)
+    scrivi([cella(report_title, alignment=Alignment(horizontal='center'))], merge=True)
+    scrivi()
+    scrivi([f"Filtri Applicati: {filters_string}"], merge=True)
+    scrivi([f"Generato il: {local_time.strftime('%d/%m/%Y %H:%M:%S')}"], merge=True)
+
+    # KPI
+    if kpi_data:
+        scrivi()
+        for key, value in kpi_data.items():
+            scrivi([None, cella(key, font=header_font), cella(value, number_format=currency_format)])
+
+    scrivi()
+
+    # Sezioni
+    for title, headers, rows in sezioni:
+        scrivi([cella(title, font=section_title_font)], merge=True)
+        scrivi()
+        if headers:
+            scrivi([cella(header_title, font=header_font) for header_title in headers])
+        for row_data in rows:
+            scrivi(row_data)
+        scrivi()
+
+    # 3. SALVATAGGIO SU FILE TEMPORANEO E RISPOSTA IN STREAMING
+    # Il file temporaneo viene chiuso (e quindi cancellato) da FileResponse a fine invio.
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    return FileResponse(output, as_attachment=True, filename=filename, content_type=CONTENT_TYPE_XLSX)
+
+
 # ==============================================================================
 # === UTILITY PER EXPORT PDF                                              ===
 # ==============================================================================
@@ -155,7 +278,15 @@ def generate_pdf_report(request, template_name, context, filename=None):
     response['Content-Disposition'] = f'attachment; filename="{filename}"'
 
     html_string = render_to_string(template_name, context, request=request)
-    pdf_file = HTML(string=html_string, base_url=request.build_absolute_uri()).write_pdf()
+    # La conversione avviene nel pool di processi (vedi pdf_renderer.py).
+    try:
+        pdf_file = render_pdf(html_string, base_url=request.build_absolute_uri())
+    except PdfTimeoutError:
+        return HttpResponse(
+            "Il PDF richiesto è troppo pesante per essere generato al momento. "
+            "Riprova o usa l'export in background dalla pagina \"I miei report\".",
+            status=503, content_type='text/plain; charset=utf-8'
+        )
 
     response.write(pdf_file)
     return response
@@ -181,8 +312,13 @@ def build_filters_string(filter_form):
                 label = field.label or name.replace('_', ' ').title()
                 display_value = value
 
+                # Per i ModelChoiceField, l'oggetto ha già una buona rappresentazione in stringa
+                # (le sue choices sono l'intero queryset: scorrerle costerebbe una query su tutta la tabella)
+                if isinstance(field, forms.ModelChoiceField):
+                    display_value = str(value)
+
                 # Gestisce i campi ChoiceField per mostrare l'etichetta leggibile
-                if hasattr(field, 'choices'):
+                elif hasattr(field, 'choices'):
                     # Cerca il valore nella lista delle choices
                     display_value = dict(field.choices).get(value, value)
                 
@@ -190,10 +326,17 @@ def build_filters_string(filter_form):
                 if isinstance(value, date):
                     display_value = value.strftime('%d/%m/%Y')
                 
-                # Per i ModelChoiceField, l'oggetto ha già una buona rappresentazione in stringa
-                if isinstance(field, forms.ModelChoiceField):
-                    display_value = str(value)
-                
                 filtri_attivi.append(f"{label}: {display_value}")
     
-    return " | ".join(filtri_attivi) if filtri_attivi else "Nessun filtro applicato"
\ No newline at end of file
+    return " | ".join(filtri_attivi) if filtri_attivi else "Nessun filtro applicato"
+
+
+def nome_file_allegato(response, default):
+    """Nome del file indicato nell'header Content-Disposition di una risposta di export."""
+    trovato = _FILENAME_RE.search(response.get('Content-Disposition', ''))
+    return trovato.group(1) if trovato else default
+
+
+def contenuto_risposta(response):
+    """Blocchi di bytes del corpo della risposta, sia normale sia in streaming."""
+    return response.streaming_content if response.streaming else [response.content]
@@ -0,0 +1,54 @@
+# gestionale/ricerca.py
+
+"""
+Ricerca testuale sulle anagrafiche, condivisa da lista, export e autocompletamento.
+
+Su PostgreSQL la ricerca usa l'estensione pg_trgm: i campi vengono confrontati
+per "somiglianza di parola" (operatore %>), servita dagli indici GIN trigram
+definiti su Anagrafica. Rispetto a icontains ('%testo%', che obbliga a leggere
+tutta la tabella) tollera errori di battitura ("Rosi" trova "Rossi") e permette
+di ordinare i risultati per pertinenza.
+
+Sugli altri database, e per termini troppo corti per formare trigrammi
+significativi, si ricade sul filtro icontains.
+"""
+
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connection
+from django.db.models import Q
+from django.db.models.functions import Greatest
+
+# Campi su cui si cerca (ognuno ha il suo indice GIN trigram su PostgreSQL).
+CAMPI_RICERCA_ANAGRAFICA = ('nome_cognome_ragione_sociale', 'citta', 'p_iva')
+
+# Sotto questa lunghezza i trigrammi sono pochi e poco selettivi.
+MIN_CARATTERI_TRIGRAM = 3
+
+
+def ricerca_trigram_disponibile():
+    return connection.vendor == 'postgresql'
+
+
+def cerca_anagrafiche(queryset, termine):
+    """
+    Filtra il queryset di anagrafiche sul 'termine' cercato.
+    Con pg_trgm i risultati sono ordinati per somiglianza decrescente, poi per nome.
+    """
+    termine = (termine or '').strip()
+    if not termine:
+        return queryset
+
+    if not ricerca_trigram_disponibile() or len(termine) < MIN_CARATTERI_TRIGRAM:
+        filtro = Q()
+        for campo in CAMPI_RICERCA_ANAGRAFICA:
+            filtro |= Q(**{f'{campo}__icontains': termine})
+        return queryset.filter(filtro)
+
+    filtro = Q()
+    for campo in CAMPI_RICERCA_ANAGRAFICA:
+        filtro |= Q(**{f'{campo}__trigram_word_similar': termine})
+    return (
+        queryset.filter(filtro)
+        .annotate(somiglianza=Greatest(*[TrigramWordSimilarity(termine, campo) for campo in CAMPI_RICERCA_ANAGRAFICA]))
+        .order_by('-somiglianza', 'nome_cognome_ragione_sociale')
+    )
@@ -0,0 +1,109 @@
+# gestionale/righe_export.py
+
+"""
+Generatori delle righe per gli export Excel.
+
+Ogni funzione riceve il queryset già filtrato e ordinato dalla vista e produce
+le righe del report una alla volta, leggendo dal database soltanto le colonne
+necessarie con values_list() (i JOIN sono espressi nei nomi dei campi) e a
+blocchi con iterator(): non vengono create istanze dei modelli e la memoria
+occupata non dipende dal numero di righe esportate.
+
+Le etichette delle scelte (get_FOO_display) vengono risolte con un dizionario
+costruito una volta sola per export.
+"""
+
+from .models import Anagrafica, DiarioAttivita, DocumentoTestata, PrimaNota, Scadenza
+
+# Righe lette dal database per ogni andata e ritorno (cursore lato server su PostgreSQL).
+CHUNK_SIZE_EXPORT = 2000
+
+
+def _righe(queryset, *campi):
+    """Tuple dei soli 'campi' richiesti, lette a blocchi di CHUNK_SIZE_EXPORT."""
+    return queryset.values_list(*campi).iterator(chunk_size=CHUNK_SIZE_EXPORT)
+
+
+def righe_documenti(documenti_qs):
+    """Righe: Tipo, Numero, Data, Cliente/Fornitore, Totale, Stato."""
+    tipi = dict(DocumentoTestata.TipoDoc.choices)
+    stati = dict(DocumentoTestata.Stato.choices)
+    for tipo, numero, data, anagrafica, totale, stato in _righe(
+        documenti_qs, 'tipo_doc', 'numero_documento', 'data_documento',
+        'anagrafica__nome_cognome_ragione_sociale', 'totale', 'stato'
+    ):
+        yield [tipi.get(tipo, tipo), numero, data, anagrafica, totale, stati.get(stato, stato)]
+
+
+def righe_movimenti(movimenti_qs):
+    """Righe: Data, Descrizione, Conto Finanziario, Causale, Entrata, Uscita, Anagrafica, Cantiere."""
+    for (data, descrizione, conto, causale, tipo, importo,
+         anagrafica, codice_anagrafica, codice_cantiere, descrizione_cantiere) in _righe(
+        movimenti_qs, 'data_registrazione', 'descrizione', 'conto_finanziario__nome_conto',
+        'causale__descrizione', 'tipo_movimento', 'importo',
+        'anagrafica__nome_cognome_ragione_sociale', 'anagrafica__codice',
+        'cantiere__codice_cantiere', 'cantiere__descrizione'
+    ):
+        yield [
+            data,
+            descrizione,
+            conto,
+            causale,
+            importo if tipo == PrimaNota.TipoMovimento.ENTRATA else None,
+            importo if tipo == PrimaNota.TipoMovimento.USCITA else None,
+            # Stesso testo di Anagrafica.__str__ e Cantiere.__str__
+            f"{anagrafica} ({codice_anagrafica})" if anagrafica is not None else "",
+            f"{codice_cantiere} - {descrizione_cantiere}" if codice_cantiere is not None else "",
+        ]
+
+
+def righe_scadenze(scadenze_qs):
+    """Righe: Data Scad., Tipo, Cliente/Fornitore, Rif. Doc., Importo Rata, Residuo, Stato Rata."""
+    tipi = dict(Scadenza.Tipo.choices)
+    stati = dict(Scadenza.Stato.choices)
+    for data, tipo, anagrafica, numero_documento, rata, residuo, stato in _righe(
+        scadenze_qs, 'data_scadenza', 'tipo_scadenza', 'anagrafica__nome_cognome_ragione_sociale',
+        'documento__numero_documento', 'importo_rata', 'importo_residuo', 'stato'
+    ):
+        yield [data, tipi.get(tipo, tipo), anagrafica, numero_documento, rata, residuo, stati.get(stato, stato)]
+
+
+def righe_anagrafiche(anagrafiche_qs):
+    """Righe: Codice, Nome/Ragione Sociale, Tipo, P.IVA, C.F., Città, Stato."""
+    tipi = dict(Anagrafica.Tipo.choices)
+    for codice, nome, tipo, p_iva, codice_fiscale, citta, attivo in _righe(
+        anagrafiche_qs, 'codice', 'nome_cognome_ragione_sociale', 'tipo',
+        'p_iva', 'codice_fiscale', 'citta', 'attivo'
+    ):
+        yield [codice, nome, tipi.get(tipo, tipo), p_iva, codice_fiscale, citta, "Attivo" if attivo else "Non Attivo"]
+
+
+# --- Fascicolo Cantiere ---
+
+def righe_diario_cantiere(diario_qs):
+    """Righe: Data, Dipendente, Stato, Ore Ordinarie, Ore Straordinarie."""
+    stati = dict(DiarioAttivita.StatoPresenza.choices)
+    for data, dipendente, stato, ore_ordinarie, ore_straordinarie in _righe(
+        diario_qs, 'data', 'dipendente__nome_cognome_ragione_sociale', 'stato_presenza',
+        'ore_ordinarie', 'ore_straordinarie'
+    ):
+        yield [data, dipendente, stati.get(stato, stato), ore_ordinarie, ore_straordinarie]
+
+
+def righe_documenti_cantiere(documenti_qs):
+    """Righe: Data, Tipo, Numero, Anagrafica, Totale."""
+    tipi = dict(DocumentoTestata.TipoDoc.choices)
+    for data, tipo, numero, anagrafica, totale in _righe(
+        documenti_qs, 'data_documento', 'tipo_doc', 'numero_documento',
+        'anagrafica__nome_cognome_ragione_sociale', 'totale'
+    ):
+        yield [data, tipi.get(tipo, tipo), numero, anagrafica, totale]
+
+
+def righe_movimenti_cantiere(movimenti_qs):
+    """Righe: Data, Descrizione, Importo (con segno), Conto, Causale."""
+    for data, descrizione, tipo, importo, conto, causale in _righe(
+        movimenti_qs, 'data_registrazione', 'descrizione', 'tipo_movimento', 'importo',
+        'conto_finanziario__nome_conto', 'causale__descrizione'
+    ):
+        yield [data, descrizione, importo if tipo == PrimaNota.TipoMovimento.ENTRATA else -importo, conto, causale]
@@ -0,0 +1,223 @@
+# gestionale/saldi_giornalieri.py
+
+"""
+Saldi giornalieri: fotografia dei valori di chiusura di ogni giorno per tenant
+(modello SaldoGiornaliero), per leggere i valori "alla data" senza ri-sommare
+tutto lo storico.
+
+Le voci fotografate sono cumulate dall'inizio dello storico, con le stesse
+regole dei KPI della Dashboard Analisi:
+- liquidità per conto finanziario: entrate meno uscite;
+- crediti/debiti aperti: rate dei documenti confermati (alla data del
+  documento) meno i pagamenti collegati (alla data di registrazione);
+- movimenti per conto operativo: somma degli importi (ricavi e costi).
+
+aggiorna_tenant() scrive le righe dal giorno dopo l'ultimo calcolato fino a una
+data (di solito ieri): lo lancia ogni ora il worker 'esegui_report_in_coda' e,
+a richiesta, il comando 'aggiorna_saldi_giornalieri'. Un movimento o un
+documento registrato con una data già fotografata elimina le fotografie da quel
+giorno in poi (SaldoGiornaliero.invalida()) e il successivo aggiornamento le
+ricalcola solo da lì. Il calcolo procede a blocchi di giorni, ognuno salvato
+in una transazione breve: le scritture non aspettano mai l'intero calcolo.
+
+saldi_alle_date() legge i valori a una o più date: l'ultima fotografia non
+successiva a ciascuna data (una query per tutte) più i movimenti dei pochi
+giorni non ancora fotografati.
+"""
+
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Min, Q, Subquery, Sum
+
+from tenants.models import Company
+
+from .models import DocumentoTestata, PrimaNota, SaldoGiornaliero, Scadenza, StatoSaldiGiornalieri
+
+DIMENSIONE_LOTTO = 1000
+# Giorni calcolati e salvati in ciascuna transazione di aggiorna_tenant().
+GIORNI_PER_BLOCCO = 31
+
+Voce = SaldoGiornaliero.Voce
+
+
+def _variazioni(movimenti, rate, dopo=None, fino_a=None, per_giorno=False):
+    """
+    Variazioni delle voci nei giorni (dopo, fino_a]: {(giorno, voce, riferimento): importo},
+    con giorno None se non si raggruppa per giorno. 'movimenti' e 'rate' sono i
+    queryset di PrimaNota e Scadenza da considerare. Query eseguite: 2.
+    """
+    if dopo:
+        movimenti = movimenti.filter(data_registrazione__gt=dopo)
+        rate = rate.filter(documento__data_documento__gt=dopo)
+    if fino_a:
+        movimenti = movimenti.filter(data_registrazione__lte=fino_a)
+        rate = rate.filter(documento__data_documento__lte=fino_a)
+
+    variazioni = defaultdict(Decimal)
+    campi = ['conto_finanziario_id', 'conto_operativo_id', 'tipo_movimento', 'scadenza_collegata__tipo_scadenza']
+    for riga in movimenti.values(*campi, *(['data_registrazione'] if per_giorno else [])).annotate(
+        totale=Sum('importo')
+    ).order_by():
+        giorno, importo = riga.get('data_registrazione'), riga['totale']
+        if riga['tipo_movimento'] == PrimaNota.TipoMovimento.ENTRATA:
+            variazioni[giorno, Voce.LIQUIDITA, riga['conto_finanziario_id']] += importo
+        else:
+            variazioni[giorno, Voce.LIQUIDITA, riga['conto_finanziario_id']] -= importo
+        if riga['conto_operativo_id']:
+            variazioni[giorno, Voce.OPERATIVO, riga['conto_operativo_id']] += importo
+        if riga['scadenza_collegata__tipo_scadenza'] == Scadenza.Tipo.INCASSO:
+            variazioni[giorno, Voce.CREDITI, 0] -= importo
+        elif riga['scadenza_collegata__tipo_scadenza'] == Scadenza.Tipo.PAGAMENTO:
+            variazioni[giorno, Voce.DEBITI, 0] -= importo
+
+    for riga in rate.filter(documento__stato=DocumentoTestata.Stato.CONFERMATO).values(
+        'tipo_scadenza', *(['documento__data_documento'] if per_giorno else [])
+    ).annotate(totale=Sum('importo_rata')).order_by():
+        voce = Voce.CREDITI if riga['tipo_scadenza'] == Scadenza.Tipo.INCASSO else Voce.DEBITI
+        variazioni[riga.get('documento__data_documento'), voce, 0] += riga['totale']
+    return variazioni
+
+
+# ==============================================================================
+# === LETTURA                                                               ===
+# ==============================================================================
+
+def saldi_alle_date(*giorni):
+    """
+    Valori di chiusura del tenant corrente a ciascuna data: {data: {(voce, riferimento): importo}}.
+    Query eseguite: 1 sulle fotografie per tutte le date, più 2 per ogni data
+    successiva all'ultimo giorno fotografato (i movimenti mancanti).
+    """
+    ultima_fotografia = lambda data: Subquery(
+        SaldoGiornaliero.objects.filter(data__lte=data).order_by('-data').values('data')[:1]
+    )
+    fotografie = defaultdict(dict)
+    filtro = Q()
+    for data in giorni:
+        filtro |= Q(data=ultima_fotografia(data))
+    for giorno, voce, riferimento, importo in SaldoGiornaliero.objects.filter(filtro).values_list(
+        'data', 'voce', 'riferimento', 'importo'
+    ):
+        fotografie[giorno][voce, riferimento] = importo
+
+    saldi = {}
+    for data in giorni:
+        base = max((giorno for giorno in fotografie if giorno <= data), default=None)
+        valori = dict(fotografie.get(base, {}))
+        if base != data:
+            variazioni = _variazioni(PrimaNota.objects.all(), Scadenza.objects.all(), dopo=base, fino_a=data)
+            for (_, voce, riferimento), importo in variazioni.items():
+                valori[voce, riferimento] = valori.get((voce, riferimento), Decimal('0')) + importo
+        saldi[data] = valori
+    return saldi
+
+
+# ==============================================================================
+# === CALCOLO DELLE FOTOGRAFIE                                              ===
+# ==============================================================================
+
+def chiusure(tenant_id, dopo, fino_a, valori=None):
+    """
+    Genera (giorno, valori) per ogni giorno in (dopo, fino_a] a partire dai valori
+    di chiusura del giorno 'dopo' (vuoti se None: si parte dal primo giorno con
+    movimenti o documenti). 'valori' viene aggiornato sul posto a ogni giorno.
+    """
+    valori = {} if valori is None else valori
+    per_giorno = defaultdict(list)
+    for (giorno, voce, riferimento), importo in _variazioni(
+        PrimaNota._base_manager.filter(tenant_id=tenant_id), Scadenza._base_manager.filter(tenant_id=tenant_id),
+        dopo=dopo, fino_a=fino_a, per_giorno=True
+    ).items():
+        per_giorno[giorno].append((voce, riferimento, importo))
+
+    giorno = dopo + timedelta(days=1) if dopo else min(per_giorno, default=None)
+    while giorno is not None and giorno <= fino_a:
+        for voce, riferimento, importo in per_giorno.get(giorno, ()):
+            valori[voce, riferimento] = valori.get((voce, riferimento), Decimal('0')) + importo
+        yield giorno, valori
+        giorno += timedelta(days=1)
+
+
+def _primo_giorno(tenant_id):
+    """Primo giorno con movimenti o documenti confermati con rate (None se non ce ne sono)."""
+    giorni = [
+        PrimaNota._base_manager.filter(tenant_id=tenant_id).aggregate(primo=Min('data_registrazione'))['primo'],
+        Scadenza._base_manager.filter(
+            tenant_id=tenant_id, documento__stato=DocumentoTestata.Stato.CONFERMATO
+        ).aggregate(primo=Min('documento__data_documento'))['primo'],
+    ]
+    return min((giorno for giorno in giorni if giorno), default=None)
+
+
+def aggiorna_tenant(tenant_id, al, ricostruisci=False):
+    """
+    Calcola i saldi giornalieri del tenant fino al giorno 'al' compreso, dal giorno
+    dopo l'ultimo già calcolato (o da zero con 'ricostruisci'). Restituisce il
+    numero di righe scritte.
+
+    Il calcolo procede a blocchi di GIORNI_PER_BLOCCO giorni senza bloccare la
+    riga di stato: il blocco viene prima prenotato (in_calcolo_fino_a), poi
+    calcolato e infine salvato in una transazione breve, solo se nel frattempo
+    nessuna scrittura l'ha invalidato (SaldoGiornaliero.invalida()); altrimenti
+    viene ricalcolato dall'ultimo giorno ancora valido.
+    """
+    # La riga di stato viene creata (e confermata) prima del calcolo, perché le
+    # scritture concorrenti la trovino.
+    StatoSaldiGiornalieri._base_manager.get_or_create(tenant_id=tenant_id)
+    stati = StatoSaldiGiornalieri._base_manager.filter(tenant_id=tenant_id)
+    saldi = SaldoGiornaliero._base_manager.filter(tenant_id=tenant_id)
+    if ricostruisci:
+        with transaction.atomic():
+            stati.select_for_update().get()
+            saldi.delete()
+            stati.update(calcolati_al=None)
+
+    scritte = 0
+    valori = None  # valori di chiusura dell'ultimo giorno calcolato, se già letti
+    while True:
+        ultimo = stati.values_list('calcolati_al', flat=True).get()
+        if ultimo and ultimo >= al:
+            return scritte
+        if ultimo is None:
+            primo = _primo_giorno(tenant_id)
+            dopo, valori = (primo - timedelta(days=1) if primo and primo <= al else al), {}
+        else:
+            dopo = ultimo
+            if valori is None:
+                valori = {(voce, riferimento): importo for voce, riferimento, importo in saldi.filter(
+                    data=ultimo).values_list('voce', 'riferimento', 'importo')}
+        fino_a = min(al, dopo + timedelta(days=GIORNI_PER_BLOCCO))
+
+        # Prenotazione: da qui le scritture con date fino a 'fino_a' invalidano il blocco.
+        stati.update(in_calcolo_fino_a=fino_a)
+        valori_finali = dict(valori)
+        righe = [
+            SaldoGiornaliero(tenant_id=tenant_id, data=giorno, voce=voce, riferimento=riferimento, importo=importo)
+            for giorno, valori_giorno in chiusure(tenant_id, dopo, fino_a, valori_finali)
+            for (voce, riferimento), importo in valori_giorno.items()
+        ] if dopo < fino_a else []
+
+        with transaction.atomic():
+            stato = stati.select_for_update().get()
+            if stato.calcolati_al != ultimo or stato.in_calcolo_fino_a != fino_a:
+                # Invalidato durante il calcolo: si riparte dall'ultimo giorno valido.
+                valori = None
+                continue
+            (saldi.filter(data__gt=ultimo) if ultimo else saldi).delete()
+            SaldoGiornaliero._base_manager.bulk_create(righe, batch_size=DIMENSIONE_LOTTO)
+            stato.calcolati_al, stato.in_calcolo_fino_a = fino_a, None
+            stato.save(update_fields=['calcolati_al', 'in_calcolo_fino_a', 'updated_at'])
+        scritte += len(righe)
+        valori = valori_finali
+
+
+def aggiorna_saldi_giornalieri(al=None, tenant_id=None):
+    """Aggiorna i saldi giornalieri di tutte le aziende (o di una) fino ad 'al' (default: ieri)."""
+    al = al or date.today() - timedelta(days=1)
+    aziende = Company.objects.order_by('pk')
+    if tenant_id:
+        aziende = aziende.filter(pk=tenant_id)
+    return {pk: aggiorna_tenant(pk, al) for pk in aziende.values_list('pk', flat=True)}
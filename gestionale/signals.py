@@ -0,0 +1,103 @@
+# gestionale/signals.py
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+
+from .kpi import invalida_kpi
+from .models import (
+    Anagrafica, Cantiere, ContoFinanziario, ContoOperativo, DiarioAttivita,
+    DocumentoTestata, PrimaNota, SaldoGiornaliero, Scadenza, TotaleMensileDocumenti,
+    TotaleMensileMovimenti
+)
+
+# Modelli da cui dipendono i KPI in cache (Dashboard): ogni loro modifica
+# invalida i KPI del tenant a cui appartengono.
+MODELLI_KPI = (
+    PrimaNota, Scadenza, DocumentoTestata, DiarioAttivita,
+    Anagrafica, Cantiere, ContoFinanziario, ContoOperativo,
+)
+
+
+def invalida_kpi_tenant(sender, instance, **kwargs):
+    """
+    Invalida i KPI del tenant dell'istanza salvata/eliminata.
+    L'invalidazione avviene dopo il commit: se avvenisse prima, una richiesta
+    concorrente potrebbe rimettere in cache i dati vecchi con la versione nuova.
+    """
+    tenant_id = instance.tenant_id
+    if tenant_id:
+        transaction.on_commit(lambda: invalida_kpi(tenant_id))
+
+
+for modello in MODELLI_KPI:
+    post_save.connect(invalida_kpi_tenant, sender=modello, dispatch_uid=f'kpi_save_{modello.__name__}')
+    post_delete.connect(invalida_kpi_tenant, sender=modello, dispatch_uid=f'kpi_delete_{modello.__name__}')
+
+
+# ==============================================================================
+# === SALDI GIORNALIERI E TOTALI MENSILI                                    ===
+# ==============================================================================
+# I movimenti di Prima Nota aggiornano saldi giornalieri e totali mensili in
+# PrimaNota.save()/delete(); documenti e scadenze qui. Le scadenze contano per i
+# saldi giornalieri alla data del documento. Le scritture massive (bulk_create)
+# non inviano segnali: chi le usa aggiorna saldi e totali da sé.
+
+# Campi della scadenza da cui dipendono crediti e debiti aperti: aggiorna_pagato()
+# salva solo importo pagato, residuo e stato, che non contano.
+CAMPI_SCADENZA_SALDI = {'importo_rata', 'tipo_scadenza', 'documento', 'documento_id'}
+
+
+def memorizza_documento_precedente(sender, instance, **kwargs):
+    """Prima di modificare un documento ne legge la versione salvata, da stornare dai totali."""
+    instance._valori_precedenti = None
+    if instance.pk:
+        instance._valori_precedenti = DocumentoTestata._base_manager.filter(pk=instance.pk).values(
+            *TotaleMensileDocumenti.CAMPI_DOCUMENTO
+        ).first()
+
+
+def aggiorna_saldi_documento_salvato(sender, instance, **kwargs):
+    precedente = getattr(instance, '_valori_precedenti', None)
+    nuovo = {campo: getattr(instance, campo) for campo in TotaleMensileDocumenti.CAMPI_DOCUMENTO}
+    if precedente == nuovo:
+        return
+    SaldoGiornaliero.invalida(instance.tenant_id, instance.data_documento, precedente and precedente['data_documento'])
+    if precedente:
+        TotaleMensileDocumenti.registra_documento(instance.tenant_id, precedente, storno=True)
+    TotaleMensileDocumenti.registra_documento(instance.tenant_id, nuovo)
+
+
+def aggiorna_saldi_documento_eliminato(sender, instance, **kwargs):
+    SaldoGiornaliero.invalida(instance.tenant_id, instance.data_documento)
+    TotaleMensileDocumenti.registra_documento(instance.tenant_id, {
+        campo: getattr(instance, campo) for campo in TotaleMensileDocumenti.CAMPI_DOCUMENTO
+    }, storno=True)
+
+
+def invalida_saldi_scadenza(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not CAMPI_SCADENZA_SALDI & set(update_fields):
+        return
+    data_documento = DocumentoTestata._base_manager.filter(
+        pk=instance.documento_id
+    ).values_list('data_documento', flat=True).first()
+    SaldoGiornaliero.invalida(instance.tenant_id, data_documento)
+
+
+def sposta_totali_cantiere(sender, instance, **kwargs):
+    """
+    Alla cancellazione di un cantiere documenti e movimenti restano, senza cantiere
+    (SET_NULL): i suoi totali mensili passano alle righe senza cantiere.
+    """
+    for modello in (TotaleMensileDocumenti, TotaleMensileMovimenti):
+        righe = modello._base_manager.filter(cantiere=instance)
+        for riga in righe.values('mese', modello.CAMPO_IMPORTO, *modello.CAMPI_CHIAVE):
+            modello.registra(instance.tenant_id, riga.pop('mese'), riga.pop(modello.CAMPO_IMPORTO), **{**riga, 'cantiere_id': None})
+        righe.delete()
+
+
+pre_save.connect(memorizza_documento_precedente, sender=DocumentoTestata, dispatch_uid='saldi_pre_save_documento')
+post_save.connect(aggiorna_saldi_documento_salvato, sender=DocumentoTestata, dispatch_uid='saldi_save_documento')
+post_delete.connect(aggiorna_saldi_documento_eliminato, sender=DocumentoTestata, dispatch_uid='saldi_delete_documento')
+post_save.connect(invalida_saldi_scadenza, sender=Scadenza, dispatch_uid='saldi_save_scadenza')
+post_delete.connect(invalida_saldi_scadenza, sender=Scadenza, dispatch_uid='saldi_delete_scadenza')
+pre_delete.connect(sposta_totali_cantiere, sender=Cantiere, dispatch_uid='totali_delete_cantiere')
@@ -1,3 +1,1892 @@
-from django.test import TestCase
+# gestionale/tests.py
 
-# Create your tests here.
+"""
+Test dei valori materializzati (saldi dei conti, pagato delle scadenze, saldi
+giornalieri, totali mensili, contatori di numerazione), dei KPI che li leggono
+e delle misure sulle query delle richieste.
+
+I test di base partono da un'azienda minima creata a mano (crea_azienda); quelli
+che hanno bisogno di volumi realistici dal comando 'genera_dati_prova' con seme
+e data fissi, quindi con dati sempre uguali. Dopo ogni scrittura i valori
+materializzati vengono confrontati con quelli ricalcolati da zero dai comandi di
+verifica ('ricalcola_saldi_conti --verifica', 'riconcilia_scadenze --verifica',
+...), che escono con CommandError alla prima differenza.
+"""
+
+import asyncio
+import csv
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+
+import openpyxl
+from asgiref.sync import ThreadSensitiveContext, async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.core.paginator import Page
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.models import Sum
+from django.test import AsyncClient, Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from tenants.cache import invalida_cache_tenant
+from tenants.models import Company, UserCompanyPermission
+
+from . import autocomplete, report_in_coda
+from .budget_query import BudgetQuerySuperato
+from .cache_artefatti import leggi_artefatto, salva_artefatto, versione_dati
+from .documenti import DIMENSIONE_LOTTO, crea_documento
+from .importazione import ImportatoreAnagrafiche, importa, leggi_righe
+from .kpi import calcola_kpi_cantiere, calcola_kpi_dashboard, calcola_kpi_periodo, kpi_in_cache
+from .managers import tenant_context
+from .models import (
+    AliquotaIVA, Anagrafica, Cantiere, Causale, ContatoreNumerazione, ContoFinanziario, ContoOperativo,
+    DocumentoRiga, DocumentoTestata, ModalitaPagamento, PrimaNota, RichiestaReport, SaldoContoFinanziario,
+    SaldoGiornaliero, Scadenza, StatoSaldiGiornalieri, TotaleMensileDocumenti, TotaleMensileMovimenti,
+)
+from .paginazione import PARAMETRO_CURSORE, PaginaKeyset, pagina_keyset
+from .pool_export import esegui_in_pool_export
+from .profilazione import MisuraRichiesta, attiva_misure
+from .report_in_coda import (
+    accoda_report, chiudi_richieste_bloccate, elimina_richieste_scadute, esegui_richiesta, preleva_richiesta,
+)
+from .saldi_giornalieri import aggiorna_tenant
+from .views import AnagraficaListExportExcelView, DocumentoDetailExportPdfView, PrimaNotaListView
+
+# Data più recente dei dati di prova.
+AL = date(2025, 6, 18)
+CENTESIMO = Decimal('0.01')
+PASSWORD = 'password-di-prova'
+
+_numeri_documento = itertools.count(1)
+
+
+def crea_azienda(nome, username):
+    """
+    Azienda con le tabelle di configurazione, un cliente, un fornitore, un
+    cantiere e un amministratore. Descrizioni e nomi dei conti sono univoci su
+    tutta la piattaforma: il suffisso con l'id dell'azienda evita collisioni.
+    """
+    tenant = Company.objects.create(company_name=nome)
+    utente = get_user_model().objects.create_user(username, password=PASSWORD)
+    UserCompanyPermission.objects.create(
+        user=utente, company=tenant, company_role=UserCompanyPermission.CompanyRole.ADMIN
+    )
+    suffisso = f" [{tenant.pk}]"
+    cliente = Anagrafica.objects.create(
+        tenant=tenant, tipo=Anagrafica.Tipo.CLIENTE, nome_cognome_ragione_sociale=f"Cliente{suffisso}",
+        p_iva=f"{tenant.pk:011d}",
+    )
+    return SimpleNamespace(
+        tenant=tenant,
+        utente=utente,
+        # Il primo conto e la prima causale sono quelli usati da nuovo_movimento().
+        banca=ContoFinanziario.objects.create(tenant=tenant, nome_conto=f"Banca{suffisso}"),
+        cassa=ContoFinanziario.objects.create(tenant=tenant, nome_conto=f"Cassa{suffisso}"),
+        causale=Causale.objects.create(
+            tenant=tenant, descrizione=f"Incassi e pagamenti{suffisso}", tipo_movimento_default=Causale.Tipo.MISTO
+        ),
+        ricavi=ContoOperativo.objects.create(tenant=tenant, nome_conto=f"Ricavi{suffisso}", tipo=ContoOperativo.Tipo.RICAVO),
+        costi=ContoOperativo.objects.create(tenant=tenant, nome_conto=f"Costi{suffisso}", tipo=ContoOperativo.Tipo.COSTO),
+        iva=AliquotaIVA.objects.create(tenant=tenant, descrizione="IVA 22%", valore_percentuale=Decimal('22')),
+        modalita=ModalitaPagamento.objects.create(tenant=tenant, descrizione=f"Bonifico 30 gg{suffisso}", giorni_scadenza=30),
+        cliente=cliente,
+        fornitore=Anagrafica.objects.create(
+            tenant=tenant, tipo=Anagrafica.Tipo.FORNITORE, nome_cognome_ragione_sociale=f"Fornitore{suffisso}",
+            p_iva=f"{tenant.pk + 50000:011d}",
+        ),
+        cantiere=Cantiere.objects.create(
+            tenant=tenant, codice_cantiere=f"C{tenant.pk}-00001", descrizione=f"Cantiere{suffisso}",
+            cliente=cliente, stato=Cantiere.Stato.APERTO,
+        ),
+    )
+
+
+def accedi_in_azienda(client, utente, tenant):
+    """Login come amministratore con l'azienda già scelta, come dopo ActivateTenantView."""
+    client.force_login(utente)
+    sessione = client.session
+    sessione.update({
+        'active_tenant_id': tenant.pk,
+        'active_tenant_name': tenant.company_name,
+        'user_company_role': UserCompanyPermission.CompanyRole.ADMIN,
+    })
+    sessione.save()
+    return client
+
+
+# I test non devono leggere né lasciare voci nella cache condivisa su file.
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TenantTestCase(TestCase):
+    """Un'azienda minima (crea_azienda), con il tenant attivo in ogni test."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.azienda = crea_azienda("Azienda di prova", 'tester')
+        cls.tenant, cls.utente = cls.azienda.tenant, cls.azienda.utente
+
+    def setUp(self):
+        contesto = tenant_context(self.tenant)
+        contesto.__enter__()
+        self.addCleanup(contesto.__exit__, None, None, None)
+
+    def accedi(self, client, azienda=None):
+        """Login nell'azienda del test o in 'azienda' (da crea_azienda)."""
+        if azienda:
+            return accedi_in_azienda(client, azienda.utente, azienda.tenant)
+        return accedi_in_azienda(client, self.utente, self.tenant)
+
+    def verifica(self, comando, **opzioni):
+        """Esegue il comando di verifica sul tenant: fallisce il test se trova differenze."""
+        call_command(comando, tenant=self.tenant.pk, verifica=True, stdout=StringIO(), **opzioni)
+
+    @classmethod
+    def nuovo_movimento(cls, **campi):
+        """Registra un movimento di Prima Nota sui primi conto e causale dell'azienda."""
+        valori = {
+            'data_registrazione': AL - timedelta(days=40),
+            'descrizione': "Movimento di test",
+            'importo': Decimal('123.45'),
+            'tipo_movimento': PrimaNota.TipoMovimento.ENTRATA,
+            'conto_finanziario': ContoFinanziario.objects.order_by('pk').first(),
+            'causale': Causale.objects.order_by('pk').first(),
+            **campi,
+        }
+        return PrimaNota.objects.create(**valori)
+
+    @classmethod
+    def nuovo_documento(cls, tipo_doc=DocumentoTestata.TipoDoc.FATTURA_VENDITA, totale=Decimal('1220.00'), rate=1, **campi):
+        """
+        Documento confermato sul primo cliente (vendite) o fornitore (acquisti)
+        dell'azienda, con 'rate' scadenze mensili che ne dividono il totale.
+        """
+        vendita = tipo_doc in (DocumentoTestata.TipoDoc.FATTURA_VENDITA, DocumentoTestata.TipoDoc.NOTA_CREDITO_VENDITA)
+        imponibile = (totale / Decimal('1.22')).quantize(CENTESIMO)
+        valori = {
+            'tipo_doc': tipo_doc,
+            'anagrafica': Anagrafica.objects.filter(
+                tipo=Anagrafica.Tipo.CLIENTE if vendita else Anagrafica.Tipo.FORNITORE
+            ).order_by('pk').first(),
+            'modalita_pagamento': ModalitaPagamento.objects.order_by('pk').first(),
+            'data_documento': AL - timedelta(days=40),
+            'numero_documento': f"T-{next(_numeri_documento)}",
+            'imponibile': imponibile,
+            'iva': totale - imponibile,
+            'totale': totale,
+            'stato': DocumentoTestata.Stato.CONFERMATO,
+            **campi,
+        }
+        documento = DocumentoTestata.objects.create(**valori)
+        rata = (totale / rate).quantize(CENTESIMO)
+        for n in range(rate):
+            Scadenza.objects.create(
+                documento=documento, anagrafica=documento.anagrafica,
+                data_scadenza=documento.data_documento + timedelta(days=30 * (n + 1)),
+                importo_rata=totale - rata * (rate - 1) if n == rate - 1 else rata,
+                tipo_scadenza=Scadenza.Tipo.INCASSO if vendita else Scadenza.Tipo.PAGAMENTO,
+            )
+        return documento
+
+
+class DatiDiProvaTestCase(TenantTestCase):
+    """Un'azienda di prova piccola ma completa, generata da 'genera_dati_prova'."""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'genera_dati_prova', prefisso='Test', utente='tester', al=AL, seed=1, anni=2,
+            clienti=20, fornitori=10, dipendenti=5, cantieri=6, documenti=150, righe_max=4,
+            primanota=300, giorni_diario=10, stdout=StringIO(),
+        )
+        cls.tenant = Company.objects.get(company_name='Test 1')
+        cls.utente = get_user_model().objects.get(username='tester')
+
+
+# ==============================================================================
+# === SALDI DEI CONTI FINANZIARI                                            ===
+# ==============================================================================
+
+class SaldoContoFinanziarioTest(TenantTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        with tenant_context(cls.tenant):
+            for giorni, conto in ((90, cls.azienda.banca), (60, cls.azienda.cassa), (30, cls.azienda.banca)):
+                cls.nuovo_movimento(data_registrazione=AL - timedelta(days=giorni), conto_finanziario=conto)
+            cls.nuovo_movimento(conto_finanziario=cls.azienda.cassa, tipo_movimento=PrimaNota.TipoMovimento.USCITA)
+
+    def saldo(self, conto):
+        return SaldoContoFinanziario.objects.get(conto_finanziario=conto).saldo
+
+    def test_saldi_allineati(self):
+        self.assertEqual(self.saldo(self.azienda.banca), Decimal('246.90'))
+        self.assertEqual(self.saldo(self.azienda.cassa), Decimal('0.00'))
+        self.verifica('ricalcola_saldi_conti')
+
+    def test_creazione_modifica_eliminazione(self):
+        conto, altro_conto = self.azienda.banca, self.azienda.cassa
+        saldo_conto, saldo_altro = self.saldo(conto), self.saldo(altro_conto)
+
+        movimento = self.nuovo_movimento(conto_finanziario=conto)
+        self.assertEqual(self.saldo(conto), saldo_conto + Decimal('123.45'))
+        self.verifica('ricalcola_saldi_conti')
+
+        movimento.importo = Decimal('100.00')
+        movimento.save()
+        self.assertEqual(self.saldo(conto), saldo_conto + Decimal('100.00'))
+
+        movimento.tipo_movimento = PrimaNota.TipoMovimento.USCITA
+        movimento.save()
+        self.assertEqual(self.saldo(conto), saldo_conto - Decimal('100.00'))
+
+        movimento.conto_finanziario = altro_conto
+        movimento.save()
+        self.assertEqual(self.saldo(conto), saldo_conto)
+        self.assertEqual(self.saldo(altro_conto), saldo_altro - Decimal('100.00'))
+        self.verifica('ricalcola_saldi_conti')
+
+        movimento.delete()
+        self.assertEqual(self.saldo(altro_conto), saldo_altro)
+        self.verifica('ricalcola_saldi_conti')
+
+    def test_primo_movimento_di_un_conto(self):
+        conto = ContoFinanziario.objects.create(nome_conto="Conto di test")
+        self.nuovo_movimento(conto_finanziario=conto, tipo_movimento=PrimaNota.TipoMovimento.USCITA)
+        self.assertEqual(self.saldo(conto), Decimal('-123.45'))
+        self.verifica('ricalcola_saldi_conti')
+
+
+# ==============================================================================
+# === PAGATO E RESIDUO DELLE SCADENZE                                       ===
+# ==============================================================================
+
+class ScadenzaPagatoTest(TenantTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        with tenant_context(cls.tenant):
+            cls.nuovo_documento(rate=3)
+            cls.nuovo_documento(DocumentoTestata.TipoDoc.FATTURA_ACQUISTO, totale=Decimal('610.00'))
+
+    def scadenza_aperta(self, **filtri):
+        return Scadenza.objects.filter(stato=Scadenza.Stato.APERTA, importo_rata__gt=10, **filtri).order_by('pk').first()
+
+    def test_scadenze_allineate(self):
+        self.assertEqual(
+            list(Scadenza.objects.order_by('pk').values_list('importo_pagato', 'importo_residuo', 'stato')),
+            [
+                (Decimal('0.00'), Decimal('406.67'), Scadenza.Stato.APERTA),
+                (Decimal('0.00'), Decimal('406.67'), Scadenza.Stato.APERTA),
+                (Decimal('0.00'), Decimal('406.66'), Scadenza.Stato.APERTA),
+                (Decimal('0.00'), Decimal('610.00'), Scadenza.Stato.APERTA),
+            ],
+        )
+        self.verifica('riconcilia_scadenze')
+
+    def test_pagamenti_parziali_e_saldo(self):
+        scadenza = self.scadenza_aperta()
+        rata = scadenza.importo_rata
+        acconto = (rata / 2).quantize(CENTESIMO)
+
+        primo = self.nuovo_movimento(importo=acconto, scadenza_collegata=scadenza)
+        scadenza.refresh_from_db()
+        self.assertEqual(
+            (scadenza.importo_pagato, scadenza.importo_residuo, scadenza.stato),
+            (acconto, rata - acconto, Scadenza.Stato.PARZIALE),
+        )
+
+        secondo = self.nuovo_movimento(importo=rata - acconto, scadenza_collegata=scadenza)
+        scadenza.refresh_from_db()
+        self.assertEqual(
+            (scadenza.importo_pagato, scadenza.importo_residuo, scadenza.stato),
+            (rata, Decimal('0.00'), Scadenza.Stato.SALDATA),
+        )
+        self.verifica('riconcilia_scadenze')
+
+        secondo.delete()
+        scadenza.refresh_from_db()
+        self.assertEqual((scadenza.importo_residuo, scadenza.stato), (rata - acconto, Scadenza.Stato.PARZIALE))
+
+        primo.importo = Decimal('0.00')
+        primo.save()
+        scadenza.refresh_from_db()
+        self.assertEqual((scadenza.importo_residuo, scadenza.stato), (rata, Scadenza.Stato.APERTA))
+        self.verifica('riconcilia_scadenze')
+
+    def test_pagamento_spostato_su_altra_scadenza(self):
+        scadenza, altra = Scadenza.objects.filter(
+            stato=Scadenza.Stato.APERTA, importo_rata__gt=10
+        ).order_by('pk')[:2]
+        pagamento = self.nuovo_movimento(importo=Decimal('10.00'), scadenza_collegata=scadenza)
+
+        pagamento.scadenza_collegata = altra
+        pagamento.save()
+        scadenza.refresh_from_db()
+        altra.refresh_from_db()
+        self.assertEqual((scadenza.importo_pagato, scadenza.stato), (Decimal('0.00'), Scadenza.Stato.APERTA))
+        self.assertEqual((altra.importo_pagato, altra.stato), (Decimal('10.00'), Scadenza.Stato.PARZIALE))
+        self.verifica('riconcilia_scadenze')
+
+    def test_scadenza_annullata_resta_annullata(self):
+        scadenza = self.scadenza_aperta()
+        scadenza.stato = Scadenza.Stato.ANNULLATA
+        scadenza.save()
+        self.nuovo_movimento(importo=Decimal('10.00'), scadenza_collegata=scadenza)
+        scadenza.refresh_from_db()
+        self.assertEqual((scadenza.importo_pagato, scadenza.stato), (Decimal('10.00'), Scadenza.Stato.ANNULLATA))
+        self.verifica('riconcilia_scadenze')
+
+    def test_importo_rata_come_stringa(self):
+        # Il wizard dei documenti passa gli importi come stringhe.
+        esistente = self.scadenza_aperta()
+        scadenza = Scadenza.objects.create(
+            documento=esistente.documento, anagrafica=esistente.anagrafica, data_scadenza=AL,
+            importo_rata='250.50', tipo_scadenza=esistente.tipo_scadenza,
+        )
+        scadenza.refresh_from_db()
+        self.assertEqual(
+            (scadenza.importo_pagato, scadenza.importo_residuo, scadenza.stato),
+            (Decimal('0.00'), Decimal('250.50'), Scadenza.Stato.APERTA),
+        )
+
+
+# ==============================================================================
+# === KPI                                                                   ===
+# ==============================================================================
+
+class KpiTest(TenantTestCase):
+    """
+    I KPI letti da totali mensili e saldi giornalieri devono coincidere con le
+    somme fatte direttamente su documenti, movimenti e scadenze, un filtro per
+    volta, e costare un numero fisso di query.
+    """
+    IERI = AL - timedelta(days=1)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        with tenant_context(cls.tenant):
+            cls.popola(random.Random(1))
+        aggiorna_tenant(cls.tenant.pk, cls.IERI)
+
+    @classmethod
+    def popola(cls, rng):
+        """
+        Un anno e mezzo di documenti (anche in bozza e annullati, con e senza
+        cantiere), pagamenti parziali e totali delle loro rate e movimenti liberi
+        su conti operativi e cantieri, fino ad AL compreso.
+        """
+        azienda = cls.azienda
+        secondo_cantiere = Cantiere.objects.create(
+            codice_cantiere=f"C{cls.tenant.pk}-00002", descrizione=f"Secondo cantiere [{cls.tenant.pk}]",
+            cliente=azienda.cliente, stato=Cantiere.Stato.APERTO,
+        )
+        cantieri = [None, azienda.cantiere, secondo_cantiere]
+        Stato = DocumentoTestata.Stato
+        for giorni in range(540, -1, -4):
+            documento = cls.nuovo_documento(
+                rng.choice(DocumentoTestata.TipoDoc.values),
+                totale=Decimal(rng.randint(10000, 500000)) / 100,
+                rate=rng.choice([1, 1, 3]),
+                data_documento=AL - timedelta(days=giorni),
+                cantiere=rng.choice(cantieri),
+                stato=rng.choice([Stato.CONFERMATO] * 8 + [Stato.BOZZA, Stato.ANNULLATO]),
+            )
+            if documento.stato != Stato.CONFERMATO:
+                continue
+            for scadenza in documento.scadenze.all():
+                if scadenza.data_scadenza > AL or rng.random() < 0.3:
+                    continue
+                quota = rng.choice([Decimal('1'), Decimal('1'), Decimal('0.5')])
+                cls.nuovo_movimento(
+                    data_registrazione=min(scadenza.data_scadenza + timedelta(days=rng.randint(-5, 20)), AL),
+                    importo=(scadenza.importo_rata * quota).quantize(CENTESIMO),
+                    tipo_movimento=(
+                        PrimaNota.TipoMovimento.ENTRATA if scadenza.tipo_scadenza == Scadenza.Tipo.INCASSO
+                        else PrimaNota.TipoMovimento.USCITA
+                    ),
+                    conto_finanziario=rng.choice([azienda.banca, azienda.cassa]),
+                    anagrafica=scadenza.anagrafica, cantiere=documento.cantiere, scadenza_collegata=scadenza,
+                )
+        for giorni in range(540, -1, -3):
+            conto_operativo = rng.choice([None, azienda.ricavi, azienda.costi])
+            cls.nuovo_movimento(
+                data_registrazione=AL - timedelta(days=giorni),
+                importo=Decimal(rng.randint(500, 100000)) / 100,
+                tipo_movimento=(
+                    PrimaNota.TipoMovimento.USCITA if conto_operativo == azienda.costi
+                    else rng.choice(PrimaNota.TipoMovimento.values)
+                ),
+                conto_finanziario=rng.choice([azienda.banca, azienda.cassa]),
+                conto_operativo=conto_operativo, cantiere=rng.choice(cantieri),
+            )
+
+    # --------------------------------------------------------------------------
+    # VALORI ATTESI
+    # --------------------------------------------------------------------------
+
+    @staticmethod
+    def somma(queryset, campo='importo'):
+        return queryset.aggregate(totale=Sum(campo))['totale'] or Decimal('0')
+
+    def fatturato_atteso(self, documenti):
+        documenti = documenti.filter(stato=DocumentoTestata.Stato.CONFERMATO)
+        per_tipo = lambda tipo_doc: self.somma(documenti.filter(tipo_doc=tipo_doc), 'totale')
+        TipoDoc = DocumentoTestata.TipoDoc
+        return (
+            per_tipo(TipoDoc.FATTURA_VENDITA) - per_tipo(TipoDoc.NOTA_CREDITO_VENDITA),
+            per_tipo(TipoDoc.FATTURA_ACQUISTO) - per_tipo(TipoDoc.NOTA_CREDITO_ACQUISTO),
+        )
+
+    def movimenti_attesi(self, movimenti):
+        """(entrate, uscite, ricavi, costi) dei movimenti."""
+        return (
+            self.somma(movimenti.filter(tipo_movimento=PrimaNota.TipoMovimento.ENTRATA)),
+            self.somma(movimenti.filter(tipo_movimento=PrimaNota.TipoMovimento.USCITA)),
+            self.somma(movimenti.filter(conto_operativo__tipo=ContoOperativo.Tipo.RICAVO)),
+            self.somma(movimenti.filter(conto_operativo__tipo=ContoOperativo.Tipo.COSTO)),
+        )
+
+    def aperti_alla_data(self, tipo_scadenza, data):
+        """Rate dei documenti confermati fino alla data meno i pagamenti registrati fino alla data."""
+        rate = Scadenza.objects.filter(
+            tipo_scadenza=tipo_scadenza, documento__stato=DocumentoTestata.Stato.CONFERMATO,
+            documento__data_documento__lte=data,
+        )
+        pagamenti = PrimaNota.objects.filter(scadenza_collegata__tipo_scadenza=tipo_scadenza, data_registrazione__lte=data)
+        return self.somma(rate, 'importo_rata') - self.somma(pagamenti)
+
+    def kpi_dashboard_attesi(self, oggi):
+        aperte = Scadenza.objects.filter(stato__in=[Scadenza.Stato.APERTA, Scadenza.Stato.PARZIALE])
+        incassi = aperte.filter(tipo_scadenza=Scadenza.Tipo.INCASSO)
+        pagamenti = aperte.filter(tipo_scadenza=Scadenza.Tipo.PAGAMENTO)
+        attivo, passivo = self.fatturato_atteso(DocumentoTestata.objects.filter(data_documento__year=oggi.year))
+        entrate, uscite, ricavi, costi = self.movimenti_attesi(PrimaNota.objects.filter(data_registrazione__year=oggi.year))
+        return {
+            'crediti_clienti': self.somma(incassi, 'importo_residuo'),
+            'debiti_fornitori': self.somma(pagamenti, 'importo_residuo'),
+            'crediti_scaduti': self.somma(incassi.filter(data_scadenza__lt=oggi), 'importo_residuo'),
+            'debiti_scaduti': self.somma(pagamenti.filter(data_scadenza__lt=oggi), 'importo_residuo'),
+            'fatturato_attivo': attivo,
+            'fatturato_passivo': passivo,
+            'fatturato_netto_ytd': attivo - passivo,
+            'cash_flow_ytd': entrate - uscite,
+            'risultato_economico_ytd': ricavi - costi,
+        }
+
+    def kpi_periodo_attesi(self, data_da, data_a):
+        attivo, passivo = self.fatturato_atteso(DocumentoTestata.objects.filter(data_documento__range=(data_da, data_a)))
+        entrate, uscite, ricavi, costi = self.movimenti_attesi(
+            PrimaNota.objects.filter(data_registrazione__range=(data_da, data_a))
+        )
+        entrate_totali, uscite_totali, _, _ = self.movimenti_attesi(PrimaNota.objects.filter(data_registrazione__lte=data_a))
+        return {
+            'liquidita_totale': entrate_totali - uscite_totali,
+            'crediti_clienti': self.aperti_alla_data(Scadenza.Tipo.INCASSO, data_a),
+            'debiti_fornitori': self.aperti_alla_data(Scadenza.Tipo.PAGAMENTO, data_a),
+            'fatturato_attivo_periodo': attivo,
+            'costi_fatturati_periodo': passivo,
+            'ricavi_periodo': ricavi,
+            'costi_periodo': costi,
+            'risultato_economico_periodo': ricavi - costi,
+            'cash_flow_periodo': entrate - uscite,
+        }
+
+    def kpi_cantiere_attesi(self, cantiere):
+        attivo, passivo = self.fatturato_atteso(DocumentoTestata.objects.filter(cantiere=cantiere))
+        entrate, uscite, ricavi, costi = self.movimenti_attesi(PrimaNota.objects.filter(cantiere=cantiere))
+        return {
+            'redditivita': (attivo + ricavi) - (passivo + costi),
+            'cash_flow': entrate - uscite,
+            'esposizione_clienti': attivo - entrate,
+            'esposizione_fornitori': passivo - uscite,
+        }
+
+    # --------------------------------------------------------------------------
+    # TEST
+    # --------------------------------------------------------------------------
+
+    def test_dashboard(self):
+        with self.assertNumQueries(3):
+            kpi = calcola_kpi_dashboard(AL)
+        self.assertEqual(kpi, self.kpi_dashboard_attesi(AL))
+
+    def test_periodo_fotografato(self):
+        data_da, data_a = date(AL.year, 1, 10), AL - timedelta(days=5)
+        # Saldi alle due date, conti operativi, totali mensili e giorni ai bordi dei documenti.
+        with self.assertNumQueries(4):
+            kpi = calcola_kpi_periodo(data_da, data_a)
+        self.assertEqual(kpi, self.kpi_periodo_attesi(data_da, data_a))
+
+    def test_periodo_fino_a_oggi(self):
+        data_da = date(AL.year - 1, 1, 1)
+        # Oggi non è ancora fotografato: 2 query in più per i suoi movimenti; l'anno
+        # precedente è fatto di mesi interi, ma il mese in corso no.
+        with self.assertNumQueries(6):
+            kpi = calcola_kpi_periodo(data_da, AL)
+        self.assertEqual(kpi, self.kpi_periodo_attesi(data_da, AL))
+
+    def test_cantiere(self):
+        for cantiere in Cantiere.objects.order_by('pk'):
+            with self.subTest(cantiere=cantiere.codice_cantiere), self.assertNumQueries(2):
+                kpi = calcola_kpi_cantiere(cantiere)
+            self.assertEqual(kpi, self.kpi_cantiere_attesi(cantiere))
+
+    def test_dopo_nuove_scritture(self):
+        cantiere = Cantiere.objects.order_by('pk').first()
+        movimento = self.nuovo_movimento(
+            data_registrazione=date(AL.year, 3, 1), cantiere=cantiere,
+            conto_operativo=ContoOperativo.objects.filter(tipo=ContoOperativo.Tipo.RICAVO).first(),
+        )
+        documento = DocumentoTestata.objects.filter(
+            stato=DocumentoTestata.Stato.CONFERMATO, data_documento__year=AL.year
+        ).order_by('pk').first()
+        documento.totale += Decimal('500.00')
+        documento.cantiere = cantiere
+        documento.save()
+        movimento.importo = Decimal('42.00')
+        movimento.save()
+        aggiorna_tenant(self.tenant.pk, self.IERI)
+
+        data_da = date(AL.year, 2, 15)
+        self.assertEqual(calcola_kpi_dashboard(AL), self.kpi_dashboard_attesi(AL))
+        self.assertEqual(calcola_kpi_periodo(data_da, self.IERI), self.kpi_periodo_attesi(data_da, self.IERI))
+        self.assertEqual(calcola_kpi_cantiere(cantiere), self.kpi_cantiere_attesi(cantiere))
+
+
+class KpiInCacheTest(TenantTestCase):
+    """
+    I KPI in cache (kpi_in_cache) restano validi finché non cambiano i dati del
+    tenant: i segnali li invalidano dopo il commit e solo per quel tenant.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.calcoli = 0
+
+    def kpi(self, tenant=None):
+        """Blocco di KPI in cache: il valore è il numero del calcolo che l'ha prodotto."""
+        def calcola():
+            self.calcoli += 1
+            return self.calcoli
+        return kpi_in_cache((tenant or self.tenant).pk, 'dashboard', calcola, AL)
+
+    def test_servito_dalla_cache(self):
+        self.assertEqual((self.kpi(), self.kpi()), (1, 1))
+        # La data di riferimento entra nella chiave.
+        self.assertEqual(kpi_in_cache(self.tenant.pk, 'dashboard', lambda: 'ieri', AL - timedelta(days=1)), 'ieri')
+
+    def test_invalidati_dopo_il_commit(self):
+        documento = self.nuovo_documento()
+        scadenza = documento.scadenze.get()
+        scritture = {
+            'prima nota': lambda: self.nuovo_movimento(),
+            'scadenza': lambda: scadenza.save(),
+            'documento': lambda: documento.save(),
+        }
+        for nome, scrivi in scritture.items():
+            with self.subTest(nome):
+                prima = self.kpi()
+                with self.captureOnCommitCallbacks(execute=True):
+                    scrivi()
+                    # Prima del commit una richiesta concorrente vedrebbe ancora
+                    # i dati vecchi: la versione non deve cambiare.
+                    self.assertEqual(self.kpi(), prima)
+                self.assertEqual(self.kpi(), prima + 1)
+
+    def test_non_invalidati_se_la_transazione_fallisce(self):
+        prima = self.kpi()
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError), transaction.atomic():
+                self.nuovo_movimento()
+                raise ValueError
+        self.assertEqual(self.kpi(), prima)
+
+    def test_altri_tenant_restano_in_cache(self):
+        altra = crea_azienda("Altra azienda", 'altro')
+        del_tenant, dell_altra = self.kpi(), self.kpi(altra.tenant)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.nuovo_movimento()
+        self.assertEqual(self.kpi(altra.tenant), dell_altra)
+        self.assertEqual(self.kpi(), self.calcoli)
+        self.assertNotEqual(self.kpi(), del_tenant)
+
+    def test_invalidazione_da_un_altro_processo(self):
+        # Regressione: con la cache in memoria del processo, l'invalidazione fatta
+        # da un altro processo (comandi di gestione, altri processi web) non
+        # arrivava alla dashboard. Serve la cache configurata nel progetto, non
+        # quella in memoria dei test.
+        from config.settings import CACHES
+        with tempfile.TemporaryDirectory() as cartella:
+            cache_progetto = {'default': {**CACHES['default'], 'LOCATION': cartella}}
+            with self.settings(CACHES=cache_progetto):
+                prima = self.kpi()
+                subprocess.run(
+                    [sys.executable, 'manage.py', 'shell', '-c',
+                     f'from gestionale.kpi import invalida_kpi; invalida_kpi({self.tenant.pk})'],
+                    cwd=settings.BASE_DIR, env={**os.environ, 'CACHE_LOCATION': cartella},
+                    check=True, capture_output=True,
+                )
+                self.assertEqual(self.kpi(), prima + 1)
+
+
+# ==============================================================================
+# === REPORT IN CODA                                                        ===
+# ==============================================================================
+
+class ReportInCodaTest(TenantTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cartella = tempfile.TemporaryDirectory()
+        self.addCleanup(cartella.cleanup)
+        impostazioni = self.settings(MEDIA_ROOT=cartella.name, ARTEFATTI_CACHE_MB=0)
+        impostazioni.enable()
+        self.addCleanup(impostazioni.disable)
+        invalida_cache_tenant()
+
+    def accoda(self, azienda=None, **campi):
+        azienda = azienda or self.azienda
+        valori = {
+            'tenant': azienda.tenant,
+            'utente': azienda.utente,
+            'ruolo': UserCompanyPermission.CompanyRole.ADMIN,
+            'titolo': "Lista Anagrafiche",
+            'formato': RichiestaReport.Formato.EXCEL,
+            'vista': 'anagrafica_list_export_excel',
+            **campi,
+        }
+        return RichiestaReport._base_manager.create(**valori)
+
+    def esegui_worker(self):
+        call_command('esegui_report_in_coda', una_volta=True, stdout=StringIO(), stderr=StringIO())
+
+    def permesso(self):
+        return UserCompanyPermission.objects.get(user=self.utente, company=self.tenant)
+
+    @staticmethod
+    def celle(richiesta):
+        foglio = openpyxl.load_workbook(richiesta.file.path).active
+        return {valore for riga in foglio.iter_rows(values_only=True) for valore in riga if valore}
+
+    def test_accoda_dalla_vista(self):
+        client = self.accedi(self.client)
+        response = client.post(
+            reverse('report_accoda', args=['anagrafica_list_export_excel']), {'parametri': '?tipo=Cliente'}, secure=True
+        )
+        self.assertRedirects(response, reverse('report_list'), fetch_redirect_response=False)
+        richiesta = RichiestaReport.objects.get()
+        self.assertEqual(
+            (richiesta.tenant_id, richiesta.utente_id, richiesta.ruolo, richiesta.parametri, richiesta.stato),
+            (self.tenant.pk, self.utente.pk, UserCompanyPermission.CompanyRole.ADMIN, 'tipo=Cliente',
+             RichiestaReport.Stato.IN_CODA),
+        )
+
+    def test_ruolo_verificato_dal_middleware(self):
+        # In sessione resta il ruolo scelto all'accesso: conta quello verificato.
+        request = RequestFactory().post('/')
+        request.user, request.tenant = self.utente, self.tenant
+        request.company_role = UserCompanyPermission.CompanyRole.VISUALIZZATORE
+        request.session = {'active_tenant_id': self.tenant.pk, 'user_company_role': UserCompanyPermission.CompanyRole.ADMIN}
+        richiesta = accoda_report(request, 'anagrafica_list_export_excel')
+        self.assertEqual(richiesta.ruolo, UserCompanyPermission.CompanyRole.VISUALIZZATORE)
+
+    def test_prelievo_in_ordine_di_arrivo(self):
+        prima, seconda = self.accoda(), self.accoda()
+        self.accoda(stato=RichiestaReport.Stato.COMPLETATA)
+        self.assertEqual(preleva_richiesta().pk, prima.pk)
+        prelevata = preleva_richiesta()
+        self.assertEqual((prelevata.pk, prelevata.stato), (seconda.pk, RichiestaReport.Stato.IN_CORSO))
+        self.assertIsNotNone(prelevata.avviata_il)
+        self.assertIsNone(preleva_richiesta())
+
+    def test_eseguita_nel_tenant_della_richiesta(self):
+        altra = crea_azienda("Altra azienda", 'altro')
+        richiesta = self.accoda(altra)
+        # Il worker non ha un tenant corrente: lo prende dalla richiesta.
+        with tenant_context(None):
+            self.esegui_worker()
+        richiesta.refresh_from_db()
+        self.assertEqual((richiesta.stato, richiesta.progresso), (RichiestaReport.Stato.COMPLETATA, 100))
+        celle = self.celle(richiesta)
+        self.assertIn(altra.cliente.nome_cognome_ragione_sociale, celle)
+        self.assertNotIn(self.azienda.cliente.nome_cognome_ragione_sociale, celle)
+
+    def test_ruolo_riletto_prima_dell_esecuzione(self):
+        richiesta = self.accoda()
+        permesso = self.permesso()
+        permesso.company_role = UserCompanyPermission.CompanyRole.CONTABILE
+        with self.captureOnCommitCallbacks(execute=True):
+            permesso.save()
+        with mock.patch.object(
+            report_in_coda, '_ricostruisci_richiesta_http', wraps=report_in_coda._ricostruisci_richiesta_http
+        ) as ricostruisci:
+            esegui_richiesta(richiesta)
+        self.assertEqual(ricostruisci.call_args.args[2], UserCompanyPermission.CompanyRole.CONTABILE)
+
+    def test_permesso_revocato(self):
+        richiesta = self.accoda()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.permesso().delete()
+        self.esegui_worker()
+        richiesta.refresh_from_db()
+        self.assertEqual(richiesta.stato, RichiestaReport.Stato.ERRORE)
+        self.assertIn("non ha più accesso", richiesta.messaggio_errore)
+        self.assertFalse(richiesta.file)
+
+    def test_azienda_disattivata(self):
+        richiesta = self.accoda()
+        self.tenant.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tenant.save()
+        self.esegui_worker()
+        richiesta.refresh_from_db()
+        self.assertEqual(richiesta.stato, RichiestaReport.Stato.ERRORE)
+
+    def test_richieste_bloccate(self):
+        adesso = timezone.now()
+        bloccata = self.accoda(
+            stato=RichiestaReport.Stato.IN_CORSO, avviata_il=adesso - timedelta(minutes=settings.REPORT_MINUTI_TIMEOUT + 1)
+        )
+        in_corso = self.accoda(stato=RichiestaReport.Stato.IN_CORSO, avviata_il=adesso)
+        self.assertEqual(chiudi_richieste_bloccate(), 1)
+        bloccata.refresh_from_db()
+        in_corso.refresh_from_db()
+        self.assertEqual((bloccata.stato, in_corso.stato), (RichiestaReport.Stato.ERRORE, RichiestaReport.Stato.IN_CORSO))
+
+    def test_richieste_scadute(self):
+        scaduta = timezone.now() - timedelta(days=settings.REPORT_GIORNI_CONSERVAZIONE + 1)
+        completata = self.accoda()
+        esegui_richiesta(completata)
+        completata.refresh_from_db()
+        percorso = completata.file.path
+        RichiestaReport._base_manager.filter(pk=completata.pk).update(completata_il=scaduta)
+        self.accoda(stato=RichiestaReport.Stato.ERRORE, completata_il=scaduta)
+        recente = self.accoda(stato=RichiestaReport.Stato.ERRORE, completata_il=timezone.now())
+        in_coda = self.accoda()
+
+        self.assertEqual(elimina_richieste_scadute(), 2)
+        self.assertFalse(os.path.exists(percorso))
+        self.assertEqual(set(RichiestaReport.objects.values_list('pk', flat=True)), {recente.pk, in_coda.pk})
+
+
+@skipUnless(connection.vendor == 'postgresql', "SELECT ... FOR UPDATE SKIP LOCKED verificato solo su PostgreSQL.")
+class PrelievoConcorrenteTest(TransactionTestCase):
+    """Due worker in parallelo: la richiesta bloccata dal primo viene saltata dal secondo."""
+
+    def test_richiesta_bloccata_saltata(self):
+        azienda = crea_azienda("Azienda di prova", 'tester')
+        prima, seconda = [
+            RichiestaReport._base_manager.create(
+                tenant=azienda.tenant, utente=azienda.utente, ruolo=UserCompanyPermission.CompanyRole.ADMIN,
+                titolo="Lista Anagrafiche", formato=RichiestaReport.Formato.EXCEL, vista='anagrafica_list_export_excel',
+            )
+            for _ in range(2)
+        ]
+        bloccata, rilascia = threading.Event(), threading.Event()
+
+        def primo_worker():
+            try:
+                with transaction.atomic():
+                    RichiestaReport._base_manager.select_for_update().get(pk=prima.pk)
+                    bloccata.set()
+                    rilascia.wait(10)
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=primo_worker)
+        thread.start()
+        try:
+            self.assertTrue(bloccata.wait(10))
+            self.assertEqual(preleva_richiesta().pk, seconda.pk)
+        finally:
+            rilascia.set()
+            thread.join()
+
+
+# ==============================================================================
+# === CACHE DEGLI EXPORT                                                    ===
+# ==============================================================================
+
+class CacheArtefattiTest(TenantTestCase):
+    """
+    Gli export (ExportInCacheMixin) vengono serviti dal file già generato finché
+    tenant, filtri e versione dei dati (cache_artefatti.versione_dati) non cambiano.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cartella = tempfile.TemporaryDirectory()
+        self.addCleanup(cartella.cleanup)
+        impostazioni = self.settings(ARTEFATTI_CACHE_DIR=cartella.name, ARTEFATTI_CACHE_MB=512)
+        impostazioni.enable()
+        self.addCleanup(impostazioni.disable)
+
+    def scarica(self, client, **filtri):
+        """(generato, valori del foglio): 'generato' è falso se l'export arriva dalla cache."""
+        vista = AnagraficaListExportExcelView
+        with mock.patch.object(vista, 'get', autospec=True, side_effect=vista.get) as genera:
+            response = client.get(reverse('anagrafica_list_export_excel'), filtri, secure=True)
+        self.assertEqual(response.status_code, 200)
+        contenuto = b''.join(response.streaming_content)
+        response.close()
+        foglio = openpyxl.load_workbook(BytesIO(contenuto)).active
+        return genera.called, {valore for riga in foglio.iter_rows(values_only=True) for valore in riga if valore}
+
+    def test_servito_dalla_cache(self):
+        client = self.accedi(self.client)
+        generato, nomi = self.scarica(client)
+        self.assertTrue(generato)
+        self.assertEqual(self.scarica(client), (False, nomi))
+        # Filtri diversi, artefatto diverso.
+        generato, nomi = self.scarica(client, tipo=Anagrafica.Tipo.FORNITORE)
+        self.assertTrue(generato)
+        self.assertNotIn(self.azienda.cliente.nome_cognome_ragione_sociale, nomi)
+
+    def test_rigenerato_quando_cambiano_i_dati(self):
+        client = self.accedi(self.client)
+        self.scarica(client)
+        cliente = self.azienda.cliente
+        cliente.nome_cognome_ragione_sociale = "Cliente rinominato"
+        cliente.save()
+        generato, nomi = self.scarica(client)
+        self.assertTrue(generato)
+        self.assertIn("Cliente rinominato", nomi)
+        # Anche un'eliminazione, che non tocca updated_at, cambia la versione.
+        self.azienda.fornitore.delete()
+        generato, nomi = self.scarica(client)
+        self.assertTrue(generato)
+        self.assertNotIn(self.azienda.fornitore.nome_cognome_ragione_sociale, nomi)
+
+    def test_artefatti_separati_per_tenant(self):
+        altra = crea_azienda("Altra azienda", 'altro')
+        _, nomi = self.scarica(self.accedi(self.client))
+        generato, nomi_altra = self.scarica(self.accedi(Client(), altra))
+        self.assertTrue(generato)
+        self.assertIn(altra.cliente.nome_cognome_ragione_sociale, nomi_altra)
+        self.assertNotIn(self.azienda.cliente.nome_cognome_ragione_sociale, nomi_altra)
+        self.assertIn(self.azienda.cliente.nome_cognome_ragione_sociale, nomi)
+
+    def test_eliminati_i_meno_usati_di_recente(self):
+        mezzo_mega = b'x' * (512 * 1024)
+        adesso = time.time()
+        percorsi = {}
+        with self.settings(ARTEFATTI_CACHE_MB=1):
+            for nome, eta in (('primo', 30), ('secondo', 20)):
+                percorsi[nome] = salva_artefatto(nome, f'{nome}.bin', [mezzo_mega])
+                os.utime(percorsi[nome], (adesso - eta, adesso - eta))
+            self.assertEqual(leggi_artefatto('primo'), percorsi['primo'])  # ora è il più recente
+            salva_artefatto('terzo', 'terzo.bin', [mezzo_mega])
+        self.assertIsNone(leggi_artefatto('secondo'))
+        self.assertIsNotNone(leggi_artefatto('primo'))
+        self.assertIsNotNone(leggi_artefatto('terzo'))
+
+    def test_versione_cambia_con_le_modifiche_sul_posto(self):
+        # Regressione: righe dei documenti e causali non avevano updated_at e la
+        # versione usava il pk massimo: una modifica sul posto lasciava in cache
+        # il PDF o l'Excel vecchio.
+        documento = self.nuovo_documento()
+        riga = DocumentoRiga.objects.create(
+            testata=documento, descrizione="Riga", quantita=1, prezzo_unitario=Decimal('1000.00'),
+            aliquota_iva=self.azienda.iva, imponibile_riga=Decimal('1000.00'), iva_riga=Decimal('220.00'),
+        )
+        causale = self.azienda.causale
+
+        def versioni():
+            return (
+                versione_dati(DocumentoDetailExportPdfView().get_dati_versionati(None, pk=documento.pk)),
+                versione_dati([Causale.objects.all()]),
+            )
+
+        prima = versioni()
+        time.sleep(0.02)  # updated_at diverso anche con orologi a bassa risoluzione
+        riga.imponibile_riga = Decimal('900.00')
+        riga.save()
+        causale.descrizione = "Causale rinominata"
+        causale.save()
+        dopo = versioni()
+        self.assertNotEqual(dopo[0], prima[0])
+        self.assertNotEqual(dopo[1], prima[1])
+
+    def test_tabelle_senza_updated_at_non_in_cache(self):
+        self.assertIsNone(versione_dati([Anagrafica.objects.all(), ModalitaPagamento.objects.all()]))
+        client = self.accedi(self.client)
+        with mock.patch.object(AnagraficaListExportExcelView, 'modelli_dati', [Anagrafica, ModalitaPagamento]):
+            self.assertTrue(self.scarica(client)[0])
+            self.assertTrue(self.scarica(client)[0])
+        self.assertEqual(os.listdir(settings.ARTEFATTI_CACHE_DIR), [])
+
+
+# ==============================================================================
+# === INDICI DELLE LISTE                                                    ===
+# ==============================================================================
+
+@skipUnless(connection.vendor == 'postgresql', "EXPLAIN e indici per tenant verificati solo su PostgreSQL.")
+class IndiciTest(TenantTestCase):
+
+    def test_query_delle_liste_usano_gli_indici(self):
+        # Su un database piccolo il planner preferirebbe le scansioni sequenziali:
+        # --forza-indici verifica che gli indici previsti siano almeno utilizzabili.
+        uscita = StringIO()
+        try:
+            call_command('verifica_indici', tenant=self.tenant.pk, forza_indici=True, stdout=uscita)
+        except CommandError as errore:
+            self.fail(f"{errore}\n{uscita.getvalue()}")
+
+
+# ==============================================================================
+# === AUTOCOMPLETAMENTO                                                     ===
+# ==============================================================================
+
+class AutocompleteTest(TenantTestCase):
+    """API 'api_autocomplete' e 'api_get_anagrafiche': pagine di al massimo LIMITE_MASSIMO opzioni."""
+    CLIENTI = 60
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        with tenant_context(cls.tenant):
+            for n in range(1, cls.CLIENTI):
+                Anagrafica.objects.create(tipo=Anagrafica.Tipo.CLIENTE, nome_cognome_ragione_sociale=f"Cliente {n:03d}")
+        crea_azienda("Altra azienda", 'altro')
+
+    def setUp(self):
+        super().setUp()
+        self.accedi(self.client)
+
+    def opzioni(self, sorgente='anagrafica', **parametri):
+        response = self.client.get(reverse('api_autocomplete', args=[sorgente]), parametri, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    @staticmethod
+    def etichette(dati):
+        return [opzione['text'] for opzione in dati['results']]
+
+    def test_pagine(self):
+        clienti = Anagrafica.objects.filter(tipo=Anagrafica.Tipo.CLIENTE)
+        visti = []
+        for pagina, (quanti, altre) in enumerate([(25, True), (25, True), (10, False)], start=1):
+            dati = self.opzioni(tipo=Anagrafica.Tipo.CLIENTE, page=pagina, limit=25)
+            self.assertEqual((len(dati['results']), dati['pagination']['more']), (quanti, altre))
+            visti += [opzione['id'] for opzione in dati['results']]
+        self.assertEqual(visti, list(clienti.values_list('pk', flat=True)))
+        self.assertEqual(self.opzioni(tipo=Anagrafica.Tipo.CLIENTE, page=4, limit=25)['results'], [])
+
+    def test_limite(self):
+        self.assertEqual(len(self.opzioni()['results']), autocomplete.LIMITE_DEFAULT)
+        self.assertEqual(len(self.opzioni(limit=1000)['results']), autocomplete.LIMITE_MASSIMO)
+        # Valori non validi: si usano i default.
+        dati = self.opzioni(limit='tutti', page=-1)
+        self.assertEqual(len(dati['results']), autocomplete.LIMITE_DEFAULT)
+        self.assertEqual(dati['results'], self.opzioni()['results'])
+
+    def test_una_query_per_pagina(self):
+        # Una riga in più del limite dice se c'è un'altra pagina: nessun COUNT.
+        with self.assertNumQueries(1):
+            dati = autocomplete.cerca_opzioni('anagrafica', pagina=2, limite=10)
+        self.assertTrue(dati['pagination']['more'])
+
+    def test_filtri(self):
+        rossi = Anagrafica.objects.create(tipo=Anagrafica.Tipo.FORNITORE, nome_cognome_ragione_sociale="Rossi Costruzioni")
+        Cantiere.objects.create(
+            codice_cantiere=f"C{self.tenant.pk}-00002", descrizione="Cantiere chiuso",
+            cliente=self.azienda.cliente, stato=Cantiere.Stato.CHIUSO,
+        )
+        self.assertEqual(self.etichette(self.opzioni(q="Rossi")), [str(rossi)])
+        self.assertEqual(
+            self.etichette(self.opzioni(tipo=Anagrafica.Tipo.FORNITORE)), [str(self.azienda.fornitore), str(rossi)]
+        )
+        # 'aperti' vale per la Prima Nota: solo i cantieri in corso.
+        self.assertEqual(self.etichette(self.opzioni('cantiere', tipo='aperti')), [str(self.azienda.cantiere)])
+        self.assertEqual(len(self.opzioni('cantiere')['results']), 2)
+
+    def test_solo_il_tenant_corrente(self):
+        modelli = {'anagrafica': Anagrafica, 'cantiere': Cantiere, 'causale': Causale, 'conto_finanziario': ContoFinanziario}
+        self.assertEqual(set(modelli), set(autocomplete.SORGENTI_AUTOCOMPLETAMENTO))
+        for sorgente, modello in modelli.items():
+            with self.subTest(sorgente=sorgente):
+                dati = self.opzioni(sorgente, limit=autocomplete.LIMITE_MASSIMO)
+                del_tenant = modello._base_manager.filter(tenant=self.tenant).values_list('pk', flat=True)
+                self.assertTrue(dati['results'])
+                self.assertLessEqual({opzione['id'] for opzione in dati['results']}, set(del_tenant))
+
+    def test_sorgente_inesistente(self):
+        response = self.client.get(reverse('api_autocomplete', args=['utenti']), secure=True)
+        self.assertEqual(response.status_code, 404)
+
+    def test_anagrafiche_per_tipo_documento(self):
+        url = reverse('api_get_anagrafiche')
+        vendita = self.client.get(url, {'tipo_doc': DocumentoTestata.TipoDoc.FATTURA_VENDITA, 'limit': 100}, secure=True).json()
+        self.assertEqual(len(vendita['results']), autocomplete.LIMITE_MASSIMO)
+        self.assertTrue(vendita['pagination']['more'])
+        acquisto = self.client.get(url, {'tipo_doc': DocumentoTestata.TipoDoc.FATTURA_ACQUISTO}, secure=True).json()
+        self.assertEqual(self.etichette(acquisto), [str(self.azienda.fornitore)])
+        vuota = self.client.get(url, {'tipo_doc': 'XYZ'}, secure=True).json()
+        self.assertEqual(vuota, {'results': [], 'pagination': {'more': False}})
+
+
+# ==============================================================================
+# === PAGINAZIONE A CURSORE                                                 ===
+# ==============================================================================
+
+class PaginazioneTest(TenantTestCase):
+    """Le liste sfogliate a cursore devono mostrare ogni riga una e una sola volta."""
+    ORDINAMENTO = PrimaNotaListView.ordinamento  # decrescente
+    MOVIMENTI = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        with tenant_context(cls.tenant):
+            # Solo tre date: la chiave di ordinamento si ripete e decide il pk.
+            for n in range(cls.MOVIMENTI):
+                cls.nuovo_movimento(data_registrazione=AL - timedelta(days=n % 3))
+
+    def pagina(self, cursore=None, ordinamento=ORDINAMENTO, per_pagina=6):
+        return pagina_keyset(PrimaNota.objects.all(), ordinamento, cursore, per_pagina, conteggio='esatto')
+
+    def sfoglia(self, ordinamento=ORDINAMENTO):
+        """Pagine (liste di pk) dalla prima all'ultima e poi di nuovo a ritroso fino alla prima."""
+        pagine, pagina = [], self.pagina(ordinamento=ordinamento)
+        self.assertFalse(pagina.has_previous())
+        pagine.append([movimento.pk for movimento in pagina])
+        while pagina.has_next():
+            self.assertLess(len(pagine), self.MOVIMENTI, "il cursore non avanza")
+            pagina = self.pagina(pagina.next_cursor, ordinamento)
+            pagine.append([movimento.pk for movimento in pagina])
+        ritorno = [pagine[-1]]
+        while pagina.has_previous():
+            self.assertLess(len(ritorno), self.MOVIMENTI, "il cursore non arretra")
+            pagina = self.pagina(pagina.previous_cursor, ordinamento)
+            ritorno.append([movimento.pk for movimento in pagina])
+        self.assertTrue(pagina.has_next())
+        return pagine, ritorno[::-1]
+
+    def test_avanti_e_indietro(self):
+        for ordinamento in (self.ORDINAMENTO, ['data_registrazione', 'pk']):
+            with self.subTest(ordinamento=ordinamento):
+                attesi = list(PrimaNota.objects.order_by(*ordinamento).values_list('pk', flat=True))
+                pagine, ritorno = self.sfoglia(ordinamento)
+                self.assertEqual([len(pagina) for pagina in pagine], [6, 6, 6, 2])
+                self.assertEqual(list(itertools.chain(*pagine)), attesi)
+                self.assertEqual(ritorno, pagine)
+
+    def test_pagina_unica(self):
+        pagina = self.pagina(per_pagina=self.MOVIMENTI)
+        self.assertEqual(len(pagina), self.MOVIMENTI)
+        self.assertFalse(pagina.has_other_pages())
+        self.assertEqual(pagina.conteggio, self.MOVIMENTI)
+
+    def test_cursore_manomesso(self):
+        cursore = self.pagina().next_cursor
+        prima_pagina = [movimento.pk for movimento in self.pagina()]
+        contraffatti = [
+            cursore[:-1] + ('A' if cursore[-1] != 'A' else 'B'),
+            signing.dumps({'d': 'n', 'v': ['2025-06-18', '1']}, salt='altro'),
+            'cursore-non-valido',
+        ]
+        for contraffatto in contraffatti:
+            with self.subTest(cursore=contraffatto):
+                # Un cursore non valido riporta alla prima pagina.
+                pagina = self.pagina(contraffatto)
+                self.assertEqual([movimento.pk for movimento in pagina], prima_pagina)
+                self.assertFalse(pagina.has_previous())
+
+    def test_conteggio(self):
+        queryset = PrimaNota.objects.all()
+        self.assertIsNone(pagina_keyset(queryset, self.ORDINAMENTO, None, 6, conteggio=None).conteggio)
+        stimata = pagina_keyset(queryset, self.ORDINAMENTO, None, 6, conteggio='stimato')
+        if connection.vendor == 'postgresql':
+            self.assertTrue(stimata.conteggio_stimato)
+        else:
+            # Senza stima del planner si ripiega sul conteggio esatto.
+            self.assertEqual((stimata.conteggio, stimata.conteggio_stimato), (self.MOVIMENTI, False))
+
+    def lista(self, **parametri):
+        response = self.client.get(reverse('primanota_list'), parametri, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response.context['page_obj']
+
+    @override_settings(PAGINAZIONE_CURSORE=True, PAGINAZIONE_CONTEGGIO_STIMATO=False)
+    def test_vista_a_cursore(self):
+        self.accedi(self.client)
+        prima = self.lista()
+        self.assertIsInstance(prima, PaginaKeyset)
+        seconda = self.lista(**{PARAMETRO_CURSORE: prima.next_cursor})
+        self.assertEqual(len(prima) + len(seconda), self.MOVIMENTI)
+        self.assertFalse(seconda.has_next())
+        self.assertEqual(self.lista(**{PARAMETRO_CURSORE: seconda.previous_cursor}).object_list, prima.object_list)
+
+    @override_settings(PAGINAZIONE_CURSORE=False)
+    def test_vista_numerata(self):
+        self.accedi(self.client)
+        seconda = self.lista(page=2)
+        self.assertIsInstance(seconda, Page)
+        self.assertEqual((seconda.number, seconda.paginator.count), (2, self.MOVIMENTI))
+        self.assertEqual(self.lista(page=99).number, 2)
+
+
+# ==============================================================================
+# === API ASYNC E RICHIESTE CONCORRENTI                                     ===
+# ==============================================================================
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ApiAsyncTest(TransactionTestCase):
+    """
+    Sotto ASGI le API async di più aziende si alternano sullo stesso event loop:
+    ogni risposta deve contenere solo i dati dell'azienda di chi l'ha chiesta.
+    Come ASGIHandler, ogni richiesta ha il proprio thread per il codice sync
+    (ThreadSensitiveContext), quindi la propria connessione: i dati vanno salvati
+    davvero, da qui TransactionTestCase.
+    """
+
+    def setUp(self):
+        invalida_cache_tenant()
+        self.aziende = [crea_azienda("Azienda di prova", 'tester'), crea_azienda("Altra azienda", 'altro')]
+
+    @staticmethod
+    async def opzioni_dopo_le_altre(*args, **kwargs):
+        # Le altre richieste passano dal middleware prima che questa legga i dati.
+        await asyncio.sleep(0.01)
+        return await autocomplete.acerca_opzioni(*args, **kwargs)
+
+    @staticmethod
+    async def richiesta(client, url, parametri):
+        async with ThreadSensitiveContext():
+            try:
+                return await client.get(url, parametri, secure=True)
+            finally:
+                await sync_to_async(connections.close_all)()
+
+    def in_parallelo(self, richieste):
+        """
+        Esegue insieme le richieste (client, url, parametri) e restituisce le
+        risposte. Con async_to_sync il codice sync di tutte le richieste
+        girerebbe nel thread del test, una richiesta alla volta.
+        """
+        async def tutte():
+            return await asyncio.gather(*(self.richiesta(*richiesta) for richiesta in richieste))
+        return asyncio.run(tutte())
+
+    def test_autocomplete_isolato_per_azienda(self):
+        richieste, attese = [], []
+        for azienda in self.aziende * 3:
+            client = accedi_in_azienda(AsyncClient(), azienda.utente, azienda.tenant)
+            richieste += [
+                (client, reverse('api_autocomplete', args=['anagrafica']), {}),
+                (client, reverse('api_autocomplete', args=['conto_finanziario']), {}),
+                (client, reverse('api_get_anagrafiche'), {'tipo_doc': DocumentoTestata.TipoDoc.FATTURA_ACQUISTO}),
+            ]
+            attese += [
+                {azienda.cliente.pk, azienda.fornitore.pk},
+                {azienda.banca.pk, azienda.cassa.pk},
+                {azienda.fornitore.pk},
+            ]
+        with mock.patch('gestionale.views.acerca_opzioni', side_effect=self.opzioni_dopo_le_altre):
+            risposte = self.in_parallelo(richieste)
+        for (_, url, _), response, attesi in zip(richieste, risposte, attese):
+            with self.subTest(url=url):
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual({opzione['id'] for opzione in response.json()['results']}, attesi)
+
+    def test_saldo_solo_dei_conti_dell_azienda(self):
+        richieste = []
+        for azienda, altra in (self.aziende, self.aziende[::-1]):
+            client = accedi_in_azienda(AsyncClient(), azienda.utente, azienda.tenant)
+            richieste += [
+                (client, reverse('api_get_conto_saldo'), {'conto_id': azienda.banca.pk}),
+                (client, reverse('api_get_conto_saldo'), {'conto_id': altra.banca.pk}),
+            ]
+        risposte = self.in_parallelo(richieste)
+        self.assertEqual([response.status_code for response in risposte], [200, 404, 200, 404])
+
+    def test_senza_azienda_in_sessione(self):
+        client = AsyncClient()
+        client.force_login(self.aziende[0].utente)
+        response = self.in_parallelo([(client, reverse('api_autocomplete', args=['anagrafica']), {})])[0]
+        self.assertRedirects(response, reverse('tenant_selection'), fetch_redirect_response=False)
+
+
+# ==============================================================================
+# === NUMERAZIONE DI DOCUMENTI E ANAGRAFICHE                                ===
+# ==============================================================================
+
+class ContatoreNumerazioneTest(TenantTestCase):
+    FTV = DocumentoTestata.TipoDoc.FATTURA_VENDITA
+    NCV = DocumentoTestata.TipoDoc.NOTA_CREDITO_VENDITA
+
+    def test_prosegue_dopo_i_documenti_esistenti(self):
+        for _ in range(2):
+            self.nuovo_documento(numero_documento=DocumentoTestata.genera_numero(self.tenant.pk, self.FTV, AL.year))
+        self.assertEqual(
+            sorted(DocumentoTestata.objects.values_list('numero_documento', flat=True)),
+            [f'FT-{AL.year}-000001', f'FT-{AL.year}-000002'],
+        )
+        self.assertEqual(DocumentoTestata.genera_numero(self.tenant.pk, self.FTV, AL.year), f'FT-{AL.year}-000003')
+
+    def test_numeri_consecutivi_per_tipo_e_anno(self):
+        self.assertEqual(DocumentoTestata.genera_numero(self.tenant.pk, self.FTV, 2030), 'FT-2030-000001')
+        self.assertEqual(DocumentoTestata.genera_numero(self.tenant.pk, self.FTV, 2030), 'FT-2030-000002')
+        self.assertEqual(
+            DocumentoTestata.genera_numeri(self.tenant.pk, self.FTV, 2030, 3),
+            ['FT-2030-000003', 'FT-2030-000004', 'FT-2030-000005'],
+        )
+        # Ogni tipo documento e ogni anno hanno la propria serie.
+        self.assertEqual(DocumentoTestata.genera_numero(self.tenant.pk, self.NCV, 2030), 'NC-2030-000001')
+        self.assertEqual(DocumentoTestata.genera_numero(self.tenant.pk, self.FTV, 2031), 'FT-2031-000001')
+
+    def test_serie_separate_per_azienda(self):
+        altra = crea_azienda("Altra azienda", 'altro')
+        self.assertEqual(DocumentoTestata.genera_numero(self.tenant.pk, self.FTV, 2030), 'FT-2030-000001')
+        self.assertEqual(DocumentoTestata.genera_numero(altra.tenant.pk, self.FTV, 2030), 'FT-2030-000001')
+
+    def test_allinea(self):
+        serie = ContatoreNumerazione.serie_documento(self.FTV)
+        ContatoreNumerazione.allinea(self.tenant.pk, serie, 2030, 41)
+        ContatoreNumerazione.allinea(self.tenant.pk, serie, 2030, 7)  # non torna indietro
+        self.assertEqual(DocumentoTestata.genera_numero(self.tenant.pk, self.FTV, 2030), 'FT-2030-000042')
+
+    def test_numero_non_consumato_se_la_transazione_fallisce(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            DocumentoTestata.genera_numero(self.tenant.pk, self.FTV, 2030)
+            raise ValueError
+        self.assertEqual(DocumentoTestata.genera_numero(self.tenant.pk, self.FTV, 2030), 'FT-2030-000001')
+
+    def test_codici_anagrafica(self):
+        self.assertEqual(self.azienda.cliente.codice, 'CL000001')
+        cliente = Anagrafica.objects.create(tipo=Anagrafica.Tipo.CLIENTE, nome_cognome_ragione_sociale="Cliente di test")
+        self.assertEqual(cliente.codice, 'CL000002')
+        self.assertEqual(Anagrafica.genera_codici(self.tenant.pk, Anagrafica.Tipo.CLIENTE, 2), ['CL000003', 'CL000004'])
+        fornitore = Anagrafica.objects.create(tipo=Anagrafica.Tipo.FORNITORE, nome_cognome_ragione_sociale="Fornitore di test")
+        self.assertEqual(fornitore.codice, 'FO000002')
+
+
+# ==============================================================================
+# === CREAZIONE DEI DOCUMENTI                                               ===
+# ==============================================================================
+
+class CreaDocumentoTest(TenantTestCase):
+    """Documenti del wizard salvati da crea_documento (gestionale/documenti.py) con bulk_create."""
+    IERI = AL - timedelta(days=1)
+    GIORNO = AL - timedelta(days=10)
+
+    def setUp(self):
+        super().setUp()
+        aggiorna_tenant(self.tenant.pk, self.IERI)
+
+    def dati_wizard(self, righe=3, rate=2, tipo_doc=DocumentoTestata.TipoDoc.FATTURA_VENDITA, **testata):
+        """(testata, righe, scadenze) come li lascia in sessione il wizard: importi in stringa, date ISO."""
+        vendita = 'V' in tipo_doc
+        testata_data = {
+            'tipo_doc': tipo_doc,
+            'anagrafica_id': (self.azienda.cliente if vendita else self.azienda.fornitore).pk,
+            'modalita_pagamento_id': self.azienda.modalita.pk,
+            'cantiere_id': self.azienda.cantiere.pk,
+            'data_documento': self.GIORNO.isoformat(),
+            **testata,
+        }
+        righe_data = [
+            {
+                'descrizione': f"Riga {n}", 'quantita': '2', 'prezzo_unitario': '50.00',
+                'aliquota_iva_id': self.azienda.iva.pk, 'imponibile_riga': '100.00', 'iva_riga': '22.00',
+            }
+            for n in range(righe)
+        ]
+        totale = Decimal('122.00') * righe
+        rata = (totale / rate).quantize(CENTESIMO)
+        scadenze_data = [
+            {
+                'data_scadenza': (self.GIORNO + timedelta(days=30 * (n + 1))).isoformat(),
+                'importo_rata': str(totale - rata * (rate - 1) if n == rate - 1 else rata),
+            }
+            for n in range(rate)
+        ]
+        return testata_data, righe_data, scadenze_data
+
+    def crea(self, *dati):
+        return crea_documento(self.tenant.pk, self.utente, *(dati or self.dati_wizard()))
+
+    def test_documento_completo(self):
+        documento = self.crea()
+        self.assertEqual(documento.numero_documento, f"FT-{date.today().year}-000001")
+        self.assertEqual(
+            (documento.imponibile, documento.iva, documento.totale, documento.stato),
+            (Decimal('300.00'), Decimal('66.00'), Decimal('366.00'), DocumentoTestata.Stato.CONFERMATO),
+        )
+        self.assertEqual(documento.righe.count(), 3)
+        self.assertEqual(
+            list(documento.scadenze.order_by('data_scadenza').values_list(
+                'importo_rata', 'importo_pagato', 'importo_residuo', 'stato', 'tipo_scadenza', 'tenant_id'
+            )),
+            [(Decimal('183.00'), Decimal('0.00'), Decimal('183.00'), Scadenza.Stato.APERTA, Scadenza.Tipo.INCASSO, self.tenant.pk)] * 2,
+        )
+        self.verifica('riconcilia_scadenze')
+
+    def test_acquisto_con_numero_del_fornitore(self):
+        documento = self.crea(*self.dati_wizard(
+            tipo_doc=DocumentoTestata.TipoDoc.FATTURA_ACQUISTO, numero_documento_manuale='A/123'
+        ))
+        self.assertEqual(documento.numero_documento, 'A/123')
+        self.assertEqual(set(documento.scadenze.values_list('tipo_scadenza', flat=True)), {Scadenza.Tipo.PAGAMENTO})
+        with self.assertRaisesMessage(ValidationError, "Numero documento mancante"):
+            self.crea(*self.dati_wizard(tipo_doc=DocumentoTestata.TipoDoc.FATTURA_ACQUISTO))
+
+    def test_totali_saldi_e_kpi_aggiornati(self):
+        # bulk_create non invia segnali: bastano quelli del salvataggio della testata.
+        kpi = kpi_in_cache(self.tenant.pk, 'dashboard', lambda: 'prima', AL)
+        with self.captureOnCommitCallbacks(execute=True):
+            documento = self.crea()
+        self.assertEqual(StatoSaldiGiornalieri.objects.get().calcolati_al, self.GIORNO - timedelta(days=1))
+        self.assertEqual(
+            TotaleMensileDocumenti.objects.filter(mese=self.GIORNO.replace(day=1)).aggregate(totale=Sum('totale'))['totale'],
+            documento.totale,
+        )
+        self.verifica('ricostruisci_totali_mensili')
+        aggiorna_tenant(self.tenant.pk, self.IERI)
+        self.verifica('aggiorna_saldi_giornalieri')
+        self.assertNotEqual(kpi_in_cache(self.tenant.pk, 'dashboard', lambda: 'dopo', AL), kpi)
+
+    def test_errore_annulla_tutto(self):
+        with mock.patch.object(Scadenza.objects, 'bulk_create', side_effect=DatabaseError("Scrittura non riuscita")):
+            with self.assertRaises(DatabaseError):
+                self.crea()
+        self.assertFalse(DocumentoTestata.objects.exists())
+        self.assertFalse(DocumentoRiga.objects.exists())
+        self.assertFalse(TotaleMensileDocumenti.objects.exists())
+        # Il numero non è stato consumato.
+        self.assertEqual(self.crea().numero_documento, f"FT-{date.today().year}-000001")
+
+    def test_dati_non_validi(self):
+        testata, righe, scadenze = self.dati_wizard()
+        altra = crea_azienda("Altra azienda", 'altro')
+        errori = {
+            "non corrisponde al totale": (testata, righe, scadenze[:1]),
+            "non contiene righe": (testata, [], scadenze),
+            "prezzo della riga 2": (testata, [righe[0], {**righe[1], 'prezzo_unitario': 'dieci'}], scadenze),
+            "aliquote IVA": (testata, [{**righe[0], 'aliquota_iva_id': altra.iva.pk}] + righe[1:], scadenze),
+        }
+        for messaggio, dati in errori.items():
+            with self.subTest(messaggio), self.assertRaisesMessage(ValidationError, messaggio):
+                self.crea(*dati)
+        with self.assertRaises(Anagrafica.DoesNotExist):
+            self.crea({**testata, 'anagrafica_id': altra.cliente.pk}, righe, scadenze)
+        self.assertFalse(DocumentoTestata.objects.exists())
+        self.assertEqual(DocumentoTestata.genera_numero(self.tenant.pk, DocumentoTestata.TipoDoc.FATTURA_VENDITA, date.today().year),
+                         f"FT-{date.today().year}-000001")
+
+    def test_query_indipendenti_dalle_righe(self):
+        # Le righe vanno a lotti di DIMENSIONE_LOTTO (o meno, se il database accetta
+        # meno parametri per query): le altre query non dipendono dal numero di righe.
+        campi = [campo for campo in DocumentoRiga._meta.concrete_fields if not campo.primary_key]
+        lotto = min(DIMENSIONE_LOTTO, connection.ops.bulk_batch_size(campi, [None] * DIMENSIONE_LOTTO))
+        # Il primo documento crea contatore e totali del mese: le misure partono dal secondo.
+        self.crea()
+        query = {}
+        for righe in (1, DIMENSIONE_LOTTO):
+            with CaptureQueriesContext(connection) as contesto:
+                self.crea(*self.dati_wizard(righe=righe, rate=12))
+            inserimenti = [q for q in contesto.captured_queries if 'INSERT INTO "gestionale_documentoriga"' in q['sql']]
+            self.assertEqual(len(inserimenti), -(-righe // lotto))
+            query[righe] = len(contesto) - len(inserimenti)
+        self.assertEqual(query[1], query[DIMENSIONE_LOTTO])
+        self.assertEqual(DocumentoRiga.objects.count(), 3 + 1 + DIMENSIONE_LOTTO)
+
+
+# ==============================================================================
+# === IMPORTAZIONE DA CSV E XLSX                                            ===
+# ==============================================================================
+
+class ImportazioneTest(TenantTestCase):
+    """Importatori di gestionale/importazione.py su piccoli file CSV (con ';', come Excel italiano) e XLSX."""
+    IERI = AL - timedelta(days=1)
+    GIORNO = AL - timedelta(days=20)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        suffisso = f" [{cls.tenant.pk}]"
+        cls.vendite = Causale.objects.create(
+            tenant=cls.tenant, descrizione=f"Vendite{suffisso}", tipo_movimento_default=Causale.Tipo.ENTRATA
+        )
+        cls.giroconto = Causale.objects.create(
+            tenant=cls.tenant, descrizione="Giroconto", tipo_movimento_default=Causale.Tipo.MISTO
+        )
+
+    def setUp(self):
+        super().setUp()
+        aggiorna_tenant(self.tenant.pk, self.IERI)
+
+    @staticmethod
+    def file(righe, formato):
+        """File in memoria; le colonne sono le chiavi delle righe, nell'ordine in cui compaiono."""
+        colonne = list(dict.fromkeys(colonna for riga in righe for colonna in riga))
+        if formato == 'csv':
+            testo = StringIO()
+            scrittore = csv.writer(testo, delimiter=';')
+            scrittore.writerow(colonne)
+            scrittore.writerows([riga.get(colonna, '') for colonna in colonne] for riga in righe)
+            return BytesIO(testo.getvalue().encode('utf-8-sig')), 'dati.csv'
+        workbook = openpyxl.Workbook()
+        foglio = workbook.active
+        foglio.append(colonne)
+        for riga in righe:
+            foglio.append([riga.get(colonna) for colonna in colonne])
+        contenuto = BytesIO()
+        workbook.save(contenuto)
+        contenuto.seek(0)
+        return contenuto, 'dati.xlsx'
+
+    def importa(self, tipo, righe, formato='csv', **opzioni):
+        return importa(tipo, *self.file(righe, formato), self.tenant, utente=self.utente, **opzioni)
+
+    def verifica_totali(self):
+        """Saldi, totali mensili e scadenze scritti a lotti coincidono con un ricalcolo da zero."""
+        self.verifica('ricalcola_saldi_conti')
+        self.verifica('ricostruisci_totali_mensili')
+        self.verifica('riconcilia_scadenze')
+        aggiorna_tenant(self.tenant.pk, self.IERI)
+        self.verifica('aggiorna_saldi_giornalieri')
+
+    def righe_anagrafiche(self, partita_iva):
+        return [
+            {'tipo': 'cliente', 'nome_cognome_ragione_sociale': 'rossi costruzioni srl', 'p_iva': f'IT {partita_iva}',
+             'citta': 'milano', 'provincia': 'mi'},
+            {'tipo': 'Fornitore', 'nome_cognome_ragione_sociale': 'Bianchi Forniture', 'codice_fiscale': 'bncmra80a01f205x',
+             'attivo': 'no'},
+            {'tipo': 'Socio', 'nome_cognome_ragione_sociale': 'Tipo non valido'},
+            {'tipo': 'Cliente', 'nome_cognome_ragione_sociale': 'Stessa P.IVA della riga 2', 'p_iva': partita_iva},
+            {'tipo': 'Cliente', 'nome_cognome_ragione_sociale': 'P.IVA già in archivio', 'p_iva': self.azienda.cliente.p_iva},
+        ]
+
+    def test_anagrafiche(self):
+        for formato, partita_iva, codice_fiscale in (('csv', '12345678901', None), ('xlsx', '10987654321', 'bncmra80a01f205y')):
+            with self.subTest(formato):
+                righe = self.righe_anagrafiche(partita_iva)
+                if codice_fiscale:
+                    righe[1]['codice_fiscale'] = codice_fiscale
+                esito = self.importa('anagrafiche', righe, formato)
+                self.assertEqual((esito.righe_lette, esito.importati), (5, 2))
+                self.assertEqual([numero for numero, _ in esito.errori], [4, 5, 6])
+                self.assertIn("Partita IVA", esito.errori[1][1])
+                self.assertIn("Partita IVA", esito.errori[2][1])
+                cliente = Anagrafica.objects.get(p_iva=partita_iva)
+                self.assertEqual(
+                    (cliente.nome_cognome_ragione_sociale, cliente.citta, cliente.provincia, cliente.attivo, cliente.created_by),
+                    ("Rossi Costruzioni Srl", "Milano", "MI", True, self.utente),
+                )
+                self.assertFalse(Anagrafica.objects.get(codice_fiscale=(codice_fiscale or righe[1]['codice_fiscale']).upper()).attivo)
+        # Codici assegnati dai contatori, dopo quelli di crea_azienda.
+        self.assertEqual(
+            sorted(Anagrafica.objects.exclude(pk__in=[self.azienda.cliente.pk, self.azienda.fornitore.pk]).values_list('codice', flat=True)),
+            ['CL000002', 'CL000003', 'FO000002', 'FO000003'],
+        )
+
+    def test_prima_nota(self):
+        banca, cassa = self.azienda.banca, self.azienda.cassa
+        righe = [
+            {'data_registrazione': self.GIORNO.isoformat(), 'descrizione': 'Incasso fattura', 'importo': '1.234,56',
+             'tipo_movimento': 'Entrata', 'causale': self.vendite.descrizione.upper(), 'conto_finanziario': banca.nome_conto,
+             'conto_operativo': self.azienda.ricavi.nome_conto, 'anagrafica': self.azienda.cliente.codice,
+             'cantiere': self.azienda.cantiere.codice_cantiere},
+            {'data_registrazione': (self.GIORNO + timedelta(days=1)).isoformat(), 'descrizione': 'Spese varie',
+             'importo': '50', 'tipo_movimento': 'u', 'causale': self.vendite.descrizione, 'conto_finanziario': cassa.nome_conto},
+            {'data_registrazione': (self.GIORNO + timedelta(days=2)).isoformat(), 'descrizione': 'Versamento',
+             'importo': '200,00', 'causale': 'giroconto', 'conto_finanziario': banca.nome_conto,
+             'conto_destinazione': cassa.nome_conto},
+            {'data_registrazione': self.GIORNO.isoformat(), 'descrizione': 'Conto sconosciuto', 'importo': '10',
+             'tipo_movimento': 'E', 'causale': self.vendite.descrizione, 'conto_finanziario': 'Conto inesistente'},
+            {'data_registrazione': self.GIORNO.isoformat(), 'descrizione': 'Giroconto incompleto', 'importo': '10',
+             'causale': 'Giroconto', 'conto_finanziario': banca.nome_conto},
+        ]
+        esito = self.importa('primanota', righe)
+        self.assertEqual((esito.righe_lette, esito.importati), (5, 3))
+        self.assertEqual([numero for numero, _ in esito.errori], [5, 6])
+        self.assertIn("'Conto inesistente' non trovato", esito.errori[0][1])
+        self.assertIn("conto_destinazione", esito.errori[1][1])
+
+        incasso = PrimaNota.objects.get(descrizione='Incasso fattura')
+        self.assertEqual(
+            (incasso.importo, incasso.tipo_movimento, incasso.anagrafica, incasso.cantiere, incasso.conto_operativo),
+            (Decimal('1234.56'), PrimaNota.TipoMovimento.ENTRATA, self.azienda.cliente, self.azienda.cantiere, self.azienda.ricavi),
+        )
+        # Il giroconto genera i due movimenti collegati, come la vista.
+        uscita = PrimaNota.objects.get(causale=self.giroconto, tipo_movimento=PrimaNota.TipoMovimento.USCITA)
+        entrata = uscita.movimento_collegato
+        self.assertEqual(entrata.movimento_collegato, uscita)
+        self.assertEqual(
+            (uscita.conto_finanziario, uscita.descrizione, entrata.conto_finanziario, entrata.descrizione, entrata.importo),
+            (banca, f"GIROCONTO -> {cassa.nome_conto}", cassa, f"GIROCONTO <- {banca.nome_conto}", Decimal('200.00')),
+        )
+        self.assertEqual(SaldoContoFinanziario.objects.get(conto_finanziario=banca).saldo, Decimal('1034.56'))
+        self.assertEqual(SaldoContoFinanziario.objects.get(conto_finanziario=cassa).saldo, Decimal('150.00'))
+        self.verifica_totali()
+
+    def test_documenti(self):
+        anno = self.GIORNO.year
+        cliente, fornitore = self.azienda.cliente.codice, self.azienda.fornitore.codice
+
+        def riga(tipo_doc, anagrafica, giorni, numero='', descrizione='Lavori', quantita=1, prezzo=100, aliquota='IVA 22%'):
+            return {
+                'tipo_doc': tipo_doc, 'numero_documento': numero, 'data_documento': self.GIORNO + timedelta(days=giorni),
+                'anagrafica': anagrafica, 'modalita_pagamento': self.azienda.modalita.descrizione,
+                'cantiere': self.azienda.cantiere.codice_cantiere if tipo_doc == 'FTV' else None,
+                'descrizione': descrizione, 'quantita': quantita, 'prezzo_unitario': prezzo, 'aliquota_iva': aliquota,
+            }
+
+        righe = [
+            riga('FTV', cliente, 0, descrizione='Scavo', quantita=2, prezzo=150.5),  # righe 2-3: un documento
+            riga('FTV', cliente, 0, descrizione='Trasporto'),
+            riga('ftv', cliente, 1, numero=f'FT-{anno}-000007'),
+            riga('FTA', fornitore, 2, numero='A/1'),
+            riga('FTA', fornitore, 3, numero='A/1'),  # stesso numero del fornitore
+            riga('FTV', cliente, 4, numero=f'FT-{anno}-000007'),  # numero già usato nel file
+            riga('FTA', fornitore, 5),  # acquisto senza numero
+            riga('FTV', cliente, 6, aliquota='IVA 99%'),
+            riga('FTV', cliente, 7),
+        ]
+        esito = self.importa('documenti', righe, 'xlsx')
+        self.assertEqual((esito.righe_lette, esito.importati), (9, 4))
+        self.assertEqual([numero for numero, _ in esito.errori], [6, 7, 8, 9])
+        self.assertIn("già stato registrato", esito.errori[0][1])
+        self.assertIn("già presente", esito.errori[1][1])
+        self.assertIn("Numero documento mancante", esito.errori[2][1])
+        self.assertIn("Riga 9: aliquota_iva", esito.errori[3][1])
+
+        # Il numero indicato fa avanzare il contatore: i documenti senza numero proseguono da lì.
+        self.assertEqual(
+            sorted(DocumentoTestata.objects.filter(tipo_doc='FTV').values_list('numero_documento', flat=True)),
+            [f'FT-{anno}-000007', f'FT-{anno}-000008', f'FT-{anno}-000009'],
+        )
+        self.assertEqual(DocumentoTestata.genera_numero(self.tenant.pk, 'FTV', anno), f'FT-{anno}-000010')
+
+        documento = DocumentoTestata.objects.get(data_documento=self.GIORNO)
+        self.assertEqual(
+            (documento.imponibile, documento.iva, documento.totale, documento.righe.count(), documento.cantiere),
+            (Decimal('401.00'), Decimal('88.22'), Decimal('489.22'), 2, self.azienda.cantiere),
+        )
+        scadenza = documento.scadenze.get()
+        self.assertEqual(
+            (scadenza.data_scadenza, scadenza.importo_rata, scadenza.importo_pagato, scadenza.importo_residuo, scadenza.tipo_scadenza),
+            (self.GIORNO + timedelta(days=30), Decimal('489.22'), Decimal('0.00'), Decimal('489.22'), Scadenza.Tipo.INCASSO),
+        )
+        self.assertEqual(
+            DocumentoTestata.objects.get(tipo_doc='FTA').scadenze.get().tipo_scadenza, Scadenza.Tipo.PAGAMENTO
+        )
+        self.verifica_totali()
+
+    def test_simulazione_non_scrive(self):
+        file = {
+            'anagrafiche': self.righe_anagrafiche('12345678901'),
+            'primanota': [{'data_registrazione': self.GIORNO.isoformat(), 'descrizione': 'Versamento', 'importo': '10',
+                           'causale': 'Giroconto', 'conto_finanziario': self.azienda.banca.nome_conto,
+                           'conto_destinazione': self.azienda.cassa.nome_conto}],
+            'documenti': [{'tipo_doc': 'FTV', 'data_documento': self.GIORNO.isoformat(),
+                           'anagrafica': self.azienda.cliente.codice, 'modalita_pagamento': self.azienda.modalita.descrizione,
+                           'descrizione': 'Lavori', 'quantita': '1', 'prezzo_unitario': '100', 'aliquota_iva': 'IVA 22%'}],
+        }
+        for tipo, righe in file.items():
+            with self.subTest(tipo):
+                esito = self.importa(tipo, righe, simula=True)
+                self.assertGreater(esito.importati, 0)
+        self.assertEqual(Anagrafica.objects.count(), 2)
+        self.assertFalse(PrimaNota.objects.exists())
+        self.assertFalse(DocumentoTestata.objects.exists())
+        self.assertFalse(SaldoContoFinanziario.objects.filter(saldo__gt=0).exists())
+        self.assertFalse(TotaleMensileMovimenti.objects.exists())
+        self.assertEqual(StatoSaldiGiornalieri.objects.get().calcolati_al, self.IERI)
+        self.assertEqual(Anagrafica.genera_codici(self.tenant.pk, Anagrafica.Tipo.CLIENTE, 1), ['CL000002'])
+        self.assertEqual(DocumentoTestata.genera_numero(self.tenant.pk, 'FTV', self.GIORNO.year), f'FT-{self.GIORNO.year}-000001')
+
+    def test_lotto_non_salvato(self):
+        # Lotti di una riga; il primo fallisce: prepara() ricarica P.IVA e C.F. dal database,
+        # quindi la stessa anagrafica più avanti nel file non è scartata come duplicato.
+        righe = self.righe_anagrafiche('12345678901')[:1] * 2
+        bulk_create = Anagrafica.objects.bulk_create
+
+        def scrivi(*args, **kwargs):
+            if scrittura.call_count == 1:
+                raise DatabaseError("Scrittura non riuscita")
+            return bulk_create(*args, **kwargs)
+
+        with mock.patch.object(Anagrafica.objects, 'bulk_create', side_effect=scrivi) as scrittura:
+            importatore = ImportatoreAnagrafiche(self.tenant, utente=self.utente, dimensione_lotto=1)
+            esito = importatore.esegui(leggi_righe(*self.file(righe, 'csv')))
+        self.assertEqual((esito.righe_lette, esito.importati), (2, 1))
+        self.assertEqual(esito.errori, [(2, "Lotto fino alla riga 2 non salvato: Scrittura non riuscita")])
+        # Il codice riservato dal lotto fallito è tornato disponibile.
+        self.assertEqual(Anagrafica.objects.get(p_iva='12345678901').codice, 'CL000002')
+
+    def test_comando(self):
+        cartella = tempfile.TemporaryDirectory()
+        self.addCleanup(cartella.cleanup)
+        percorso, errori = os.path.join(cartella.name, 'anagrafiche.csv'), os.path.join(cartella.name, 'errori.csv')
+        contenuto, _ = self.file(self.righe_anagrafiche('12345678901'), 'csv')
+        with open(percorso, 'wb') as file:
+            file.write(contenuto.getvalue())
+        uscita = StringIO()
+        call_command(
+            'importa_dati', 'anagrafiche', percorso, tenant=self.tenant.pk, utente=self.utente.username,
+            errori=errori, stdout=uscita,
+        )
+        self.assertIn("Record importati: 2 anagrafiche da 5 righe", uscita.getvalue())
+        self.assertIn("riga 4:", uscita.getvalue())
+        with open(errori, newline='', encoding='utf-8') as file:
+            self.assertEqual([riga[0] for riga in csv.reader(file, delimiter=';')], ['riga', '4', '5', '6'])
+        testo = os.path.join(cartella.name, 'anagrafiche.txt')
+        os.rename(percorso, testo)
+        with self.assertRaisesMessage(CommandError, "Formato non supportato"):
+            call_command('importa_dati', 'anagrafiche', testo, tenant=self.tenant.pk, stdout=StringIO())
+
+
+# ==============================================================================
+# === MISURE SULLE QUERY DELLE RICHIESTE                                    ===
+# ==============================================================================
+
+@override_settings(
+    PROFILAZIONE_RICHIESTE=True, PROFILAZIONE_SOGLIA_MS=0,
+    PROFILAZIONE_LOG=os.path.join(tempfile.gettempdir(), 'gestionale-test', 'richieste.jsonl'),
+)
+class ProfilazioneTest(TenantTestCase):
+    """
+    Sotto ASGI il middleware gira nell'event loop e le query delle viste sync in
+    un altro thread, con un'altra connessione: la misura deve contarle lo stesso.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        with tenant_context(cls.tenant):
+            for _ in range(3):
+                cls.nuovo_documento()
+
+    def misura(self, client, url):
+        """Riga di log della richiesta: con AsyncClient passa dal gestore ASGI (event loop in un altro thread)."""
+        self.accedi(client)
+        invalida_cache_tenant()  # azienda e ruolo riletti dal database in entrambi i casi
+        richiesta = async_to_sync(client.get) if isinstance(client, AsyncClient) else client.get
+        # Come nel thread di una nuova richiesta: una connessione senza execute wrapper.
+        wrapper = connection.execute_wrappers[:]
+        connection.execute_wrappers.clear()
+        try:
+            with self.assertLogs('gestionale.profilazione', 'INFO') as log:
+                response = richiesta(url, secure=True)
+        finally:
+            connection.execute_wrappers[:] = wrapper
+        self.assertEqual(response.status_code, 200)
+        return json.loads(log.records[-1].getMessage())
+
+    def test_query_contate_sotto_asgi(self):
+        for url in (reverse('documento_list'), reverse('scadenzario_list')):
+            with self.subTest(url=url):
+                asgi = self.misura(AsyncClient(), url)
+                wsgi = self.misura(Client(), url)
+                self.assertGreater(wsgi['query'], 0)
+                self.assertEqual(asgi['query'], wsgi['query'])
+                self.assertEqual((asgi['tenant'], asgi['vista']), (self.tenant.pk, wsgi['vista']))
+
+    def test_query_nel_pool_degli_export(self):
+        # I thread del pool aprono connessioni proprie: ricevono le misure con il contesto.
+        attiva_misure()
+        misura = MisuraRichiesta()
+
+        def query():
+            with connections['default'].cursor() as cursore:
+                cursore.execute("SELECT 1")
+
+        async_to_sync(esegui_in_pool_export)(query)
+        misura.stacca()
+        self.assertEqual(misura.query, 1)
+
+    def test_misura_staccata(self):
+        attiva_misure()
+        misura = MisuraRichiesta()
+        misura.stacca()
+        SaldoContoFinanziario.objects.count()
+        self.assertEqual(misura.query, 0)
+
+
+# ==============================================================================
+# === BUDGET DI QUERY DELLE VISTE                                           ===
+# ==============================================================================
+
+class BudgetQueryTest(DatiDiProvaTestCase):
+
+    def verifica_budget(self, **opzioni):
+        # Visita tutti gli URL come amministratore: viste in errore, oltre il budget o
+        # con query ripetute (N+1) fanno uscire il comando con CommandError.
+        uscita = StringIO()
+        try:
+            call_command('verifica_budget_query', tenant=self.tenant.pk, stdout=uscita, **opzioni)
+        except CommandError as errore:
+            self.fail(f"{errore}\n{uscita.getvalue()}")
+
+    def test_viste_nel_budget(self):
+        self.verifica_budget()
+
+    def test_viste_nel_budget_sotto_asgi(self):
+        self.verifica_budget(asgi=True)
+
+    @override_settings(CONTROLLO_QUERY=True, CONTROLLO_QUERY_ERRORE=True, QUERY_BUDGET_DEFAULT=1)
+    def test_budget_superato_sotto_asgi(self):
+        client = self.accedi(AsyncClient())
+        with self.assertRaisesMessage(BudgetQuerySuperato, 'anagrafica_list'):
+            async_to_sync(client.get)(reverse('anagrafica_list'), secure=True)
+
+
+# ==============================================================================
+# === SALDI GIORNALIERI                                                     ===
+# ==============================================================================
+
+class SaldoGiornalieroTest(DatiDiProvaTestCase):
+    IERI = AL - timedelta(days=1)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        aggiorna_tenant(cls.tenant.pk, cls.IERI)
+
+    def stato(self):
+        return StatoSaldiGiornalieri.objects.get()
+
+    def aggiorna_e_verifica(self):
+        aggiorna_tenant(self.tenant.pk, self.IERI)
+        self.assertEqual(self.stato().calcolati_al, self.IERI)
+        self.verifica('aggiorna_saldi_giornalieri')
+
+    def test_saldi_calcolati_allineati(self):
+        self.assertEqual(self.stato().calcolati_al, self.IERI)
+        self.verifica('aggiorna_saldi_giornalieri')
+
+    def test_ricostruzione(self):
+        call_command('aggiorna_saldi_giornalieri', tenant=self.tenant.pk, al=self.IERI, ricostruisci=True, stdout=StringIO())
+        self.aggiorna_e_verifica()
+
+    def test_movimento_in_un_giorno_fotografato(self):
+        giorno = AL - timedelta(days=40)
+        movimento = self.nuovo_movimento(data_registrazione=giorno)
+        self.assertEqual(self.stato().calcolati_al, giorno - timedelta(days=1))
+        self.assertFalse(SaldoGiornaliero.objects.filter(data__gte=giorno).exists())
+        self.aggiorna_e_verifica()
+
+        # Spostato più indietro: si ricalcola dalla data precedente.
+        movimento.data_registrazione = giorno - timedelta(days=60)
+        movimento.save()
+        self.assertEqual(self.stato().calcolati_al, giorno - timedelta(days=61))
+        self.aggiorna_e_verifica()
+
+        movimento.importo = Decimal('99.99')
+        movimento.save()
+        self.aggiorna_e_verifica()
+
+        movimento.delete()
+        self.assertEqual(self.stato().calcolati_al, giorno - timedelta(days=61))
+        self.aggiorna_e_verifica()
+
+    def test_rata_modificata(self):
+        scadenza = Scadenza.objects.filter(
+            documento__stato=DocumentoTestata.Stato.CONFERMATO, documento__data_documento__lt=self.IERI
+        ).select_related('documento').order_by('pk').first()
+        scadenza.importo_rata += Decimal('10.00')
+        scadenza.save()
+        self.assertEqual(self.stato().calcolati_al, scadenza.documento.data_documento - timedelta(days=1))
+        self.aggiorna_e_verifica()
+
+    def test_movimento_dopo_l_ultimo_giorno_fotografato(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.nuovo_movimento(data_registrazione=AL)
+        self.assertEqual(self.stato().calcolati_al, self.IERI)
+        self.verifica('aggiorna_saldi_giornalieri')
+
+    def test_scrittura_nel_blocco_in_calcolo(self):
+        # Un aggiornamento in corso ha prenotato i giorni fino a domani.
+        StatoSaldiGiornalieri.objects.update(in_calcolo_fino_a=AL + timedelta(days=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.nuovo_movimento(data_registrazione=AL)
+        stato = self.stato()
+        self.assertEqual((stato.calcolati_al, stato.in_calcolo_fino_a), (self.IERI, None))
+
+
+# ==============================================================================
+# === TOTALI MENSILI                                                        ===
+# ==============================================================================
+
+class TotaleMensileTest(DatiDiProvaTestCase):
+
+    def test_totali_generati_allineati(self):
+        self.verifica('ricostruisci_totali_mensili')
+
+    def test_movimenti(self):
+        cantiere, altro_cantiere = Cantiere.objects.order_by('pk')[:2]
+        movimento = self.nuovo_movimento(
+            cantiere=cantiere, conto_operativo=ContoOperativo.objects.filter(tipo=ContoOperativo.Tipo.RICAVO).first()
+        )
+        self.verifica('ricostruisci_totali_mensili')
+
+        movimento.data_registrazione -= timedelta(days=45)  # un altro mese
+        movimento.cantiere = altro_cantiere
+        movimento.conto_operativo = ContoOperativo.objects.filter(tipo=ContoOperativo.Tipo.COSTO).first()
+        movimento.tipo_movimento = PrimaNota.TipoMovimento.USCITA
+        movimento.importo = Decimal('67.89')
+        movimento.save()
+        self.verifica('ricostruisci_totali_mensili')
+
+        movimento.delete()
+        self.verifica('ricostruisci_totali_mensili')
+
+    def test_documenti(self):
+        documento = DocumentoTestata.objects.filter(
+            stato=DocumentoTestata.Stato.CONFERMATO, cantiere__isnull=False
+        ).order_by('pk').first()
+
+        documento.totale += Decimal('100.00')
+        documento.data_documento -= timedelta(days=45)
+        documento.cantiere = None
+        documento.save()
+        self.verifica('ricostruisci_totali_mensili')
+
+        documento.stato = DocumentoTestata.Stato.ANNULLATO
+        documento.save()
+        self.verifica('ricostruisci_totali_mensili')
+
+        documento.stato = DocumentoTestata.Stato.CONFERMATO
+        documento.save()
+        self.verifica('ricostruisci_totali_mensili')
+
+        documento.delete()
+        self.verifica('ricostruisci_totali_mensili')
+
+    def test_cantiere_eliminato(self):
+        cantiere = Cantiere.objects.filter(
+            totali_mensili_movimenti__isnull=False, totali_mensili_documenti__isnull=False
+        ).distinct().order_by('pk').first()
+        totale_documenti = sum(TotaleMensileDocumenti.objects.values_list('totale', flat=True))
+        totale_movimenti = sum(TotaleMensileMovimenti.objects.values_list('importo', flat=True))
+
+        cantiere_id = cantiere.pk
+        cantiere.delete()
+        self.assertFalse(TotaleMensileDocumenti.objects.filter(cantiere_id=cantiere_id).exists())
+        self.assertFalse(TotaleMensileMovimenti.objects.filter(cantiere_id=cantiere_id).exists())
+        self.assertEqual(sum(TotaleMensileDocumenti.objects.values_list('totale', flat=True)), totale_documenti)
+        self.assertEqual(sum(TotaleMensileMovimenti.objects.values_list('importo', flat=True)), totale_movimenti)
+        self.verifica('ricostruisci_totali_mensili')
@@ -0,0 +1,86 @@
+# gestionale/totali_mensili.py
+
+"""
+Ricostruzione e verifica dei totali mensili (TotaleMensileDocumenti e
+TotaleMensileMovimenti) a partire da documenti e movimenti di Prima Nota.
+
+Durante l'uso normale i totali vengono aggiornati a ogni scrittura:
+PrimaNota.save()/delete(), segnali dei documenti in gestionale/signals.py e,
+per le importazioni massive con bulk_create, registra_totali(). La
+ricostruzione completa serve al comando 'ricostruisci_totali_mensili' e al
+generatore dei dati di prova.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+
+from .models import DocumentoTestata, PrimaNota, TotaleMensileDocumenti, TotaleMensileMovimenti
+
+# Per ogni tabella dei totali: tabella di dettaglio, campo data e filtro sui record che contano.
+SORGENTI = {
+    TotaleMensileDocumenti: (DocumentoTestata, 'data_documento', {'stato': DocumentoTestata.Stato.CONFERMATO}),
+    TotaleMensileMovimenti: (PrimaNota, 'data_registrazione', {}),
+}
+
+
+def totali_attesi(modello, tenant_id):
+    """Totali ricalcolati dal dettaglio: {(mese, *chiave): importo}, senza i totali a zero."""
+    dettaglio, campo_data, filtro = SORGENTI[modello]
+    righe = dettaglio._base_manager.filter(tenant_id=tenant_id, **filtro).annotate(
+        mese=TruncMonth(campo_data)
+    ).values('mese', *modello.CAMPI_CHIAVE).annotate(totale=Sum(modello.CAMPO_IMPORTO)).order_by()
+    return {
+        (riga['mese'], *(riga[campo] for campo in modello.CAMPI_CHIAVE)): riga['totale']
+        for riga in righe if riga['totale']
+    }
+
+
+def totali_salvati(modello, tenant_id):
+    """Totali presenti nella tabella, nello stesso formato di totali_attesi()."""
+    righe = modello._base_manager.filter(tenant_id=tenant_id).exclude(**{modello.CAMPO_IMPORTO: 0})
+    return {
+        (mese, *chiave): importo
+        for mese, *chiave, importo in righe.values_list('mese', *modello.CAMPI_CHIAVE, modello.CAMPO_IMPORTO)
+    }
+
+
+def registra_totali(tenant_id, modello, oggetti):
+    """
+    Aggiunge ai totali mensili documenti o movimenti appena scritti con bulk_create,
+    con un aggiornamento per mese e chiave invece di uno per oggetto.
+    """
+    _, campo_data, filtro = SORGENTI[modello]
+    totali = defaultdict(Decimal)
+    for oggetto in oggetti:
+        if oggetto and all(getattr(oggetto, campo) == valore for campo, valore in filtro.items()):
+            chiave = tuple(getattr(oggetto, campo) for campo in modello.CAMPI_CHIAVE)
+            totali[getattr(oggetto, campo_data).replace(day=1), chiave] += getattr(oggetto, modello.CAMPO_IMPORTO)
+    for (mese, chiave), importo in totali.items():
+        modello.registra(tenant_id, mese, importo, **dict(zip(modello.CAMPI_CHIAVE, chiave)))
+
+
+def ricostruisci_tenant(tenant_id):
+    """
+    Riscrive da zero i totali mensili del tenant; restituisce le righe scritte.
+    Le righe esistenti vengono bloccate prima di leggere il dettaglio: le
+    scritture in corso che le hanno già aggiornate terminano prima della lettura
+    (e vi sono comprese), quelle successive aspettano la ricostruzione e
+    aggiungono il proprio importo alle righe nuove.
+    """
+    scritte = 0
+    with transaction.atomic():
+        for modello in SORGENTI:
+            righe = modello._base_manager.filter(tenant_id=tenant_id)
+            list(righe.select_for_update().values_list('pk', flat=True))
+            attesi = totali_attesi(modello, tenant_id)
+            righe.delete()
+            righe = modello._base_manager.bulk_create([
+                modello(tenant_id=tenant_id, mese=mese, **dict(zip(modello.CAMPI_CHIAVE, chiave)), **{modello.CAMPO_IMPORTO: importo})
+                for (mese, *chiave), importo in attesi.items()
+            ], batch_size=1000)
+            scritte += len(righe)
+    return scritte
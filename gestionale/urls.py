@@ -4,11 +4,12 @@ from .views import (
     AdminDashboardView, AliquotaIVACreateView, AliquotaIVAListView, AliquotaIVAToggleAttivoView, AliquotaIVAUpdateView, AnagraficaListExportExcelView, AnagraficaListExportPdfView, AnagraficaPartitarioExportPdfView, CantiereCreateView, CantiereDetailView, CantiereFascicoloExportExcelView, CantiereFascicoloExportPdfView, CantiereListExportExcelView, CantiereListExportPdfView, CantiereUpdateView, CausaleCreateView, CausaleListView, CausaleToggleAttivoView, CausaleUpdateView, ContoFinanziarioCreateView, ContoFinanziarioListView, ContoFinanziarioToggleAttivoView, ContoFinanziarioUpdateView, ContoOperativoCreateView, ContoOperativoListView, ContoOperativoToggleAttivoView, ContoOperativoUpdateView, DashboardAnalisiView, DashboardView, AnagraficaListView, AnagraficaCreateView, DipendenteDetailView, 
     DipendenteDettaglioCreateView, AnagraficaUpdateView, AnagraficaDetailView,
     AnagraficaToggleAttivoView, DipendenteUpdateView, DocumentoDeleteView, DocumentoListExportExcelView, DocumentoListExportPdfView, 
-    DocumentoListView, DocumentoDetailView, ExportTabelleContabiliView, ExportTabelleSistemaView, MezzoAziendaleCreateView, MezzoAziendaleListView, MezzoAziendaleToggleAttivoView, MezzoAziendaleUpdateView, ModalitaPagamentoCreateView, ModalitaPagamentoListView, ModalitaPagamentoToggleAttivoView, ModalitaPagamentoUpdateView, PagamentoDeleteView, PagamentoUpdateView, PrimaNotaCreateView, PrimaNotaListExportExcelView, PrimaNotaListExportPdfView, PrimaNotaListView,RegistraPagamentoView, SalvaAttivitaDiarioView, ScadenzaPersonaleCreateView, ScadenzaPersonaleDeleteView, ScadenzaPersonaleUpdateView, ScadenzarioExportPdfView,
+    DocumentoListView, DocumentoDetailView, ExportTabelleContabiliView, ExportTabelleSistemaView, ImportazioneDatiView, MezzoAziendaleCreateView, MezzoAziendaleListView, MezzoAziendaleToggleAttivoView, MezzoAziendaleUpdateView, ModalitaPagamentoCreateView, ModalitaPagamentoListView, ModalitaPagamentoToggleAttivoView, ModalitaPagamentoUpdateView, PagamentoDeleteView, PagamentoUpdateView, PrimaNotaCreateView, PrimaNotaListExportExcelView, PrimaNotaListExportPdfView, PrimaNotaListView,RegistraPagamentoView, SalvaAttivitaDiarioView, ScadenzaPersonaleCreateView, ScadenzaPersonaleDeleteView, ScadenzaPersonaleUpdateView, ScadenzarioExportPdfView,
     ScadenzarioListView, ScadenzarioExportExcelView, AnagraficaPartitarioExportExcelView,
-    DashboardHRView, PrimaNotaCreateView, PrimaNotaUpdateView, PrimaNotaDeleteView, DocumentoDetailExportPdfView, TesoreriaDashboardView, TesoreriaExportExcelView, TesoreriaExportPdfView, TipoScadenzaPersonaleCreateView, TipoScadenzaPersonaleListView, TipoScadenzaPersonaleToggleAttivoView, TipoScadenzaPersonaleUpdateView, GetContoFinanziarioSaldoView
+    DashboardHRView, PrimaNotaCreateView, PrimaNotaUpdateView, PrimaNotaDeleteView, DocumentoDetailExportPdfView, TesoreriaDashboardView, TesoreriaExportExcelView, TesoreriaExportPdfView, TipoScadenzaPersonaleCreateView, TipoScadenzaPersonaleListView, TipoScadenzaPersonaleToggleAttivoView, TipoScadenzaPersonaleUpdateView, GetContoFinanziarioSaldoView,
+    ReportAccodaView, ReportDownloadView, ReportListView, ReportStatoView
 )
-from .views import documento_create_step1_testata, documento_create_step2_righe, documento_create_step3_scadenze, get_anagrafiche_by_tipo
+from .views import documento_create_step1_testata, documento_create_step2_righe, documento_create_step3_scadenze, get_anagrafiche_by_tipo, autocomplete
 
 urlpatterns = [
     path('', DashboardView.as_view(), name='dashboard'),
@@ -23,6 +24,7 @@ urlpatterns = [
     path('documenti/nuovo/step2/', documento_create_step2_righe, name='documento_create_step2_righe'),
     path('documenti/nuovo/step3/', documento_create_step3_scadenze, name='documento_create_step3_scadenze'),
     path('api/get-anagrafiche/', get_anagrafiche_by_tipo, name='api_get_anagrafiche'),
+    path('api/autocomplete/<str:sorgente>/', autocomplete, name='api_autocomplete'),
     path('anagrafiche/<int:pk>/', AnagraficaDetailView.as_view(), name='anagrafica_detail'),
     path('pagamenti/registra/', RegistraPagamentoView.as_view(), name='registra_pagamento'),
     path('scadenzario/', ScadenzarioListView.as_view(), name='scadenzario_list'),
@@ -95,6 +97,7 @@ urlpatterns = [
     # NUOVO URL PER EXPORT DI SISTEMA
     path('admin-panel/export-sistema/', ExportTabelleSistemaView.as_view(), name='export_tabelle_sistema'),
     path('admin-panel/export-contabili/', ExportTabelleContabiliView.as_view(), name='export_tabelle_contabili'),
+    path('admin-panel/importazione/', ImportazioneDatiView.as_view(), name='importazione_dati'),
     path('dipendenti/<int:pk>/modifica/', DipendenteUpdateView.as_view(), name='dipendente_update'),
     # NUOVI URL PER CRUD CANTIERI
     path('cantieri/nuovo/', CantiereCreateView.as_view(), name='cantiere_create'),
@@ -110,5 +113,11 @@ urlpatterns = [
     path('documenti/<int:pk>/elimina/', DocumentoDeleteView.as_view(), name='documento_delete'),
     # NUOVO URL PER LA DASHBOARD DI ANALISI
     path('dashboard-analisi/', DashboardAnalisiView.as_view(), name='dashboard_analisi'),
+    # REPORT IN BACKGROUND
+    path('report/', ReportListView.as_view(), name='report_list'),
+    path('report/accoda/<str:vista>/', ReportAccodaView.as_view(), name='report_accoda'),
+    path('report/accoda/<str:vista>/<int:pk>/', ReportAccodaView.as_view(), name='report_accoda_oggetto'),
+    path('report/<int:pk>/stato/', ReportStatoView.as_view(), name='report_stato'),
+    path('report/<int:pk>/download/', ReportDownloadView.as_view(), name='report_download'),
 
 ]
@@ -6,20 +6,26 @@
 # Standard Library
 from dataclasses import field
 import json
+import os
+from inspect import iscoroutine
 from datetime import date, timedelta,datetime
 today = date.today()
 from decimal import Decimal
 
 # Django Core
+from asgiref.sync import iscoroutinefunction
 from django import forms
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.views import redirect_to_login
+from django.core.exceptions import ValidationError
 from django.core.paginator import Paginator
 from django.db import models, transaction
-from django.db.models import Q, Sum, Value, Case, When, F, Count, DecimalField
+from django.db.models import Q, Sum, Value, F, DecimalField, Prefetch
 from django.db.models.functions import Coalesce
-from django.http import HttpResponse, HttpResponseRedirect, JsonResponse, HttpResponseForbidden
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect, JsonResponse, HttpResponseForbidden
 from django.shortcuts import get_object_or_404, redirect, render
 from django.template.loader import render_to_string
 from django.urls import reverse, reverse_lazy
@@ -34,8 +40,7 @@ from django.apps import apps
 
 # Librerie di terze parti
 import openpyxl
-from openpyxl import Workbook
-from openpyxl.styles import Alignment, Font
+from openpyxl.styles import Alignment
 from weasyprint import HTML
 
 # Importazioni delle app locali
@@ -44,14 +49,31 @@ from .forms import (
     DocumentoFilterForm, DocumentoRigaForm, DocumentoTestataForm, MezzoAziendaleForm, ModalitaPagamentoForm,
     PagamentoForm, PartitarioFilterForm, PrimaNotaFilterForm, PrimaNotaForm, ScadenzaPersonaleForm,
     ScadenzarioFilterForm, ScadenzaWizardForm,PrimaNotaUpdateForm,PagamentoUpdateForm, TipoScadenzaPersonaleForm, CantiereForm,
-    AnagraficaFilterForm, FascicoloCantiereFilterForm
+    AnagraficaFilterForm, FascicoloCantiereFilterForm, ImportazioneDatiForm
 )
 from .models import (
     AliquotaIVA, Anagrafica, Cantiere, Causale, ContoFinanziario,
     ContoOperativo, DiarioAttivita, DipendenteDettaglio, DocumentoRiga,
-    DocumentoTestata, MezzoAziendale, ModalitaPagamento, PrimaNota, Scadenza, TipoScadenzaPersonale, ScadenzaPersonale
+    DocumentoTestata, MezzoAziendale, ModalitaPagamento, PrimaNota, Scadenza, TipoScadenzaPersonale, ScadenzaPersonale,
+    RichiestaReport, SaldoContoFinanziario
 )
-from .report_utils import build_filters_string, generate_excel_report, generate_pdf_report
+from .report_utils import (
+    build_filters_string, contenuto_risposta, generate_excel_report_streaming, generate_pdf_report, nome_file_allegato,
+)
+from .cache_artefatti import cache_attiva, chiave_artefatto, leggi_artefatto, salva_artefatto, versione_dati
+from .righe_export import (
+    righe_anagrafiche, righe_diario_cantiere, righe_documenti, righe_documenti_cantiere,
+    righe_movimenti, righe_movimenti_cantiere, righe_scadenze,
+)
+from .report_in_coda import REPORT_ACCODABILI, accoda_report, vista_consentita
+from .ricerca import cerca_anagrafiche
+from .autocomplete import acerca_opzioni
+from .pool_export import vista_in_pool_export
+from .paginazione import pagina_lista
+from .documenti import crea_documento
+from .importazione import IMPORTATORI, importa
+from .export_tabelle import export_tabelle
+from .kpi import calcola_kpi_cantiere, calcola_kpi_dashboard, calcola_kpi_periodo, conta_anagrafiche_attive, kpi_in_cache
 from tenants.models import Company
 from .templatetags import currency_filters
 
@@ -63,18 +85,48 @@ from .forms import AnalisiFilterForm
 # === MIXINS E FUNZIONI HELPER GLOBALI                                      ===
 # ==============================================================================
 
+def ruolo_corrente(request):
+    """
+    Ruolo dell'utente nell'azienda attiva, verificato da TenantMiddleware (o
+    dal worker dei report per le richieste che ricostruisce). Le richieste che
+    non passano da nessuno dei due usano il ruolo salvato in sessione.
+    """
+    if hasattr(request, 'company_role'):
+        return request.company_role
+    return request.session.get('user_company_role')
+
+
 class TenantRequiredMixin(LoginRequiredMixin, View):
-    """Mixin per assicurare che un tenant sia attivo in sessione."""
+    """
+    Mixin per assicurare che un tenant sia attivo in sessione.
+    Vale anche per le viste async (handler 'async def'): utente e sessione
+    vengono letti con le API async, senza bloccare l'event loop.
+    """
     def dispatch(self, request, *args, **kwargs):
+        if self.view_is_async:
+            return self._dispatch_async(request, *args, **kwargs)
         if not request.session.get('active_tenant_id'):
             return redirect(reverse('tenant_selection'))
         return super().dispatch(request, *args, **kwargs)
 
+    async def _dispatch_async(self, request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path(), self.get_login_url(), self.get_redirect_field_name())
+        if not await request.session.aget('active_tenant_id'):
+            return redirect(reverse('tenant_selection'))
+        # Saltiamo LoginRequiredMixin (già verificato); gli altri mixin restituiscono
+        # una risposta (accesso negato) oppure la coroutine dell'handler.
+        response = super(LoginRequiredMixin, self).dispatch(request, *args, **kwargs)
+        if iscoroutine(response):
+            response = await response
+        return response
+
 
 class AdminRequiredMixin(AccessMixin):
     """Verifica che l'utente abbia il ruolo di 'admin' in sessione."""
     def dispatch(self, request, *args, **kwargs):
-        if request.session.get('user_company_role') != 'admin':
+        if ruolo_corrente(request) != 'admin':
             messages.error(request, "Accesso negato. È richiesta l'autorizzazione di un amministratore.")
             # Reindirizza a una pagina sicura, come la dashboard
             return redirect(reverse_lazy('dashboard'))
@@ -85,12 +137,66 @@ class RoleRequiredMixin(AccessMixin):
     allowed_roles = [] # Deve essere sovrascritto dalle classi figlie
 
     def dispatch(self, request, *args, **kwargs):
-        user_role = request.session.get('user_company_role')
+        user_role = ruolo_corrente(request)
         if user_role not in self.allowed_roles:
             messages.error(request, "Accesso negato. Non hai i permessi necessari.")
             return redirect(reverse_lazy('dashboard')) # O una pagina di errore permessi
         return super().dispatch(request, *args, **kwargs)
 
+class ExportInThreadPoolMixin(View):
+    """
+    Sotto ASGI (SERVER_ASGI) esegue l'intera vista di export, controlli
+    compresi, nel pool di thread dedicato agli export (gestionale/pool_export.py).
+    Sotto waitress la vista resta quella sincrona di sempre.
+    """
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        return vista_in_pool_export(view) if settings.SERVER_ASGI else view
+
+
+class ExportInCacheMixin(ExportInThreadPoolMixin):
+    """
+    Serve gli export da cache su disco quando dati e filtri non sono cambiati
+    (vedi gestionale/cache_artefatti.py).
+
+    Va elencato DOPO la vista da cui si eredita (es. 'class X(DocumentoListView,
+    ExportInCacheMixin)'): così il suo dispatch viene eseguito dopo i controlli su
+    login, tenant e ruolo e subito prima del get() che genera il file.
+    Le sottoclassi indicano in 'modelli_dati' le tabelle lette dal report, oppure
+    ridefiniscono get_dati_versionati() per limitarle ai record coinvolti.
+    """
+    modelli_dati = []
+
+    def get_dati_versionati(self, request, *args, **kwargs):
+        return [modello.objects.all() for modello in self.modelli_dati]
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method != 'GET' or not cache_attiva():
+            return super().dispatch(request, *args, **kwargs)
+
+        versione = versione_dati(self.get_dati_versionati(request, *args, **kwargs))
+        if versione is None:
+            return super().dispatch(request, *args, **kwargs)
+        chiave = chiave_artefatto(
+            request.session['active_tenant_id'],
+            self.__class__.__name__,
+            [kwargs, sorted(request.GET.lists())],
+            versione,
+        )
+        percorso = leggi_artefatto(chiave)
+        if percorso is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code != 200 or not response.has_header('Content-Disposition'):
+                return response
+            nome_file = nome_file_allegato(response, f"{self.__class__.__name__}.bin")
+            try:
+                percorso = salva_artefatto(chiave, nome_file, contenuto_risposta(response))
+            finally:
+                response.close()
+        return FileResponse(open(percorso, 'rb'), as_attachment=True, filename=os.path.basename(percorso))
+
+
 def role_required(allowed_roles=None):
     """Decoratore per le viste basate su funzioni che richiede uno o più ruoli specifici."""
     if allowed_roles is None:
@@ -99,7 +205,7 @@ def role_required(allowed_roles=None):
     def decorator(view_func):
         @wraps(view_func)
         def _wrapped_view(request, *args, **kwargs):
-            user_role = request.session.get('user_company_role')
+            user_role = ruolo_corrente(request)
             if user_role not in allowed_roles:
                 messages.error(request, "Accesso negato. Non hai i permessi necessari.")
                 return redirect(reverse_lazy('dashboard')) # O una pagina di errore permessi
@@ -114,7 +220,16 @@ def clear_doc_wizard_session(session):
     session.pop('doc_scadenze_data', None)
 
 def tenant_required(view_func):
-    """Decoratore per le viste basate su funzioni che richiede un tenant attivo in sessione."""
+    """Decoratore per le viste basate su funzioni (anche async) che richiede un tenant attivo in sessione."""
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def _wrapped_view_async(request, *args, **kwargs):
+            if not await request.session.aget('active_tenant_id'):
+                messages.error(request, "Seleziona un'azienda per continuare.")
+                return redirect(reverse('tenant_selection'))
+            return await view_func(request, *args, **kwargs)
+        return _wrapped_view_async
+
     @wraps(view_func)
     def _wrapped_view(request, *args, **kwargs):
         if not request.session.get('active_tenant_id'):
@@ -147,11 +262,7 @@ class AnagraficaListView(TenantRequiredMixin, RoleRequiredMixin, View):
             attivo_str = filter_form.cleaned_data.get('attivo')
 
             if q:
-                anagrafiche_list = anagrafiche_list.filter(
-                    Q(nome_cognome_ragione_sociale__icontains=q) |
-                    Q(citta__icontains=q) |
-                    Q(p_iva__icontains=q)
-                )
+                anagrafiche_list = cerca_anagrafiche(anagrafiche_list, q)
             
             if tipo:
                 anagrafiche_list = anagrafiche_list.filter(tipo=tipo)
@@ -438,74 +549,26 @@ def documento_create_step3_scadenze(request):
                 form = ScadenzaWizardForm(initial=get_scadenza_initial_data(testata_data, scadenze_data, residuo_da_scadenzare))
             else:
                 # --- INIZIO BLOCCO DI FINALIZZAZIONE SICURO ---
+                # Validazione in memoria e salvataggio con bulk_create in un'unica transazione (gestionale/documenti.py)
                 try:
-                    with transaction.atomic():
-                        # Recupera gli oggetti collegati in modo sicuro
-                        anagrafica = get_object_or_404(Anagrafica, pk=testata_data.get('anagrafica_id'))
-                        modalita_pagamento = get_object_or_404(ModalitaPagamento, pk=testata_data.get('modalita_pagamento_id'))
-                        cantiere = None
-                        if testata_data.get('cantiere_id'):
-                            cantiere = get_object_or_404(Cantiere, pk=testata_data.get('cantiere_id'))
-
-                        # Logica di numerazione automatica (invariata)
-                        tipo_doc = testata_data['tipo_doc']
-                        numero_doc_finale = ""
-                        prefissi_vendita = {
-                            DocumentoTestata.TipoDoc.FATTURA_VENDITA: 'FT',
-                            DocumentoTestata.TipoDoc.NOTA_CREDITO_VENDITA: 'NC',
-                        }
-                        if tipo_doc in prefissi_vendita:
-                            prefisso = prefissi_vendita[tipo_doc]
-                            anno_corrente = date.today().year
-                            ultimo_documento = DocumentoTestata.objects.filter(tipo_doc=tipo_doc, data_documento__year=anno_corrente).order_by('numero_documento').last()
-                            if ultimo_documento and ultimo_documento.numero_documento:
-                                try:
-                                    nuovo_progressivo = int(ultimo_documento.numero_documento.split('-')[-1]) + 1
-                                except (IndexError, ValueError):
-                                    nuovo_progressivo = 1
-                            else:
-                                nuovo_progressivo = 1
-                            numero_doc_finale = f"{prefisso}-{anno_corrente}-{nuovo_progressivo:06d}"
-                        else:
-                            numero_doc_finale = testata_data.get('numero_documento_manuale', 'ERRORE_NUM_MANCANTE')
-
-                        # Creazione degli oggetti nel database
-                        nuova_testata = DocumentoTestata.objects.create(
-                            tipo_doc=tipo_doc, anagrafica=anagrafica,
-                            data_documento=date.fromisoformat(testata_data['data_documento']),
-                            numero_documento=numero_doc_finale, modalita_pagamento=modalita_pagamento,
-                            cantiere=cantiere, note=testata_data['note'],
-                            imponibile=sum(Decimal(r['imponibile_riga']) for r in righe_data),
-                            iva=sum(Decimal(r['iva_riga']) for r in righe_data),
-                            totale=totale_documento, stato=DocumentoTestata.Stato.CONFERMATO,
-                            created_by=request.user, updated_by=request.user
-                        )
-                        for riga in righe_data:
-                            DocumentoRiga.objects.create(
-                                testata=nuova_testata, descrizione=riga['descrizione'], quantita=riga['quantita'],
-                                prezzo_unitario=riga['prezzo_unitario'], aliquota_iva_id=riga['aliquota_iva_id'],
-                                imponibile_riga=riga['imponibile_riga'], iva_riga=riga['iva_riga']
-                            )
-                        for scadenza in scadenze_data:
-                            Scadenza.objects.create(
-                                documento=nuova_testata, anagrafica=anagrafica,
-                                data_scadenza=date.fromisoformat(scadenza['data_scadenza']),
-                                importo_rata=scadenza['importo_rata'],
-                                tipo_scadenza=Scadenza.Tipo.INCASSO if 'V' in nuova_testata.tipo_doc else Scadenza.Tipo.PAGAMENTO
-                            )
-                        
-                        clear_doc_wizard_session(request.session)
-                        messages.success(request, f"Documento {nuova_testata} creato con successo!")
-                        return redirect(nuova_testata.get_absolute_url())
-
+                    nuova_testata = crea_documento(
+                        request.session['active_tenant_id'], request.user, testata_data, righe_data, scadenze_data
+                    )
                 except (Anagrafica.DoesNotExist, ModalitaPagamento.DoesNotExist, Cantiere.DoesNotExist):
                     messages.error(request, "Errore critico: uno dei record selezionati (cliente, modalità di pagamento o cantiere) non esiste più. Il processo è stato annullato. Si prega di ricominciare.")
                     clear_doc_wizard_session(request.session)
                     return redirect(reverse('documento_create_step1_testata'))
+                except ValidationError as e:
+                    messages.error(request, " ".join(e.messages))
+                    return redirect(reverse('documento_create_step3_scadenze'))
                 except Exception as e:
                     messages.error(request, f"Si è verificato un errore imprevisto durante il salvataggio: {e}. Il processo è stato annullato.")
                     clear_doc_wizard_session(request.session)
                     return redirect(reverse('documento_create_step1_testata'))
+
+                clear_doc_wizard_session(request.session)
+                messages.success(request, f"Documento {nuova_testata} creato con successo!")
+                return redirect(nuova_testata.get_absolute_url())
                 # --- FINE BLOCCO DI FINALIZZAZIONE SICURO ---
         
         # Caso B: L'utente aggiunge una nuova scadenza
@@ -621,42 +684,75 @@ class DocumentoDeleteView(TenantRequiredMixin, RoleRequiredMixin, View):
 # === VISTE API (per richieste AJAX)                                        ===
 # ==============================================================================
 
+# Le API sono viste async: sotto ASGI vengono servite dall'event loop con l'ORM
+# async, senza attendere un thread libero; sotto waitress Django le esegue
+# comunque in modo sincrono.
+
 @login_required
 @tenant_required
-def get_anagrafiche_by_tipo(request):
+async def get_anagrafiche_by_tipo(request):
+    """
+    Anagrafiche selezionabili nel wizard documenti: clienti per i documenti di vendita,
+    fornitori per quelli di acquisto. Stessi parametri e risposta paginata di 'autocomplete'.
+    """
     tipo_documento = request.GET.get('tipo_doc')
-    anagrafiche_qs = Anagrafica.objects.none()
 
     # Logica per i documenti di VENDITA
     if tipo_documento in [DocumentoTestata.TipoDoc.FATTURA_VENDITA, DocumentoTestata.TipoDoc.NOTA_CREDITO_VENDITA]:
-        anagrafiche_qs = Anagrafica.objects.filter(tipo=Anagrafica.Tipo.CLIENTE, attivo=True)
-    
-    # === NUOVA LOGICA PER I DOCUMENTI DI ACQUISTO ===
+        tipo_anagrafica = Anagrafica.Tipo.CLIENTE
+    # Logica per i documenti di ACQUISTO
     elif tipo_documento in [DocumentoTestata.TipoDoc.FATTURA_ACQUISTO, DocumentoTestata.TipoDoc.NOTA_CREDITO_ACQUISTO]:
-        anagrafiche_qs = Anagrafica.objects.filter(tipo=Anagrafica.Tipo.FORNITORE, attivo=True)
+        tipo_anagrafica = Anagrafica.Tipo.FORNITORE
+    else:
+        return JsonResponse({'results': [], 'pagination': {'more': False}})
+
+    return JsonResponse(await acerca_opzioni(
+        'anagrafica', request.GET.get('q'), tipo_anagrafica, request.GET.get('page'), request.GET.get('limit')
+    ))
 
-    data = [{'id': anag.pk, 'text': str(anag)} for anag in anagrafiche_qs]
-    return JsonResponse({'results': data})
+
+@login_required
+@tenant_required
+async def autocomplete(request, sorgente):
+    """
+    Opzioni per i campi con autocompletamento (widget AutocompleteSelect).
+    Parametri GET: q (testo cercato), tipo (filtro della sorgente), page, limit.
+    """
+    try:
+        dati = await acerca_opzioni(
+            sorgente, request.GET.get('q'), request.GET.get('tipo'), request.GET.get('page'), request.GET.get('limit')
+        )
+    except KeyError:
+        raise Http404("Sorgente di autocompletamento non trovata.")
+    return JsonResponse(dati)
 
 # ==============================================================================
 # === VISTE DOCUMENTI (Dettaglio/Partitario)                              ===
 # ==============================================================================
 
 
+def annota_pagato_scadenze(queryset):
+    """
+    Espone importo pagato e residuo (memorizzati sulla scadenza) con i nomi
+    'pagato' e 'residuo' usati da template ed export, senza JOIN sui pagamenti.
+    """
+    return queryset.annotate(pagato=F('importo_pagato'), residuo=F('importo_residuo'))
+
 def get_documento_dettaglio_context(pk):
     """
     Funzione helper che recupera tutti i dati necessari per la vista
     di dettaglio di un documento, ma SENZA applicare la paginazione.
     """
-    documento = get_object_or_404(DocumentoTestata, pk=pk)
+    # Le righe con la loro aliquota IVA sono lette dai template: una query sola per tutte.
+    documento = get_object_or_404(
+        DocumentoTestata.objects.select_related('anagrafica', 'cantiere').prefetch_related(
+            Prefetch('righe', queryset=DocumentoRiga.objects.select_related('aliquota_iva'))
+        ),
+        pk=pk,
+    )
 
-    # Recupera i queryset completi e annota le scadenze con l'importo già pagato
-    # Codice OTTIMIZZATO
-    scadenze_qs = Scadenza.objects.filter(documento=documento).annotate(
-        pagato=Coalesce(Sum('pagamenti__importo'), Value(0), output_field=models.DecimalField()),
-        # Aggiungiamo il calcolo del residuo direttamente nella query
-        residuo=models.F('importo_rata') - models.F('pagato')
-    ).order_by('data_scadenza')
+    # Recupera i queryset completi; pagato e residuo sono già memorizzati sulla scadenza
+    scadenze_qs = annota_pagato_scadenze(Scadenza.objects.filter(documento=documento)).order_by('data_scadenza')
 
     cronologia_pagamenti_qs = PrimaNota.objects.filter(
         scadenza_collegata__documento=documento
@@ -722,6 +818,10 @@ class DocumentoListView(TenantRequiredMixin, RoleRequiredMixin, View):
     """
     template_name = 'gestionale/documento_list.html'
     paginate_by = 15
+    # Ordinamento della lista (univoco, per la paginazione a cursore)
+    ordinamento = ['data_documento', 'numero_documento', 'pk']
+    # Tabelle lette dagli export (versione dei dati per ExportInCacheMixin)
+    modelli_dati = [DocumentoTestata, Anagrafica]
 
     def _get_filtered_data(self, request):
         """
@@ -747,9 +847,7 @@ class DocumentoListView(TenantRequiredMixin, RoleRequiredMixin, View):
     def get(self, request, *args, **kwargs):
         documenti_qs, filter_form = self._get_filtered_data(request)
         
-        paginator = Paginator(documenti_qs, self.paginate_by)
-        page_number = request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
+        page_obj = pagina_lista(request, documenti_qs, self.ordinamento, self.paginate_by)
         
         context = {
             'documenti': page_obj,
@@ -759,7 +857,7 @@ class DocumentoListView(TenantRequiredMixin, RoleRequiredMixin, View):
         }
         return render(request, self.template_name, context)
 
-class DocumentoListExportExcelView(DocumentoListView):
+class DocumentoListExportExcelView(DocumentoListView, ExportInCacheMixin):
     """
     Esporta la lista filtrata dei documenti in formato Excel.
     """
@@ -786,25 +884,15 @@ class DocumentoListExportExcelView(DocumentoListView):
         filtri_str = " | ".join(filtri_attivi) if filtri_attivi else "Nessun filtro"
         
         headers = ["Tipo", "Numero", "Data", "Cliente/Fornitore", "Totale", "Stato"]
-        data_rows = []
-        for doc in documenti_qs:
-            data_rows.append([
-                doc.get_tipo_doc_display(),
-                doc.numero_documento,
-                doc.data_documento,
-                doc.anagrafica.nome_cognome_ragione_sociale,
-                doc.totale,
-                doc.get_stato_display()
-            ])
-            
-        report_sections = [{'title': 'Elenco Documenti', 'headers': headers, 'rows': data_rows}]
+        # Le righe vengono generate man mano che il report le scrive (vedi righe_export.py).
+        report_sections = [{'title': 'Elenco Documenti', 'headers': headers, 'rows': righe_documenti(documenti_qs)}]
             
-        return generate_excel_report(
+        return generate_excel_report_streaming(
             tenant_name, report_title, filtri_str, None, report_sections,
             filename_prefix=filename_prefix
         )
 
-class DocumentoListExportPdfView(DocumentoListView):
+class DocumentoListExportPdfView(DocumentoListView, ExportInCacheMixin):
     """
     Esporta la lista filtrata dei documenti in formato PDF.
     """
@@ -840,11 +928,23 @@ class DocumentoListExportPdfView(DocumentoListView):
             context
         )
 
-class DocumentoDetailExportPdfView(TenantRequiredMixin, RoleRequiredMixin, View):
+class DocumentoDetailExportPdfView(TenantRequiredMixin, RoleRequiredMixin, ExportInCacheMixin, View):
    allowed_roles = ['admin', 'contabile', 'visualizzatore']
    """
    Gestisce la generazione e il download del PDF per il dettaglio di un documento.
    """
+   def get_dati_versionati(self, request, *args, **kwargs):
+       pk = kwargs['pk']
+       return [
+           DocumentoTestata.objects.filter(pk=pk),
+           DocumentoRiga.objects.filter(testata_id=pk),
+           AliquotaIVA.objects.filter(documentoriga__testata_id=pk),
+           Scadenza.objects.filter(documento_id=pk),
+           PrimaNota.objects.filter(scadenza_collegata__documento_id=pk),
+           Anagrafica.objects.filter(documenti=pk),
+           ContoFinanziario.objects.all(),
+       ]
+
    def get(self, request, *args, **kwargs):
        # 1. Recupera tutti i dati necessari usando la funzione helper esistente.
        # Nota: la funzione helper restituisce i queryset completi, non paginati.
@@ -887,6 +987,18 @@ class AnagraficaDetailView(TenantRequiredMixin, RoleRequiredMixin, View):
     di recupero dati riutilizzata dagli export.
     """
     template_name = 'gestionale/anagrafica_detail.html'
+
+    def get_dati_versionati(self, request, *args, **kwargs):
+        """Record letti dal partitario (versione dei dati per ExportInCacheMixin)."""
+        pk = kwargs['pk']
+        return [
+            Anagrafica.objects.filter(pk=pk),
+            DocumentoTestata.objects.filter(anagrafica_id=pk),
+            Scadenza.objects.filter(anagrafica_id=pk),
+            PrimaNota.objects.filter(anagrafica_id=pk),
+            ContoFinanziario.objects.all(),
+            Causale.objects.all(),
+        ]
     
     def _get_partitario_data(self, request, anagrafica_pk):
         """
@@ -934,11 +1046,9 @@ class AnagraficaDetailView(TenantRequiredMixin, RoleRequiredMixin, View):
         
         # 3. APPLICA ORDINAMENTI E ANNOTAZIONI AI DATI DEL PERIODO
         documenti = documenti_periodo.order_by('-data_documento')
-        scadenze_aperte = scadenze_periodo.annotate(
-            pagato=Coalesce(Sum('pagamenti__importo'), Value(0), output_field=models.DecimalField()),
-            residuo=models.F('importo_rata') - models.F('pagato')
-        ).order_by('data_scadenza')
-        movimenti = movimenti_periodo.order_by('-data_registrazione')
+        # I template del partitario leggono documento e conto di ogni riga: li carichiamo nella stessa query.
+        scadenze_aperte = annota_pagato_scadenze(scadenze_periodo).select_related('documento').order_by('data_scadenza')
+        movimenti = movimenti_periodo.select_related('conto_finanziario').order_by('-data_registrazione')
         
         # 4. CALCOLA I KPI DEL PERIODO
         esposizione_periodo = sum(doc.totale if 'V' in doc.tipo_doc else -doc.totale for doc in documenti)
@@ -974,7 +1084,7 @@ class AnagraficaDetailView(TenantRequiredMixin, RoleRequiredMixin, View):
         context['conti_finanziari'] = ContoFinanziario.objects.filter(attivo=True)
         return render(request, self.template_name, context)
 
-class AnagraficaPartitarioExportExcelView(AnagraficaDetailView):
+class AnagraficaPartitarioExportExcelView(AnagraficaDetailView, ExportInCacheMixin):
     """
     Gestisce la creazione e il download di un report Excel per il partitario
     completo e filtrato di una specifica anagrafica.
@@ -1077,7 +1187,7 @@ class AnagraficaPartitarioExportExcelView(AnagraficaDetailView):
 
         # 4. CHIAMATA ALLA FUNZIONE DI UTILITY
         # Passiamo tutti i dati preparati alla nostra funzione centralizzata.
-        return generate_excel_report(
+        return generate_excel_report_streaming(
             tenant_name=tenant_name,
             report_title=report_title,
             filters_string=filtri_str,
@@ -1086,7 +1196,7 @@ class AnagraficaPartitarioExportExcelView(AnagraficaDetailView):
             filename_prefix=filename_prefix
         )  
 
-class AnagraficaPartitarioExportPdfView(AnagraficaDetailView):
+class AnagraficaPartitarioExportPdfView(AnagraficaDetailView, ExportInCacheMixin):
     """
     Gestisce la creazione e il download di un report PDF per il partitario
     completo e filtrato di una specifica anagrafica.
@@ -1131,8 +1241,9 @@ class AnagraficaPartitarioExportPdfView(AnagraficaDetailView):
         )
 
 
-class AnagraficaListExportExcelView(TenantRequiredMixin, RoleRequiredMixin, View):
+class AnagraficaListExportExcelView(TenantRequiredMixin, RoleRequiredMixin, ExportInCacheMixin, View):
     allowed_roles = ['admin', 'contabile', 'visualizzatore']
+    modelli_dati = [Anagrafica]
 
     def get(self, request, *args, **kwargs):
         # Riutilizziamo la stessa logica di filtraggio
@@ -1144,7 +1255,7 @@ class AnagraficaListExportExcelView(TenantRequiredMixin, RoleRequiredMixin, View
             tipo = filter_form.cleaned_data.get('tipo')
             attivo_str = filter_form.cleaned_data.get('attivo')
             if q:
-                query = query.filter(Q(nome_cognome_ragione_sociale__icontains=q) | Q(citta__icontains=q) | Q(p_iva__icontains=q))
+                query = cerca_anagrafiche(query, q)
             if tipo:
                 query = query.filter(tipo=tipo)
             if attivo_str:
@@ -1153,10 +1264,10 @@ class AnagraficaListExportExcelView(TenantRequiredMixin, RoleRequiredMixin, View
         report_sections = [{
             'title': 'Lista Anagrafiche',
             'headers': ['Codice', 'Nome/Ragione Sociale', 'Tipo', 'P.IVA', 'C.F.', 'Città', 'Stato'],
-            'rows': [[a.codice, a.nome_cognome_ragione_sociale, a.get_tipo_display(), a.p_iva, a.codice_fiscale, a.citta, "Attivo" if a.attivo else "Non Attivo"] for a in query]
+            'rows': righe_anagrafiche(query)
         }]
         
-        return generate_excel_report(
+        return generate_excel_report_streaming(
             tenant_name=request.session.get('active_tenant_name', 'N/A'),
             report_title="Lista Anagrafiche",
             filters_string=build_filters_string(filter_form),
@@ -1165,11 +1276,12 @@ class AnagraficaListExportExcelView(TenantRequiredMixin, RoleRequiredMixin, View
             filename_prefix="anagrafiche"
         )
 
-class AnagraficaListExportPdfView(TenantRequiredMixin, RoleRequiredMixin, View):
+class AnagraficaListExportPdfView(TenantRequiredMixin, RoleRequiredMixin, ExportInCacheMixin, View):
     """
     Esporta la lista filtrata delle anagrafiche in formato PDF.
     """
     allowed_roles = ['admin', 'contabile', 'visualizzatore']
+    modelli_dati = [Anagrafica]
 
     def get(self, request, *args, **kwargs):
         # 1. Inizializziamo il form con i parametri GET, proprio come nella vista elenco
@@ -1185,11 +1297,7 @@ class AnagraficaListExportPdfView(TenantRequiredMixin, RoleRequiredMixin, View):
             attivo_str = filter_form.cleaned_data.get('attivo')
 
             if q:
-                query = query.filter(
-                    Q(nome_cognome_ragione_sociale__icontains=q) |
-                    Q(citta__icontains=q) |
-                    Q(p_iva__icontains=q)
-                )
+                query = cerca_anagrafiche(query, q)
             
             if tipo:
                 query = query.filter(tipo=tipo)
@@ -1230,22 +1338,20 @@ class RegistraPagamentoView(TenantRequiredMixin, RoleRequiredMixin, View):
         redirect_url = request.META.get('HTTP_REFERER', reverse('dashboard'))
 
         if form.is_valid():
-            scadenza = get_object_or_404(Scadenza, pk=form.cleaned_data['scadenza_id'])
             importo_pagato = form.cleaned_data['importo_pagato']
-            
-            # --- PRIMA CORREZIONE QUI ---
-            # Aggiungiamo output_field=models.DecimalField() a Coalesce
-            query_pagato = Scadenza.objects.filter(pk=scadenza.pk).annotate(
-                pagato=Coalesce(Sum('pagamenti__importo'), Value(0), output_field=models.DecimalField())
-            ).first()
-            pagato_precedente = query_pagato.pagato if query_pagato else Decimal('0.00')
-            residuo_attuale = scadenza.importo_rata - pagato_precedente
-
-            if importo_pagato > residuo_attuale:
-                messages.error(request, f"L'importo inserito (€{importo_pagato}) supera il residuo (€{residuo_attuale:.2f}).")
-                return redirect(redirect_url)
 
             with transaction.atomic():
+                # Blocchiamo la riga della scadenza: due pagamenti concorrenti sulla
+                # stessa rata vengono serializzati e il controllo sul residuo resta valido.
+                scadenza = get_object_or_404(
+                    Scadenza.objects.select_for_update(), pk=form.cleaned_data['scadenza_id']
+                )
+                residuo_attuale = scadenza.importo_residuo
+
+                if importo_pagato > residuo_attuale:
+                    messages.error(request, f"L'importo inserito (€{importo_pagato}) supera il residuo (€{residuo_attuale:.2f}).")
+                    return redirect(redirect_url)
+
                 if scadenza.tipo_scadenza == Scadenza.Tipo.INCASSO:
                     causale, _ = Causale.objects.get_or_create(descrizione="INC. FT. CLI.")
                     tipo_movimento = PrimaNota.TipoMovimento.ENTRATA
@@ -1253,6 +1359,8 @@ class RegistraPagamentoView(TenantRequiredMixin, RoleRequiredMixin, View):
                     causale, _ = Causale.objects.get_or_create(descrizione="PAG. FT. FORN.")
                     tipo_movimento = PrimaNota.TipoMovimento.USCITA
                 
+                # Il salvataggio del movimento aggiorna anche importo pagato,
+                # residuo e stato della scadenza collegata (vedi PrimaNota.save).
                 PrimaNota.objects.create(
                     # === RIGA AGGIUNTA ===
                     # Poiché PrimaNota eredita da TenantAwareModel, dobbiamo associare
@@ -1269,17 +1377,6 @@ class RegistraPagamentoView(TenantRequiredMixin, RoleRequiredMixin, View):
                     scadenza_collegata=scadenza,
                     created_by=self.request.user
                 )
-
-                # --- SECONDA CORREZIONE QUI ---
-                # Riutilizziamo la stessa logica robusta.
-                # Il nuovo totale pagato è la somma di quanto già c'era più l'ultimo pagamento.
-                nuovo_totale_pagato = pagato_precedente + importo_pagato
-                
-                if nuovo_totale_pagato >= scadenza.importo_rata:
-                    scadenza.stato = Scadenza.Stato.SALDATA
-                else:
-                    scadenza.stato = Scadenza.Stato.PARZIALE
-                scadenza.save()
             
             messages.success(request, "Pagamento registrato con successo.")
         else:
@@ -1313,34 +1410,9 @@ class PagamentoDeleteView(TenantRequiredMixin, DeleteView):
         """
         Questo metodo viene eseguito dopo che l'utente ha confermato l'eliminazione.
         """
-        # self.object è il record di PrimaNota che stiamo per cancellare.
-        scadenza_da_aggiornare = self.object.scadenza_collegata
-        
-        with transaction.atomic():
-            # Eseguiamo l'eliminazione effettiva del pagamento.
-            # Chiamiamo il metodo della classe base per farlo.
-            response = super().form_valid(form)
-            
-            # Se la scadenza esiste ancora, ricalcoliamo il suo stato.
-            if scadenza_da_aggiornare:
-                # Ricarichiamo l'oggetto dal DB per essere sicuri dei dati.
-                scadenza_da_aggiornare.refresh_from_db()
-                
-                # Calcoliamo il nuovo totale pagato.
-                aggregato = scadenza_da_aggiornare.pagamenti.aggregate(
-                    total=Coalesce(Sum('importo'), Value(0), output_field=models.DecimalField())
-                )
-                totale_pagato = aggregato['total']
-                
-                # Aggiorniamo lo stato.
-                if totale_pagato <= 0:
-                    scadenza_da_aggiornare.stato = Scadenza.Stato.APERTA
-                elif totale_pagato < scadenza_da_aggiornare.importo_rata:
-                    scadenza_da_aggiornare.stato = Scadenza.Stato.PARZIALE
-                else:
-                    scadenza_da_aggiornare.stato = Scadenza.Stato.SALDATA
-                
-                scadenza_da_aggiornare.save()
+        # L'eliminazione del movimento (PrimaNota.delete) ricalcola, nella stessa
+        # transazione, importo pagato, residuo e stato della scadenza collegata.
+        response = super().form_valid(form)
 
         messages.success(self.request, f"Pagamento N. {self.object.pk} eliminato con successo. Stato scadenza aggiornato.")
         return response
@@ -1368,30 +1440,14 @@ class PagamentoUpdateView(TenantRequiredMixin, UpdateView):
         """
         Salva le modifiche e ricalcola lo stato della scadenza.
         """
-        with transaction.atomic():
-            # Salva le modifiche al pagamento
-            pagamento = form.save(commit=False)
-            pagamento.updated_by = self.request.user # Anche se non abbiamo questo campo su PrimaNota
-            pagamento.save()
-            
-            # Ricalcola e aggiorna lo stato della scadenza collegata
-            scadenza = pagamento.scadenza_collegata
-            scadenza.refresh_from_db()
-            
-            totale_pagato = scadenza.pagamenti.aggregate(
-                total=Coalesce(Sum('importo'), Value(0), output_field=models.DecimalField())
-            )['total']
-            
-            if totale_pagato <= 0:
-                scadenza.stato = Scadenza.Stato.APERTA
-            elif totale_pagato < scadenza.importo_rata:
-                scadenza.stato = Scadenza.Stato.PARZIALE
-            else:
-                scadenza.stato = Scadenza.Stato.SALDATA
-            scadenza.save()
+        # Il salvataggio del movimento (PrimaNota.save) ricalcola, nella stessa
+        # transazione, importo pagato, residuo e stato della scadenza collegata.
+        pagamento = form.save(commit=False)
+        pagamento.updated_by = self.request.user # Anche se non abbiamo questo campo su PrimaNota
+        pagamento.save()
 
         messages.success(self.request, f"Pagamento N. {self.object.pk} aggiornato con successo.")
-        return super().form_valid(form)
+        return HttpResponseRedirect(self.get_success_url())
  
 # ==============================================================================
 # === VISTE SCADENZIARIO                                                    ===
@@ -1405,6 +1461,10 @@ class ScadenzarioListView(TenantRequiredMixin, View):
     """
     template_name = 'gestionale/scadenzario_list.html'
     paginate_by = 15
+    # Ordinamento della lista (univoco, per la paginazione a cursore)
+    ordinamento = ['data_scadenza', 'pk']
+    # Tabelle lette dagli export (versione dei dati per ExportInCacheMixin)
+    modelli_dati = [Scadenza, Anagrafica, DocumentoTestata]
 
     def _get_filtered_data(self, request):
         """
@@ -1426,9 +1486,9 @@ class ScadenzarioListView(TenantRequiredMixin, View):
         # Queryset di base: tutte le scadenze che non sono né 'Saldata' né 'Annullata'.
         # Usiamo select_related per ottimizzare le query, pre-caricando i dati
         # delle tabelle collegate Anagrafica e DocumentoTestata con un unico JOIN.
-        scadenze_qs = Scadenza.objects.filter(
+        scadenze_qs = annota_pagato_scadenze(Scadenza.objects.filter(
             stato__in=[Scadenza.Stato.APERTA, Scadenza.Stato.PARZIALE]
-        ).select_related('anagrafica', 'documento').order_by('data_scadenza')
+        )).select_related('anagrafica', 'documento').order_by('data_scadenza')
 
         # Applica i filtri al queryset se il form è stato inviato e i dati sono validi.
         if filter_form.is_valid():
@@ -1452,16 +1512,16 @@ class ScadenzarioListView(TenantRequiredMixin, View):
                 scadenze_qs = scadenze_qs.filter(data_scadenza__gte=today)
         
         # Calcola i KPI aggregati sull'INTERO queryset GIA' FILTRATO.
-        # Questa è una singola, efficiente query al database.
+        # Questa è una singola, efficiente query al database (nessuna JOIN sui pagamenti).
         kpi = scadenze_qs.aggregate(
             incassi_totali_rate=Coalesce(Sum('importo_rata', filter=models.Q(tipo_scadenza=Scadenza.Tipo.INCASSO)), Value(0), output_field=models.DecimalField()),
             pagamenti_totali_rate=Coalesce(Sum('importo_rata', filter=models.Q(tipo_scadenza=Scadenza.Tipo.PAGAMENTO)), Value(0), output_field=models.DecimalField()),
-            incassi_pagati=Coalesce(Sum('pagamenti__importo', filter=models.Q(tipo_scadenza=Scadenza.Tipo.INCASSO)), Value(0), output_field=models.DecimalField()),
-            pagamenti_pagati=Coalesce(Sum('pagamenti__importo', filter=models.Q(tipo_scadenza=Scadenza.Tipo.PAGAMENTO)), Value(0), output_field=models.DecimalField()),
+            incassi_pagati=Coalesce(Sum('importo_pagato', filter=models.Q(tipo_scadenza=Scadenza.Tipo.INCASSO)), Value(0), output_field=models.DecimalField()),
+            pagamenti_pagati=Coalesce(Sum('importo_pagato', filter=models.Q(tipo_scadenza=Scadenza.Tipo.PAGAMENTO)), Value(0), output_field=models.DecimalField()),
             incassi_scaduti_rate=Coalesce(Sum('importo_rata', filter=models.Q(tipo_scadenza=Scadenza.Tipo.INCASSO, data_scadenza__lt=today)), Value(0), output_field=models.DecimalField()),
             pagamenti_scaduti_rate=Coalesce(Sum('importo_rata', filter=models.Q(tipo_scadenza=Scadenza.Tipo.PAGAMENTO, data_scadenza__lt=today)), Value(0), output_field=models.DecimalField()),
-            incassi_scaduti_pagati=Coalesce(Sum('pagamenti__importo', filter=models.Q(tipo_scadenza=Scadenza.Tipo.INCASSO, data_scadenza__lt=today)), Value(0), output_field=models.DecimalField()),
-            pagamenti_scaduti_pagati=Coalesce(Sum('pagamenti__importo', filter=models.Q(tipo_scadenza=Scadenza.Tipo.PAGAMENTO, data_scadenza__lt=today)), Value(0), output_field=models.DecimalField())
+            incassi_scaduti_pagati=Coalesce(Sum('importo_pagato', filter=models.Q(tipo_scadenza=Scadenza.Tipo.INCASSO, data_scadenza__lt=today)), Value(0), output_field=models.DecimalField()),
+            pagamenti_scaduti_pagati=Coalesce(Sum('importo_pagato', filter=models.Q(tipo_scadenza=Scadenza.Tipo.PAGAMENTO, data_scadenza__lt=today)), Value(0), output_field=models.DecimalField())
         )
         
         # Restituisce i dati pronti per essere usati.
@@ -1483,21 +1543,9 @@ class ScadenzarioListView(TenantRequiredMixin, View):
         pagamenti_scaduti = kpi_data['pagamenti_scaduti_rate'] - kpi_data['pagamenti_scaduti_pagati']
         
         # 3. Applica la paginazione al queryset filtrato.
-        paginator = Paginator(scadenze_qs, self.paginate_by)
-        page_number = request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
+        page_obj = pagina_lista(request, scadenze_qs, self.ordinamento, self.paginate_by)
         
-        # 4. Calcola il residuo per le sole scadenze della pagina corrente (per efficienza).
-        ids_pagina_corrente = [s.id for s in page_obj]
-        scadenze_pagina_con_pagato = Scadenza.objects.filter(pk__in=ids_pagina_corrente).annotate(
-            pagato=Coalesce(Sum('pagamenti__importo'), Value(0), output_field=models.DecimalField())
-        )
-        pagato_map = {s.id: s.pagato for s in scadenze_pagina_con_pagato}
-
-        for s in page_obj:
-            s.residuo = s.importo_rata - pagato_map.get(s.id, Decimal(0))
-
-        # 5. Prepara il contesto da passare al template.
+        # 4. Prepara il contesto da passare al template.
         context = {
             'page_obj': page_obj,
             'is_paginated': page_obj.has_other_pages(),
@@ -1514,10 +1562,10 @@ class ScadenzarioListView(TenantRequiredMixin, View):
             }
         }
         
-        # 6. Renderizza il template con il contesto.
+        # 5. Renderizza il template con il contesto.
         return render(request, self.template_name, context)
 
-class ScadenzarioExportExcelView(ScadenzarioListView):
+class ScadenzarioExportExcelView(ScadenzarioListView, ExportInCacheMixin):
     def get(self, request, *args, **kwargs):
         scadenze_qs, kpi_data, filter_form, today = self._get_filtered_data(request)
         
@@ -1536,21 +1584,9 @@ class ScadenzarioExportExcelView(ScadenzarioListView):
         
         # === CORREZIONE ===
         headers = ["Data Scad.", "Tipo", "Cliente/Fornitore", "Rif. Doc.", "Importo Rata", "Residuo", "Stato Rata"]
-        data_rows = []
-        scadenze_con_pagato = scadenze_qs.annotate(
-            pagato=Coalesce(Sum('pagamenti__importo'), Value(0), output_field=models.DecimalField())
-        )
-        for scadenza in scadenze_con_pagato:
-            data_rows.append([
-                scadenza.data_scadenza, scadenza.get_tipo_scadenza_display(),
-                scadenza.anagrafica.nome_cognome_ragione_sociale, scadenza.documento.numero_documento,
-                scadenza.importo_rata, scadenza.importo_rata - scadenza.pagato,
-                scadenza.get_stato_display()
-            ])
-            
-        report_sections = [{'title': 'Dettaglio Scadenze', 'headers': headers, 'rows': data_rows}]
+        report_sections = [{'title': 'Dettaglio Scadenze', 'headers': headers, 'rows': righe_scadenze(scadenze_qs)}]
         
-        return generate_excel_report(
+        return generate_excel_report_streaming(
             tenant_name=tenant_name,
             report_title=report_title,
             filters_string=filtri_str,
@@ -1559,7 +1595,7 @@ class ScadenzarioExportExcelView(ScadenzarioListView):
             filename_prefix=filename_prefix
         )
 
-class ScadenzarioExportPdfView(ScadenzarioListView):
+class ScadenzarioExportPdfView(ScadenzarioListView, ExportInCacheMixin):
     """
     Esporta i dati dello scadenziario in PDF, usando la utility centralizzata.
     """
@@ -1568,12 +1604,8 @@ class ScadenzarioExportPdfView(ScadenzarioListView):
         scadenze_qs, kpi_data, filter_form, today = self._get_filtered_data(request)
 
         # 2. Prepara i dati per il contesto del template PDF.
-        # Calcola il residuo per ogni scadenza.
-        scadenze_con_pagato = scadenze_qs.annotate(
-            pagato=Coalesce(Sum('pagamenti__importo'), Value(0), output_field=models.DecimalField())
-        )
-        for scadenza in scadenze_con_pagato:
-            scadenza.residuo = scadenza.importo_rata - scadenza.pagato
+        # Il residuo è già annotato da _get_filtered_data.
+        scadenze_con_pagato = scadenze_qs
             
         # Costruisci la stringa dei filtri.
         filtri_str = build_filters_string(filter_form)
@@ -1793,6 +1825,10 @@ class PrimaNotaListView(TenantRequiredMixin, RoleRequiredMixin, View):
     """
     template_name = 'gestionale/primanota_list.html'
     paginate_by = 15
+    # Ordinamento della lista (univoco, per la paginazione a cursore)
+    ordinamento = ['-data_registrazione', '-pk']
+    # Tabelle lette dagli export (versione dei dati per ExportInCacheMixin)
+    modelli_dati = [PrimaNota, ContoFinanziario, Causale, Anagrafica, Cantiere]
 
     def _get_filtered_data(self, request):
         """
@@ -1834,9 +1870,7 @@ class PrimaNotaListView(TenantRequiredMixin, RoleRequiredMixin, View):
         """
         movimenti_qs, filter_form = self._get_filtered_data(request)
         
-        paginator = Paginator(movimenti_qs, self.paginate_by)
-        page_number = request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
+        page_obj = pagina_lista(request, movimenti_qs, self.ordinamento, self.paginate_by)
         
         context = {
             'movimenti': page_obj,
@@ -2062,7 +2096,7 @@ class PrimaNotaCreateView(TenantRequiredMixin, RoleRequiredMixin, CreateView):
         # Reindirizza alla pagina di successo in entrambi i casi.
         return HttpResponseRedirect(self.get_success_url())
     
-class PrimaNotaListExportExcelView(PrimaNotaListView):
+class PrimaNotaListExportExcelView(PrimaNotaListView, ExportInCacheMixin):
     """
     Esporta la lista filtrata dei movimenti di Prima Nota in formato Excel.
     Eredita da PrimaNotaListView per accedere al metodo _get_filtered_data.
@@ -2078,41 +2112,15 @@ class PrimaNotaListExportExcelView(PrimaNotaListView):
         filename_prefix = 'Prima_Nota'
         
         # Costruisci la stringa dei filtri applicati
-        filtri_attivi = []
-        if filter_form.is_valid() and filter_form.cleaned_data:
-            for name, value in filter_form.cleaned_data.items():
-                if value:
-                    label = filter_form.fields[name].label or name.title()
-                    display_value = value
-                    if hasattr(filter_form.fields[name], 'choices'):
-                        display_value = dict(filter_form.fields[name].choices).get(value, value)
-                    if isinstance(value, date):
-                        display_value = value.strftime('%d/%m/%Y')
-                    if isinstance(field, forms.ModelChoiceField): # 'field' non è definito, usiamo 'filter_form.fields[name]'
-                        display_value = str(value)
-                    filtri_attivi.append(f"{label}: {display_value}")
-        filtri_str = " | ".join(filtri_attivi) if filtri_attivi else "Nessun filtro"
+        filtri_str = build_filters_string(filter_form)
 
         # Definisci le sezioni del report (in questo caso solo una)
         headers = ["Data", "Descrizione", "Conto Finanziario", "Causale", "Entrata", "Uscita", "Anagrafica", "Cantiere"]
-        data_rows = []
-        for movimento in movimenti_qs:
-            data_rows.append([
-                movimento.data_registrazione,
-                movimento.descrizione,
-                movimento.conto_finanziario.nome_conto,
-                movimento.causale.descrizione,
-                movimento.importo if movimento.tipo_movimento == 'E' else None,
-                movimento.importo if movimento.tipo_movimento == 'U' else None,
-                str(movimento.anagrafica) if movimento.anagrafica else "",
-                str(movimento.cantiere) if movimento.cantiere else "",
-            ])
-        
-        report_sections = [{'title': 'Dettaglio Movimenti', 'headers': headers, 'rows': data_rows}]
+        report_sections = [{'title': 'Dettaglio Movimenti', 'headers': headers, 'rows': righe_movimenti(movimenti_qs)}]
         
         # 3. CHIAMATA ALLA FUNZIONE DI UTILITY
         # Deleghiamo tutta la complessità della creazione del file Excel.
-        return generate_excel_report(
+        return generate_excel_report_streaming(
             tenant_name=tenant_name,
             report_title=report_title,
             filters_string=filtri_str,
@@ -2121,7 +2129,7 @@ class PrimaNotaListExportExcelView(PrimaNotaListView):
             filename_prefix=filename_prefix
         )
   
-class PrimaNotaListExportPdfView(PrimaNotaListView):
+class PrimaNotaListExportPdfView(PrimaNotaListView, ExportInCacheMixin):
     """
     Esporta la lista filtrata dei movimenti di Prima Nota in formato PDF.
     """
@@ -2165,6 +2173,16 @@ class PrimaNotaListExportPdfView(PrimaNotaListView):
 # === VISTE TESORERIA                                                       ===
 # ==============================================================================
 
+def annota_saldo_conti(queryset):
+    """
+    Annota ogni conto finanziario con il suo saldo leggendolo dalla tabella
+    dei saldi materializzati (una JOIN per conto, nessuna somma sui movimenti).
+    I conti senza movimenti non hanno ancora una riga di saldo: valgono zero.
+    """
+    return queryset.annotate(
+        saldo=Coalesce(F('saldo_corrente__saldo'), Value(0), output_field=DecimalField())
+    )
+
 class TesoreriaDashboardView(TenantRequiredMixin, RoleRequiredMixin, View):
     allowed_roles = ['admin', 'contabile', 'visualizzatore']
     """
@@ -2172,25 +2190,14 @@ class TesoreriaDashboardView(TenantRequiredMixin, RoleRequiredMixin, View):
     Contiene la logica di calcolo dei saldi riutilizzabile dagli export.
     """
     template_name = 'gestionale/tesoreria_dashboard.html'
+    # Tabelle lette dagli export (versione dei dati per ExportInCacheMixin)
+    modelli_dati = [ContoFinanziario, SaldoContoFinanziario]
 
     def _get_tesoreria_data(self):
         """
         Metodo helper che calcola i saldi per tutti i conti finanziari.
         """
-        conti_finanziari = ContoFinanziario.objects.filter(attivo=True).annotate(
-            saldo=Coalesce(
-                Sum(
-                    models.Case(
-                        models.When(movimenti__tipo_movimento='E', then=models.F('movimenti__importo')),
-                        models.When(movimenti__tipo_movimento='U', then=-models.F('movimenti__importo')),
-                        default=Value(0),
-                        output_field=models.DecimalField()
-                    )
-                ), 
-                Value(0),
-                output_field=models.DecimalField()
-            )
-        ).order_by('nome_conto')
+        conti_finanziari = annota_saldo_conti(ContoFinanziario.objects.filter(attivo=True)).order_by('nome_conto')
         
         liquidita_totale = sum(conto.saldo for conto in conti_finanziari)
         
@@ -2207,7 +2214,7 @@ class TesoreriaDashboardView(TenantRequiredMixin, RoleRequiredMixin, View):
         
         return render(request, self.template_name, context)
     
-class TesoreriaExportExcelView(TesoreriaDashboardView):
+class TesoreriaExportExcelView(TesoreriaDashboardView, ExportInCacheMixin):
     """
     Esporta i saldi di tesoreria in formato Excel.
     """
@@ -2234,12 +2241,12 @@ class TesoreriaExportExcelView(TesoreriaDashboardView):
             
         report_sections = [{'title': 'Dettaglio Saldi', 'headers': headers, 'rows': data_rows}]
         
-        return generate_excel_report(
+        return generate_excel_report_streaming(
             tenant_name, report_title, "Dati al " + timezone.now().strftime('%d/%m/%Y'), 
             kpi_report, report_sections, filename_prefix=filename_prefix
         )
 
-class TesoreriaExportPdfView(TesoreriaDashboardView):
+class TesoreriaExportPdfView(TesoreriaDashboardView, ExportInCacheMixin):
     """
     Esporta i saldi di tesoreria in formato PDF.
     """
@@ -2266,18 +2273,16 @@ from .templatetags import currency_filters # Importiamo i nostri filtri
 
 class GetContoFinanziarioSaldoView(TenantRequiredMixin, View):
     """
-    Vista API che restituisce il saldo di un conto finanziario in formato JSON.
+    Vista API (async) che restituisce il saldo di un conto finanziario in formato JSON.
     """
-    def get(self, request, *args, **kwargs):
+    async def get(self, request, *args, **kwargs):
         conto_id = request.GET.get('conto_id')
         if not conto_id:
             return JsonResponse({'error': 'ID Conto mancante'}, status=400)
 
         try:
-            # Riutilizziamo la nostra potente query dalla Tesoreria
-            conto = ContoFinanziario.objects.annotate(
-                saldo=Coalesce(Sum(Case(When(movimenti__tipo_movimento='E', then=F('movimenti__importo')),When(movimenti__tipo_movimento='U', then=-F('movimenti__importo')),default=Value(0),output_field=models.DecimalField())),Value(0),output_field=models.DecimalField())
-            ).get(pk=conto_id)
+            # Riutilizziamo il saldo materializzato, come la Tesoreria
+            conto = await annota_saldo_conti(ContoFinanziario.objects.all()).aget(pk=conto_id)
             
             saldo_formattato = currency_filters.format_currency(conto.saldo)
             
@@ -2336,11 +2341,6 @@ class ModalitaPagamentoUpdateView(TenantRequiredMixin, AdminRequiredMixin, Updat
     form_class = ModalitaPagamentoForm
     template_name = 'gestionale/config_form_base.html' # Template generico
     success_url = reverse_lazy('modalita_pagamento_list')
-
-    def get_form_kwargs(self):
-        kwargs = super().get_form_kwargs()
-        kwargs['tenant'] = self.request.tenant
-        return kwargs
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -2710,6 +2710,7 @@ class DipendenteDetailView(TenantRequiredMixin, RoleRequiredMixin, View):
     per un'anagrafica di tipo Dipendente, con tabelle paginate.
     """
     template_name = 'gestionale/dipendente_detail.html'
+    query_budget = 20
 
     def get(self, request, *args, **kwargs):
         """
@@ -2859,118 +2860,60 @@ class DashboardView(TenantRequiredMixin, RoleRequiredMixin, View):
     Mostra la dashboard principale con KPI aggregati e riepiloghi operativi.
     """
     template_name = 'gestionale/dashboard.html'
+    query_budget = 20
 
-    def get(self, request, *args, **kwargs):
-        today = date.today()
-        current_year = today.year
-        
-        # --- 1. CALCOLI FINANZIARI ESISTENTI (Scadenze e Saldi) ---
-        scadenze_aperte_qs = Scadenza.objects.filter(
-            stato__in=[Scadenza.Stato.APERTA, Scadenza.Stato.PARZIALE]
-        )
-
-        kpi_rate = scadenze_aperte_qs.aggregate(
-            incassi_tot_rate=Coalesce(Sum('importo_rata', filter=Q(tipo_scadenza='Incasso')), Value(0), output_field=DecimalField()),
-            pagamenti_tot_rate=Coalesce(Sum('importo_rata', filter=Q(tipo_scadenza='Pagamento')), Value(0), output_field=DecimalField()),
-        )
-        
-        kpi_pagamenti = PrimaNota.objects.filter(scadenza_collegata__in=scadenze_aperte_qs).aggregate(
-            incassi_pagati=Coalesce(Sum('importo', filter=Q(scadenza_collegata__tipo_scadenza='Incasso')), Value(0), output_field=DecimalField()),
-            pagamenti_pagati=Coalesce(Sum('importo', filter=Q(scadenza_collegata__tipo_scadenza='Pagamento')), Value(0), output_field=DecimalField()),
-        )
-
-        incassi_aperti = kpi_rate['incassi_tot_rate'] - kpi_pagamenti['incassi_pagati']
-        debiti_aperti = kpi_rate['pagamenti_tot_rate'] - kpi_pagamenti['pagamenti_pagati']
+    def _get_dashboard_data(self, today):
+        """
+        Calcola tutti i blocchi della dashboard. Il risultato contiene solo
+        valori e liste già valutate, così può essere salvato in cache.
+        """
+        # --- 1. KPI FINANZIARI, ECONOMICI E ANAGRAFICI ---
+        # Calcolati dal motore KPI con una query per tabella (vedi gestionale/kpi.py).
+        kpi = calcola_kpi_dashboard(today)
+        kpi_anagrafiche = conta_anagrafiche_attive()
 
-        scaduti_agg = scadenze_aperte_qs.filter(data_scadenza__lt=today).annotate(
-            pagato=Coalesce(Sum('pagamenti__importo'), Decimal('0.00'))
-        ).aggregate(
-            crediti_scaduti=Coalesce(Sum(F('importo_rata') - F('pagato'), filter=Q(tipo_scadenza='Incasso')), Decimal('0.00')),
-            debiti_scaduti=Coalesce(Sum(F('importo_rata') - F('pagato'), filter=Q(tipo_scadenza='Pagamento')), Decimal('0.00')),
-        )
-        
-        conti_finanziari = ContoFinanziario.objects.filter(attivo=True).annotate(
-            saldo=Coalesce(Sum(Case(When(movimenti__tipo_movimento='E', then=F('movimenti__importo')), When(movimenti__tipo_movimento='U', then=-F('movimenti__importo')), default=Value(0), output_field=DecimalField())), Value(0), output_field=DecimalField())
-        ).order_by('nome_conto')
+        conti_finanziari = list(annota_saldo_conti(ContoFinanziario.objects.filter(attivo=True)).order_by('nome_conto'))
         
         liquidita_totale = sum(c.saldo for c in conti_finanziari)
 
-        # --- 2. NUOVI KPI: ECONOMICI E ANAGRAFICI ---
-
-        kpi_anagrafiche = Anagrafica.objects.aggregate(
-            clienti=Count('id', filter=Q(tipo=Anagrafica.Tipo.CLIENTE, attivo=True)),
-            fornitori=Count('id', filter=Q(tipo=Anagrafica.Tipo.FORNITORE, attivo=True)),
-            dipendenti=Count('id', filter=Q(tipo=Anagrafica.Tipo.DIPENDENTE, attivo=True))
-        )
-
-        fatturato_ytd_agg = DocumentoTestata.objects.filter(
-            data_documento__year=current_year,
-            stato=DocumentoTestata.Stato.CONFERMATO
-        ).aggregate(
-            fatture_vendita=Coalesce(Sum('totale', filter=Q(tipo_doc=DocumentoTestata.TipoDoc.FATTURA_VENDITA)), Decimal('0.00')),
-            note_credito_vendita=Coalesce(Sum('totale', filter=Q(tipo_doc=DocumentoTestata.TipoDoc.NOTA_CREDITO_VENDITA)), Decimal('0.00')),
-            fatture_acquisto=Coalesce(Sum('totale', filter=Q(tipo_doc=DocumentoTestata.TipoDoc.FATTURA_ACQUISTO)), Decimal('0.00')),
-            note_credito_acquisto=Coalesce(Sum('totale', filter=Q(tipo_doc=DocumentoTestata.TipoDoc.NOTA_CREDITO_ACQUISTO)), Decimal('0.00'))
-        )
-        fatturato_attivo = fatturato_ytd_agg['fatture_vendita'] - fatturato_ytd_agg['note_credito_vendita']
-        fatturato_passivo = fatturato_ytd_agg['fatture_acquisto'] - fatturato_ytd_agg['note_credito_acquisto']
-        fatturato_netto_ytd = fatturato_attivo - fatturato_passivo
-
-        cash_flow_ytd_agg = PrimaNota.objects.filter(
-            data_registrazione__year=current_year, 
-            conto_finanziario__isnull=False
-        ).aggregate(
-            entrate=Coalesce(Sum('importo', filter=Q(tipo_movimento='E')), Decimal('0.00')),
-            uscite=Coalesce(Sum('importo', filter=Q(tipo_movimento='U')), Decimal('0.00'))
-        )
-        cash_flow_ytd = cash_flow_ytd_agg['entrate'] - cash_flow_ytd_agg['uscite']
-
-        movimenti_economici_ytd = PrimaNota.objects.filter(
-            data_registrazione__year=current_year,
-            conto_operativo__isnull=False
-        ).aggregate(
-            ricavi=Coalesce(Sum('importo', filter=Q(conto_operativo__tipo=ContoOperativo.Tipo.RICAVO)), Decimal('0.00')),
-            costi=Coalesce(Sum('importo', filter=Q(conto_operativo__tipo=ContoOperativo.Tipo.COSTO)), Decimal('0.00'))
-        )
-        risultato_economico_ytd = movimenti_economici_ytd['ricavi'] - movimenti_economici_ytd['costi']
-
         # --- 3. NUOVI KPI: OPERATIVI (Margine per Cantiere) ---
-        cantieri_con_margine = Cantiere.objects.filter(stato=Cantiere.Stato.APERTO).annotate(
-            ricavi_totali=Coalesce(Sum('movimenti_primanota__importo', filter=Q(movimenti_primanota__conto_operativo__tipo=ContoOperativo.Tipo.RICAVO)), Decimal('0.00')),
-            costi_totali=Coalesce(Sum('movimenti_primanota__importo', filter=Q(movimenti_primanota__conto_operativo__tipo=ContoOperativo.Tipo.COSTO)), Decimal('0.00'))
+        # Dai totali mensili dei movimenti: una riga per mese e conto invece di una per movimento.
+        cantieri_con_margine = list(Cantiere.objects.filter(stato=Cantiere.Stato.APERTO).annotate(
+            ricavi_totali=Coalesce(Sum('totali_mensili_movimenti__importo', filter=Q(totali_mensili_movimenti__conto_operativo__tipo=ContoOperativo.Tipo.RICAVO)), Decimal('0.00')),
+            costi_totali=Coalesce(Sum('totali_mensili_movimenti__importo', filter=Q(totali_mensili_movimenti__conto_operativo__tipo=ContoOperativo.Tipo.COSTO)), Decimal('0.00'))
         ).annotate(
             margine=F('ricavi_totali') - F('costi_totali')
-        ).order_by('-margine')
+        ).order_by('-margine'))
 
         # --- 4. WIDGET ESISTENTI (Scadenze e Riepilogo HR) ---
         sessanta_giorni_da_oggi = today + timedelta(days=60)
-        scadenze_imminenti = scadenze_aperte_qs.filter(
+        scadenze_imminenti = list(Scadenza.objects.filter(
+            stato__in=[Scadenza.Stato.APERTA, Scadenza.Stato.PARZIALE],
             data_scadenza__gte=today,
             data_scadenza__lte=sessanta_giorni_da_oggi
-        ).annotate(
-            pagato=Coalesce(Sum('pagamenti__importo'), Value(0), output_field=DecimalField()),
-            residuo=F('importo_rata') - F('pagato')
-        ).filter(residuo__gt=0).order_by('data_scadenza')[:5]
+        ).filter(importo_residuo__gt=0).annotate(
+            residuo=F('importo_residuo')
+        ).select_related('anagrafica').order_by('data_scadenza')[:5])
 
         dipendenti_presenti = DiarioAttivita.objects.filter(data=today, stato_presenza=DiarioAttivita.StatoPresenza.PRESENTE).count()
         totale_dipendenti_attivi = kpi_anagrafiche['dipendenti']
         cantieri_attivi = Cantiere.objects.filter(stato=Cantiere.Stato.APERTO).count()
         
         # --- 5. COSTRUZIONE DEL CONTESTO PER IL TEMPLATE ---
-        context = {
+        return {
             'kpi_finanziari': {
-                'crediti_clienti': incassi_aperti,
-                'crediti_scaduti': scaduti_agg['crediti_scaduti'],
-                'debiti_fornitori': debiti_aperti,
-                'debiti_scaduti': scaduti_agg['debiti_scaduti'],
+                'crediti_clienti': kpi['crediti_clienti'],
+                'crediti_scaduti': kpi['crediti_scaduti'],
+                'debiti_fornitori': kpi['debiti_fornitori'],
+                'debiti_scaduti': kpi['debiti_scaduti'],
                 'liquidita_totale': liquidita_totale,
-                'saldo_netto': incassi_aperti - debiti_aperti,
+                'saldo_netto': kpi['crediti_clienti'] - kpi['debiti_fornitori'],
             },
             'kpi_economici_e_anagrafici': {
                 'anagrafiche': kpi_anagrafiche,
-                'fatturato_netto_ytd': fatturato_netto_ytd,
-                'cash_flow_ytd': cash_flow_ytd,
-                'risultato_economico_ytd': risultato_economico_ytd,
+                'fatturato_netto_ytd': kpi['fatturato_netto_ytd'],
+                'cash_flow_ytd': kpi['cash_flow_ytd'],
+                'risultato_economico_ytd': kpi['risultato_economico_ytd'],
             },
             'cantieri_con_margine': cantieri_con_margine,
             'conti_finanziari': conti_finanziari,
@@ -2982,7 +2925,16 @@ class DashboardView(TenantRequiredMixin, RoleRequiredMixin, View):
                 'note_spese_pendenti': 0, # Placeholder
             }
         }
-        
+
+    def get(self, request, *args, **kwargs):
+        today = date.today()
+        # I KPI vengono serviti dalla cache del tenant finché non cambia nessuno
+        # dei dati da cui dipendono (vedi gestionale/signals.py); la data entra
+        # nella chiave perché scaduti e presenze dipendono dal giorno.
+        context = kpi_in_cache(
+            request.session['active_tenant_id'], 'dashboard',
+            lambda: self._get_dashboard_data(today), today
+        )
         return render(request, self.template_name, context)
 
 class DashboardAnalisiView(TenantRequiredMixin, RoleRequiredMixin, View):
@@ -2994,38 +2946,21 @@ class DashboardAnalisiView(TenantRequiredMixin, RoleRequiredMixin, View):
         Metodo helper che calcola tutti i KPI in base a un intervallo di date.
         Versione COMPLETA con tutti i KPI.
         """
-        # ... Sezioni 1 e 2 con i calcoli di stato e di flusso rimangono invariate ...
-        # (copio qui il codice corretto per completezza)
-        movimenti_fino_a_data_a = PrimaNota.objects.filter(data_registrazione__lte=data_a, conto_finanziario__isnull=False)
-        liquidita_totale = movimenti_fino_a_data_a.aggregate(saldo=Coalesce(Sum(Case(When(tipo_movimento='E', then=F('importo')), default=-F('importo'))), Value(0), output_field=DecimalField()))['saldo']
-        scadenze_fino_a_data_a = Scadenza.objects.filter(documento__data_documento__lte=data_a, documento__stato=DocumentoTestata.Stato.CONFERMATO)
-        pagamenti_fino_a_data_a = PrimaNota.objects.filter(data_registrazione__lte=data_a, scadenza_collegata__isnull=False)
-        crediti_emessi = scadenze_fino_a_data_a.filter(tipo_scadenza='Incasso').aggregate(t=Coalesce(Sum('importo_rata'), Value(0), output_field=DecimalField()))['t']
-        incassi_ricevuti = pagamenti_fino_a_data_a.filter(scadenza_collegata__tipo_scadenza='Incasso').aggregate(t=Coalesce(Sum('importo'), Value(0), output_field=DecimalField()))['t']
-        crediti_clienti = crediti_emessi - incassi_ricevuti
-        debiti_ricevuti = scadenze_fino_a_data_a.filter(tipo_scadenza='Pagamento').aggregate(t=Coalesce(Sum('importo_rata'), Value(0), output_field=DecimalField()))['t']
-        pagamenti_effettuati = pagamenti_fino_a_data_a.filter(scadenza_collegata__tipo_scadenza='Pagamento').aggregate(t=Coalesce(Sum('importo'), Value(0), output_field=DecimalField()))['t']
-        debiti_fornitori = debiti_ricevuti - pagamenti_effettuati
-        doc_periodo = DocumentoTestata.objects.filter(data_documento__range=(data_da, data_a), stato=DocumentoTestata.Stato.CONFERMATO)
-        fatturato_attivo_periodo = (doc_periodo.filter(tipo_doc__in=['FTV']).aggregate(t=Coalesce(Sum('totale'), Value(0), output_field=DecimalField()))['t']) - (doc_periodo.filter(tipo_doc__in=['NCV']).aggregate(t=Coalesce(Sum('totale'), Value(0), output_field=DecimalField()))['t'])
-        costi_fatturati_periodo = (doc_periodo.filter(tipo_doc__in=['FTA']).aggregate(t=Coalesce(Sum('totale'), Value(0), output_field=DecimalField()))['t']) - (doc_periodo.filter(tipo_doc__in=['NCA']).aggregate(t=Coalesce(Sum('totale'), Value(0), output_field=DecimalField()))['t'])
-        mov_eco_periodo = PrimaNota.objects.filter(data_registrazione__range=(data_da, data_a), conto_operativo__isnull=False)
-        ricavi_periodo = mov_eco_periodo.filter(conto_operativo__tipo=ContoOperativo.Tipo.RICAVO).aggregate(t=Coalesce(Sum('importo'), Value(0), output_field=DecimalField()))['t']
-        costi_periodo = mov_eco_periodo.filter(conto_operativo__tipo=ContoOperativo.Tipo.COSTO).aggregate(t=Coalesce(Sum('importo'), Value(0), output_field=DecimalField()))['t']
-        risultato_economico_periodo = ricavi_periodo - costi_periodo
-        mov_fin_periodo = PrimaNota.objects.filter(data_registrazione__range=(data_da, data_a), conto_finanziario__isnull=False)
-        entrate_periodo = mov_fin_periodo.filter(tipo_movimento='E').aggregate(t=Coalesce(Sum('importo'), Value(0), output_field=DecimalField()))['t']
-        uscite_periodo = mov_fin_periodo.filter(tipo_movimento='U').aggregate(t=Coalesce(Sum('importo'), Value(0), output_field=DecimalField()))['t']
-        cash_flow_periodo = entrate_periodo - uscite_periodo
-        
-        # === INIZIO MODIFICA: Aggiungiamo il conteggio anagrafiche ===
-        anagrafiche_attive = Anagrafica.objects.filter(attivo=True).aggregate(
-            clienti=Count('id', filter=Q(tipo=Anagrafica.Tipo.CLIENTE)),
-            fornitori=Count('id', filter=Q(tipo=Anagrafica.Tipo.FORNITORE)),
-            dipendenti=Count('id', filter=Q(tipo=Anagrafica.Tipo.DIPENDENTE))
-        )
+        # --- 1 e 2. KPI DI STATO E DI FLUSSO ---
+        # Tutti i totali arrivano dal motore KPI: una query per tabella (vedi gestionale/kpi.py).
+        totali = calcola_kpi_periodo(data_da, data_a)
+        liquidita_totale = totali['liquidita_totale']
+        crediti_clienti = totali['crediti_clienti']
+        debiti_fornitori = totali['debiti_fornitori']
+        fatturato_attivo_periodo = totali['fatturato_attivo_periodo']
+        costi_fatturati_periodo = totali['costi_fatturati_periodo']
+        ricavi_periodo = totali['ricavi_periodo']
+        costi_periodo = totali['costi_periodo']
+        risultato_economico_periodo = totali['risultato_economico_periodo']
+        cash_flow_periodo = totali['cash_flow_periodo']
+
+        anagrafiche_attive = conta_anagrafiche_attive()
         num_dipendenti = anagrafiche_attive['dipendenti']
-        # === FINE MODIFICA ===
 
         # --- 3. KPI DERIVATI (con aggiornamento num_dipendenti) ---
         giorni_periodo = (data_a - data_da).days + 1
@@ -3080,144 +3015,88 @@ class DashboardAnalisiView(TenantRequiredMixin, RoleRequiredMixin, View):
 # ==============================================================================
 # === EXPORT TABELLE DI SISTEMA                                              ===
 # ==============================================================================
-class ExportTabelleSistemaView(TenantRequiredMixin, AdminRequiredMixin, View):
+class ExportTabelleSistemaView(TenantRequiredMixin, AdminRequiredMixin, ExportInThreadPoolMixin):
     """
     Gestisce l'esportazione di tutte le tabelle dell'app 'gestionale'
-    in un unico file Excel, con un foglio per ogni tabella.
+    in un unico file Excel, con un foglio per ogni tabella
+    (o, con ?formato=csv, in uno zip con un CSV per tabella).
     """
+    query_budget = 30  # una query per tabella dell'app
     def get(self, request, *args, **kwargs):
-        # 1. PREPARAZIONE DELLA RISPOSTA E DEL FILE EXCEL
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        )
-        local_time = timezone.localtime(timezone.now())
-        timestamp = local_time.strftime('%Y%m%d%H%M')
-        filename = f"{timestamp}_Esportazione_Tabelle_di_Sistema_GestiLub.xlsx"
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-
-        workbook = Workbook()
-        workbook.remove(workbook.active) # Rimuoviamo il foglio di default
-        header_font = Font(bold=True)
-
-        # 2. IDENTIFICAZIONE DEI MODELLI DA ESPORTARE
         # Usiamo il registro delle app di Django per trovare dinamicamente
         # tutti i modelli definiti nella nostra app 'gestionale'.
         app_models = apps.get_app_config('gestionale').get_models()
+        return export_tabelle(
+            app_models, "Esportazione_Tabelle_di_Sistema_GestiLub", request.GET.get('formato'),
+            "Nessun dato trovato in nessuna tabella dell'applicazione."
+        )
 
-        # 3. CICLO DI ESPORTAZIONE PER OGNI MODELLO
-        for model in app_models:
-            model_name = model.__name__
-            queryset = model.objects.all()
-            
-            # Se non ci sono dati, non creiamo il foglio
-            if not queryset.exists():
-                continue
-
-            # Crea un nuovo foglio di lavoro per questo modello
-            worksheet = workbook.create_sheet(title=model_name[:31]) # Titolo foglio max 31 chars
-
-            # Scrivi le intestazioni (i nomi dei campi del modello)
-            headers = [field.name for field in model._meta.fields]
-            worksheet.append(headers)
-            for cell in worksheet[1]:
-                cell.font = header_font
-
-            # Scrivi le righe di dati
-            for obj in queryset:
-                row_data = []
-                for field_name in headers:
-                    cell_value = getattr(obj, field_name)
-
-                    # Controlla se il valore è un oggetto datetime
-                    if isinstance(cell_value, datetime):
-                        # Se è timezone-aware, convertilo nel fuso orario locale
-                        if timezone.is_aware(cell_value):
-                            cell_value = timezone.localtime(cell_value)
-                        # Rendi l'oggetto datetime "naive" (senza tzinfo)
-                        cell_value = cell_value.replace(tzinfo=None)
-                    
-                    # Gestisci i campi ForeignKey
-                    elif isinstance(cell_value, models.Model):
-                        cell_value = str(cell_value)
-
-                    row_data.append(cell_value)
-                worksheet.append(row_data)
-
-        # Se non abbiamo esportato nessun foglio, creane uno vuoto di avviso
-        if not workbook.sheetnames:
-            worksheet = workbook.create_sheet(title="NessunDato")
-            worksheet.append(["Nessun dato trovato in nessuna tabella dell'applicazione."])
-
-        # 4. SALVATAGGIO E RESTITUZIONE
-        workbook.save(response)
-        return response
-
-class ExportTabelleContabiliView(TenantRequiredMixin, AdminRequiredMixin, View):
+class ExportTabelleContabiliView(TenantRequiredMixin, AdminRequiredMixin, ExportInThreadPoolMixin):
     """
     Gestisce l'esportazione di tutte le tabelle operative/contabili
-    dell'azienda corrente in un unico file Excel.
+    dell'azienda corrente in un unico file Excel (o zip di CSV con ?formato=csv).
     """
     def get(self, request, *args, **kwargs):
-        # 1. PREPARAZIONE DELLA RISPOSTA E DEL FILE EXCEL
         tenant_name = request.session.get('active_tenant_name', 'Gestionale')
         safe_tenant_name = "".join(c for c in tenant_name if c.isalnum() or c in " _-").rstrip()
 
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        )
-        local_time = timezone.localtime(timezone.now())
-        timestamp = local_time.strftime('%Y%m%d%H%M')
-        filename = f"{timestamp}_Esportazione_Tabelle_Contabili_{safe_tenant_name}.xlsx"
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-
-        workbook = Workbook()
-        workbook.remove(workbook.active)
-        header_font = Font(bold=True)
-
-        # 2. DEFINIZIONE ESPLICITA DEI MODELLI DA ESPORTARE
         # A differenza dell'export di sistema, qui selezioniamo a mano i modelli.
         models_to_export = [
             Anagrafica, Cantiere, DocumentoTestata, DocumentoRiga, Scadenza,
             PrimaNota, DipendenteDettaglio, DiarioAttivita, ScadenzaPersonale
         ]
+        return export_tabelle(
+            models_to_export, f"Esportazione_Tabelle_Contabili_{safe_tenant_name}", request.GET.get('formato'),
+            "Nessun dato trovato nelle tabelle contabili."
+        )
 
-        # 3. CICLO DI ESPORTAZIONE (identico alla vista precedente)
-        for model in models_to_export:
-            model_name = model.__name__
-            queryset = model.objects.all()
-            
-            if not queryset.exists():
-                continue
-
-            worksheet = workbook.create_sheet(title=model_name[:31])
-            headers = [field.name for field in model._meta.fields]
-            worksheet.append(headers)
-            for cell in worksheet[1]:
-                cell.font = header_font
-
-            for obj in queryset:
-                row_data = []
-                for field_name in headers:
-                    cell_value = getattr(obj, field_name)
-
-                    if isinstance(cell_value, datetime):
-                        if timezone.is_aware(cell_value):
-                            cell_value = timezone.localtime(cell_value)
-                        cell_value = cell_value.replace(tzinfo=None)
-                    
-                    elif isinstance(cell_value, models.Model):
-                        cell_value = str(cell_value)
+# ==============================================================================
+# === IMPORTAZIONE MASSIVA DA CSV/XLSX                                       ===
+# ==============================================================================
+class ImportazioneDatiView(TenantRequiredMixin, AdminRequiredMixin, ExportInThreadPoolMixin):
+    """
+    Caricamento di un file CSV/XLSX di anagrafiche, movimenti di Prima Nota o
+    documenti (gestionale/importazione.py). Come gli export, sotto ASGI gira nel
+    pool di thread dedicato per non rallentare le richieste interattive.
+    """
+    template_name = 'gestionale/importazione_dati.html'
+    # Righe scartate mostrate nella pagina; l'elenco completo si ottiene dal comando 'importa_dati --errori'.
+    max_errori_mostrati = 200
 
-                    row_data.append(cell_value)
-                worksheet.append(row_data)
+    def get(self, request, *args, **kwargs):
+        return render(request, self.template_name, {'form': ImportazioneDatiForm()})
 
-        if not workbook.sheetnames:
-            worksheet = workbook.create_sheet(title="NessunDato")
-            worksheet.append(["Nessun dato trovato nelle tabelle contabili."])
+    def post(self, request, *args, **kwargs):
+        form = ImportazioneDatiForm(request.POST, request.FILES)
+        if not form.is_valid():
+            return render(request, self.template_name, {'form': form})
 
-        # 4. SALVATAGGIO E RESTITUZIONE
-        workbook.save(response)
-        return response
+        tipo = form.cleaned_data['tipo']
+        file = form.cleaned_data['file']
+        try:
+            esito = importa(tipo, file, file.name, request.tenant, utente=request.user, simula=form.cleaned_data['simula'])
+        except ValidationError as e:
+            form.add_error('file', e)
+            return render(request, self.template_name, {'form': form})
+        except Exception as e:
+            # File corrotto o non leggibile (es. XLSX non valido, codifica errata).
+            form.add_error('file', f"Impossibile leggere il file: {e}")
+            return render(request, self.template_name, {'form': form})
+
+        if form.cleaned_data['simula']:
+            messages.info(request, f"Verifica completata: {esito.importati} {IMPORTATORI[tipo].descrizione} validi, nessun dato salvato.")
+        elif esito.importati:
+            messages.success(request, f"Record importati: {esito.importati} {IMPORTATORI[tipo].descrizione}.")
+        if esito.errori:
+            messages.warning(request, f"{len(esito.errori)} record scartati: vedere il dettaglio sotto.")
+
+        context = {
+            'form': ImportazioneDatiForm(initial={'tipo': tipo}),
+            'esito': esito,
+            'errori': esito.errori[:self.max_errori_mostrati],
+            'errori_nascosti': max(0, len(esito.errori) - self.max_errori_mostrati),
+        }
+        return render(request, self.template_name, context)
     
 class DipendenteUpdateView(TenantRequiredMixin, AdminRequiredMixin, View):
     """
@@ -3338,10 +3217,12 @@ class CantiereUpdateView(TenantRequiredMixin, RoleRequiredMixin, UpdateView):
         context['title'] = f"Modifica Cantiere: {self.object.codice_cantiere}"
         return context
     
-class CantiereListExportExcelView(TenantRequiredMixin, AdminRequiredMixin, View):
+class CantiereListExportExcelView(TenantRequiredMixin, AdminRequiredMixin, ExportInCacheMixin, View):
     """
     Esporta la lista filtrata dei cantieri in formato Excel.
     """
+    modelli_dati = [Cantiere, Anagrafica]
+
     def get(self, request, *args, **kwargs):
         # Riutilizziamo la logica di filtraggio dalla DashboardHRView
         stato_cantiere_filter = request.GET.get('stato_cantiere', Cantiere.Stato.APERTO)
@@ -3371,15 +3252,17 @@ class CantiereListExportExcelView(TenantRequiredMixin, AdminRequiredMixin, View)
             
         report_sections = [{'title': 'Dettaglio Cantieri', 'headers': headers, 'rows': data_rows}]
         
-        return generate_excel_report(
+        return generate_excel_report_streaming(
             tenant_name, report_title, filtri_str, None, report_sections,
             filename_prefix=filename_prefix
         )
 
-class CantiereListExportPdfView(TenantRequiredMixin, AdminRequiredMixin, View):
+class CantiereListExportPdfView(TenantRequiredMixin, AdminRequiredMixin, ExportInCacheMixin, View):
     """
     Esporta la lista filtrata dei cantieri in formato PDF.
     """
+    modelli_dati = [Cantiere, Anagrafica]
+
     def get(self, request, *args, **kwargs):
         # Riutilizziamo la logica di filtraggio
         stato_cantiere_filter = request.GET.get('stato_cantiere', Cantiere.Stato.APERTO)
@@ -3425,6 +3308,20 @@ class CantiereDetailView(TenantRequiredMixin, RoleRequiredMixin, View):
     di recupero dati riutilizzata dagli export.
     """
     template_name = 'gestionale/cantiere_detail.html'
+    query_budget = 20
+
+    def get_dati_versionati(self, request, *args, **kwargs):
+        """Record letti dal fascicolo (versione dei dati per ExportInCacheMixin)."""
+        pk = kwargs['pk']
+        return [
+            Cantiere.objects.filter(pk=pk),
+            DiarioAttivita.objects.filter(cantiere_pianificato_id=pk),
+            DocumentoTestata.objects.filter(cantiere_id=pk),
+            PrimaNota.objects.filter(cantiere_id=pk),
+            Anagrafica.objects.all(),
+            ContoFinanziario.objects.all(),
+            Causale.objects.all(),
+        ]
 
     def _get_fascicolo_data(self, request, cantiere_pk):
         """
@@ -3438,37 +3335,8 @@ class CantiereDetailView(TenantRequiredMixin, RoleRequiredMixin, View):
         # --- FASE 2: CALCOLO DEI KPI TOTALI (SULL'INTERA VITA DEL CANTIERE) ---
         # Eseguiamo prima i calcoli aggregati sull'intero storico del cantiere.
         # Questi valori verranno mostrati nelle card di riepilogo e non cambieranno con i filtri di data.
-
-        # Queryset di base per i totali (non ancora filtrati per data)
-        documenti_totali_cantiere = DocumentoTestata.objects.filter(cantiere=cantiere, stato=DocumentoTestata.Stato.CONFERMATO)
-        movimenti_totali_cantiere = PrimaNota.objects.filter(cantiere=cantiere)
-        
-        # 2.1 Calcolo Fatturato e Costi da Documenti
-        fatturato_netto = (documenti_totali_cantiere.filter(tipo_doc=DocumentoTestata.TipoDoc.FATTURA_VENDITA).aggregate(tot=Coalesce(Sum('totale'), Value(0), output_field=DecimalField()))['tot']) - \
-                          (documenti_totali_cantiere.filter(tipo_doc=DocumentoTestata.TipoDoc.NOTA_CREDITO_VENDITA).aggregate(tot=Coalesce(Sum('totale'), Value(0), output_field=DecimalField()))['tot'])
-
-        costi_fatturati_netti = (documenti_totali_cantiere.filter(tipo_doc=DocumentoTestata.TipoDoc.FATTURA_ACQUISTO).aggregate(tot=Coalesce(Sum('totale'), Value(0), output_field=DecimalField()))['tot']) - \
-                                (documenti_totali_cantiere.filter(tipo_doc=DocumentoTestata.TipoDoc.NOTA_CREDITO_ACQUISTO).aggregate(tot=Coalesce(Sum('totale'), Value(0), output_field=DecimalField()))['tot'])
-
-        # 2.2 Calcolo Incassi, Pagamenti e Costi/Ricavi diretti da Prima Nota
-        incassi_totali = movimenti_totali_cantiere.filter(tipo_movimento=PrimaNota.TipoMovimento.ENTRATA).aggregate(tot=Coalesce(Sum('importo'), Value(0), output_field=DecimalField()))['tot']
-        pagamenti_totali = movimenti_totali_cantiere.filter(tipo_movimento=PrimaNota.TipoMovimento.USCITA).aggregate(tot=Coalesce(Sum('importo'), Value(0), output_field=DecimalField()))['tot']
-        
-        costi_diretti = movimenti_totali_cantiere.filter(conto_operativo__tipo=ContoOperativo.Tipo.COSTO).aggregate(tot=Coalesce(Sum('importo'), Value(0), output_field=DecimalField()))['tot']
-        ricavi_diretti = movimenti_totali_cantiere.filter(conto_operativo__tipo=ContoOperativo.Tipo.RICAVO).aggregate(tot=Coalesce(Sum('importo'), Value(0), output_field=DecimalField()))['tot']
-
-        # 2.3 Assemblaggio dei KPI finali
-        redditivita = (fatturato_netto + ricavi_diretti) - (costi_fatturati_netti + costi_diretti)
-        cash_flow = incassi_totali - pagamenti_totali
-        esposizione_clienti = fatturato_netto - incassi_totali
-        esposizione_fornitori = costi_fatturati_netti - pagamenti_totali
-
-        riepilogo = {
-            "redditivita": redditivita,
-            "cash_flow": cash_flow,
-            "esposizione_clienti": esposizione_clienti,
-            "esposizione_fornitori": esposizione_fornitori,
-        }
+        # Il motore KPI usa una sola query per tabella (vedi gestionale/kpi.py).
+        riepilogo = calcola_kpi_cantiere(cantiere)
 
         # --- FASE 3: PREPARAZIONE DEI DATI PER LA VISUALIZZAZIONE NELLE TABELLE ---
         # Ora prepariamo i queryset che verranno mostrati nelle tabelle paginate.
@@ -3476,8 +3344,8 @@ class CantiereDetailView(TenantRequiredMixin, RoleRequiredMixin, View):
 
         # Queryset di base per le tabelle (non ancora filtrati per data)
         dipendenti_qs = DiarioAttivita.objects.filter(cantiere_pianificato=cantiere).select_related('dipendente').order_by('-data')
-        documenti_qs = documenti_totali_cantiere.order_by('-data_documento') # Riutilizziamo il queryset dei totali
-        movimenti_qs = movimenti_totali_cantiere.select_related('conto_finanziario', 'causale').order_by('-data_registrazione') # Riutilizziamo e ottimizziamo
+        documenti_qs = DocumentoTestata.objects.filter(cantiere=cantiere, stato=DocumentoTestata.Stato.CONFERMATO).select_related('anagrafica').order_by('-data_documento')
+        movimenti_qs = PrimaNota.objects.filter(cantiere=cantiere).select_related('conto_finanziario', 'causale').order_by('-data_registrazione')
 
         # Applichiamo i filtri di data, se presenti nel form
         if filter_form.is_valid():
@@ -3527,7 +3395,7 @@ class CantiereDetailView(TenantRequiredMixin, RoleRequiredMixin, View):
         return render(request, self.template_name, context)
 
 
-class CantiereFascicoloExportExcelView(CantiereDetailView):
+class CantiereFascicoloExportExcelView(CantiereDetailView, ExportInCacheMixin):
     """
     Esporta il fascicolo cantiere filtrato in formato Excel.
     Eredita da CantiereDetailView per riutilizzare _get_fascicolo_data.
@@ -3559,24 +3427,24 @@ class CantiereFascicoloExportExcelView(CantiereDetailView):
 
         # Sezione 1: Dipendenti (invariata)
         dip_headers = ["Data", "Dipendente", "Stato", "Ore Ordinarie", "Ore Straordinarie"]
-        dip_rows = [[d.data, d.dipendente.nome_cognome_ragione_sociale, d.get_stato_presenza_display(), d.ore_ordinarie, d.ore_straordinarie] for d in fascicolo_data['dipendenti_assegnati']]
+        dip_rows = righe_diario_cantiere(fascicolo_data['dipendenti_assegnati'])
         report_sections.append({'title': 'Personale Assegnato', 'headers': dip_headers, 'rows': dip_rows})
 
         # Sezione 2: Documenti (invariata)
         doc_headers = ["Data", "Tipo", "Numero", "Anagrafica", "Totale"]
-        doc_rows = [[d.data_documento, d.get_tipo_doc_display(), d.numero_documento, d.anagrafica.nome_cognome_ragione_sociale, d.totale] for d in fascicolo_data['documenti_associati']]
+        doc_rows = righe_documenti_cantiere(fascicolo_data['documenti_associati'])
         report_sections.append({'title': 'Documenti Associati', 'headers': doc_headers, 'rows': doc_rows})
 
         # Sezione 3: Movimenti (invariata)
         mov_headers = ["Data", "Descrizione", "Importo", "Conto", "Causale"]
-        mov_rows = [[m.data_registrazione, m.descrizione, m.importo * (1 if m.tipo_movimento == 'E' else -1), m.conto_finanziario.nome_conto, m.causale.descrizione] for m in fascicolo_data['movimenti_associati']]
+        mov_rows = righe_movimenti_cantiere(fascicolo_data['movimenti_associati'])
         report_sections.append({'title': 'Movimenti di Prima Nota Associati', 'headers': mov_headers, 'rows': mov_rows})
 
-        # MODIFICA: Passiamo kpi_report alla funzione generate_excel_report
-        return generate_excel_report(tenant_name, report_title, filtri_str, kpi_report, report_sections, filename_prefix)
+        # MODIFICA: Passiamo kpi_report alla funzione generate_excel_report_streaming
+        return generate_excel_report_streaming(tenant_name, report_title, filtri_str, kpi_report, report_sections, filename_prefix)
     
 
-class CantiereFascicoloExportPdfView(CantiereDetailView):
+class CantiereFascicoloExportPdfView(CantiereDetailView, ExportInCacheMixin):
     allowed_roles = ['admin', 'contabile', 'visualizzatore']
     """
     Esporta il fascicolo cantiere filtrato in formato PDF.
@@ -3594,4 +3462,61 @@ class CantiereFascicoloExportPdfView(CantiereDetailView):
             **fascicolo_data
         }
         
-        return generate_pdf_report(request, 'gestionale/cantiere_fascicolo_pdf.html', context)
\ No newline at end of file
+        return generate_pdf_report(request, 'gestionale/cantiere_fascicolo_pdf.html', context)
+
+
+# ==============================================================================
+# === REPORT IN BACKGROUND                                                  ===
+# ==============================================================================
+
+class ReportAccodaView(TenantRequiredMixin, View):
+    """
+    Mette in coda l'export richiesto (vedi gestionale/report_in_coda.py) e rimanda
+    alla pagina "I miei report", dove l'utente ne segue l'avanzamento.
+    """
+    def post(self, request, vista, pk=None):
+        if vista not in REPORT_ACCODABILI:
+            raise Http404("Report non disponibile.")
+        argomenti = {'pk': pk} if pk is not None else {}
+
+        if not vista_consentita(vista, argomenti, ruolo_corrente(request)):
+            messages.error(request, "Accesso negato. Non hai i permessi necessari.")
+            return redirect(reverse_lazy('dashboard'))
+
+        richiesta = accoda_report(request, vista, argomenti, request.POST.get('parametri', ''))
+        messages.info(request, f"Il report \"{richiesta.titolo}\" è in preparazione: potrai scaricarlo da questa pagina appena pronto.")
+        return redirect('report_list')
+
+
+class ReportListView(TenantRequiredMixin, View):
+    """Elenco dei report richiesti dall'utente nell'azienda attiva."""
+    template_name = 'gestionale/report_list.html'
+
+    def get(self, request, *args, **kwargs):
+        richieste = RichiestaReport.objects.filter(utente=request.user).order_by('-created_at')[:50]
+        return render(request, self.template_name, {'richieste': richieste})
+
+
+class ReportStatoView(TenantRequiredMixin, View):
+    """Vista API interrogata periodicamente dalla pagina dei report per aggiornare lo stato."""
+    def get(self, request, pk):
+        richiesta = get_object_or_404(RichiestaReport, pk=pk, utente=request.user)
+        return JsonResponse({
+            'stato': richiesta.stato,
+            'stato_display': richiesta.get_stato_display(),
+            'progresso': richiesta.progresso,
+            'terminata': richiesta.terminata,
+            'url_download': reverse('report_download', args=[richiesta.pk]) if richiesta.stato == RichiestaReport.Stato.COMPLETATA else None,
+            'errore': richiesta.messaggio_errore,
+        })
+
+
+class ReportDownloadView(TenantRequiredMixin, View):
+    """Scarica il file di un report completato."""
+    def get(self, request, pk):
+        richiesta = get_object_or_404(
+            RichiestaReport, pk=pk, utente=request.user, stato=RichiestaReport.Stato.COMPLETATA
+        )
+        if not richiesta.file:
+            raise Http404("File del report non disponibile.")
+        return FileResponse(richiesta.file.open('rb'), as_attachment=True, filename=richiesta.nome_file)
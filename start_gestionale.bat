@@ -77,4 +77,8 @@ ECHO ===========================================================================
 ECHO.
 
 CALL .\venv\Scripts\activate
+
+:: Il worker dei report (PDF/Excel in background) gira in una finestra separata.
+start "GestionaleDjango - Worker report" /MIN cmd /c "python manage.py esegui_report_in_coda"
+
 waitress-serve --host=0.0.0.0 --port=8000 --threads=8 config.wsgi:application 2>nul
\ No newline at end of file
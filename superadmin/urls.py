@@ -20,6 +20,7 @@ from .views import (
     # Other admin views
     SuperAdminDashboardView,
     DatabaseBackupView,
+    EndpointLentiView,
 )
 app_name = 'superadmin'
 urlpatterns = [
@@ -34,6 +35,7 @@ urlpatterns = [
     path('utenti/<int:pk>/modifica/', UserUpdateView.as_view(), name='user_update'),
     path('utenti/<int:pk>/password/', UserPasswordChangeView.as_view(), name='user_password_change'),
     path('backup/', DatabaseBackupView.as_view(), name='database_backup'),
+    path('endpoint-lenti/', EndpointLentiView.as_view(), name='endpoint_lenti'),
     path('aziende/<int:pk>/', CompanyDetailView.as_view(), name='company_detail'),
     path('permissions/<int:pk>/delete/', UserPermissionDeleteView.as_view(), name='user_permission_delete'),
     path('permissions/<int:pk>/update/', UserPermissionUpdateView.as_view(), name='user_permission_update'),
@@ -2,6 +2,7 @@
 # Standard library imports
 import os
 import subprocess
+import time
 from datetime import timedelta
 
 # Django core imports
@@ -18,6 +19,7 @@ from django.views.generic import CreateView, FormView, ListView, UpdateView,Dele
 
 # Models imports
 from accounts.models import User
+from gestionale.profilazione import riepilogo
 from gestionale.report_utils import generate_excel_report
 from tenants.models import Company
 
@@ -296,6 +298,41 @@ class SuperAdminDashboardView(SuperAdminRequiredMixin, View):
         return render(request, self.template_name, context)
 
 
+# === PROFILAZIONE ===
+class EndpointLentiView(SuperAdminRequiredMixin, View):
+    """
+    Endpoint più lenti per azienda, aggregati dal log di profilazione delle
+    richieste (PROFILAZIONE_RICHIESTE, vedi gestionale/profilazione.py).
+    """
+    template_name = 'superadmin/endpoint_lenti.html'
+    PERIODI = {'1': "Ultima ora", '24': "Ultime 24 ore", '168': "Ultimi 7 giorni", '720': "Ultimi 30 giorni"}
+    MAX_RIGHE = 100
+
+    def get(self, request, *args, **kwargs):
+        periodo = request.GET.get('ore', '24')
+        if periodo not in self.PERIODI:
+            periodo = '24'
+        azienda = request.GET.get('azienda', '')
+        tenant_id = int(azienda) if azienda.isdigit() else None
+
+        righe = riepilogo(time.time() - int(periodo) * 3600, tenant_id)
+        nomi_aziende = dict(Company.objects.values_list('pk', 'company_name'))
+        for riga in righe:
+            riga['azienda'] = nomi_aziende.get(riga['tenant'])
+
+        context = {
+            'attiva': settings.PROFILAZIONE_RICHIESTE,
+            'righe': righe[:self.MAX_RIGHE],
+            'righe_nascoste': max(0, len(righe) - self.MAX_RIGHE),
+            'totale_richieste': sum(riga['richieste'] for riga in righe),
+            'periodi': self.PERIODI,
+            'periodo': periodo,
+            'aziende': sorted(nomi_aziende.items(), key=lambda voce: voce[1]),
+            'azienda': tenant_id,
+        }
+        return render(request, self.template_name, context)
+
+
 # === GESTIONE PASSWORD ===
 class UserPasswordChangeView(SuperAdminRequiredMixin, PasswordChangeView):
     """
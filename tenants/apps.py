@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class TenantsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tenants'
+
+    def ready(self):
+        # Registra i segnali che invalidano la cache di aziende e ruoli (tenants/cache.py)
+        from . import signals  # noqa: F401
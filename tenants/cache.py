@@ -0,0 +1,83 @@
+# tenants/cache.py
+
+"""
+Cache, in memoria del processo, delle aziende e dei ruoli utente letti da
+TenantMiddleware a ogni richiesta autenticata.
+
+Ogni voce vale al massimo TENANT_CACHE_TIMEOUT secondi ed è legata a una
+"versione" conservata nella cache di Django: i segnali di tenants/signals.py la
+cambiano quando un'azienda o un permesso utente-azienda viene salvato o
+eliminato (attivazione/disattivazione, modifica, cambio di ruolo, rimozione),
+così la modifica ha effetto alla richiesta successiva. Se la cache di Django non
+è condivisa tra processi (LocMemCache), negli altri processi la modifica arriva
+comunque entro il timeout.
+"""
+
+import copy
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Company, UserCompanyPermission
+
+_CHIAVE_VERSIONE = 'tenants:versione'
+
+# Oltre questo numero di voci la cache viene svuotata (le voci scadute non vengono rimosse una a una).
+_MAX_VOCI = 10000
+
+_lock = threading.Lock()
+_aziende = {}  # company_id -> (scadenza, versione, Company | None)
+_ruoli = {}    # (user_id, company_id) -> (scadenza, versione, ruolo | None)
+
+
+def versione_corrente():
+    versione = cache.get(_CHIAVE_VERSIONE)
+    if versione is None:
+        cache.add(_CHIAVE_VERSIONE, time.time_ns(), timeout=None)
+        versione = cache.get(_CHIAVE_VERSIONE)
+    return versione
+
+
+def invalida_cache_tenant():
+    """Rende obsolete tutte le aziende e i ruoli in cache (in ogni processo)."""
+    cache.set(_CHIAVE_VERSIONE, time.time_ns(), timeout=None)
+    with _lock:
+        _aziende.clear()
+        _ruoli.clear()
+
+
+def _leggi(archivio, chiave, versione, carica):
+    adesso = time.monotonic()
+    with _lock:
+        voce = archivio.get(chiave)
+    if voce is not None and voce[0] > adesso and voce[1] == versione:
+        return voce[2]
+
+    valore = carica()
+    with _lock:
+        if len(archivio) >= _MAX_VOCI:
+            archivio.clear()
+        archivio[chiave] = (adesso + settings.TENANT_CACHE_TIMEOUT, versione, valore)
+    return valore
+
+
+def risolvi_tenant(user_id, company_id):
+    """
+    Restituisce (azienda, ruolo) per l'utente e l'azienda attiva in sessione.
+    L'azienda è None se non esiste più, il ruolo è None se l'utente non ha
+    (più) un permesso su quell'azienda. L'azienda restituita è una copia:
+    le richieste concorrenti non condividono la stessa istanza.
+    """
+    versione = versione_corrente()
+    azienda = _leggi(
+        _aziende, company_id, versione,
+        lambda: Company.objects.filter(pk=company_id).first()
+    )
+    ruolo = _leggi(
+        _ruoli, (user_id, company_id), versione,
+        lambda: UserCompanyPermission.objects.filter(user_id=user_id, company_id=company_id)
+        .values_list('company_role', flat=True).first()
+    )
+    return copy.copy(azienda), ruolo
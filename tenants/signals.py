@@ -0,0 +1,20 @@
+# tenants/signals.py
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from .cache import invalida_cache_tenant
+from .models import Company, UserCompanyPermission
+
+
+def invalida_tenant(sender, instance, **kwargs):
+    """
+    Invalida aziende e ruoli in cache di TenantMiddleware dopo il commit:
+    prima, una richiesta concorrente potrebbe rileggere e mettere in cache i dati vecchi.
+    """
+    transaction.on_commit(invalida_cache_tenant)
+
+
+for modello in (Company, UserCompanyPermission):
+    post_save.connect(invalida_tenant, sender=modello, dispatch_uid=f'tenant_save_{modello.__name__}')
+    post_delete.connect(invalida_tenant, sender=modello, dispatch_uid=f'tenant_delete_{modello.__name__}')
@@ -1,3 +1,195 @@
-from django.test import TestCase
+# tenants/tests.py
 
-# Create your tests here.
+"""
+Test della cache di aziende e ruoli (tenants/cache.py) letta da TenantMiddleware:
+le modifiche fatte dal Super Admin devono valere dalla richiesta successiva.
+Sotto ASGI più richieste si alternano sullo stesso event loop: ognuna deve
+vedere solo la propria azienda.
+"""
+
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.test import RequestFactory, TestCase, override_settings
+
+from config.middleware import TenantMiddleware
+from gestionale.managers import get_current_tenant
+
+from .cache import invalida_cache_tenant, risolvi_tenant
+from .models import Company, UserCompanyPermission
+
+Ruolo = UserCompanyPermission.CompanyRole
+
+
+# I test non devono leggere né lasciare voci nella cache condivisa su file.
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TenantMiddlewareTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.azienda = Company.objects.create(company_name="Azienda di prova")
+        cls.altra = Company.objects.create(company_name="Altra azienda")
+        cls.utente = get_user_model().objects.create_user('tester', password='password-di-prova')
+        for azienda in (cls.azienda, cls.altra):
+            UserCompanyPermission.objects.create(user=cls.utente, company=azienda, company_role=Ruolo.ADMIN)
+
+    def setUp(self):
+        invalida_cache_tenant()
+        self.sessione = SessionStore()
+        self.sessione.update({
+            'active_tenant_id': self.azienda.pk,
+            'active_tenant_name': self.azienda.company_name,
+            'user_company_role': Ruolo.ADMIN,
+        })
+        self.middleware = TenantMiddleware(self.vista)
+
+    @staticmethod
+    def vista(request):
+        # Tenant corrente dei manager durante la vista.
+        request.tenant_corrente = get_current_tenant()
+        return request
+
+    def richiesta(self):
+        request = RequestFactory().get('/')
+        request.user, request.session = self.utente, self.sessione
+        return self.middleware(request)
+
+    def permesso(self, azienda=None):
+        return UserCompanyPermission.objects.get(user=self.utente, company=azienda or self.azienda)
+
+    def salva(self, istanza):
+        with self.captureOnCommitCallbacks(execute=True):
+            istanza.save()
+
+    def assertSenzaAzienda(self, request):
+        self.assertEqual((request.tenant, request.company_role, request.tenant_corrente), (None, None, None))
+        self.assertNotIn('active_tenant_id', self.sessione)
+        self.assertNotIn('user_company_role', self.sessione)
+
+    def test_azienda_e_ruolo_dalla_sessione(self):
+        request = self.richiesta()
+        self.assertEqual((request.tenant, request.company_role), (self.azienda, Ruolo.ADMIN))
+        self.assertEqual(request.tenant_corrente, self.azienda)
+        self.assertIsNone(get_current_tenant())
+
+    def test_letti_dalla_cache(self):
+        self.richiesta()
+        with self.assertNumQueries(0):
+            self.assertEqual(risolvi_tenant(self.utente.pk, self.azienda.pk), (self.azienda, Ruolo.ADMIN))
+
+    def test_azienda_disattivata(self):
+        self.richiesta()
+        self.azienda.is_active = False
+        self.salva(self.azienda)
+        self.assertSenzaAzienda(self.richiesta())
+
+    def test_azienda_eliminata(self):
+        self.richiesta()
+        with self.captureOnCommitCallbacks(execute=True):
+            Company.objects.filter(pk=self.azienda.pk).delete()
+        self.assertSenzaAzienda(self.richiesta())
+
+    def test_ruolo_cambiato(self):
+        self.richiesta()
+        permesso = self.permesso()
+        permesso.company_role = Ruolo.VISUALIZZATORE
+        self.salva(permesso)
+        request = self.richiesta()
+        self.assertEqual((request.tenant, request.company_role), (self.azienda, Ruolo.VISUALIZZATORE))
+        # Anche la sessione, letta dai template, ha il nuovo ruolo.
+        self.assertEqual(self.sessione['user_company_role'], Ruolo.VISUALIZZATORE)
+
+    def test_permesso_rimosso(self):
+        self.richiesta()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.permesso().delete()
+        self.assertSenzaAzienda(self.richiesta())
+
+    def test_invalidazione_dopo_il_commit(self):
+        self.richiesta()
+        permesso = self.permesso()
+        permesso.company_role = Ruolo.CONTABILE
+        with self.captureOnCommitCallbacks(execute=True):
+            permesso.save()
+            # Prima del commit le richieste continuano a vedere il ruolo in cache.
+            self.assertEqual(self.richiesta().company_role, Ruolo.ADMIN)
+        self.assertEqual(self.richiesta().company_role, Ruolo.CONTABILE)
+
+    def test_modifiche_ad_altre_aziende(self):
+        self.richiesta()
+        self.altra.is_active = False
+        self.salva(self.altra)
+        permesso = self.permesso(self.altra)
+        permesso.company_role = Ruolo.VISUALIZZATORE
+        self.salva(permesso)
+        request = self.richiesta()
+        self.assertEqual((request.tenant, request.company_role), (self.azienda, Ruolo.ADMIN))
+
+    @override_settings(TENANT_CACHE_TIMEOUT=0)
+    def test_voci_scadute(self):
+        self.richiesta()
+        # Modifica che non passa dai segnali (es. update() da shell): vale alla scadenza.
+        UserCompanyPermission.objects.filter(user=self.utente, company=self.azienda).update(company_role=Ruolo.CONTABILE)
+        self.assertEqual(self.richiesta().company_role, Ruolo.CONTABILE)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TenantMiddlewareAsyncTest(TestCase):
+    """Catena async di TenantMiddleware: sessione e utente letti con le API async, tenant in una ContextVar."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.accessi = []
+        for n in range(3):
+            azienda = Company.objects.create(company_name=f"Azienda {n}")
+            utente = get_user_model().objects.create_user(f'utente{n}', password='password-di-prova')
+            UserCompanyPermission.objects.create(user=utente, company=azienda, company_role=Ruolo.CONTABILE)
+            cls.accessi.append((utente, azienda))
+
+    def setUp(self):
+        invalida_cache_tenant()
+
+    @staticmethod
+    async def vista(request):
+        # Cede più volte il controllo alle altre richieste, poi legge il tenant
+        # corrente anche da un thread di sync_to_async, come una vista sync.
+        visti = []
+        for _ in range(3):
+            await asyncio.sleep(0)
+            visti.append(get_current_tenant())
+        visti.append(await sync_to_async(get_current_tenant)())
+        request.tenant_visti = visti
+        return request
+
+    @staticmethod
+    def nuova_richiesta(utente, azienda):
+        request = RequestFactory().get('/')
+        request.session = SessionStore()
+        request.session.update({'active_tenant_id': azienda.pk, 'user_company_role': Ruolo.ADMIN})
+
+        async def auser():
+            return utente
+        request.auser = auser
+        return request
+
+    async def test_richieste_concorrenti(self):
+        middleware = TenantMiddleware(self.vista)
+        richieste = [self.nuova_richiesta(utente, azienda) for utente, azienda in self.accessi * 3]
+        risposte = await asyncio.gather(*(middleware(request) for request in richieste))
+        for request, (utente, azienda) in zip(risposte, self.accessi * 3):
+            self.assertEqual((request.tenant, request.company_role), (azienda, Ruolo.CONTABILE))
+            self.assertEqual(request.tenant_visti, [azienda] * 4)
+            # Ruolo cambiato: aggiornato anche in sessione.
+            self.assertEqual(await request.session.aget('user_company_role'), Ruolo.CONTABILE)
+        self.assertIsNone(get_current_tenant())
+
+    async def test_azienda_disattivata(self):
+        utente, azienda = self.accessi[0]
+        await Company.objects.filter(pk=azienda.pk).aupdate(is_active=False)
+        await sync_to_async(invalida_cache_tenant)()
+        request = await TenantMiddleware(self.vista)(self.nuova_richiesta(utente, azienda))
+        self.assertEqual((request.tenant, request.company_role), (None, None))
+        self.assertEqual(request.tenant_visti, [None] * 4)
+        self.assertIsNone(await request.session.aget('active_tenant_id'))